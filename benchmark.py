@@ -0,0 +1,193 @@
+"""
+离线基准测试
+
+回放录制的大模型响应，端到端运行流式流水线（签名 → 总结 → 实现），不消耗token地测量流水线本身的开销：
+- 总耗时、进程CPU时间（Python自身开销）
+- 大模型调用次数、每个项目的平均调用次数、回放的录制耗时
+- 编译验证次数和耗时
+
+先使用 --record 真实运行一次生成录制文件，之后每次改动都可以用回放结果对比报告，发现性能回退。
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from c2rust_converter_new import Logger, DEFAULT_CASSETTE
+from pipeline import StreamingPipeline, STAGE_IMPLEMENT, STAGE_SUMMARY
+from sig_utils.llm_cassette import MODE_RECORD, MODE_REPLAY, Cassette, CassetteServer
+from sig_utils.model_router import ModelRouter
+from sig_utils.tracing import tracer
+from sig_utils.metrics import run_metrics
+from sig_utils.run_history import describe, record_run
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+main_logger = Logger("benchmark_main")
+
+
+class CallTimer:
+    """统计被包装函数的调用次数和累计耗时（多线程安全）"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.count += 1
+                    self.total += time.perf_counter() - start
+        return timed
+
+
+def run_benchmark(input_path, cassette, api_key, max_workers=1, max_items=None, enable_compile_check=False,
+                  use_http=False, routes=None, model="gpt-4o"):
+    """
+    运行一次基准测试
+
+    Args:
+        cassette: 录制或回放用的Cassette
+        use_http: 回放时经由本地OpenAI兼容HTTP服务，包含HTTP客户端的开销
+
+    Returns:
+        Dict: 基准测试报告
+    """
+    server = CassetteServer(cassette).start() if use_http and cassette.mode == MODE_REPLAY else None
+    try:
+        router = ModelRouter.from_file(routes, api_key, server.url if server else None,
+                                       request_options={"cassette": None if server else cassette}, default_model=model)
+        pipeline = StreamingPipeline(api_key, max_workers, enable_compile_check, router=router)
+
+        # 编译验证的调用次数和耗时
+        compile_timer = CallTimer()
+        for owner in (pipeline.converter, pipeline.implementer.c2r_converter):
+            owner._compile_rust_code = compile_timer.wrap(owner._compile_rust_code)
+        pipeline.implementer._check_compilation = compile_timer.wrap(pipeline.implementer._check_compilation)
+
+        # 输出写到临时目录，避免从已有结果中断点续跑
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "benchmark_architecture.json")
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            pipeline.run(input_path, output_path, max_items)
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+    finally:
+        if server:
+            server.stop()
+
+    progress = pipeline.state["progress"]
+    items = progress["success"] + progress["skipped"] + progress["failed"]
+    routes_report = router.report()
+    backends = [backend for role_backends in routes_report.values() for backend in role_backends]
+    calls = sum(backend["calls"] + backend["failures"] for backend in backends)
+    llm_time = sum(backend["total_time"] for backend in backends)
+    stage_items = items + pipeline.state["counts"][STAGE_SUMMARY] + pipeline.state["counts"][STAGE_IMPLEMENT]
+
+    return {
+        "input": input_path,
+        "cassette": {"path": cassette.path, "mode": cassette.mode, "http": bool(server), **cassette.get_stats()},
+        "max_workers": max_workers,
+        "items": {
+            "converted": items,
+            "conversion_success": progress["success"],
+            "summarized": pipeline.state["counts"][STAGE_SUMMARY],
+            "implemented": pipeline.state["counts"][STAGE_IMPLEMENT],
+            "implementation_success": len(pipeline.state["implemented"])
+        },
+        "wall_time": round(wall_time, 3),
+        # 进程CPU时间不含等待网络和cargo子进程的时间，近似为流水线自身的Python开销
+        "python_cpu_time": round(cpu_time, 3),
+        "llm": {
+            "calls": calls,
+            "calls_per_item": round(calls / stage_items, 2) if stage_items else 0,
+            "time": round(llm_time, 3)
+        },
+        "compile": {"count": compile_timer.count, "time": round(compile_timer.total, 3)},
+        # 单线程时总耗时减去大模型和编译耗时即为其余开销（JSON读写、依赖图、日志等）
+        "other_time": round(wall_time - llm_time - compile_timer.total, 3) if max_workers == 1 else None,
+        "routes": routes_report
+    }
+
+
+def main():
+    """主程序入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="回放录制的大模型响应，端到端测量流水线开销")
+    parser.add_argument("--input", "-i", default="merged_architecture.json", help="输入的架构JSON文件路径（默认zopfli）")
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE, help="录制文件路径（默认 data/llm_cassette.jsonl）")
+    parser.add_argument("--record", action="store_true", help="真实调用大模型并录制到cassette，而不是回放")
+    parser.add_argument("--http", action="store_true", help="回放经由本地OpenAI兼容HTTP服务，包含HTTP客户端开销")
+    parser.add_argument("--replay-latency", action="store_true", help="回放时按录制的耗时等待")
+    parser.add_argument("--max-workers", type=int, default=1, help="工作线程数（默认1，便于拆分各部分耗时）")
+    parser.add_argument("--max-items", "-m", type=int, help="最大签名转换项数")
+    parser.add_argument("--enable-compile-check", action="store_true", help="签名转换阶段启用实时编译验证")
+    parser.add_argument("--routes", help="模型路由配置JSON文件（需与录制时一致，否则回放无法命中）")
+    parser.add_argument("--model", default="gpt-4o", help="未配置路由时使用的模型")
+    parser.add_argument("--api-key", "-k", help="OpenAI API密钥（仅录制时需要），如不提供则从环境变量OPENAI_API_KEY获取")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"),
+                        help="把本次基准测试的摘要追加到运行历史（设为空字符串时不记录），用 run_report.py --stage benchmark 对比")
+    parser.add_argument("--trace", help="同时记录各阶段的span，导出为Chrome trace JSON到该路径")
+    parser.add_argument("--report", default=os.path.join(DATA_DIR, "benchmark_report.json"), help="基准测试报告输出路径")
+
+    args = parser.parse_args()
+
+    # 回放不访问网络，客户端只需要一个占位密钥
+    api_key = args.api_key or os.environ.get("OPENAI_API_KEY")
+    if args.record and not api_key:
+        main_logger.error("录制需要API密钥，请通过--api-key参数或OPENAI_API_KEY环境变量提供")
+        sys.exit(1)
+
+    if not args.record and not os.path.exists(args.cassette):
+        main_logger.error(f"回放文件不存在: {args.cassette}。请先用 --record 真实运行一次录制响应")
+        sys.exit(1)
+
+    try:
+        if args.record and os.path.exists(args.cassette):
+            main_logger.warning(f"cassette已存在，新的录制将追加到末尾: {args.cassette}")
+        if args.trace:
+            tracer.enable()
+        cassette = Cassette(args.cassette, MODE_RECORD if args.record else MODE_REPLAY, args.replay_latency)
+        run_metrics.start()
+        report = run_benchmark(args.input, cassette, api_key or "replay", args.max_workers, args.max_items,
+                               args.enable_compile_check, args.http, args.routes, args.model)
+        run_metrics.stop()
+    except Exception as e:
+        main_logger.error(f"基准测试出错: {str(e)}")
+        main_logger.error(traceback.format_exc())
+        sys.exit(1)
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+
+    main_logger.info("="*80)
+    main_logger.info(f"总耗时: {report['wall_time']}s, Python CPU时间: {report['python_cpu_time']}s, 其余开销: {report['other_time']}s")
+    main_logger.info(f"大模型: {report['llm']['calls']} 次调用（每项 {report['llm']['calls_per_item']} 次）, 耗时 {report['llm']['time']}s, "
+                     f"回放命中 {report['cassette']['hits']} 次, 未命中 {report['cassette']['misses']} 次")
+    main_logger.info(f"编译验证: {report['compile']['count']} 次, 耗时 {report['compile']['time']}s")
+    main_logger.info(f"项目: {report['items']}")
+    main_logger.info(f"报告已保存到: {args.report}")
+    if not args.record:
+        # 录制运行包含真实网络耗时，不与回放运行混在一起对比
+        record = record_run(args.history, "benchmark", vars(args), run_metrics.snapshot(), report["routes"])
+        if record:
+            main_logger.info(f"运行记录 {describe(record)}")
+    if args.trace:
+        tracer.export(args.trace, main_logger.info)
+    main_logger.info("="*80)
+
+
+if __name__ == "__main__":
+    main()
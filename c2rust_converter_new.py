@@ -6,82 +6,70 @@ import sys
 import traceback
 import re
 import copy  # 添加深拷贝支持
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 
 # 配置根日志器，禁止显示详细信息
 logging.basicConfig(level=logging.WARNING)  # 只显示警告级别以上的信息
 
 # 导入工具模块
+from sig_utils.async_logging import configure_logger
 from sig_utils.gpt_client import GPT
 from sig_utils.stats_collector import ConversionStats
 from sig_utils.c_preprocessor import CPreprocessor
 from sig_utils.text_extractor import TextExtractor
 from sig_utils.prompt_templates import PromptTemplates
 from sig_utils.cross_file_validator import CrossFileValidator  # 新增跨文件验证器
-from sig_utils.ai_implementation_detector import get_detector, quick_check_implementation  # 新增AI检测器
+from sig_utils.ai_implementation_detector import get_detector, quick_check_implementation, StructuralAnalyzer  # 新增AI检测器
+from sig_utils.dependency_graph import DependencyGraph, root_closure
+from sig_utils.ready_queue import ReadyQueue
+from sig_utils.fingerprint import carry_over_stage, stamp_fingerprint
+from sig_utils.architecture_store import ArchitectureStore
+from sig_utils.local_converter import LocalConverter
+from sig_utils.review_policy import ReviewPolicy
+from sig_utils.micro_batcher import MicroBatcher
+from sig_utils.prompt_budget import PromptBudget
+from sig_utils.speculative import SpeculativeRunner
+from sig_utils.model_router import ModelRouter
+from sig_utils.llm_cassette import open_cassette
+from sig_utils.tracing import tracer
+from sig_utils.metrics import run_metrics
+from sig_utils.budget import run_budget
+from sig_utils.run_history import describe, record_run
+from sig_utils.translation_memory import TranslationMemory
+from sig_utils.response_schemas import (
+    StructuredOutputError, CONVERSION_SCHEMA, COMPONENT_CONVERSION_SCHEMA, FIX_SCHEMA, REVIEW_SCHEMA,
+    BATCH_CONVERSION_SCHEMA, BATCH_REVIEW_SCHEMA
+)
 
 # 配置目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 DATA_DIR = os.path.join(BASE_DIR, "data")
+DEFAULT_CASSETTE = os.path.join(DATA_DIR, "llm_cassette.jsonl")  # --dry-run 默认回放的录制文件
 os.makedirs(LOG_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # 配置日志
 class Logger:
     def __init__(self, name, log_dir=LOG_DIR, console_output=True):
-        self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.propagate = False  # 禁止日志向上传播到root logger
-        
-        # 确保处理器不会重复添加
-        if not self.logger.handlers:
-            # 文件处理器，使用固定文件名而非时间戳
-            file_handler = logging.FileHandler(
-                os.path.join(log_dir, f"{name}.log"), 
-                encoding="utf-8",
-                mode='w'  # 使用'w'模式，每次运行覆盖之前的日志
-            )
-            file_handler.setLevel(logging.DEBUG)
-            
-            # 格式化器
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(formatter)
-            
-            self.logger.addHandler(file_handler)
-            
-            # 只有在需要控制台输出时才添加控制台处理器
-            if console_output:
-                # 控制台处理器
-                console_handler = logging.StreamHandler()
-                console_handler.setLevel(logging.INFO)
-                console_handler.setFormatter(formatter)
-                self.logger.addHandler(console_handler)
+        # 日志记录只放入队列，由后台线程写入按大小轮转并压缩的文件，较长的正文按内容哈希只保存一次
+        self.logger = configure_logger(logging.getLogger(name), os.path.join(log_dir, f"{name}.log"), console_output)
     
     def debug(self, msg): 
         self.logger.debug(msg)
-        self._flush_handlers()
         
     def info(self, msg): 
         self.logger.info(msg)
-        self._flush_handlers()
         
     def warning(self, msg): 
         self.logger.warning(msg)
-        self._flush_handlers()
         
     def error(self, msg): 
         self.logger.error(msg)
-        self._flush_handlers()
         
     def critical(self, msg): 
         self.logger.critical(msg)
-        self._flush_handlers()
-    
-    def _flush_handlers(self):
-        """确保日志立即写入文件"""
-        for handler in self.logger.handlers:
-            handler.flush()
 
 # 主日志
 main_logger = Logger("c2rust_main")
@@ -92,15 +80,28 @@ ai_dialog_logger = Logger("c2rust_ai_dialog", console_output=False)  # 专门记
 
 # C到Rust转换器
 class C2RustConverter:
-    def __init__(self, api_key, enable_compile_check=False, max_fix_rounds=5):
+    def __init__(self, api_key, enable_compile_check=False, max_fix_rounds=5, max_workers=1, store=None, review_policy=None,
+                 batch_size=1, prompt_budget=None, speculative_candidates=1, request_options=None, router=None,
+                 translation_memory=None):
         main_logger.info("初始化C到Rust转换器")
-        self.agent1 = GPT(api_key, model_name="gpt-4o")  # 转换专家
-        self.agent2 = GPT(api_key, model_name="gpt-4o")  # 审核专家
-        self.agent3 = GPT(api_key, model_name="gpt-4o")  # 仲裁专家
+        # 按角色选择模型和后端；未提供路由器时所有角色使用gpt-4o，request_options为请求保护选项（deadline、hedge）
+        self.router = router or ModelRouter(api_key, request_options=request_options)
+        self.agent1 = self.router.client("converter", GPT)  # 转换专家
+        self.agent2 = self.router.client("reviewer", GPT)  # 审核专家
+        self.agent3 = self.router.client("arbiter", GPT)  # 仲裁专家
+        self.fixer = self.router.client("fixer", GPT)  # 编译错误修复专家
         self.stats = ConversionStats()
         self.preprocessor = CPreprocessor()
+        self.local_converter = LocalConverter()  # 规则转换，简单的宏、类型定义和结构体无需调用大模型
         self.enable_compile_check = enable_compile_check
         self.max_fix_rounds = max_fix_rounds
+        self.max_workers = max(1, max_workers)  # 并行转换的工作线程数
+        self.store = store  # 可选的SQLite架构存储（ArchitectureStore），逐项写入转换结果
+        self.review_policy = review_policy or ReviewPolicy()  # 决定低风险项目是否跳过Agent2审核
+        self.prompt_budget = prompt_budget or PromptBudget()  # 控制依赖项上下文和多轮对话的token数
+        self.batcher = MicroBatcher(batch_size, counter=self.prompt_budget.counter)  # 将同类型的小项目合并到一次请求中，batch_size为1时不合批
+        self.speculator = SpeculativeRunner(speculative_candidates)  # 并行生成多个候选，第一个通过验证的胜出，候选数为1时不启用
+        self.translation_memory = translation_memory  # 可选的跨项目翻译记忆（TranslationMemory），命中时不调用大模型
         
         # 跨文件验证器 - 现在主要用于记录，不强制验证
         self.cross_file_validator = CrossFileValidator()
@@ -111,7 +112,7 @@ class C2RustConverter:
         # main_logger.info("🛡️ 代码清理器已启用（AI行为强制约束）")
         
         # AI实现检测器 - 用AI检测AI的额外实现
-        self.ai_detector = get_detector(api_key)
+        self.ai_detector = get_detector(api_key, self.router.client("detector", GPT))
         main_logger.info("🤖 AI实现检测器已启用（AI互相检测，不通过就重新生成）")
         
         if enable_compile_check:
@@ -120,6 +121,7 @@ class C2RustConverter:
         else:
             main_logger.info("📝 使用AI检测器验证模式")
     
+    @tracer.traced("convert", "convert", arg_names=("kind",), item_arg="item_id", stage="convert")
     def convert_with_dependencies(self, item_id, kind, c_code, dependency_code=None, max_rounds=5, max_arbitration=1, data=None, file_name=None):
         """转换单个C代码项为Rust代码，包含依赖项信息"""
         main_logger.info(f"开始转换 [{kind}]: {item_id}，含 {len(dependency_code) if dependency_code else 0} 个依赖项")
@@ -164,6 +166,11 @@ class C2RustConverter:
                 "is_header_guard": True
             }
         
+        # 先尝试本地规则转换，无法确定时回退到大模型
+        local_result = self._convert_locally(item_id, kind, c_code, dependency_code, data)
+        if local_result:
+            return local_result
+        
         # 准备特殊结构信息
         special_structures_text = ""
         for construct_type, items in special_constructs.items():
@@ -172,17 +179,19 @@ class C2RustConverter:
                 for item in items[:3]:  # 仅展示前3个
                     special_structures_text += f"  * {item['full_text']}\n"
         
-        # 准备依赖项信息
+        # 准备依赖项信息（按token预算裁剪并按键排序，编译验证仍使用完整依赖代码）
         dependencies_text = ""
         if dependency_code:
-            dependencies_text = "\n## 依赖项的Rust代码：\n"
-            for dep_id, rust_code in dependency_code.items():
-                dependencies_text += f"### {dep_id}\n```rust\n{rust_code}\n```\n\n"
-        
-        # 构建JSON格式的提示
-        json_prompt = f"""请将以下C语言定义转换为Rust代码，并以JSON格式返回结果：
-
-## 原始C代码：
+            dependencies_text = self._format_dependency_code(dependency_code, c_code)
+        
+        # 当前项目的内容放在提示末尾，静态说明和依赖项构成稳定的前缀；翻译记忆中的近似译例属于当前项目的内容
+        item_text = ""
+        if self.translation_memory:
+            examples = self.translation_memory.similar(kind, c_code)
+            if examples:
+                item_logger.info(f"翻译记忆近似译例: {len(examples)} 个，相似度 {[example['similarity'] for example in examples]}")
+                item_text += TranslationMemory.format_examples(examples) + "\n"
+        item_text += f"""## 原始C代码：
 ```c
 {c_code}
 ```
@@ -194,56 +203,20 @@ class C2RustConverter:
                              (c_code.strip().endswith(")") or "(*" in c_code))
         
         if is_function_pointer:
-            json_prompt += """
-## 特别注意：函数指针类型转换
-这是一个函数指针类型定义。请转换为Rust的函数类型：
-- C格式：`typedef return_type FuncName(param_types)`
-- Rust格式：`type FuncName = fn(param_types) -> return_type;`
-- 如果涉及C ABI，使用：`type FuncName = unsafe extern "C" fn(param_types) -> return_type;`
-- 只输出一行类型定义，不要添加其他代码
-"""
+            item_text += "\n" + PromptTemplates.FUNCTION_POINTER_NOTE
         
         if special_structures_text:
-            json_prompt += f"""
+            item_text += f"""
 ## 代码分析
 我已检测到代码中包含以下特殊结构，请在转换时特别注意：
 {special_structures_text}
-"""
-        
-        if dependencies_text:
-            json_prompt += f"""
-{dependencies_text}
-请在转换时参考上述依赖项的Rust代码，保持一致的风格和命名。
 """
         
         # 添加对函数的特殊指示
         if kind == "function":
-            json_prompt += """
-## 特别注意
-只转换函数签名，不实现函数体。函数体使用 { unimplemented!() } 或 { todo!() } 占位。
-"""
+            item_text += "\n" + PromptTemplates.FUNCTION_NOTE
         
-        json_prompt += """
-## 转换要求
-请按照Rust的惯用法进行转换，尽量使用安全Rust特性，只在必要时使用unsafe。
-注意处理指针、特殊类型和命名规范。如果使用unsafe，请添加注释解释原因。
-
-**重要：不要生成任何导入语句（use、mod等），只生成核心的类型定义、结构体或函数签名。**
-
-## 输出格式
-请以JSON格式返回转换结果，包含以下字段：
-```json
-{
-  "rust_code": "转换后的Rust代码",
-  "confidence": "HIGH/MEDIUM/LOW",
-  "warnings": ["警告信息列表"],
-  "unsafe_used": true/false,
-  "unsafe_reason": "如果使用了unsafe，请说明原因"
-}
-```
-
-只返回JSON对象，不要添加其他文本。
-"""
+        json_prompt = PromptTemplates.stable_prompt(PromptTemplates.AGENT1_JSON_INSTRUCTIONS, dependencies_text, item_text)
         
         messages = [
             {"role": "system", "content": PromptTemplates.AGENT1_SYSTEM},
@@ -254,6 +227,15 @@ class C2RustConverter:
         ai_dialog_logger.info(f"系统提示: {PromptTemplates.AGENT1_SYSTEM}")
         ai_dialog_logger.info(f"用户提示: {json_prompt}")
         
+        # 推测式多候选只用于慢尾部：规模较大或包含特殊结构的项目首轮即推测，其余项目首轮未通过后再推测；
+        # 第一个通过验证的候选直接采用，都未通过时继续逐轮转换
+        speculated = self.speculator.should_speculate(self.prompt_budget.counter.count(c_code),
+                                                       high_risk=bool(special_structures_text))
+        if speculated:
+            speculative_result = self._convert_speculatively(item_id, kind, c_code, messages, dependency_code, data, file_name)
+            if speculative_result:
+                return speculative_result
+        
         conversion_history = []
         arbitration_count = 0
         
@@ -261,72 +243,24 @@ class C2RustConverter:
         for round_num in range(1, max_rounds + 1):
             item_logger.info(f"开始第 {round_num} 轮转换")
             
+            if round_num > 1 and not speculated and self.speculator.should_speculate(failed_rounds=round_num - 1):
+                speculated = True
+                speculative_result = self._convert_speculatively(item_id, kind, c_code, messages, dependency_code, data,
+                                                                 file_name, round_num)
+                if speculative_result:
+                    return speculative_result
+            
             try:
                 # 1. 获取Agent1的转换结果
                 item_logger.info(f"第 {round_num} 轮: 正在获取转换结果...")
                 start_time = time.time()
-                rust_response_raw = self.agent1.ask(messages)
+                messages = self.prompt_budget.compact_messages(messages)
+                rust_response_json, rust_response_raw = self._request_conversion(messages)
                 ai_dialog_logger.info(f"转换轮 {round_num} - Agent1回复: {rust_response_raw}")
                 item_logger.info(f"第 {round_num} 轮: 获取转换结果用时 {time.time() - start_time:.2f} 秒")
                 
-                # 解析JSON响应
-                rust_response_json = TextExtractor.extract_json(rust_response_raw)
-                if not rust_response_json:
-                    # 如果JSON解析失败，尝试提取代码块作为备选
-                    item_logger.warning("JSON解析失败，尝试提取代码块")
-                    rust_code = TextExtractor.extract_code_block(rust_response_raw)
-                    rust_response_json = {
-                        "rust_code": rust_code,
-                        "confidence": "LOW",
-                        "warnings": ["JSON格式解析失败，使用备选方案"],
-                        "unsafe_used": "unsafe" in rust_code.lower(),
-                        "unsafe_reason": "未提供原因"
-                    }
-                
                 rust_code = rust_response_json.get("rust_code", "")
                 
-                # 验证提取的代码是否正确
-                if "json" in rust_code.lower() or "{" in rust_code and "}" in rust_code and "rust_code" in rust_code:
-                    main_logger.warning(f"检测到转换代码提取错误，包含JSON格式文本")
-                    ai_dialog_logger.warning(f"转换代码提取错误，当前内容: {rust_code}")
-                    
-                    # 如果是第一轮就出现提取错误，说明TextExtractor有bug，尝试重新开始
-                    if round_num == 1:
-                        main_logger.warning(f"第一轮转换即出现代码提取错误，重新开始转换: {item_id}")
-                        # 重新开始转换，但限制重试次数
-                        if not hasattr(self, '_restart_count'):
-                            self._restart_count = {}
-                        
-                        restart_key = f"{item_id}_{kind}"
-                        current_restarts = self._restart_count.get(restart_key, 0)
-                        
-                        if current_restarts < 2:  # 最多重启2次
-                            self._restart_count[restart_key] = current_restarts + 1
-                            main_logger.info(f"重新开始转换 (第 {current_restarts + 1} 次重启): {item_id}")
-                            ai_dialog_logger.info(f"重新开始转换 (第 {current_restarts + 1} 次重启)")
-                            
-                            # 重置消息历史，重新开始
-                            messages = [
-                                {"role": "system", "content": PromptTemplates.AGENT1_SYSTEM},
-                                {"role": "user", "content": json_prompt}
-                            ]
-                            conversion_history = []
-                            continue  # 重新开始当前轮次
-                        else:
-                            main_logger.error(f"代码提取错误重启次数已达上限，转换失败: {item_id}")
-                            break
-                    
-                    # 尝试从JSON响应中提取纯代码
-                    if rust_response_json and "rust_code" in rust_response_json:
-                        pure_code = rust_response_json["rust_code"]
-                        if pure_code and not ("json" in pure_code.lower() or "{" in pure_code and "rust_code" in pure_code):
-                            rust_code = pure_code
-                            main_logger.info(f"已修正转换代码提取：{rust_code[:50]}...")
-                        else:
-                            # 如果修正也失败，这轮转换视为失败，跳到下一轮
-                            main_logger.warning(f"代码提取修正失败，跳过当前轮: {round_num}")
-                            continue
-                
                 # 保存转换尝试
                 attempt_record = {
                     "round": round_num,
@@ -335,82 +269,101 @@ class C2RustConverter:
                 }
                 conversion_history.append(attempt_record)
                 
-                # 格式化转换历史文本
-                history_text = "\n\n## 转换历史：\n"
+                # 格式化转换历史文本，超出预算时较早的尝试只保留标题
+                history_sections = []
                 for i, attempt in enumerate(conversion_history, 1):
-                    history_text += f"### 尝试 {i}：\n```rust\n{attempt['rust_code']}\n```\n"
+                    section = f"### 尝试 {i}：\n```rust\n{attempt['rust_code']}\n```\n"
                     if "json_response" in attempt:
                         json_resp = attempt["json_response"]
-                        history_text += f"置信度: {json_resp.get('confidence', 'UNKNOWN')}\n"
+                        section += f"置信度: {json_resp.get('confidence', 'UNKNOWN')}\n"
                         if json_resp.get("warnings"):
-                            history_text += f"警告: {', '.join(json_resp['warnings'])}\n"
+                            section += f"警告: {', '.join(json_resp['warnings'])}\n"
                         if json_resp.get("unsafe_used"):
-                            history_text += f"Unsafe原因: {json_resp.get('unsafe_reason', '未说明')}\n"
+                            section += f"Unsafe原因: {json_resp.get('unsafe_reason', '未说明')}\n"
                     if "review" in attempt:
-                        history_text += f"审核结果: {attempt['review']['result']}\n"
-                        history_text += f"原因: {attempt['review']['reason']}\n"
+                        section += f"审核结果: {attempt['review']['result']}\n"
+                        section += f"原因: {attempt['review']['reason']}\n"
                     if "compile_result" in attempt:
                         compile_res = attempt["compile_result"]
-                        history_text += f"编译结果: {'成功' if compile_res['success'] else '失败'}\n"
+                        section += f"编译结果: {'成功' if compile_res['success'] else '失败'}\n"
                         if not compile_res["success"] and compile_res["errors"]:
-                            history_text += f"编译错误: {len(compile_res['errors'])} 个错误\n"
+                            section += f"编译错误: {len(compile_res['errors'])} 个错误\n"
                     if "fix_result" in attempt:
                         fix_res = attempt["fix_result"]
-                        history_text += f"修复结果: {'成功' if fix_res['success'] else '失败'}\n"
+                        section += f"修复结果: {'成功' if fix_res['success'] else '失败'}\n"
                         if fix_res.get("fix_rounds"):
-                            history_text += f"修复轮数: {fix_res['fix_rounds']}\n"
-                    history_text += "\n"
+                            section += f"修复轮数: {fix_res['fix_rounds']}\n"
+                    section += "\n"
+                    history_sections.append(section)
+                history_text = "\n\n## 转换历史：\n" + "".join(self.prompt_budget.fit_sections(history_sections))
                 
-                # 2. 让Agent2审核结果
-                item_logger.info(f"第 {round_num} 轮: 开始审核转换结果...")
-                start_time = time.time()
-                review_prompt = PromptTemplates.AGENT2_WITH_HISTORY
-                review_prompt = review_prompt.replace("{c_code}", c_code)
-                review_prompt = review_prompt.replace("{rust_code}", rust_code)
-                review_prompt = review_prompt.replace("{conversion_history}", history_text)
+                # 2. 按审核策略决定是否让Agent2审核结果
+                local_check = StructuralAnalyzer.analyze(
+                    rust_code, kind, list(dependency_code.keys()) if dependency_code else [], item_id
+                )
+                review_decision = self.review_policy.decide(
+                    kind, rust_code, rust_response_json.get("confidence"), round_num, self.stats, local_check
+                )
+                if not review_decision["review"]:
+                    main_logger.info(f"⏭️ [{kind}]: {item_id} {review_decision['reason']}")
+                    review_json = {"result": "PASS", "reason": review_decision["reason"], "skipped": True}
+                    attempt_record["review"] = review_json
+                    self.stats.record_review(kind, True, skipped=True)
+                else:
+                    item_logger.info(f"第 {round_num} 轮: 开始审核转换结果...")
+                    start_time = time.time()
+                    review_prompt = PromptTemplates.AGENT2_WITH_HISTORY
+                    review_prompt = review_prompt.replace("{c_code}", c_code)
+                    review_prompt = review_prompt.replace("{rust_code}", rust_code)
+                    review_prompt = review_prompt.replace("{conversion_history}", history_text)
                 
-                review_messages = [
-                    {"role": "system", "content": PromptTemplates.AGENT2_SYSTEM},
-                    {"role": "user", "content": review_prompt}
-                ]
+                    review_messages = [
+                        {"role": "system", "content": PromptTemplates.AGENT2_SYSTEM},
+                        {"role": "user", "content": review_prompt}
+                    ]
                 
-                # 记录审核对话
-                ai_dialog_logger.info(f"审核轮 {round_num} - 系统提示: {PromptTemplates.AGENT2_SYSTEM}")
-                ai_dialog_logger.info(f"审核轮 {round_num} - 用户提示: {review_prompt}")
+                    # 记录审核对话
+                    ai_dialog_logger.info(f"审核轮 {round_num} - 系统提示: {PromptTemplates.AGENT2_SYSTEM}")
+                    ai_dialog_logger.info(f"审核轮 {round_num} - 用户提示: {review_prompt}")
                 
-                try:
-                    review_response = self.agent2.ask(review_messages)
-                    ai_dialog_logger.info(f"审核轮 {round_num} - Agent2回复: {review_response}")
-                    item_logger.info(f"第 {round_num} 轮: 审核结果获取用时 {time.time() - start_time:.2f} 秒")
-                    review_json = TextExtractor.extract_json(review_response)
+                    try:
+                        try:
+                            review_json, review_response = self.agent2.ask_json(review_messages, REVIEW_SCHEMA)
+                        except StructuredOutputError as e:
+                            item_logger.warning(f"审核结果校验失败，回退到文本提取: {e}")
+                            review_response = e.raw_text
+                            review_json = TextExtractor.extract_json(review_response)
+                        ai_dialog_logger.info(f"审核轮 {round_num} - Agent2回复: {review_response}")
+                        item_logger.info(f"第 {round_num} 轮: 审核结果获取用时 {time.time() - start_time:.2f} 秒")
                     
-                    if not review_json:
-                        item_logger.warning("无法解析审核结果JSON，尝试再次解析")
-                        # 尝试简单的解析方案
-                        if '"result": "PASS"' in review_response:
-                            review_json = {"result": "PASS", "reason": "审核通过"}
-                        elif '"result": "FAIL"' in review_response:
-                            reason_match = re.search(r'"reason":\s*"([^"]+)"', review_response)
-                            reason = reason_match.group(1) if reason_match else "未通过审核，但未提供具体原因"
-                            review_json = {"result": "FAIL", "reason": reason}
-                        else:
-                            review_json = {"result": "FAIL", "reason": "无法解析审核结果"}
-                            item_logger.warning(f"无法解析的审核响应: {review_response[:200]}...")
+                        if not review_json:
+                            item_logger.warning("无法解析审核结果JSON，尝试再次解析")
+                            # 尝试简单的解析方案
+                            if '"result": "PASS"' in review_response:
+                                review_json = {"result": "PASS", "reason": "审核通过"}
+                            elif '"result": "FAIL"' in review_response:
+                                reason_match = re.search(r'"reason":\s*"([^"]+)"', review_response)
+                                reason = reason_match.group(1) if reason_match else "未通过审核，但未提供具体原因"
+                                review_json = {"result": "FAIL", "reason": reason}
+                            else:
+                                review_json = {"result": "FAIL", "reason": "无法解析审核结果"}
+                                item_logger.warning(f"无法解析的审核响应: {review_response[:200]}...")
                     
-                    # 记录审核结果
-                    attempt_record["review"] = review_json
-                    item_logger.info(f"审核结果: {review_json['result']}")
-                    item_logger.debug(f"审核原因: {review_json['reason']}")
+                        # 记录审核结果
+                        attempt_record["review"] = review_json
+                        self.stats.record_review(kind, review_json["result"] == "PASS", sampled=review_decision["sampled"])
+                        item_logger.info(f"审核结果: {review_json['result']}")
+                        item_logger.debug(f"审核原因: {review_json['reason']}")
                     
-                except Exception as e:
-                    item_logger.error(f"审核过程发生错误: {str(e)}")
-                    ai_dialog_logger.error(f"审核轮 {round_num} 错误: {str(e)}")
-                    attempt_record["review"] = {"result": "ERROR", "reason": f"审核过程错误: {str(e)}"}
-                    # 如果是第一轮，直接失败；否则尝试使用上一轮结果继续
-                    if round_num == 1:
-                        raise
-                    item_logger.warning("由于审核错误，将使用上一轮结果继续")
-                    review_json = {"result": "FAIL", "reason": "审核过程发生错误，将重新尝试"}
+                    except Exception as e:
+                        item_logger.error(f"审核过程发生错误: {str(e)}")
+                        ai_dialog_logger.error(f"审核轮 {round_num} 错误: {str(e)}")
+                        attempt_record["review"] = {"result": "ERROR", "reason": f"审核过程错误: {str(e)}"}
+                        # 如果是第一轮，直接失败；否则尝试使用上一轮结果继续
+                        if round_num == 1:
+                            raise
+                        item_logger.warning("由于审核错误，将使用上一轮结果继续")
+                        review_json = {"result": "FAIL", "reason": "审核过程发生错误，将重新尝试"}
                 
                 # 3. 根据审核结果决定下一步
                 if review_json["result"] == "PASS":
@@ -424,8 +377,10 @@ class C2RustConverter:
                     
                     # AI检测器检查是否有额外实现
                     detection_result = self.ai_detector.detect_extra_implementation(
-                        rust_code, kind, known_dependencies
+                        rust_code, kind, known_dependencies, item_name=item_id
                     )
+                    self.stats.record_detection(kind, detection_result.get("tier", "llm"),
+                                                detection_result["is_clean"], detection_result.get("confidence"))
                     
                     attempt_record["ai_detection"] = detection_result
                     
@@ -518,20 +473,7 @@ class C2RustConverter:
                             main_logger.info(f"✅ [{kind}]: {item_id} AI检测通过，转换成功，用了 {round_num} 轮")
                         
                         # 记录到跨文件验证器（仅记录，不验证）
-                        if self.cross_file_validator:
-                            unique_key = self.cross_file_validator._generate_unique_key(kind, item_id, rust_code)
-                            if unique_key not in self.cross_file_validator.global_converted_items:
-                                from sig_utils.cross_file_validator import CodeItem
-                                code_item = CodeItem(
-                                    file_name=file_name or "unknown_file",
-                                    kind=kind,
-                                    item_name=item_id,
-                                    actual_name=self.cross_file_validator._extract_actual_name(rust_code, kind),
-                                    rust_code=rust_code.strip(),
-                                    original_type=kind
-                                )
-                                self.cross_file_validator.global_converted_items[unique_key] = code_item
-                                self.cross_file_validator._update_global_state(code_item)
+                        self._record_cross_file_item(file_name, kind, item_id, rust_code)
                         
                         self.stats.record_success(item_id, kind, round_num, {
                             "c_code": c_code,
@@ -728,8 +670,660 @@ class C2RustConverter:
         ai_dialog_logger.info(f"==================== AI对话结束 [{kind}]: {item_id} (达到最大轮数) ====================")
         return result
     
-    def process_architecture_file(self, filepath, output_path=None, max_items=None):
-        """处理整个架构文件"""
+    def _request_conversion(self, messages, temperature=0.2):
+        """请求Agent1转换结果，响应不符合Schema时回退到文本提取，返回 (结果JSON, 原始响应)"""
+        try:
+            return self.agent1.ask_json(messages, CONVERSION_SCHEMA, temperature=temperature)
+        except StructuredOutputError as e:
+            # 响应不符合Schema，回退到文本提取
+            item_logger.warning(f"结构化响应校验失败，回退到文本提取: {e}")
+            rust_response_raw = e.raw_text
+            rust_response_json = TextExtractor.extract_json(rust_response_raw)
+        
+        if not rust_response_json:
+            # 如果JSON解析失败，尝试提取代码块作为备选
+            item_logger.warning("JSON解析失败，尝试提取代码块")
+            rust_code = TextExtractor.extract_code_block(rust_response_raw)
+            rust_response_json = {
+                "rust_code": rust_code,
+                "confidence": "LOW",
+                "warnings": ["JSON格式解析失败，使用备选方案"],
+                "unsafe_used": "unsafe" in rust_code.lower(),
+                "unsafe_reason": "未提供原因"
+            }
+        elif '"rust_code"' in str(rust_response_json.get("rust_code", "")):
+            # 文本提取把JSON外壳当成了代码，交给审核反馈修正，不重启转换
+            item_logger.warning("文本提取的代码中包含JSON格式文本")
+            rust_response_json["confidence"] = "LOW"
+            rust_response_json["warnings"] = list(rust_response_json.get("warnings") or []) + ["代码中包含JSON格式文本"]
+        return rust_response_json, rust_response_raw
+    
+    def _record_cross_file_item(self, file_name, kind, item_id, rust_code):
+        """将转换结果记录到跨文件验证器（仅记录，不验证）"""
+        if not self.cross_file_validator:
+            return
+        unique_key = self.cross_file_validator._generate_unique_key(kind, item_id, rust_code)
+        if unique_key not in self.cross_file_validator.global_converted_items:
+            from sig_utils.cross_file_validator import CodeItem
+            code_item = CodeItem(
+                file_name=file_name or "unknown_file",
+                kind=kind,
+                item_name=item_id,
+                actual_name=self.cross_file_validator._extract_actual_name(rust_code, kind),
+                rust_code=rust_code.strip(),
+                original_type=kind
+            )
+            self.cross_file_validator.global_converted_items[unique_key] = code_item
+            self.cross_file_validator._update_global_state(code_item)
+    
+    def _convert_speculatively(self, item_id, kind, c_code, messages, dependency_code, data, file_name, round_num=1):
+        """
+        推测式转换：并行生成多个不同温度的候选并各自验证，采用第一个通过的候选
+        
+        Args:
+            messages: 候选共用的对话，首轮未通过后推测时包含上一轮的反馈
+            round_num: 推测所在的轮次，计入转换轮数
+        
+        Returns:
+            Dict: 与convert_with_dependencies相同格式的成功结果；所有候选都未通过时返回None
+        """
+        main_logger.info(f"🔀 推测转换 [{kind}]: {item_id}，同时生成 {self.speculator.candidates} 个候选")
+        
+        def generate(temperature):
+            rust_response_json, rust_response_raw = self._request_conversion(messages, temperature)
+            ai_dialog_logger.info(f"推测候选 (温度 {temperature}) - Agent1回复: {rust_response_raw}")
+            return rust_response_json
+        
+        def validate(rust_response_json, cancelled):
+            return self._validate_candidate(item_id, kind, c_code, rust_response_json, dependency_code or {}, data, cancelled)
+        
+        winner = self.speculator.run(generate, validate)
+        if not winner:
+            main_logger.info(f"推测转换的候选均未通过，回退到逐轮转换 [{kind}]: {item_id}")
+            return None
+        
+        validation = winner["validation"]
+        rust_code = validation["rust_code"]
+        rust_response_json = winner["candidate"]
+        main_logger.info(f"✅ [{kind}]: {item_id} 第 {winner['index'] + 1} 个候选（温度 {winner['temperature']}）通过验证，转换成功")
+        item_logger.info(f"推测转换成功，最终Rust代码:\n{rust_code}")
+        ai_dialog_logger.info(f"推测转换成功，最终代码: {rust_code}")
+        
+        self._record_cross_file_item(file_name, kind, item_id, rust_code)
+        self.stats.record_success(item_id, kind, round_num, {
+            "c_code": c_code,
+            "rust_code": rust_code,
+            "json_response": rust_response_json,
+            "ai_detection": validation["ai_detection"],
+            "compile_result": validation.get("compile_result")
+        })
+        attempt_record = {
+            "round": round_num,
+            "rust_code": rust_code,
+            "json_response": rust_response_json,
+            "review": validation["review"],
+            "ai_detection": validation["ai_detection"]
+        }
+        if validation.get("compile_result"):
+            attempt_record["compile_result"] = validation["compile_result"]
+        return {
+            "success": True,
+            "rust_code": rust_code,
+            "rounds": round_num,
+            "conversion_history": [attempt_record],
+            "json_response": rust_response_json,
+            "ai_detection": validation["ai_detection"],
+            "compile_result": validation.get("compile_result"),
+            "speculative": {
+                "candidates": self.speculator.candidates,
+                "winner": winner["index"],
+                "temperature": winner["temperature"]
+            }
+        }
+    
+    def _validate_candidate(self, item_id, kind, c_code, rust_response_json, dependency_code, data, cancelled):
+        """
+        验证一个推测候选：本地检查 → 审核（按审核策略）→ 实现检测 → 编译（启用时，不进行修复）
+        
+        每个需要请求或编译的步骤之前检查cancelled，已有候选胜出时尽快退出。
+        
+        Returns:
+            Dict: {"passed": 是否通过, "reason": 未通过原因, "rust_code", "review", "ai_detection", "compile_result"}
+        """
+        rust_code = rust_response_json.get("rust_code", "")
+        if not rust_code or "rust_code" in rust_code:
+            return {"passed": False, "reason": "候选未包含有效的Rust代码"}
+        
+        known_dependencies = list(dependency_code.keys())
+        local_check = StructuralAnalyzer.analyze(rust_code, kind, known_dependencies, item_id)
+        if not local_check["is_clean"] and local_check["confidence"] >= 0.9:
+            return {"passed": False, "reason": "本地检查发现额外实现", "rust_code": rust_code}
+        
+        result = {"passed": False, "rust_code": rust_code}
+        review_decision = self.review_policy.decide(
+            kind, rust_code, rust_response_json.get("confidence"), 1, self.stats, local_check
+        )
+        if not review_decision["review"]:
+            result["review"] = {"result": "PASS", "reason": review_decision["reason"], "skipped": True}
+            self.stats.record_review(kind, True, skipped=True)
+        else:
+            if cancelled.is_set():
+                return dict(result, reason="已取消")
+            review_prompt = PromptTemplates.AGENT2_WITH_HISTORY
+            review_prompt = review_prompt.replace("{c_code}", c_code)
+            review_prompt = review_prompt.replace("{rust_code}", rust_code)
+            review_prompt = review_prompt.replace("{conversion_history}", "（首轮转换，无历史）")
+            review_messages = [
+                {"role": "system", "content": PromptTemplates.AGENT2_SYSTEM},
+                {"role": "user", "content": review_prompt}
+            ]
+            try:
+                review_json, review_response = self.agent2.ask_json(review_messages, REVIEW_SCHEMA)
+            except StructuredOutputError as e:
+                review_response = e.raw_text
+                review_json = TextExtractor.extract_json(review_response) or {"result": "FAIL", "reason": "无法解析审核结果"}
+            ai_dialog_logger.info(f"推测候选审核 - Agent2回复: {review_response}")
+            result["review"] = review_json
+            self.stats.record_review(kind, review_json.get("result") == "PASS", sampled=review_decision["sampled"])
+            if review_json.get("result") != "PASS":
+                return dict(result, reason=f"审核未通过: {review_json.get('reason', '')}")
+        
+        if cancelled.is_set():
+            return dict(result, reason="已取消")
+        detection_result = self.ai_detector.detect_extra_implementation(
+            rust_code, kind, known_dependencies, item_name=item_id
+        )
+        self.stats.record_detection(kind, detection_result.get("tier", "llm"),
+                                    detection_result["is_clean"], detection_result.get("confidence"))
+        result["ai_detection"] = detection_result
+        if not detection_result["is_clean"]:
+            return dict(result, reason="实现检测未通过")
+        
+        if self.enable_compile_check:
+            if cancelled.is_set():
+                return dict(result, reason="已取消")
+            compile_result = self._compile_rust_code(rust_code, kind, dependency_code, data)
+            result["compile_result"] = compile_result
+            if not compile_result["success"]:
+                return dict(result, reason=f"编译失败: {len(compile_result['errors'])} 个错误")
+        
+        return dict(result, passed=True, reason="通过")
+    
+    def _format_dependency_code(self, dependency_code, source_text):
+        """按token预算格式化依赖项的Rust代码：被直接引用的依赖优先保留全文，其余折叠为签名"""
+        fitted, omitted = self.prompt_budget.fit_dependencies(dependency_code, source_text)
+        if len(fitted) < len(dependency_code) or any(fitted[key] != dependency_code[key] for key in fitted):
+            item_logger.info(f"依赖项上下文超出预算: {len(fitted)}/{len(dependency_code)} 个保留，"
+                             f"{sum(fitted[key] != dependency_code[key] for key in fitted)} 个折叠为签名")
+        # 按键排序，使依赖项相同的项目得到逐字节相同的提示前缀
+        fitted = dict(sorted(fitted.items()))
+        return MicroBatcher.format_items(fitted, "rust") + self.prompt_budget.omitted_note(sorted(omitted))
+    
+    def _convert_locally(self, item_id, kind, c_code, dependency_code=None, data=None):
+        """使用规则转换器处理简单项目，返回转换结果；不适用或校验失败时返回None"""
+        local = self.local_converter.convert(kind, c_code)
+        if not local:
+            return None
+        
+        rust_code = local["rust_code"]
+        if self.enable_compile_check and not local["is_header_guard"]:
+            compile_result = self._compile_rust_code(rust_code, kind, dependency_code or {}, data)
+            if not compile_result["success"]:
+                main_logger.info(f"本地转换结果编译失败，回退到大模型转换 [{kind}]: {item_id}")
+                return None
+        
+        main_logger.info(f"⚡ 本地规则转换 [{kind}]: {item_id} ({local['rule']})")
+        item_logger.info(f"本地规则转换 ({local['rule']}):\n{rust_code}")
+        item_logger.info(f"==================== 结束转换 [{kind}]: {item_id} ====================\n")
+        ai_dialog_logger.info(f"本地规则转换，未调用AI ({local['rule']})")
+        
+        self.stats.record_success(item_id, kind, 0, {
+            "c_code": c_code,
+            "rust_code": rust_code
+        }, is_skipped=local["is_header_guard"])
+        
+        return {
+            "success": True,
+            "rust_code": rust_code,
+            "rounds": 0,
+            "conversion_history": [],
+            "is_header_guard": local["is_header_guard"],
+            "local": True,
+            "local_rule": local["rule"]
+        }
+    
+    def _convert_from_memory(self, item_id, kind, c_code, dependency_code=None, data=None):
+        """从翻译记忆中取出此前通过验证的转换结果；未命中或编译失败时返回None"""
+        recalled = self.translation_memory.lookup(kind, c_code, dependency_code)
+        if not recalled:
+            return None
+        
+        rust_code = recalled["rust_code"]
+        if self.enable_compile_check:
+            compile_result = self._compile_rust_code(rust_code, kind, dependency_code or {}, data)
+            if not compile_result["success"]:
+                main_logger.info(f"翻译记忆中的结果编译失败，回退到大模型转换 [{kind}]: {item_id}")
+                return None
+        
+        main_logger.info(f"📚 翻译记忆命中 [{kind}]: {item_id} (来源 {recalled['source']}, 累计命中 {recalled['hits']} 次)")
+        item_logger.info(f"==================== 翻译记忆命中 [{kind}]: {item_id} ====================")
+        item_logger.info(f"来源: {recalled['source']}\n{rust_code}")
+        
+        self.stats.record_start(item_id, kind)
+        self.stats.record_success(item_id, kind, 0, {
+            "c_code": c_code,
+            "rust_code": rust_code
+        })
+        
+        return {
+            "success": True,
+            "rust_code": rust_code,
+            "rounds": 0,
+            "conversion_history": [],
+            "memory": True
+        }
+    
+    @tracer.traced("convert_component", "convert", item_arg="members")
+    def convert_component(self, members, dependency_code=None, max_rounds=3, data=None):
+        """
+        联合转换一组互相依赖的C代码项（强连通分量）
+        
+        分量内的项目在同一个提示中转换，审核与编译验证也针对整体进行，
+        避免逐个转换时因依赖项尚未转换而引用不存在的类型。
+        
+        Args:
+            members: 成员列表，每项包含key、kind、item_name、c_code
+            dependency_code: 分量外部依赖项的Rust代码
+            max_rounds: 最大转换轮数
+            data: 架构数据（用于编译验证）
+        
+        Returns:
+            Dict: 包含success、items（key -> Rust代码）、rust_code、rounds等字段
+        """
+        component_name = ", ".join(member["item_name"] for member in members)
+        main_logger.info(f"开始联合转换 {len(members)} 个项目: {component_name}，含 {len(dependency_code) if dependency_code else 0} 个外部依赖项")
+        item_logger.info(f"==================== 开始联合转换: {component_name} ====================")
+        ai_dialog_logger.info(f"==================== AI对话开始 [component]: {component_name} ====================")
+        
+        # 组合所有成员的C代码
+        combined_c_code = ""
+        for member in members:
+            combined_c_code += f"### {member['key']}\n```c\n{member['c_code']}\n```\n\n"
+        
+        dependencies_text = ""
+        if dependency_code:
+            dependencies_text = self._format_dependency_code(dependency_code, combined_c_code)
+        
+        item_text = f"## 原始C代码：\n{combined_c_code}"
+        if any(member["kind"] == "functions" for member in members):
+            item_text += PromptTemplates.FUNCTION_NOTE
+        
+        json_prompt = PromptTemplates.stable_prompt(PromptTemplates.AGENT1_COMPONENT_INSTRUCTIONS, dependencies_text, item_text)
+        
+        messages = [
+            {"role": "system", "content": PromptTemplates.AGENT1_SYSTEM},
+            {"role": "user", "content": json_prompt}
+        ]
+        ai_dialog_logger.info(f"用户提示: {json_prompt}")
+        
+        expected_keys = [member["key"] for member in members]
+        conversion_history = []
+        feedback_prompt = None
+        
+        for round_num in range(1, max_rounds + 1):
+            item_logger.info(f"联合转换第 {round_num} 轮")
+            
+            if feedback_prompt:
+                messages.append({"role": "assistant", "content": rust_response_raw})
+                messages.append({"role": "user", "content": feedback_prompt})
+                ai_dialog_logger.info(f"联合转换反馈轮 {round_num - 1}: {feedback_prompt}")
+                feedback_prompt = None
+            
+            messages = self.prompt_budget.compact_messages(messages)
+            try:
+                try:
+                    rust_response_json, rust_response_raw = self.agent1.ask_json(messages, COMPONENT_CONVERSION_SCHEMA)
+                except StructuredOutputError as e:
+                    rust_response_raw = e.raw_text
+                    rust_response_json = TextExtractor.extract_json(rust_response_raw) or {}
+                ai_dialog_logger.info(f"联合转换轮 {round_num} - Agent1回复: {rust_response_raw}")
+                
+                items = rust_response_json.get("items")
+                if not isinstance(items, dict):
+                    items = {}
+                
+                missing_keys = [key for key in expected_keys if not str(items.get(key, "")).strip()]
+                if missing_keys:
+                    main_logger.warning(f"联合转换第 {round_num} 轮缺少项目: {', '.join(missing_keys)}")
+                    feedback_prompt = f"""你的返回结果中缺少以下项目的Rust代码：
+{chr(10).join(f"- {key}" for key in missing_keys)}
+
+请重新生成完整的JSON结果，items中必须包含所有项目：{', '.join(expected_keys)}。只返回JSON对象，不要添加其他文本。
+"""
+                    continue
+                
+                combined_rust_code = "\n\n".join(items[key].strip() for key in expected_keys)
+                attempt_record = {
+                    "round": round_num,
+                    "rust_code": combined_rust_code,
+                    "json_response": rust_response_json
+                }
+                conversion_history.append(attempt_record)
+                
+                history_sections = []
+                for i, attempt in enumerate(conversion_history, 1):
+                    section = f"### 尝试 {i}：\n```rust\n{attempt['rust_code']}\n```\n"
+                    if "review" in attempt:
+                        section += f"审核结果: {attempt['review']['result']}\n"
+                        section += f"原因: {attempt['review']['reason']}\n"
+                    history_sections.append(section + "\n")
+                history_text = "".join(self.prompt_budget.fit_sections(history_sections))
+                
+                # 整体审核
+                review_prompt = PromptTemplates.AGENT2_WITH_HISTORY
+                review_prompt = review_prompt.replace("{c_code}", "\n\n".join(member["c_code"] for member in members))
+                review_prompt = review_prompt.replace("{rust_code}", combined_rust_code)
+                review_prompt = review_prompt.replace("{conversion_history}", history_text)
+                review_messages = [
+                    {"role": "system", "content": PromptTemplates.AGENT2_SYSTEM},
+                    {"role": "user", "content": review_prompt}
+                ]
+                try:
+                    review_json, review_response = self.agent2.ask_json(review_messages, REVIEW_SCHEMA)
+                except StructuredOutputError as e:
+                    review_response = e.raw_text
+                    review_json = TextExtractor.extract_json(review_response)
+                ai_dialog_logger.info(f"联合审核轮 {round_num} - Agent2回复: {review_response}")
+                if not review_json or "result" not in review_json:
+                    review_json = {"result": "FAIL", "reason": "无法解析审核结果"}
+                review_json.setdefault("reason", "未提供原因")
+                attempt_record["review"] = review_json
+                item_logger.info(f"联合审核结果: {review_json['result']}")
+                
+                if review_json["result"] != "PASS":
+                    feedback_prompt = f"""你的Rust代码未通过审核，原因是:
+
+{review_json['reason']}
+
+请修正这些问题并重新生成完整的JSON结果（包含rust_code和items字段）。只返回JSON对象，不要添加其他文本。
+"""
+                    continue
+                
+                # 逐个成员进行AI实现检测
+                known_dependencies = list(dependency_code.keys()) if dependency_code else []
+                known_dependencies += expected_keys
+                violations = []
+                for member in members:
+                    detection_result = self.ai_detector.detect_extra_implementation(
+                        items[member["key"]], member["kind"], known_dependencies, item_name=member["key"]
+                    )
+                    self.stats.record_detection(member["kind"], detection_result.get("tier", "llm"),
+                                                detection_result["is_clean"], detection_result.get("confidence"))
+                    if not detection_result["is_clean"]:
+                        for violation in detection_result["violations"]:
+                            detail = violation.get("details", str(violation)) if isinstance(violation, dict) else str(violation)
+                            violations.append(f"{member['key']}: {detail}")
+                attempt_record["ai_detection"] = violations
+                
+                if violations:
+                    main_logger.warning(f"🤖 联合转换AI检测发现问题: {'; '.join(violations)}")
+                    feedback_prompt = f"""你的Rust代码AI检测发现了问题：
+
+{chr(10).join(f"- {v}" for v in violations)}
+
+请修正这些问题并重新生成完整的JSON结果（包含rust_code和items字段）。只返回JSON对象，不要添加其他文本。
+"""
+                    continue
+                
+                # 整体编译验证
+                if self.enable_compile_check:
+                    compile_result = self._compile_rust_code(combined_rust_code, "component", dependency_code or {}, data)
+                    attempt_record["compile_result"] = compile_result
+                    if not compile_result["success"]:
+                        compile_errors = compile_result["errors"]
+                        main_logger.warning(f"🔧 联合转换编译失败，有 {len(compile_errors)} 个错误")
+                        feedback_prompt = f"""你的Rust代码编译失败，需要修复：
+
+编译错误：
+{chr(10).join(f"- {error.split(chr(10))[0]}" for error in compile_errors[:3])}
+
+请修正这些问题并重新生成完整的JSON结果（包含rust_code和items字段）。只返回JSON对象，不要添加其他文本。
+"""
+                        continue
+                
+                # 转换成功，按成员分别记录统计
+                for member in members:
+                    self.stats.record_start(member["item_name"], member["kind"])
+                    self.stats.record_success(member["item_name"], member["kind"], round_num, {
+                        "c_code": member["c_code"],
+                        "rust_code": items[member["key"]],
+                        "component": expected_keys
+                    })
+                
+                main_logger.info(f"✅ 联合转换成功: {component_name}，用了 {round_num} 轮")
+                ai_dialog_logger.info(f"联合转换成功，最终代码: {combined_rust_code}")
+                return {
+                    "success": True,
+                    "items": {key: items[key].strip() for key in expected_keys},
+                    "rust_code": combined_rust_code,
+                    "rounds": round_num,
+                    "conversion_history": conversion_history
+                }
+            
+            except Exception as e:
+                main_logger.error(f"联合转换过程发生错误: {str(e)}")
+                main_logger.error(traceback.format_exc())
+                return {
+                    "success": False,
+                    "error": f"联合转换过程发生错误: {str(e)}",
+                    "conversion_history": conversion_history
+                }
+        
+        main_logger.warning(f"❌ 联合转换达到最大轮数 {max_rounds}: {component_name}")
+        ai_dialog_logger.info(f"==================== AI对话结束 [component]: {component_name} (达到最大轮数) ====================")
+        return {
+            "success": False,
+            "error": "联合转换达到最大轮数",
+            "conversion_history": conversion_history
+        }
+    
+    @tracer.traced("convert_batch", "convert", item_arg="members")
+    def convert_batch(self, members, dependency_code=None, data=None):
+        """
+        批量转换一组互不依赖的同类型小项目
+        
+        Agent1转换、Agent2审核和AI实现检测各只发送一次请求，响应按项目键拆分。
+        本地规则可以转换的项目、响应中缺失或未通过任一步骤的项目不在此处重试，
+        由调用方逐个重新转换。
+        
+        Args:
+            members: 成员列表，每项包含key、kind、item_name、c_code
+            dependency_code: 本批项目外部依赖项的Rust代码（合并后的）
+            data: 架构数据（用于编译验证）
+        
+        Returns:
+            Dict: {"items": 转换成功的key -> Rust代码, "failed": 需要逐个重新转换的key列表}
+        """
+        kind = members[0]["kind"]
+        # 本地规则可以直接转换的项目交给逐个转换流程，不占用请求
+        batch_members = [member for member in members if not self.local_converter.convert(kind, member["c_code"])]
+        batch_keys = {member["key"] for member in batch_members}
+        failed = [member["key"] for member in members if member["key"] not in batch_keys]
+        if len(batch_members) < 2:
+            return {"items": {}, "failed": [member["key"] for member in members]}
+        
+        keys = [member["key"] for member in batch_members]
+        by_key = {member["key"]: member for member in batch_members}
+        batch_name = ", ".join(member["item_name"] for member in batch_members)
+        main_logger.info(f"📦 批量转换 {len(batch_members)} 个 [{kind}] 项目: {batch_name}")
+        item_logger.info(f"==================== 开始批量转换 [{kind}]: {batch_name} ====================")
+        ai_dialog_logger.info(f"==================== AI对话开始 [batch]: {batch_name} ====================")
+        # 只为批量结果被采用的项目记录开始，失败的项目由逐个转换流程记录，避免重复计数
+        batch_started = time.time()
+        
+        # 1. Agent1一次转换所有项目
+        dependencies_text = ""
+        if dependency_code:
+            dependencies_text = self._format_dependency_code(
+                dependency_code, "\n".join(member["c_code"] for member in batch_members)
+            )
+        
+        item_text = f"## 原始C代码：\n{MicroBatcher.format_items({key: by_key[key]['c_code'] for key in keys})}"
+        if kind == "functions":
+            item_text += PromptTemplates.FUNCTION_NOTE
+        
+        json_prompt = PromptTemplates.stable_prompt(PromptTemplates.AGENT1_BATCH_INSTRUCTIONS, dependencies_text, item_text)
+        messages = [
+            {"role": "system", "content": PromptTemplates.AGENT1_SYSTEM},
+            {"role": "user", "content": json_prompt}
+        ]
+        ai_dialog_logger.info(f"用户提示: {json_prompt}")
+        
+        try:
+            try:
+                rust_response_json, rust_response_raw = self.agent1.ask_json(messages, BATCH_CONVERSION_SCHEMA)
+            except StructuredOutputError as e:
+                rust_response_raw = e.raw_text
+                rust_response_json = TextExtractor.extract_json(rust_response_raw) or {}
+            ai_dialog_logger.info(f"批量转换 - Agent1回复: {rust_response_raw}")
+        except Exception as e:
+            main_logger.error(f"批量转换过程发生错误，回退为逐个转换: {str(e)}")
+            return {"items": {}, "failed": [member["key"] for member in members]}
+        
+        converted, missing = MicroBatcher.split_results(
+            rust_response_json, keys, lambda value: isinstance(value, str) and bool(value.strip())
+        )
+        converted = {key: code.strip() for key, code in converted.items()}
+        failed += missing
+        if missing:
+            main_logger.warning(f"批量转换缺少项目，将逐个重新转换: {', '.join(missing)}")
+        
+        # 2. 按审核策略筛选需要审核的项目，一次审核
+        known_dependencies = list(dependency_code.keys()) if dependency_code else []
+        confidence = rust_response_json.get("confidence")
+        to_review = {}
+        for key, rust_code in converted.items():
+            local_check = StructuralAnalyzer.analyze(rust_code, kind, known_dependencies, key)
+            decision = self.review_policy.decide(kind, rust_code, confidence, 1, self.stats, local_check)
+            if decision["review"]:
+                to_review[key] = decision
+            else:
+                self.stats.record_review(kind, True, skipped=True)
+        
+        verified = set()  # 经Agent2实际审核通过或编译通过的项目，抽样跳过审核的项目不在其中
+        if to_review:
+            reviews = self._review_batch(kind, {key: (by_key[key]["c_code"], converted[key]) for key in to_review})
+            for key, decision in to_review.items():
+                review_json = reviews.get(key)
+                passed = bool(review_json) and review_json.get("result") == "PASS"
+                if review_json:
+                    self.stats.record_review(kind, passed, sampled=decision["sampled"])
+                if not passed:
+                    reason = review_json.get("reason", "未提供原因") if review_json else "批量审核未返回该项目的结果"
+                    item_logger.info(f"批量审核未通过 [{kind}]: {key}，原因: {reason}")
+                    converted.pop(key)
+                    failed.append(key)
+                else:
+                    verified.add(key)
+        
+        # 3. AI实现检测，本地无法确定的项目合并为一次请求
+        if converted:
+            detections = self.ai_detector.detect_batch(
+                {key: (rust_code, kind) for key, rust_code in converted.items()}, known_dependencies
+            )
+            for key, detection_result in detections.items():
+                self.stats.record_detection(kind, detection_result.get("tier", "llm"),
+                                            detection_result["is_clean"], detection_result.get("confidence"))
+                if not detection_result["is_clean"]:
+                    item_logger.info(f"批量转换AI检测未通过 [{kind}]: {key}")
+                    converted.pop(key)
+                    failed.append(key)
+        
+        # 4. 编译验证（本地执行，逐项进行，失败的项目逐个重新转换以便走修复流程）
+        if self.enable_compile_check:
+            for key in list(converted):
+                compile_result = self._compile_rust_code(converted[key], kind, dependency_code or {}, data)
+                if not compile_result["success"]:
+                    item_logger.info(f"批量转换编译失败 [{kind}]: {key}")
+                    converted.pop(key)
+                    failed.append(key)
+                else:
+                    verified.add(key)
+        
+        for key, rust_code in converted.items():
+            member = by_key[key]
+            self.stats.record_start(member["item_name"], kind, batch_started)
+            self.stats.record_success(member["item_name"], kind, 1, {
+                "c_code": member["c_code"],
+                "rust_code": rust_code,
+                "batch": keys
+            })
+            item_logger.info(f"批量转换成功 [{kind}]: {key}\n{rust_code}")
+        
+        main_logger.info(f"📦 批量转换完成: {len(converted)}/{len(batch_members)} 个项目成功，{len(failed)} 个项目将逐个转换")
+        ai_dialog_logger.info(f"==================== AI对话结束 [batch]: {batch_name} ====================")
+        return {"items": converted, "failed": failed, "verified": sorted(verified & set(converted))}
+    
+    def _review_batch(self, kind, entries):
+        """
+        一次请求审核多个项目
+        
+        Args:
+            kind: 项目类型
+            entries: key -> (C代码, Rust代码)
+        
+        Returns:
+            Dict: key -> {"result", "reason"}，缺失的项目视为未审核
+        """
+        sections = "".join(
+            f"### {key}\n原始C代码：\n```c\n{c_code}\n```\n生成的Rust代码：\n```rust\n{rust_code}\n```\n\n"
+            for key, (c_code, rust_code) in entries.items()
+        )
+        items_example = ",\n    ".join(f'"{key}": {{"result": "PASS 或 FAIL", "reason": "详细原因描述"}}' for key in entries)
+        review_prompt = f"""请分别审核以下 {len(entries)} 个C代码到Rust的转换是否正确、安全且符合Rust惯用法，各项目互相独立判定：
+
+{sections}
+评估时要务实，对于某些C结构（如复杂宏、void*指针、特殊内存布局），可能确实需要unsafe代码。
+
+请只关注签名转换（类型定义、结构定义、函数签名），不需评估函数实现细节。
+
+以JSON格式返回每个项目的审核结果，items中必须包含上面列出的每一个项目：
+{{
+  "items": {{
+    {items_example}
+  }}
+}}
+
+确保JSON格式正确，且只返回JSON对象，不要有其他文本。
+"""
+        review_messages = [
+            {"role": "system", "content": PromptTemplates.AGENT2_SYSTEM},
+            {"role": "user", "content": review_prompt}
+        ]
+        ai_dialog_logger.info(f"批量审核 [{kind}] - 用户提示: {review_prompt}")
+        try:
+            try:
+                review_json, review_response = self.agent2.ask_json(review_messages, BATCH_REVIEW_SCHEMA)
+            except StructuredOutputError as e:
+                review_response = e.raw_text
+                review_json = TextExtractor.extract_json(review_response)
+            ai_dialog_logger.info(f"批量审核 [{kind}] - Agent2回复: {review_response}")
+        except Exception as e:
+            main_logger.error(f"批量审核过程发生错误: {str(e)}")
+            return {}
+        
+        reviews, _ = MicroBatcher.split_results(
+            review_json, list(entries), lambda value: isinstance(value, dict) and value.get("result") in ("PASS", "FAIL")
+        )
+        return reviews
+    
+    def process_architecture_file(self, filepath, output_path=None, max_items=None, roots=None):
+        """
+        处理整个架构文件
+
+        Args:
+            roots: 入口函数或类型名称列表，只转换它们的传递依赖闭包，其余项目保持未转换；为空时处理全部项目
+        """
         main_logger.info("="*80)
         main_logger.info(f"开始处理架构文件: {filepath}")
         main_logger.info("="*80)
@@ -742,64 +1336,27 @@ class C2RustConverter:
         if not output_path:
             output_path = filepath  # 直接写回原始文件
         
-        # 检查输出文件是否已存在，如果存在则读取之前的处理状态
         data = copy.deepcopy(input_data)  # 使用深拷贝而非浅拷贝
-        if output_path != filepath and os.path.exists(output_path):
+        
+        # 重新分类函数类型的define和typedef到functions类别
+        self._reclassify_function_items(data)
+        
+        # 检查输出文件是否已存在，如果存在则沿用之前的处理结果：
+        # 只沿用指纹未变化的项目，源码或依赖输出变化的项目及其反向依赖闭包重新转换
+        if os.path.exists(output_path):
             try:
                 main_logger.info(f"检测到现有输出文件: {output_path}，读取已处理状态")
-                with open(output_path, "r", encoding="utf-8") as f:
-                    output_data = json.load(f)
+                if output_path == filepath:
+                    output_data = input_data
+                else:
+                    with open(output_path, "r", encoding="utf-8") as f:
+                        output_data = json.load(f)
                 
-                # 合并数据，优先使用输出文件中的处理状态
-                for file_name, content in output_data.items():
-                    if file_name not in data:
-                        data[file_name] = content
-                        continue
-                        
-                    for kind in ["fields", "defines", "typedefs", "structs", "functions"]:
-                        if kind not in content:
-                            continue
-                            
-                        if kind not in data[file_name]:
-                            data[file_name][kind] = content[kind]
-                            continue
-                            
-                        for item_name, item in content[kind].items():
-                            # 如果项目已成功转换，使用输出文件中的状态
-                            if item.get("conversion_status") == "success":
-                                data[file_name][kind][item_name] = item
+                carried = carry_over_stage(data, output_data, "conversion")
+                main_logger.info(f"沿用 {carried['carried']} 个已转换项目，{carried['changed']} 个项目输入变化，共作废 {carried['invalidated']} 个项目（含反向依赖）")
             except Exception as e:
                 main_logger.error(f"读取输出文件时出错: {e}")
         
-        # 重新分类函数类型的define和typedef到functions类别
-        main_logger.info("正在重新分类函数类型的define和typedef项目...")
-        reclassified_count = 0
-        
-        for file_name, content in data.items():
-            if "functions" not in content:
-                content["functions"] = {}
-            
-            # 检查defines中的函数宏
-            if "defines" in content:
-                to_move = []
-                for item_name, item_data in content["defines"].items():
-                    if self._should_treat_as_function(item_name, item_data):
-                        to_move.append((item_name, item_data))
-                
-                for item_name, item_data in to_move:
-                    # 移动到functions类别
-                    content["functions"][item_name] = item_data.copy()
-                    content["functions"][item_name]["original_type"] = "define"
-                    # 从defines中删除
-                    del content["defines"][item_name]
-                    reclassified_count += 1
-                    main_logger.info(f"将define函数宏 {item_name} 重新分类到functions")
-            
-            # typedef中的函数指针保持不变（它们是类型定义，不是函数实现）
-        
-        if reclassified_count > 0:
-            main_logger.info(f"共重新分类了 {reclassified_count} 个函数类型项目")
-        
         # 初始化已处理项跟踪
         processed_items = set()
         
@@ -830,291 +1387,61 @@ class C2RustConverter:
         
         main_logger.info(f"总项目数: {total_items}, 已处理: {len(processed_items)}, 剩余: {remaining_items}")
         
-        # 转换基础结构
-        processing_items = set()  # 当前正在处理的项目
-        max_to_process = remaining_items  # 使用未处理项目数而不是总项目数
-        item_count = 0
-        success_count = 0
-        skipped_count = 0
-        failed_count = 0
+        # 构建依赖图，按强连通分量调度：依赖项所在分量总是先于依赖它的分量处理，
+        # 互相依赖（循环依赖）的项目作为一个整体联合转换，就绪分量按关键路径优先级出队
+        graph = DependencyGraph(data)
+        components = graph.strongly_connected_components()
+        
+        # 指定入口时只处理其依赖闭包；闭包对依赖封闭，强连通分量要么整体在闭包内，要么整体在闭包外
+        closure = root_closure(data, roots, graph)
+        if closure is not None:
+            components = [component for component in components if component[0] in closure]
+            remaining_items = len(closure - processed_items)
+            main_logger.info(f"入口 {', '.join(roots)} 的依赖闭包: {len(closure)} 个项目（其中 {remaining_items} 个未处理），"
+                             f"其余 {len(graph.nodes) - len(closure)} 个项目本次不处理")
+        
+        if self.store:
+            imported = self.store.import_json(data)
+            main_logger.info(f"已将 {imported} 个项目导入架构存储: {self.store.db_path}")
+        
+        cyclic_count = sum(1 for component in components if len(component) > 1)
+        main_logger.info(f"依赖图: {len(graph.nodes)} 个项目, {len(components)} 个强连通分量, 其中 {cyclic_count} 个存在循环依赖")
+        
+        progress = {
+            "item_count": 0,
+            "max_to_process": remaining_items,  # 使用未处理项目数而不是总项目数
+            "success": 0,
+            "skipped": 0,
+            "failed": 0
+        }
         
-        # 先处理基础结构
-        for file_name, content in data.items():
-            # 处理结构体、类型定义等基础结构
-            for kind in ["fields", "defines", "typedefs", "structs"]:
-                if kind not in content:
-                    continue
-                    
-                for item_name, item in content[kind].items():
-                    # 生成完整ID
-                    full_id = f"{file_name}::{kind}::{item_name}"
-                    
-                    # 如果已经处理过，跳过
-                    if full_id in processed_items:
-                        continue
-                    
-                    # 检查依赖项
-                    deps = item.get("dependencies", {})
-                    all_deps_processed = True
-                    missing_deps = []
-                    
-                    # 如果没有依赖，或者所有依赖都已处理或正在处理（避免循环依赖）
-                    if not deps or all(
-                        self._is_dependency_processed(dep_id, dep_info, data, processed_items, processing_items)
-                        for dep_id, dep_info in deps.items()
-                    ):
-                        # 显示进度信息
-                        current_progress = item_count + 1
-                        progress_percent = (current_progress / max_to_process) * 100 if max_to_process > 0 else 0
-                        main_logger.info(f"处理项目 [{current_progress}/{max_to_process}] ({progress_percent:.1f}%) - [{kind}]: {item_name}")
-                        
-                        # 获取完整文本
-                        full_text = item.get("full_text")
-                        if not full_text:
-                            main_logger.warning(f"[{kind}]: {item_name} 缺少full_text字段，跳过")
-                            processed_items.add(full_id)
-                            continue
-                        
-                        # 收集依赖项的已转换代码
-                        dependency_code = {}
-                        for dep_id, dep_info in deps.items():
-                            if not self._is_dependency_processed(dep_id, dep_info, data, processed_items, processing_items):
-                                all_deps_processed = False
-                                missing_deps.append((dep_id, dep_info))
-                                break
-                                
-                            # 收集依赖项代码
-                            dep_code = self._collect_dependency_code(dep_id, dep_info, data)
-                            dependency_code.update(dep_code)
-                        
-                        # 转换代码
-                        processing_items.add(full_id)  # 标记为正在处理
-                        try:
-                            result = self.convert_with_dependencies(
-                                item_name, kind, full_text, dependency_code, 
-                                data=data, file_name=file_name  # 传入文件名
-                            )
-                            
-                            # 更新结果
-                            if result["success"]:
-                                item["rust_signature"] = result["rust_code"]
-                                item["conversion_status"] = "success"
-                                
-                                # 检查是否为头文件保护宏，这种情况不计入常规转换轮数
-                                if result.get("is_header_guard", False):
-                                    item["is_header_guard"] = True
-                                    main_logger.info(f"[{kind}]: {item_name} 是头文件保护宏，已跳过")
-                                    # 不重复输出项目信息，减少日志量
-                                    # item_logger.info(f"跳过头文件保护宏")
-                                    skipped_count += 1
-                                else:
-                                    item["conversion_rounds"] = result["rounds"]
-                                    main_logger.info(f"成功转换 [{kind}]: {item_name} (用了{result['rounds']}轮)")
-                                    success_count += 1
-                                    
-                                    # 新增：添加到跨文件验证器并进行实时验证
-                                    if self.cross_file_validator:
-                                        # 先添加到验证器
-                                        added = self.cross_file_validator.add_converted_item(
-                                            file_name=file_name or "unknown_file",  # 使用传入的文件名
-                                            kind=kind,
-                                            item_name=item_name,
-                                            rust_code=result["rust_code"],
-                                            original_type=item.get("original_type", None)
-                                        )
-                                        
-                                        if added:
-                                            # 只在启用编译验证时才进行实时验证
-                                            if self.enable_compile_check:
-                                                # 进行实时编译验证
-                                                validation_result = self.cross_file_validator.validate_rust_code(
-                                                    result["rust_code"], kind, f"{file_name}::{item_name}"
-                                                )
-                                                if validation_result["success"]:
-                                                    main_logger.info(f"✅ 跨文件验证成功 [{kind}]: {item_name}")
-                                                else:
-                                                    main_logger.warning(f"⚠️ 跨文件验证失败 [{kind}]: {item_name}")
-                                                    for error in validation_result["errors"][:2]:  # 只显示前2个错误
-                                                        main_logger.warning(f"   错误: {error.split(chr(10))[0]}...")
-                                            else:
-                                                main_logger.debug(f"📝 已记录到验证器（跳过验证）: [{kind}]: {item_name}")
-                                        else:
-                                            main_logger.debug(f"跨文件验证器：跳过重复项目 [{kind}]: {item_name}")
-                            else:
-                                item["conversion_status"] = "failed"
-                                item["failure_reason"] = result.get("reason", "转换失败，无具体原因")
-                                main_logger.warning(f"转换失败 [{kind}]: {item_name}, 原因: {item['failure_reason']}")
-                                failed_count += 1
-                        except Exception as e:
-                            main_logger.error(f"处理 [{kind}]: {item_name} 时发生错误: {e}")
-                            item["conversion_status"] = "error"
-                            item["failure_reason"] = str(e)
-                            failed_count += 1
-                        finally:
-                            processed_items.add(full_id)  # 无论成功失败，都标记为已处理
-                            processing_items.remove(full_id)  # 从正在处理中移除
-                        
-                        # 定期保存结果
-                        item_count += 1
-                        if item_count % 10 == 0:
-                            with open(output_path, "w", encoding="utf-8") as f:
-                                json.dump(data, f, indent=4, ensure_ascii=False)
-                                
-                        # 如果设置了最大处理数量，检查是否已达到
-                        if max_items and item_count >= max_items:
-                            main_logger.info(f"已达到最大处理数量 {max_items}，停止处理")
-                            break
-                            
-                    else:
-                        # 依赖项未处理完成，记录未处理的依赖
-                        for dep_id, dep_info in deps.items():
-                            if not self._is_dependency_processed(dep_id, dep_info, data, processed_items, processing_items):
-                                missing_deps.append((dep_id, dep_info))
-                                
-                # 如果达到最大处理数量，跳出循环
-                if max_items and item_count >= max_items:
-                    break
-                    
-            # 如果达到最大处理数量，跳出循环
-            if max_items and item_count >= max_items:
-                break
-                
-        # 如果基础结构都处理了但还有剩余项，开始处理函数
-        if (not max_items or item_count < max_items) and item_count < total_items:
-            # 处理函数
-            for file_name, content in data.items():
-                if "functions" not in content:
-                    continue
-                    
-                for item_name, item in content["functions"].items():
-                    # 生成完整ID
-                    full_id = f"{file_name}::functions::{item_name}"
-                    
-                    # 如果已经处理过，跳过
-                    if full_id in processed_items:
-                        continue
-                    
-                    # 检查依赖项
-                    deps = item.get("dependencies", {})
-                    all_deps_processed = True
-                    missing_deps = []
-                    
-                    # 如果没有依赖，或者所有依赖都已处理或正在处理（避免循环依赖）
-                    if not deps or all(
-                        self._is_dependency_processed(dep_id, dep_info, data, processed_items, processing_items)
-                        for dep_id, dep_info in deps.items()
-                    ):
-                        # 显示进度信息
-                        current_progress = item_count + 1
-                        progress_percent = (current_progress / max_to_process) * 100 if max_to_process > 0 else 0
-                        main_logger.info(f"处理函数 [{current_progress}/{max_to_process}] ({progress_percent:.1f}%) - [functions]: {item_name}")
-                        
-                        # 获取完整文本
-                        full_text = item.get("full_text")
-                        if not full_text:
-                            main_logger.warning(f"[functions]: {item_name} 缺少full_text字段，跳过")
-                            processed_items.add(full_id)
-                            continue
-                        
-                        # 收集依赖项的已转换代码
-                        dependency_code = {}
-                        for dep_id, dep_info in deps.items():
-                            if not self._is_dependency_processed(dep_id, dep_info, data, processed_items, processing_items):
-                                all_deps_processed = False
-                                missing_deps.append((dep_id, dep_info))
-                                break
-                                
-                            # 收集依赖项代码
-                            dep_code = self._collect_dependency_code(dep_id, dep_info, data)
-                            dependency_code.update(dep_code)
-                        
-                        # 转换代码
-                        processing_items.add(full_id)  # 标记为正在处理
-                        try:
-                            result = self.convert_with_dependencies(
-                                item_name, "functions", full_text, dependency_code, 
-                                data=data, file_name=file_name  # 传入文件名
-                            )
-                            
-                            # 更新结果
-                            if result["success"]:
-                                item["rust_signature"] = result["rust_code"]
-                                item["conversion_status"] = "success"
-                                item["conversion_rounds"] = result["rounds"]
-                                main_logger.info(f"成功转换函数: {item_name} (用了{result['rounds']}轮)")
-                                success_count += 1
-                                
-                                # 新增：添加到跨文件验证器并进行实时验证
-                                if self.cross_file_validator:
-                                    # 先添加到验证器
-                                    added = self.cross_file_validator.add_converted_item(
-                                        file_name=file_name or "unknown_file",  # 使用传入的文件名
-                                        kind="functions",
-                                        item_name=item_name,
-                                        rust_code=result["rust_code"],
-                                        original_type=item.get("original_type", None)
-                                    )
-                                    
-                                    if added:
-                                        # 只在启用编译验证时才进行实时验证
-                                        if self.enable_compile_check:
-                                            # 进行实时编译验证
-                                            validation_result = self.cross_file_validator.validate_rust_code(
-                                                result["rust_code"], "functions", f"{file_name}::{item_name}"
-                                            )
-                                            if validation_result["success"]:
-                                                main_logger.info(f"✅ 跨文件验证成功 [functions]: {item_name}")
-                                            else:
-                                                main_logger.warning(f"⚠️ 跨文件验证失败 [functions]: {item_name}")
-                                                for error in validation_result["errors"][:2]:  # 只显示前2个错误
-                                                    main_logger.warning(f"   错误: {error.split(chr(10))[0]}...")
-                                        else:
-                                            main_logger.debug(f"📝 已记录到验证器（跳过验证）: [functions]: {item_name}")
-                                    else:
-                                        main_logger.debug(f"跨文件验证器：跳过重复函数 {item_name}")
-                            else:
-                                item["conversion_status"] = "failed"
-                                item["failure_reason"] = result.get("reason", "转换失败，无具体原因")
-                                main_logger.warning(f"转换失败 [functions]: {item_name}, 原因: {item['failure_reason']}")
-                                failed_count += 1
-                        except Exception as e:
-                            main_logger.error(f"处理 [functions]: {item_name} 时发生错误: {e}")
-                            item["conversion_status"] = "error"
-                            item["failure_reason"] = str(e)
-                            failed_count += 1
-                        finally:
-                            processed_items.add(full_id)  # 无论成功失败，都标记为已处理
-                            processing_items.remove(full_id)  # 从正在处理中移除
-                        
-                        # 定期保存结果
-                        item_count += 1
-                        if item_count % 10 == 0:
-                            with open(output_path, "w", encoding="utf-8") as f:
-                                json.dump(data, f, indent=4, ensure_ascii=False)
-                                
-                        # 如果设置了最大处理数量，检查是否已达到
-                        if max_items and item_count >= max_items:
-                            main_logger.info(f"已达到最大处理数量 {max_items}，停止处理")
-                            break
-                            
-                    else:
-                        # 依赖项未处理完成，记录未处理的依赖
-                        for dep_id, dep_info in deps.items():
-                            if not self._is_dependency_processed(dep_id, dep_info, data, processed_items, processing_items):
-                                missing_deps.append((dep_id, dep_info))
-                                
-                # 如果达到最大处理数量，跳出循环
-                if max_items and item_count >= max_items:
-                    break
+        self._run_ready_queue(graph, components, data, processed_items, progress, output_path, max_items)
+        
+        success_count = progress["success"]
+        skipped_count = progress["skipped"]
+        failed_count = progress["failed"]
         
         # 保存结果
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        self._save_checkpoint(data, output_path)
             
         # 输出结果统计
         main_logger.info("="*80)
         main_logger.info(f"处理完成: 成功={success_count}, 跳过={skipped_count}, 失败={failed_count}")
         main_logger.info(f"总项目数: {total_items}, 已处理: {len(processed_items)}")
+        detection_report = self.stats.generate_report().get("实现检测")
+        if detection_report:
+            for kind, kind_stats in detection_report.items():
+                main_logger.info(f"实现检测 [{kind}]: 本地判定={kind_stats['本地判定']}, AI判定={kind_stats['AI判定']} "
+                                 f"({kind_stats['AI判定占比']}), 平均置信度={kind_stats['平均置信度']}")
+        for line in self.router.summary_lines():
+            main_logger.info(f"模型路由 {line}")
+        if self.translation_memory:
+            main_logger.info(f"翻译记忆: {self.translation_memory.describe()}")
+        if self.speculator.enabled:
+            speculation = self.speculator.get_stats()
+            main_logger.info(f"推测转换: {speculation['runs']} 个项目（首轮即推测 {speculation['first_round']} 个, "
+                             f"首轮未通过后推测 {speculation['after_failure']} 个）, 候选通过 {speculation['won']} 个 "
+                             f"({speculation['win_rate']}), 取消候选 {speculation['cancelled']} 个")
         
         # 检查是否有未处理的项目
         if len(processed_items) < total_items:
@@ -1146,6 +1473,403 @@ class C2RustConverter:
         
         return data
 
+    def _reclassify_function_items(self, data):
+        """将函数类型的define重新分类到functions类别，返回重新分类的项目数"""
+        main_logger.info("正在重新分类函数类型的define和typedef项目...")
+        reclassified_count = 0
+        
+        for file_name, content in data.items():
+            if "functions" not in content:
+                content["functions"] = {}
+            
+            # 检查defines中的函数宏
+            if "defines" in content:
+                to_move = []
+                for item_name, item_data in content["defines"].items():
+                    if self._should_treat_as_function(item_name, item_data):
+                        to_move.append((item_name, item_data))
+                
+                for item_name, item_data in to_move:
+                    # 移动到functions类别
+                    content["functions"][item_name] = item_data.copy()
+                    content["functions"][item_name]["original_type"] = "define"
+                    # 从defines中删除
+                    del content["defines"][item_name]
+                    reclassified_count += 1
+                    main_logger.info(f"将define函数宏 {item_name} 重新分类到functions")
+            
+            # typedef中的函数指针保持不变（它们是类型定义，不是函数实现）
+        
+        if reclassified_count > 0:
+            main_logger.info(f"共重新分类了 {reclassified_count} 个函数类型项目")
+        
+        return reclassified_count
+
+    @tracer.traced("checkpoint", "io")
+    def _save_checkpoint(self, data, output_path):
+        """将当前处理结果写入输出文件"""
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+
+    def _latency_weights(self, data):
+        """
+        按项目类型估计相对转换耗时，用于关键路径优先级加权
+        
+        耗时来源于已有结果中记录的conversion_seconds（历史运行）以及本次运行的统计数据，
+        返回值以全部样本的平均耗时为1进行归一化，没有样本的类型按1处理。
+        """
+        samples = {}
+        for content in data.values():
+            if not isinstance(content, dict):
+                continue
+            for kind in ["fields", "defines", "typedefs", "structs", "functions"]:
+                for item in content.get(kind, {}).values():
+                    seconds = item.get("conversion_seconds")
+                    if seconds:
+                        samples.setdefault(kind, []).append(seconds)
+        for kind, durations in self.stats.durations.items():
+            samples.setdefault(kind, []).extend(durations)
+        
+        all_samples = [seconds for durations in samples.values() for seconds in durations]
+        if not all_samples:
+            return {}
+        overall = sum(all_samples) / len(all_samples)
+        return {kind: (sum(durations) / len(durations)) / overall for kind, durations in samples.items()}
+
+    def _run_ready_queue(self, graph, components, data, processed_items, progress, output_path, max_items=None):
+        """
+        以就绪队列调度强连通分量的转换
+        
+        分量的依赖全部完成后才进入队列，就绪分量按关键路径优先级（下游深度、扇出）出队，
+        由最多max_workers个工作线程并行转换，转换结果统一在主线程写回架构数据。
+        """
+        weights = self._latency_weights(data)
+        if weights:
+            main_logger.info("按历史耗时加权关键路径: " + ", ".join(f"{kind}={weight:.2f}" for kind, weight in weights.items()))
+        priorities = graph.critical_path_priority(
+            components, lambda node_id: weights.get(graph.nodes[node_id][1], 1.0)
+        )
+        queue = ReadyQueue(graph, components, priorities)
+        run_metrics.track_remaining("convert", queue.remaining)
+        
+        running = {}  # future -> (分量索引列表, 任务)
+        dispatched = 0
+        stop = False
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                # 填满空闲的工作线程
+                while not stop and len(queue) and len(running) < self.max_workers:
+                    run_budget.adapt(self.router, [queue], main_logger.warning)
+                    if run_budget.exhausted():
+                        main_logger.warning(f"预算已用尽（{run_budget.describe()}），停止派发，等待进行中的转换完成，"
+                                            f"剩余 {queue.remaining()} 个项目留待下次运行")
+                        stop = True
+                        break
+                    index = queue.pop()
+                    indices = self.batcher.take(queue, index, lambda i: self._batch_key(graph, components[i], processed_items))
+                    if len(indices) > 1:
+                        task = self._build_batch_task(graph, [components[i] for i in indices], data, processed_items, progress, dispatched)
+                    else:
+                        task = self._build_task(graph, components[index], data, processed_items, progress, dispatched)
+                    if task is None:
+                        for i in indices:
+                            queue.complete(i)
+                        continue
+                    
+                    # 多线程时工作线程只读取提交时的数据快照，避免与主线程写回结果冲突
+                    task_data = copy.deepcopy(data) if self.max_workers > 1 else data
+                    running[executor.submit(self._run_task, task, task_data)] = (indices, task)
+                    dispatched += len(task["members"])
+                    
+                    # 如果设置了最大处理数量，检查是否已达到
+                    if max_items and dispatched >= max_items:
+                        main_logger.info(f"已达到最大处理数量 {max_items}，停止处理")
+                        stop = True
+                
+                if not running:
+                    break
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    indices, task = running.pop(future)
+                    self._apply_task_results(task, future.result(), data, processed_items, progress, output_path)
+                    for index in indices:
+                        queue.complete(index)
+    
+    def _batch_key(self, graph, component, processed_items):
+        """分量的批处理键：只有单个待处理的小项目才能合批，同类型的项目键相同"""
+        if len(component) != 1 or component[0] in processed_items:
+            return None
+        _, kind, _ = graph.nodes[component[0]]
+        full_text = graph.get_item(component[0]).get("full_text")
+        if not full_text or not self.batcher.fits(full_text):
+            return None
+        # 函数指针类型定义需要专门的转换提示，不参与合批
+        if kind == "typedefs" and "(" in full_text:
+            return None
+        return kind
+    
+    def _build_batch_task(self, graph, components, data, processed_items, progress, dispatched):
+        """将多个单项目分量合并为一个批量转换任务，依赖代码取并集"""
+        members = []
+        dependency_code = {}
+        for component in components:
+            task = self._build_task(graph, component, data, processed_items, progress, dispatched + len(members))
+            if task is None:
+                continue
+            members.extend(task["members"])
+            dependency_code.update(task["dependency_code"])
+        if not members:
+            return None
+        return {"members": members, "dependency_code": dependency_code, "graph": graph, "batch": len(members) > 1}
+
+    def _build_task(self, graph, component, data, processed_items, progress, dispatched):
+        """为一个待处理的强连通分量准备转换任务（在主线程中执行）"""
+        members = []
+        for node_id in component:
+            if node_id in processed_items:
+                continue
+            file_name, kind, item_name = graph.nodes[node_id]
+            item = graph.get_item(node_id)
+            full_text = item.get("full_text")
+            if not full_text:
+                main_logger.warning(f"[{kind}]: {item_name} 缺少full_text字段，跳过")
+                processed_items.add(node_id)
+                continue
+            members.append({
+                "node_id": node_id,
+                "file_name": file_name,
+                "kind": kind,
+                "item_name": item_name,
+                "key": f"{kind}::{item_name}",
+                "c_code": full_text,
+                "item": item
+            })
+        
+        if not members:
+            return None
+        
+        # 显示进度信息
+        max_to_process = progress["max_to_process"]
+        for offset, member in enumerate(members, 1):
+            current_progress = dispatched + offset
+            progress_percent = (current_progress / max_to_process) * 100 if max_to_process > 0 else 0
+            main_logger.info(f"处理项目 [{current_progress}/{max_to_process}] ({progress_percent:.1f}%) - [{member['kind']}]: {member['item_name']}")
+        
+        # 只收集分量外部的依赖代码，分量内部的项目在同一个提示中一起转换
+        pending_ids = [member["node_id"] for member in members]
+        dependency_code = {}
+        for member_id, dep_id in graph.external_dependencies(pending_ids):
+            dep_info = graph.get_item(member_id).get("dependencies", {}).get(dep_id)
+            dependency_code.update(self._collect_dependency_code(dep_id, dep_info, data))
+        
+        return {"members": members, "dependency_code": dependency_code, "graph": graph}
+
+    def _run_task(self, task, data):
+        """执行转换任务（可在工作线程中执行），只返回结果，不修改架构数据"""
+        kinds = {member["kind"] for member in task["members"]}
+        with tracer.span("task", "convert", stage="convert", kind=kinds.pop() if len(kinds) == 1 else "mixed",
+                         items=len(task["members"])):
+            return self._convert_task(task, data)
+
+    def _convert_task(self, task, data):
+        """_run_task 的实现：联合转换循环依赖分量、批量转换或逐个转换"""
+        started = time.time()
+        members = task["members"]
+        dependency_code = dict(task["dependency_code"])
+        results = {}
+        joint = False
+        cyclic = len(members) > 1 and not task.get("batch")
+        
+        # 翻译记忆精确命中的项目不调用大模型；循环依赖分量的成员互相引用，键无法覆盖分量内部的依赖，不使用翻译记忆
+        if self.translation_memory and not cyclic:
+            for member in members:
+                recalled = self._convert_from_memory(member["item_name"], member["kind"], member["c_code"], dependency_code, data)
+                if recalled:
+                    results[member["node_id"]] = recalled
+        
+        if cyclic:
+            main_logger.info(f"🔁 联合转换循环依赖分量 ({len(members)} 个项目): {', '.join(m['item_name'] for m in members)}")
+            try:
+                result = self.convert_component(members, dependency_code, max_rounds=run_budget.rounds(3), data=data)
+            except Exception as e:
+                main_logger.error(f"联合转换循环依赖分量时发生错误: {e}")
+                result = {"success": False, "error": str(e)}
+            
+            if result["success"]:
+                joint = True
+                for member in members:
+                    results[member["node_id"]] = {
+                        "success": True,
+                        "rust_code": result["items"][member["key"]],
+                        "rounds": result["rounds"]
+                    }
+            else:
+                main_logger.warning(f"循环依赖分量联合转换失败，回退为逐个转换: {result.get('error', '未知错误')}")
+        
+        batch_members = [member for member in members if member["node_id"] not in results]
+        if task.get("batch") and batch_members:
+            try:
+                batch_result = self.convert_batch(batch_members, dependency_code, data=data)
+            except Exception as e:
+                main_logger.error(f"批量转换时发生错误，回退为逐个转换: {e}")
+                batch_result = {"items": {}}
+            for member in batch_members:
+                if member["key"] in batch_result["items"]:
+                    results[member["node_id"]] = {
+                        "success": True,
+                        "rust_code": batch_result["items"][member["key"]],
+                        "rounds": 1,
+                        "batched": True,
+                        "verified": member["key"] in batch_result.get("verified", ())
+                    }
+        
+        # 批量转换失败的项目在这里逐个重新转换
+        for member in members:
+            if member["node_id"] in results:
+                continue
+            try:
+                result = self.convert_with_dependencies(
+                    member["item_name"], member["kind"], member["c_code"], dependency_code,
+                    max_rounds=run_budget.rounds(5), max_arbitration=run_budget.max_arbitration(),
+                    data=data, file_name=member["file_name"]  # 传入文件名
+                )
+            except Exception as e:
+                main_logger.error(f"处理 [{member['kind']}]: {member['item_name']} 时发生错误: {e}")
+                result = {"success": False, "exception": str(e)}
+            results[member["node_id"]] = result
+            
+            # 回退为逐个转换时，前面成员的转换结果作为后续成员的依赖（批量任务的成员互不依赖）
+            if result.get("success") and len(members) > 1 and not task.get("batch"):
+                dependency_code[member["node_id"]] = result["rust_code"]
+        
+        # 只有经Agent2实际审核通过或编译通过的大模型结果写入翻译记忆；
+        # 审核策略抽样跳过审核且未编译验证的结果、规则转换、头文件保护宏和记忆命中的结果不写入
+        if self.translation_memory and not cyclic:
+            for member in members:
+                result = results[member["node_id"]]
+                if result.get("success") and not result.get("memory") and self._is_verified(result):
+                    self.translation_memory.store(member["kind"], member["c_code"], task["dependency_code"],
+                                                  result["rust_code"], source=member["node_id"])
+        
+        return {"results": results, "joint": joint, "elapsed": time.time() - started}
+
+    @staticmethod
+    def _is_verified(result):
+        """转换结果是否经Agent2实际审核通过或编译通过（审核被抽样跳过且未编译验证的结果不算）"""
+        if "verified" in result:
+            return result["verified"]
+        attempts = result.get("conversion_history") or []
+        if not attempts:
+            return False
+        final = attempts[-1]
+        review = final.get("review") or {}
+        if review.get("result") == "PASS" and not review.get("skipped"):
+            return True
+        return bool((final.get("compile_result") or {}).get("success") or (final.get("fix_result") or {}).get("success"))
+
+    def _apply_task_results(self, task, outcome, data, processed_items, progress, output_path):
+        """将任务结果写回架构数据并更新进度（在主线程中执行）"""
+        members = task["members"]
+        component_ids = [member["node_id"] for member in members] if outcome["joint"] else None
+        seconds_per_item = round(outcome["elapsed"] / len(members), 2)
+        previous_count = progress["item_count"]
+        
+        for member in members:
+            item = member["item"]
+            result = outcome["results"][member["node_id"]]
+            if "exception" in result:
+                item["conversion_status"] = "error"
+                item["failure_reason"] = result["exception"]
+                progress["failed"] += 1
+            else:
+                self._apply_conversion_result(member["file_name"], member["kind"], member["item_name"], item, result, progress)
+            
+            if component_ids:
+                item["conversion_component"] = component_ids
+            item["conversion_seconds"] = seconds_per_item
+            processed_items.add(member["node_id"])  # 无论成功失败，都标记为已处理
+            run_metrics.record_item("convert", member["kind"], item.get("conversion_status"), item.get("conversion_rounds"))
+        
+        # 所有成员写回后再记录指纹，联合转换的成员之间互相引用彼此的输出
+        for member in members:
+            if member["item"].get("conversion_status") == "success":
+                stamp_fingerprint(task["graph"], member["node_id"], "conversion")
+        
+        # 逐项更新架构存储，无需重写整个文件
+        if self.store:
+            for member in members:
+                item = member["item"]
+                self.store.upsert_item(member["file_name"], member["kind"], member["item_name"], item)
+                self.store.record_attempt(member["node_id"], "conversion", item.get("conversion_status"), item.get("conversion_rounds"), {
+                    "seconds": seconds_per_item,
+                    "joint": bool(component_ids),
+                    "failure_reason": item.get("failure_reason")
+                })
+        
+        # 定期保存结果，联合转换的分量完成后立即保存
+        progress["item_count"] += len(members)
+        if component_ids or progress["item_count"] // 10 > previous_count // 10:
+            self._save_checkpoint(data, output_path)
+
+    def _apply_conversion_result(self, file_name, kind, item_name, item, result, progress):
+        """将转换结果写回架构项目，并登记到跨文件验证器"""
+        if not result["success"]:
+            item["conversion_status"] = "failed"
+            item["failure_reason"] = result.get("reason", "转换失败，无具体原因")
+            main_logger.warning(f"转换失败 [{kind}]: {item_name}, 原因: {item['failure_reason']}")
+            progress["failed"] += 1
+            return
+        
+        item["rust_signature"] = result["rust_code"]
+        item["conversion_status"] = "success"
+        
+        # 检查是否为头文件保护宏，这种情况不计入常规转换轮数
+        if result.get("is_header_guard", False):
+            item["is_header_guard"] = True
+            main_logger.info(f"[{kind}]: {item_name} 是头文件保护宏，已跳过")
+            progress["skipped"] += 1
+            return
+        
+        item["conversion_rounds"] = result["rounds"]
+        if result.get("local"):
+            item["conversion_method"] = f"local:{result['local_rule']}"
+        elif result.get("memory"):
+            item["conversion_method"] = "memory"
+        elif result.get("batched"):
+            item["conversion_method"] = "batch"
+        elif result.get("speculative"):
+            item["conversion_method"] = f"speculative:{result['speculative']['winner'] + 1}/{result['speculative']['candidates']}"
+        main_logger.info(f"成功转换 [{kind}]: {item_name} (用了{result['rounds']}轮)")
+        progress["success"] += 1
+        
+        # 添加到跨文件验证器并进行实时验证
+        if self.cross_file_validator:
+            added = self.cross_file_validator.add_converted_item(
+                file_name=file_name or "unknown_file",
+                kind=kind,
+                item_name=item_name,
+                rust_code=result["rust_code"],
+                original_type=item.get("original_type", None)
+            )
+            
+            if added:
+                # 只在启用编译验证时才进行实时验证
+                if self.enable_compile_check:
+                    validation_result = self.cross_file_validator.validate_rust_code(
+                        result["rust_code"], kind, f"{file_name}::{item_name}"
+                    )
+                    if validation_result["success"]:
+                        main_logger.info(f"✅ 跨文件验证成功 [{kind}]: {item_name}")
+                    else:
+                        main_logger.warning(f"⚠️ 跨文件验证失败 [{kind}]: {item_name}")
+                        for error in validation_result["errors"][:2]:  # 只显示前2个错误
+                            main_logger.warning(f"   错误: {error.split(chr(10))[0]}...")
+                else:
+                    main_logger.debug(f"📝 已记录到验证器（跳过验证）: [{kind}]: {item_name}")
+            else:
+                main_logger.debug(f"跨文件验证器：跳过重复项目 [{kind}]: {item_name}")
+
     def _is_dependency_processed(self, dep_id, dep_info, data, processed_items, processing_items=None):
         """检查依赖项是否已处理"""
         # 首先检查dep_id是否直接在processed_items中
@@ -1542,6 +2266,7 @@ edition = "2021"
         
         return function_like_items
 
+    @tracer.traced("cargo", "compile", arg_names=("item_type",))
     def _compile_rust_code(self, rust_code, item_type="unknown", dependencies=None, data=None):
         """编译单个Rust代码片段，返回编译结果，使用所有已转换代码作为上下文"""
         import tempfile
@@ -1816,7 +2541,7 @@ edition = "2021"
 
     def _fix_compile_errors(self, rust_code, compile_errors, item_id, kind, dependencies=None, data=None):
         """专门用于修复编译错误的方法"""
-        max_fix_rounds = self.max_fix_rounds
+        max_fix_rounds = run_budget.rounds(self.max_fix_rounds)
         main_logger.info(f"开始修复编译错误 [{kind}]: {item_id}，共 {len(compile_errors)} 个错误")
         
         # 记录AI对话
@@ -1874,10 +2599,13 @@ edition = "2021"
             
             try:
                 # 尝试简化修复
-                fix_response_raw = self.agent1.ask(simple_fix_messages)
+                try:
+                    fix_response_json, fix_response_raw = self.fixer.ask_json(simple_fix_messages, FIX_SCHEMA)
+                except StructuredOutputError as e:
+                    fix_response_raw = e.raw_text
+                    fix_response_json = TextExtractor.extract_json(fix_response_raw)
                 ai_dialog_logger.info(f"简化修复 - AI回复: {fix_response_raw}")
                 
-                fix_response_json = TextExtractor.extract_json(fix_response_raw)
                 if fix_response_json:
                     simple_rust_code = fix_response_json.get("rust_code", "")
                     if simple_rust_code and simple_rust_code.count('\n') <= 2:  # 确保是简单代码
@@ -1925,26 +2653,13 @@ edition = "2021"
         dependencies_info = ""
         if dependencies:
             dependencies_info = "\n## 已定义的依赖项：\n"
-            for dep_id, dep_code in dependencies.items():
-                dependencies_info += f"### {dep_id}\n```rust\n{dep_code}\n```\n\n"
-            dependencies_info += "注意：以上依赖项已经存在，不要重复定义，只需修复当前代码。\n\n"
+            dependencies_info += self._format_dependency_code(dependencies, rust_code + "\n" + all_errors_text)
+            dependencies_info += "注意：以上依赖项已经存在，不要重复定义，只需修复当前代码。\n"
         
-        # 初始化修复对话
+        # 初始化修复对话：固定的要求和输出格式在前，依赖项其次，待修复的代码和错误在最后
         fix_messages = [
             {"role": "system", "content": fix_system_prompt},
-            {"role": "user", "content": f"""请修复以下Rust代码的编译错误：
-
-{dependencies_info}## 当前需要修复的代码：
-```rust
-{rust_code}
-```
-
-## 编译错误：
-```
-{all_errors_text}
-```
-
-请修正这些编译错误并返回修复后的代码：
+            {"role": "user", "content": f"""请修复末尾给出的Rust代码的编译错误，并按以下格式返回修复后的代码：
 ```json
 {{
   "rust_code": "修复后的Rust代码",
@@ -1955,7 +2670,17 @@ edition = "2021"
 }}
 ```
 
-只返回JSON对象，不要添加其他文本。"""}
+只返回JSON对象，不要添加其他文本。
+{dependencies_info}
+## 当前需要修复的代码：
+```rust
+{rust_code}
+```
+
+## 编译错误：
+```
+{all_errors_text}
+```"""}
         ]
         
         # 记录初始对话
@@ -1971,11 +2696,15 @@ edition = "2021"
             
             try:
                 # 获取修复结果
-                fix_response_raw = self.agent1.ask(fix_messages)
+                fix_messages = self.prompt_budget.compact_messages(fix_messages)
+                try:
+                    fix_response_json, fix_response_raw = self.fixer.ask_json(fix_messages, FIX_SCHEMA)
+                except StructuredOutputError as e:
+                    item_logger.warning(f"修复结果校验失败，回退到文本提取: {e}")
+                    fix_response_raw = e.raw_text
+                    fix_response_json = TextExtractor.extract_json(fix_response_raw)
                 ai_dialog_logger.info(f"修复轮 {fix_round} - AI回复: {fix_response_raw}")
                 
-                # 解析JSON响应
-                fix_response_json = TextExtractor.extract_json(fix_response_raw)
                 if not fix_response_json:
                     item_logger.warning("修复结果JSON解析失败，尝试提取代码块")
                     fixed_code = TextExtractor.extract_code_block(fix_response_raw)
@@ -2213,11 +2942,35 @@ def main():
     parser.add_argument("--api-key", "-k", help="OpenAI API密钥，如不提供则从环境变量OPENAI_API_KEY获取")
     parser.add_argument("--debug", "-d", action="store_true", help="启用调试模式")
     parser.add_argument("--test", "-t", action="store_true", help="测试模式：只处理1个项目")
-    parser.add_argument("--dry-run", action="store_true", help="不实际调用API，仅检查流程")
+    parser.add_argument("--dry-run", action="store_true", help="不实际调用API，回放已录制的响应（默认 data/llm_cassette.jsonl）")
     parser.add_argument("--generate-validation", "-v", action="store_true", help="处理完成后生成验证项目")
     parser.add_argument("--validation-dir", default="validation_project", help="验证项目输出目录")
     parser.add_argument("--enable-compile-check", action="store_true", help="启用实时编译验证（需要安装Rust）")
     parser.add_argument("--max-fix-rounds", type=int, default=5, help="最大修复轮数（默认5轮）")
+    parser.add_argument("--max-workers", type=int, default=1, help="并行转换的工作线程数（默认1）")
+    parser.add_argument("--store", help="可选的SQLite架构存储路径，逐项写入转换结果和尝试记录（检查点仍写入JSON输出文件）")
+    parser.add_argument("--review-sample-rate", type=float, default=0.1,
+                        help="低风险项目仍进行Agent2完整审核的抽样比例（默认0.1，1.0表示始终审核）")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="每次请求最多合并的同类型小项目数（默认1，即不合批）")
+    parser.add_argument("--speculative", type=int, default=1,
+                        help="慢尾部项目（首轮未通过或规模较大）并行生成的候选数，第一个通过验证的候选胜出（默认1，即不启用）")
+    parser.add_argument("--deadline", type=float, help="每次大模型调用（含重试）的截止时间（秒），默认不限制")
+    parser.add_argument("--hedge", action="store_true", help="请求超过观测到的p95耗时仍未返回时发出对冲请求，使用先返回的结果")
+    parser.add_argument("--routes", help="模型路由配置JSON文件，为转换、审核、仲裁、检测、修复等角色分别指定模型、后端和回退顺序")
+    parser.add_argument("--base-url", help="覆盖所有路由的后端地址，例如本地OpenAI兼容服务 http://localhost:8000/v1")
+    parser.add_argument("--record", help="把每次大模型请求和响应录制到该JSONL文件")
+    parser.add_argument("--replay", help="从该JSONL文件回放录制的响应，不访问网络")
+    parser.add_argument("--replay-latency", action="store_true", help="回放时按录制的耗时等待")
+    parser.add_argument("--metrics", help="运行中定期把耗时分位数、token、吞吐量和预计剩余时间写入该Prometheus textfile文件")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"), help="运行结束时把本次运行的摘要追加到该历史文件（设为空字符串时不记录），用 run_report.py 对比")
+    parser.add_argument("--trace", help="记录各Agent请求、编译、检查点写入和逐项转换的耗时，导出为Chrome trace JSON到该路径")
+    parser.add_argument("--max-tokens", type=int, help="本次运行的token上限，用尽后不再派发新项目（可参考 plan_run.py 的估算）")
+    parser.add_argument("--max-cost", type=float, help="本次运行的估算成本上限（美元），用尽后不再派发新项目")
+    parser.add_argument("--time-limit", type=float, help="本次运行的时长上限（秒），与token/成本上限一起决定降级档位，到时不再派发新项目")
+    parser.add_argument("--roots", nargs="+", help="入口函数或类型名称（如 ZopfliDeflatePart ZopfliOptions，也可以写 文件::名称 或完整项目ID），只处理它们的传递依赖闭包，其余项目保持未处理")
+    parser.add_argument("--translation-memory",
+                        help="跨项目翻译记忆（SQLite）路径：规范化C代码与依赖签名相同的项目直接复用此前通过验证的结果，近似项目作为参考译例（如 data/translation_memory.db，默认不使用）")
     
     args = parser.parse_args()
     
@@ -2237,6 +2990,9 @@ def main():
         main_logger.error("未提供API密钥，请通过--api-key参数或OPENAI_API_KEY环境变量提供")
         sys.exit(1)
     
+    store = ArchitectureStore(args.store) if args.store else None
+    memory = TranslationMemory(args.translation_memory) if args.translation_memory else None
+    
     try:
         # 测试模式提示
         if args.test:
@@ -2251,38 +3007,29 @@ def main():
         else:
             main_logger.info("⚠️ 未启用编译验证，转换后需要手动验证")
             
-        # Dry Run模式
+        # Dry Run模式：回放已录制的响应，不访问网络
         if args.dry_run:
-            main_logger.warning("⚠️ DRY-RUN模式：不会实际调用API")
-            # 模拟GPT类
-            class MockGPT:
-                def __init__(self, *args, **kwargs):
-                    self.call_count = 0
-                    self.total_tokens_in = 0
-                    self.total_tokens_out = 0
-                
-                def ask(self, messages, **kwargs):
-                    self.call_count += 1
-                    self.total_tokens_in += 100
-                    self.total_tokens_out += 50
-                    return "```rust\n// 模拟的Rust代码\npub struct TestStruct {\n    field: i32\n}\n```"
-                
-                def get_stats(self):
-                    return {
-                        "calls": self.call_count,
-                        "tokens_in": self.total_tokens_in,
-                        "tokens_out": self.total_tokens_out,
-                        "total_tokens": self.total_tokens_in + self.total_tokens_out
-                    }
-                    
-            # 替换GPT类
-            global GPT
-            real_GPT = GPT
-            GPT = MockGPT
+            args.replay = args.replay or DEFAULT_CASSETTE
+            args.record = None
+            main_logger.warning(f"⚠️ DRY-RUN模式：不会实际调用API，回放 {args.replay} 中录制的响应")
+        if args.replay and not os.path.exists(args.replay):
+            main_logger.error(f"回放文件不存在: {args.replay}。请先用 --record {args.replay} 真实运行一次录制响应"
+                              f"（或 python benchmark.py --record --cassette {args.replay}），再使用 --dry-run/--replay")
+            sys.exit(1)
+        cassette = open_cassette(args.record, args.replay, args.replay_latency)
+        if args.trace:
+            tracer.enable()
+        run_metrics.start(args.metrics)
         
         # 初始化转换器
         main_logger.info("初始化转换器...")
-        converter = C2RustConverter(api_key, args.enable_compile_check, args.max_fix_rounds)
+        router = ModelRouter.from_file(args.routes, api_key, args.base_url,
+                                       request_options={"deadline": args.deadline, "hedge": args.hedge, "cassette": cassette})
+        run_budget.configure(args.max_tokens, args.max_cost, router.prices, args.time_limit)
+        converter = C2RustConverter(api_key, args.enable_compile_check, args.max_fix_rounds, args.max_workers, store,
+                                    ReviewPolicy(sample_rate=args.review_sample_rate), args.batch_size,
+                                    speculative_candidates=args.speculative, router=router,
+                                    translation_memory=memory)
         
         # 开始处理
         main_logger.info(f"使用输入文件: {input_path}")
@@ -2292,11 +3039,17 @@ def main():
         result = converter.process_architecture_file(
             input_path,
             output_path,
-            max_items
+            max_items,
+            roots=args.roots
         )
         
         main_logger.info("转换完成!")
         main_logger.info(f"共处理项目保存到: {output_path}")
+        if run_budget.limited:
+            main_logger.info(f"预算用量: {run_budget.describe()}")
+        record = record_run(args.history, "convert", vars(args), run_metrics.snapshot(), router.report())
+        if record:
+            main_logger.info(f"运行记录 {describe(record)}")
         
         # 生成验证项目
         if args.generate_validation:
@@ -2306,15 +3059,24 @@ def main():
             main_logger.info("要验证签名正确性，请执行:")
             main_logger.info(f"  cd {validation_dir}")
             main_logger.info("  cargo check")
-        
-        # 恢复原始GPT类
-        if args.dry_run:
-            GPT = real_GPT
+        if cassette is not None:
+            main_logger.info(f"cassette [{cassette.mode}] {cassette.path}: {cassette.get_stats()}")
         
     except Exception as e:
         main_logger.error(f"程序执行出错: {str(e)}")
         main_logger.error(traceback.format_exc())
         sys.exit(1)
+    finally:
+        if store is not None:
+            store.close()
+        if memory is not None:
+            memory.close()
+        if args.trace:
+            tracer.export(args.trace, main_logger.info)
+        run_metrics.stop()
+        if args.metrics:
+            for line in run_metrics.summary_lines():
+                main_logger.info(f"运行指标 {line}")
 
 # 单个文件转换函数（方便直接在代码中调用）
 def convert_single_code(c_code, kind, api_key=None, model="gpt-4o"):
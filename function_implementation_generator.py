@@ -1,4 +1,5 @@
 import json
+import copy
 import os
 import sys
 import time
@@ -12,6 +13,18 @@ from sig_utils.gpt_client import GPT
 from sig_utils.stats_collector import ConversionStats
 from sig_utils.text_extractor import TextExtractor
 from sig_utils.prompt_templates import PromptTemplates
+from sig_utils.dependency_graph import DependencyGraph, root_closure
+from sig_utils.ready_queue import ReadyQueue
+from sig_utils.fingerprint import carry_over_stage, stamp_fingerprint
+from sig_utils.micro_batcher import MicroBatcher
+from sig_utils.prompt_budget import PromptBudget, collapse_to_signature
+from sig_utils.speculative import SpeculativeRunner
+from sig_utils.model_router import ModelRouter
+from sig_utils.llm_cassette import open_cassette
+from sig_utils.tracing import tracer
+from sig_utils.metrics import run_metrics
+from sig_utils.budget import run_budget
+from sig_utils.run_history import describe, record_run
 
 # 导入C2Rust转换器中的功能
 from c2rust_converter_new import Logger, C2RustConverter
@@ -33,18 +46,29 @@ ai_dialog_logger = Logger("func_impl_ai_dialog", console_output=False)
 class FunctionImplementationGenerator:
     """函数实现生成器 - 将函数摘要转换为具体的Rust实现"""
     
-    def __init__(self, api_key, model="gpt-4o"):
+    def __init__(self, api_key, model="gpt-4o", prompt_budget=None, speculative_candidates=1, request_options=None,
+                 router=None):
         main_logger.info("初始化函数实现生成器")
-        self.agent1 = GPT(api_key, model_name=model)  # 实现生成专家
-        self.agent2 = GPT(api_key, model_name=model)  # 实现审核专家
+        # 按角色选择模型和后端；未提供路由器时所有角色使用model，request_options为请求保护选项（deadline、hedge）
+        self.router = router or ModelRouter(api_key, {"default": {"model": model}}, request_options=request_options)
+        self.agent1 = self.router.client("implementer", GPT)  # 实现生成专家
+        self.agent2 = self.router.client("reviewer", GPT)  # 实现审核专家
+        self.fixer = self.router.client("fixer", GPT)  # 编译错误修复专家
         self.stats = ConversionStats()
+        self.prompt_budget = prompt_budget or PromptBudget()  # 控制依赖项上下文的token数
+        self.speculator = SpeculativeRunner(speculative_candidates)  # 并行生成多个候选实现，候选数为1时不启用
         
         # 编译检查器（从C2Rust转换器中借用）
-        self.c2r_converter = C2RustConverter(api_key, enable_compile_check=True, max_fix_rounds=5)
-        main_logger.info("✅ 初始化完成 - 使用模型: " + model)
+        self.c2r_converter = C2RustConverter(api_key, enable_compile_check=True, max_fix_rounds=5, router=self.router)
+        main_logger.info("✅ 初始化完成 - 使用模型: " + self.agent1.model_name)
     
-    def generate_implementation_from_json(self, json_file, output_file=None, max_functions=None):
-        """从JSON文件中生成函数实现"""
+    def generate_implementation_from_json(self, json_file, output_file=None, max_functions=None, roots=None):
+        """
+        从JSON文件中生成函数实现
+
+        Args:
+            roots: 入口函数或类型名称列表，只实现其依赖闭包中的函数；为空时处理全部函数
+        """
         main_logger.info(f"开始从JSON生成函数实现: {json_file}")
         
         # 读取JSON文件
@@ -59,26 +83,33 @@ class FunctionImplementationGenerator:
         if output_file is None:
             output_file = os.path.join(DATA_DIR, "implemented_functions.json")
         
-        # 检查输出文件是否已存在，如果存在则加载已处理的内容
-        processed_functions = set()
+        # 复制原始数据结构；输出文件已存在时沿用指纹未变化的函数实现，
+        # 签名、摘要或依赖项变化的函数及其反向依赖闭包重新实现
+        result = copy.deepcopy(data)
         if os.path.exists(output_file):
             try:
                 with open(output_file, 'r', encoding='utf-8') as f:
                     existing_data = json.load(f)
-                    for file_name, content in existing_data.items():
-                        if "functions" in content:
-                            for func_name, func_info in content["functions"].items():
-                                if func_info.get("implementation_status") == "success":
-                                    processed_functions.add(f"{file_name}::functions::{func_name}")
-                                    main_logger.info(f"跳过已处理的函数: {func_name}")
+                carried = carry_over_stage(result, existing_data, "implementation")
+                main_logger.info(f"沿用 {carried['carried']} 个函数实现，{carried['changed']} 个函数输入变化，共作废 {carried['invalidated']} 个函数（含反向依赖）")
             except Exception as e:
                 main_logger.warning(f"读取现有输出文件失败，将创建新文件: {e}")
-                existing_data = {}
-        else:
-            existing_data = {}
         
-        # 复制原始数据结构
-        result = data.copy() if not existing_data else existing_data
+        processed_functions = set()
+        for file_name, content in result.items():
+            if "functions" in content:
+                for func_name, func_info in content["functions"].items():
+                    if func_info.get("implementation_status") == "success":
+                        processed_functions.add(f"{file_name}::functions::{func_name}")
+                        main_logger.info(f"跳过已处理的函数: {func_name}")
+        
+        # 用于记录实现指纹的依赖图
+        fingerprint_graph = DependencyGraph(result)
+        
+        # 指定入口时只实现其依赖闭包中的函数
+        closure = root_closure(result, roots, fingerprint_graph)
+        if closure is not None:
+            main_logger.info(f"入口 {', '.join(roots)} 的依赖闭包: {len(closure)} 个项目，闭包外的函数本次不实现")
         
         # 跟踪已经实现的函数
         implemented_functions = processed_functions.copy()  # 初始化为已处理的函数
@@ -93,6 +124,8 @@ class FunctionImplementationGenerator:
         for file_name, content in data.items():
             if "functions" in content:
                 for func_name, func_info in content["functions"].items():
+                    if closure is not None and f"{file_name}::functions::{func_name}" not in closure:
+                        continue
                     if "function_summary" in func_info and "rust_signature" in func_info:
                         total_functions += 1
         
@@ -101,22 +134,33 @@ class FunctionImplementationGenerator:
         # 实现计数器
         implemented_count = 0
         
-        # 遍历所有文件和函数
-        for file_name, content in data.items():
-            # 确保文件结构在结果中存在
+        # 确保文件结构在结果中存在
+        for file_name in data:
             if file_name not in result:
                 result[file_name] = {}
             if "functions" not in result[file_name]:
                 result[file_name]["functions"] = {}
-                
-            # 如果文件没有函数，跳过
-            if "functions" not in content:
-                continue
-                
-            # 遍历所有函数
-            for func_name, func_info in content["functions"].items():
-                # 生成完整函数ID
-                func_id = f"{file_name}::functions::{func_name}"
+        
+        # 按函数调用关系构建依赖图，被调用的函数先实现；就绪函数按关键路径优先级出队，
+        # 阻塞最长下游调用链的函数最先处理。互相递归的函数在同一分量内依次实现
+        graph = DependencyGraph(data, kinds=["functions"])
+        components = graph.strongly_connected_components()
+        if closure is not None:
+            components = [component for component in components if component[0] in closure]
+        queue = ReadyQueue(graph, components, graph.critical_path_priority(components))
+        run_metrics.track_remaining("implement", queue.remaining)
+        
+        while len(queue):
+            run_budget.adapt(self.router, [queue], main_logger.warning)
+            if run_budget.exhausted():
+                main_logger.warning(f"预算已用尽（{run_budget.describe()}），停止实现新的函数")
+                break
+            index = queue.pop()
+            component_ids = set(components[index])
+            
+            for func_id in components[index]:
+                file_name, _, func_name = graph.nodes[func_id]
+                func_info = graph.get_item(func_id)
                 
                 # 如果已处理过，跳过
                 if func_id in processed_functions:
@@ -138,7 +182,7 @@ class FunctionImplementationGenerator:
                 
                 # 检查依赖项是否已实现
                 dependencies = func_info.get("dependencies", {})
-                if not self._check_dependencies_implemented(dependencies, implemented_functions):
+                if not self._check_dependencies_implemented(dependencies, implemented_functions | component_ids):
                     main_logger.info(f"函数 {func_name} 的依赖项尚未全部实现，暂时跳过")
                     skipped_count += 1
                     continue
@@ -148,89 +192,22 @@ class FunctionImplementationGenerator:
                 progress = f"[{implemented_count}/{total_functions}]"
                 main_logger.info(f"{progress} 开始生成函数实现: {func_name}")
                 
-                try:
-                    # 提取所需信息
-                    func_summary = func_info.get("function_summary", {})
-                    rust_signature = func_info.get("rust_signature", "")
-                    
-                    # 收集依赖项信息
-                    dependency_info = self._collect_dependency_info(data, dependencies)
-                    
-                    # 生成并审核函数实现
-                    implementation_result = self.generate_with_review_cycle(
-                        func_name, 
-                        rust_signature, 
-                        func_summary, 
-                        dependency_info
-                    )
-                    
-                    if implementation_result["success"]:
-                        # 进行编译检查 - 传递完整的数据
-                        compile_result = self._check_compilation(
-                            implementation_result["implementation"],
-                            dependency_info["code_signatures"],
-                            result  # 使用更新后的结果数据，包含当前会话中已实现的函数
-                        )
-                        
-                        # 如果编译通过
-                        if compile_result["success"]:
-                            implementation = implementation_result["implementation"]
-                            result[file_name]["functions"][func_name]["rust_implementation"] = implementation
-                            result[file_name]["functions"][func_name]["implementation_status"] = "success"
-                            result[file_name]["functions"][func_name]["review_rounds"] = implementation_result.get("review_rounds", 1)
-                            main_logger.info(f"{progress} ✅ 成功生成并通过编译: {func_name} (审核轮次: {implementation_result.get('review_rounds', 1)})")
-                            success_count += 1
-                            implemented_functions.add(func_id)  # 添加到已实现集合
-                        else:
-                            # 编译失败，尝试修复
-                            main_logger.warning(f"{progress} ⚠️ 编译失败，尝试修复: {func_name}")
-                            fix_result = self._fix_implementation(
-                                implementation_result["implementation"],
-                                compile_result["errors"],
-                                dependency_info["code_signatures"],
-                                result  # 使用更新后的结果数据
-                            )
-                            
-                            if fix_result["success"]:
-                                # 修复成功
-                                implementation = fix_result["implementation"]
-                                result[file_name]["functions"][func_name]["rust_implementation"] = implementation
-                                result[file_name]["functions"][func_name]["implementation_status"] = "success"
-                                result[file_name]["functions"][func_name]["required_fix"] = True
-                                result[file_name]["functions"][func_name]["review_rounds"] = implementation_result.get("review_rounds", 1)
-                                result[file_name]["functions"][func_name]["fix_rounds"] = fix_result["rounds"]
-                                main_logger.info(f"{progress} ✅ 修复成功: {func_name} (审核轮次: {implementation_result.get('review_rounds', 1)}, 修复轮次: {fix_result['rounds']})")
-                                success_count += 1
-                                implemented_functions.add(func_id)  # 添加到已实现集合
-                            else:
-                                # 修复失败
-                                result[file_name]["functions"][func_name]["implementation_status"] = "failed"
-                                result[file_name]["functions"][func_name]["reason"] = "编译错误修复失败"
-                                result[file_name]["functions"][func_name]["compile_errors"] = compile_result["errors"]
-                                result[file_name]["functions"][func_name]["last_attempt"] = implementation_result["implementation"]
-                                main_logger.error(f"{progress} ❌ 编译错误修复失败: {func_name}")
-                                failure_count += 1
-                    else:
-                        # 实现失败
-                        result[file_name]["functions"][func_name]["implementation_status"] = "failed"
-                        result[file_name]["functions"][func_name]["reason"] = implementation_result["error"]
-                        if "last_attempt" in implementation_result:
-                            result[file_name]["functions"][func_name]["last_attempt"] = implementation_result["last_attempt"]
-                        main_logger.error(f"{progress} ❌ 实现失败: {func_name}")
-                        failure_count += 1
+                # 生成、审核并编译检查函数实现
+                updates = self.implement_function(func_name, func_info, data, result, progress)
+                result[file_name]["functions"][func_name].update(updates)
+                run_metrics.record_item("implement", "functions", updates["implementation_status"],
+                                        updates.get("review_rounds", 0) + updates.get("fix_rounds", 0))
                 
-                except Exception as e:
-                    # 处理异常
-                    error_msg = f"处理函数 {func_name} 时发生错误: {str(e)}"
-                    main_logger.error(error_msg)
-                    main_logger.error(traceback.format_exc())
-                    result[file_name]["functions"][func_name]["implementation_status"] = "error"
-                    result[file_name]["functions"][func_name]["reason"] = error_msg
+                if updates["implementation_status"] == "success":
+                    success_count += 1
+                    implemented_functions.add(func_id)  # 添加到已实现集合
+                    stamp_fingerprint(fingerprint_graph, func_id, "implementation")
+                else:
                     failure_count += 1
                 
                 # 定期保存结果
                 if implemented_count % 5 == 0:
-                    with open(output_file, 'w', encoding='utf-8') as f:
+                    with tracer.span("checkpoint", "io"), open(output_file, 'w', encoding='utf-8') as f:
                         json.dump(result, f, indent=4, ensure_ascii=False)
                     main_logger.info(f"已处理 {implemented_count} 个函数，中间结果已保存")
                 
@@ -239,23 +216,134 @@ class FunctionImplementationGenerator:
                     main_logger.info(f"已达到最大处理函数数 {max_functions}，停止处理")
                     break
             
+            queue.complete(index)
+            
             # 如果已达到最大处理数量，跳出循环
             if max_functions and implemented_count >= max_functions:
                 break
         
         # 保存最终结果
-        with open(output_file, 'w', encoding='utf-8') as f:
+        with tracer.span("checkpoint", "io"), open(output_file, 'w', encoding='utf-8') as f:
             json.dump(result, f, indent=4, ensure_ascii=False)
         
         # 输出统计信息
         main_logger.info("="*60)
         main_logger.info(f"函数实现生成完成！总计: {total_functions} 个函数")
         main_logger.info(f"成功: {success_count}, 失败: {failure_count}, 跳过: {skipped_count}")
+        for line in self.router.summary_lines():
+            main_logger.info(f"模型路由 {line}")
         main_logger.info(f"结果已保存到: {output_file}")
         main_logger.info("="*60)
         
         return result
     
+    @tracer.traced("implement", "implement", item_arg="func_name", stage="implement", kind="functions")
+    def implement_function(self, func_name, func_info, data, compile_data, progress=""):
+        """
+        为单个函数生成实现：生成并审核实现，编译检查，失败时尝试修复
+        
+        Args:
+            func_name: 函数名
+            func_info: 架构文件中的函数项目（需包含function_summary和rust_signature）
+            data: 用于收集依赖项签名和摘要的架构数据
+            compile_data: 用于编译检查的架构数据（包含当前会话中已实现的函数）
+            progress: 日志中显示的进度前缀
+        
+        Returns:
+            Dict: 需要写回函数项目的字段，implementation_status为success/failed/error
+        """
+        try:
+            # 提取所需信息
+            func_summary = func_info.get("function_summary", {})
+            rust_signature = func_info.get("rust_signature", "")
+            
+            # 收集依赖项信息
+            dependency_info = self._collect_dependency_info(data, func_info.get("dependencies", {}))
+            
+            # 推测生成时编译检查也作为候选验证的一部分并行进行
+            compile_check = None
+            if self.speculator.enabled:
+                compile_check = lambda code: self._check_compilation(code, dependency_info["code_signatures"], compile_data)
+            
+            # 生成并审核函数实现
+            implementation_result = self.generate_with_review_cycle(
+                func_name, 
+                rust_signature, 
+                func_summary, 
+                dependency_info,
+                max_review_rounds=run_budget.rounds(3),
+                compile_check=compile_check
+            )
+            
+            if not implementation_result["success"]:
+                # 实现失败
+                updates = {
+                    "implementation_status": "failed",
+                    "reason": implementation_result["error"]
+                }
+                if "last_attempt" in implementation_result:
+                    updates["last_attempt"] = implementation_result["last_attempt"]
+                main_logger.error(f"{progress} ❌ 实现失败: {func_name}")
+                return updates
+            
+            # 进行编译检查 - 传递完整的数据（推测生成的候选已经通过编译时直接沿用结果）
+            compile_result = implementation_result.get("compile_result") or self._check_compilation(
+                implementation_result["implementation"],
+                dependency_info["code_signatures"],
+                compile_data
+            )
+            
+            # 如果编译通过
+            if compile_result["success"]:
+                main_logger.info(f"{progress} ✅ 成功生成并通过编译: {func_name} (审核轮次: {implementation_result.get('review_rounds', 1)})")
+                updates = {
+                    "rust_implementation": implementation_result["implementation"],
+                    "implementation_status": "success",
+                    "review_rounds": implementation_result.get("review_rounds", 1)
+                }
+                if implementation_result.get("speculative"):
+                    updates["implementation_method"] = "speculative"
+                return updates
+            
+            # 编译失败，尝试修复
+            main_logger.warning(f"{progress} ⚠️ 编译失败，尝试修复: {func_name}")
+            fix_result = self._fix_implementation(
+                implementation_result["implementation"],
+                compile_result["errors"],
+                dependency_info["code_signatures"],
+                compile_data
+            )
+            
+            if fix_result["success"]:
+                # 修复成功
+                main_logger.info(f"{progress} ✅ 修复成功: {func_name} (审核轮次: {implementation_result.get('review_rounds', 1)}, 修复轮次: {fix_result['rounds']})")
+                return {
+                    "rust_implementation": fix_result["implementation"],
+                    "implementation_status": "success",
+                    "required_fix": True,
+                    "review_rounds": implementation_result.get("review_rounds", 1),
+                    "fix_rounds": fix_result["rounds"]
+                }
+            
+            # 修复失败
+            main_logger.error(f"{progress} ❌ 编译错误修复失败: {func_name}")
+            return {
+                "implementation_status": "failed",
+                "reason": "编译错误修复失败",
+                "compile_errors": compile_result["errors"],
+                "last_attempt": implementation_result["implementation"]
+            }
+        
+        except Exception as e:
+            # 处理异常
+            error_msg = f"处理函数 {func_name} 时发生错误: {str(e)}"
+            main_logger.error(error_msg)
+            main_logger.error(traceback.format_exc())
+            return {
+                "implementation_status": "error",
+                "reason": error_msg
+            }
+    
     def _has_required_info(self, func_info):
         """检查函数是否有足够的信息进行实现"""
         # 必须有函数摘要和Rust签名
@@ -363,8 +451,13 @@ class FunctionImplementationGenerator:
             main_logger.debug(f"未实现的依赖项: {', '.join(missing_deps)}")
             return False
         return True    
-    def generate_with_review_cycle(self, func_name, rust_signature, func_summary, dependency_info, max_review_rounds=3):
-        """生成函数实现并与审核AI交互循环，直到审核通过或达到最大轮数"""
+    def generate_with_review_cycle(self, func_name, rust_signature, func_summary, dependency_info, max_review_rounds=3,
+                                   compile_check=None):
+        """
+        生成函数实现并与审核AI交互循环，直到审核通过或达到最大轮数
+        
+        compile_check: 可选的编译检查函数（实现代码 -> 编译结果），推测生成时用于并行验证候选
+        """
         main_logger.info(f"为函数 {func_name} 启动生成-审核循环")
         
         # 检查基本参数
@@ -385,25 +478,36 @@ class FunctionImplementationGenerator:
                 "error": "缺少函数主要目的描述"
             }
         
+        # 依赖项按token预算裁剪：签名和摘要中直接提到的依赖项优先保留全文，其余只保留签名
+        snippets = {}
+        for dep_id, dep_data in dependency_info["function_deps"].items():
+            snippets[dep_id] = f"```rust\n{dep_data['signature']}\n```\n"
+            if dep_data["summary"]:
+                snippets[dep_id] += f"主要功能: {dep_data['summary']}\n\n"
+        for dep_id, signature in dependency_info["other_deps"].items():
+            snippets[dep_id] = f"```rust\n{signature}\n```\n\n"
+        source_text = "\n".join([rust_signature, main_purpose, detailed_logic, error_handling])
+        fitted, omitted = self.prompt_budget.fit_dependencies(snippets, source_text, self._collapse_dependency)
+        
         # 构建函数依赖列表
         function_deps_text = ""
-        if dependency_info["function_deps"]:
+        if any(dep_id in fitted for dep_id in dependency_info["function_deps"]):
             function_deps_text = "### 函数依赖项:\n"
-            for dep_id, dep_data in dependency_info["function_deps"].items():
-                function_deps_text += f"#### {dep_id}\n```rust\n{dep_data['signature']}\n```\n"
-                if dep_data["summary"]:
-                    function_deps_text += f"主要功能: {dep_data['summary']}\n\n"
+            for dep_id in sorted(dependency_info["function_deps"]):
+                if dep_id in fitted:
+                    function_deps_text += f"#### {dep_id}\n{fitted[dep_id]}"
         
         # 构建其他依赖列表
         other_deps_text = ""
-        if dependency_info["other_deps"]:
+        if any(dep_id in fitted for dep_id in dependency_info["other_deps"]):
             other_deps_text = "### 其他依赖项:\n"
-            for dep_id, signature in dependency_info["other_deps"].items():
-                other_deps_text += f"#### {dep_id}\n```rust\n{signature}\n```\n\n"
+            for dep_id in sorted(dependency_info["other_deps"]):
+                if dep_id in fitted:
+                    other_deps_text += f"#### {dep_id}\n{fitted[dep_id]}"
+        other_deps_text += self.prompt_budget.omitted_note(sorted(omitted))
         
-        # 构建初始实现提示
-        initial_prompt = f"""为这个Rust函数实现代码:
-
+        # 当前函数的签名和摘要放在提示末尾，实现要求和依赖项（按键排序）构成稳定的前缀
+        function_text = f"""
     ## 函数签名:
     ```rust
     {rust_signature}
@@ -412,19 +516,18 @@ class FunctionImplementationGenerator:
     ## 函数摘要:
     - **主要目的**: {main_purpose}
     """
-
-        # 添加详细逻辑和错误处理（如果有）
         if detailed_logic:
-            initial_prompt += f"- **详细逻辑**: {detailed_logic}\n"
+            function_text += f"- **详细逻辑**: {detailed_logic}\n"
         if error_handling:
-            initial_prompt += f"- **错误处理**: {error_handling}\n"
+            function_text += f"- **错误处理**: {error_handling}\n"
         
-        # 添加依赖信息
+        dependencies_text = ""
         if function_deps_text or other_deps_text:
-            initial_prompt += "\n## 依赖项:\n" + function_deps_text + other_deps_text
+            dependencies_text = "\n## 依赖项:\n" + function_deps_text + other_deps_text
         
-        # 添加实现指南
-        initial_prompt += """
+        # 构建初始实现提示
+        initial_prompt = """为末尾给出的Rust函数实现代码。
+
     ## 实现要求:
     1. 完全遵循函数签名，不要修改签名部分
     2. 基于函数摘要中描述的功能实现代码
@@ -438,7 +541,15 @@ class FunctionImplementationGenerator:
     ```rust
     // 你的实现代码...
     ```
-    """
+    """ + dependencies_text + function_text
+        
+        # 推测式多候选只用于慢尾部：签名和摘要较长的函数首轮即推测，其余函数首轮审核未通过后再推测；
+        # 第一个通过验证的直接采用，都未通过时继续逐轮生成-审核
+        speculated = self.speculator.should_speculate(self.prompt_budget.counter.count(function_text))
+        if speculated:
+            speculative_result = self._generate_speculatively(func_name, rust_signature, func_summary, initial_prompt, compile_check)
+            if speculative_result:
+                return speculative_result
         
         # 生成-审核循环
         current_implementation = None
@@ -459,24 +570,19 @@ class FunctionImplementationGenerator:
                 else:
                     # 后续轮次加入审核反馈
                     last_review = review_history[-1]
-                    feedback_prompt = f"""请根据审核意见修改Rust函数实现:
+                    feedback_prompt = """请根据末尾给出的审核意见修改Rust函数实现。
 
-    ## 函数签名:
+    ## 修改要求:
+    1. 根据审核意见修改代码
+    2. 不要修改函数签名
+    3. 不要添加use语句或其他导入语句
+    4. 只返回修改后的完整函数实现
+
+    直接返回修改后的实现代码:
     ```rust
-    {rust_signature}
+    // 修改后的实现代码...
     ```
-
-    ## 函数摘要:
-    - **主要目的**: {main_purpose}
-    """
-                    if detailed_logic:
-                        feedback_prompt += f"- **详细逻辑**: {detailed_logic}\n"
-                    if error_handling:
-                        feedback_prompt += f"- **错误处理**: {error_handling}\n"
-                    
-                    if function_deps_text or other_deps_text:
-                        feedback_prompt += "\n## 依赖项:\n" + function_deps_text + other_deps_text
-                    
+    """ + dependencies_text + function_text
                     feedback_prompt += f"""
     ## 当前实现:
     ```rust
@@ -491,22 +597,18 @@ class FunctionImplementationGenerator:
 
     建议:
     {', '.join(last_review.get("suggestions", ["无具体建议"]))}
-
-    ## 修改要求:
-    1. 根据审核意见修改代码
-    2. 不要修改函数签名
-    3. 不要添加use语句或其他导入语句
-    4. 只返回修改后的完整函数实现
-
-    直接返回修改后的实现代码:
-    ```rust
-    // 修改后的实现代码...
-    ```
     """
                     generation_messages = [
                         {"role": "system", "content": "你是一个专业的Rust开发专家，擅长将函数描述转换为高质量的代码。请直接输出代码，不要添加任何解释或导入语句。"},
                         {"role": "user", "content": feedback_prompt}
                     ]
+                    
+                    if not speculated and self.speculator.should_speculate(failed_rounds=review_round - 1):
+                        speculated = True
+                        speculative_result = self._generate_speculatively(func_name, rust_signature, func_summary, feedback_prompt,
+                                                                          compile_check, review_history)
+                        if speculative_result:
+                            return speculative_result
                 
                 # 记录对话
                 ai_dialog_logger.info(f"=========== 函数 {func_name} 第 {review_round} 轮生成 ===========")
@@ -517,15 +619,7 @@ class FunctionImplementationGenerator:
                 ai_dialog_logger.info(f"AI生成回复: {response}")
                 
                 # 提取代码
-                implementation_code = TextExtractor.extract_code_block(response)
-                
-                if not implementation_code:
-                    # 如果找不到代码块，尝试直接使用整个响应
-                    implementation_code = response.strip()
-                    # 继续尝试过滤，只保留看起来像代码的部分
-                    if "fn " in implementation_code:
-                        start_idx = implementation_code.find("fn ")
-                        implementation_code = implementation_code[start_idx:].strip()
+                implementation_code = self._extract_implementation(response)
                 
                 # 如果还是无法获得有效代码
                 if not implementation_code or "fn " not in implementation_code:
@@ -562,17 +656,7 @@ class FunctionImplementationGenerator:
                 ai_dialog_logger.info(f"AI审核回复: {review_response}")
                 
                 # 提取JSON结果
-                review_result = TextExtractor.extract_json(review_response)
-                
-                if not review_result or "passed" not in review_result:
-                    # 如果JSON解析失败，尝试从文本判断是否通过
-                    passed = "passed" in review_response.lower() and not ("not passed" in review_response.lower() or "failed" in review_response.lower())
-                    review_result = {
-                        "passed": passed,
-                        "reason": "无法解析JSON结果，基于文本判断",
-                        "issues": [],
-                        "suggestions": []
-                    }
+                review_result = self._parse_review_result(review_response)
                 
                 # 记录审核结果
                 review_history.append(review_result)
@@ -619,6 +703,114 @@ class FunctionImplementationGenerator:
                 "last_attempt": current_implementation,
                 "review_history": review_history
             }
+    def _generate_speculatively(self, func_name, rust_signature, func_summary, initial_prompt, compile_check=None,
+                                review_history=None):
+        """
+        推测式生成：并行生成多个不同温度的候选实现，依次做签名检查、编译（提供compile_check时）和审核，
+        采用第一个通过的候选
+        
+        Args:
+            initial_prompt: 候选共用的生成提示，首轮审核未通过后推测时为带审核意见的修改提示
+            review_history: 推测之前各轮的审核结果，计入审核轮数
+        
+        Returns:
+            Dict: 与generate_with_review_cycle相同格式的成功结果；所有候选都未通过时返回None
+        """
+        main_logger.info(f"🔀 推测生成函数 {func_name} 的实现，同时生成 {self.speculator.candidates} 个候选")
+        generation_messages = [
+            {"role": "system", "content": "你是一个专业的Rust开发专家，擅长将函数描述转换为高质量的代码。请直接输出代码，不要添加任何解释或导入语句。"},
+            {"role": "user", "content": initial_prompt}
+        ]
+        
+        def generate(temperature):
+            response = self.agent1.ask(generation_messages, temperature=temperature)
+            ai_dialog_logger.info(f"推测候选 (温度 {temperature}) - AI生成回复: {response}")
+            implementation = self._extract_implementation(response)
+            return implementation if implementation and "fn " in implementation else None
+        
+        def validate(implementation, cancelled):
+            if not self._is_valid_implementation(rust_signature, implementation):
+                implementation = self._fix_implementation_signature(rust_signature, implementation)
+                if not implementation:
+                    return {"passed": False, "reason": "实现与签名不匹配，无法修复"}
+            result = {"passed": False, "implementation": implementation}
+            
+            if compile_check:
+                if cancelled.is_set():
+                    return dict(result, reason="已取消")
+                compile_result = compile_check(implementation)
+                result["compile_result"] = compile_result
+                if not compile_result["success"]:
+                    return dict(result, reason="编译失败")
+            
+            if cancelled.is_set():
+                return dict(result, reason="已取消")
+            review_response = self.agent2.ask([
+                {"role": "system", "content": "你是一个严格的Rust代码审核专家，负责评估函数实现是否符合要求和最佳实践。"},
+                {"role": "user", "content": self._build_review_prompt(func_name, rust_signature, implementation, func_summary)}
+            ])
+            ai_dialog_logger.info(f"推测候选 - AI审核回复: {review_response}")
+            review_result = self._parse_review_result(review_response)
+            result["review"] = review_result
+            if not review_result["passed"]:
+                return dict(result, reason=f"审核未通过: {review_result['reason']}")
+            return dict(result, passed=True, reason="通过")
+        
+        winner = self.speculator.run(generate, validate)
+        if not winner:
+            main_logger.info(f"函数 {func_name} 的推测候选均未通过，回退到逐轮生成-审核")
+            return None
+        
+        validation = winner["validation"]
+        main_logger.info(f"函数 {func_name} 第 {winner['index'] + 1} 个候选（温度 {winner['temperature']}）通过验证")
+        result = {
+            "success": True,
+            "implementation": validation["implementation"],
+            "review_rounds": len(review_history or []) + 1,
+            "review_history": list(review_history or []) + [validation["review"]],
+            "speculative": {
+                "candidates": self.speculator.candidates,
+                "winner": winner["index"],
+                "temperature": winner["temperature"]
+            }
+        }
+        if validation.get("compile_result"):
+            result["compile_result"] = validation["compile_result"]
+        return result
+    
+    @staticmethod
+    def _extract_implementation(response):
+        """从生成回复中提取实现代码：优先使用代码块，否则从第一个fn开始截取"""
+        implementation_code = TextExtractor.extract_code_block(response)
+        if not implementation_code:
+            # 如果找不到代码块，尝试直接使用整个响应
+            implementation_code = response.strip()
+            # 继续尝试过滤，只保留看起来像代码的部分
+            if "fn " in implementation_code:
+                start_idx = implementation_code.find("fn ")
+                implementation_code = implementation_code[start_idx:].strip()
+        return implementation_code
+    
+    @staticmethod
+    def _parse_review_result(review_response):
+        """解析审核回复，JSON解析失败时基于文本判断是否通过"""
+        review_result = TextExtractor.extract_json(review_response)
+        if not review_result or "passed" not in review_result:
+            passed = "passed" in review_response.lower() and not ("not passed" in review_response.lower() or "failed" in review_response.lower())
+            review_result = {
+                "passed": passed,
+                "reason": "无法解析JSON结果，基于文本判断",
+                "issues": [],
+                "suggestions": []
+            }
+        return review_result
+    
+    @staticmethod
+    def _collapse_dependency(text):
+        """依赖项片段只保留签名：去掉功能说明并折叠函数体"""
+        text = "\n".join(line for line in text.splitlines() if not line.startswith("主要功能:"))
+        return collapse_to_signature(text) + "\n\n"
+    
     def _build_review_prompt(self, func_name, rust_signature, implementation, func_summary):
         """构建审核提示"""
         # 提取摘要信息
@@ -626,9 +818,28 @@ class FunctionImplementationGenerator:
         detailed_logic = func_summary.get("detailed_logic", "")
         error_handling = func_summary.get("error_handling", "")
         
-        # 构建审核提示
-        review_prompt = f"""审核这个Rust函数的实现，评估它是否正确、完整、高效：
+        # 构建审核提示：审核标准和返回格式在前，待审核的内容在后
+        review_prompt = """审核末尾给出的Rust函数实现，评估它是否正确、完整、高效。
 
+    ## 审核标准:
+    1. 实现是否完全符合函数签名
+    2. 实现是否完全符合函数描述的目的和逻辑
+    3. 错误处理是否充分
+    4. 代码是否简洁高效、符合Rust习惯
+    5. 是否有潜在的bug或内存安全问题
+    6. 确认没有不必要的导入语句
+
+    请按照以下格式返回审核结果:
+    ```json
+    {
+    "passed": true/false,
+    "reason": "通过或失败的理由",
+    "issues": ["问题1", "问题2", ...],
+    "suggestions": ["建议1", "建议2", ...]
+    }
+    ```
+    """
+        review_prompt += f"""
     ## 原始函数签名:
     ```rust
     {rust_signature}
@@ -650,78 +861,13 @@ class FunctionImplementationGenerator:
     ```rust
     {implementation}
     ```
-
-    ## 审核标准:
-    1. 实现是否完全符合函数签名
-    2. 实现是否完全符合函数描述的目的和逻辑
-    3. 错误处理是否充分
-    4. 代码是否简洁高效、符合Rust习惯
-    5. 是否有潜在的bug或内存安全问题
-    6. 确认没有不必要的导入语句
-
-    请按照以下格式返回审核结果:
-    ```json
-    {{
-    "passed": true/false,
-    "reason": "通过或失败的理由",
-    "issues": ["问题1", "问题2", ...],
-    "suggestions": ["建议1", "建议2", ...]
-    }}
-    ```
     """
         return review_prompt
     def _review_implementation(self, func_name, rust_signature, implementation, func_summary):
         """审核函数实现"""
         main_logger.info(f"审核函数 {func_name} 的实现")
         
-        # 提取摘要信息
-        main_purpose = func_summary.get("main_purpose", "")
-        detailed_logic = func_summary.get("detailed_logic", "")
-        error_handling = func_summary.get("error_handling", "")
-        
-        # 构建审核提示
-        review_prompt = f"""审核这个Rust函数的实现，评估它是否正确、完整、高效：
-
-## 原始函数签名:
-```rust
-{rust_signature}
-```
-
-## 函数摘要:
-- **主要目的**: {main_purpose}
-"""
-
-        # 添加详细逻辑和错误处理（如果有）
-        if detailed_logic:
-            review_prompt += f"- **详细逻辑**: {detailed_logic}\n"
-        if error_handling:
-            review_prompt += f"- **错误处理**: {error_handling}\n"
-        
-        # 添加实现代码
-        review_prompt += f"""
-## 实现代码:
-```rust
-{implementation}
-```
-
-## 审核标准:
-1. 实现是否完全符合函数签名
-2. 实现是否完全符合函数描述的目的和逻辑
-3. 错误处理是否充分
-4. 代码是否简洁、高效、符合Rust习惯
-5. 是否有潜在的bug或内存安全问题
-6. 确认没有不必要的导入语句
-
-请按照以下格式返回审核结果:
-```json
-{{
-  "passed": true/false,
-  "reason": "通过或失败的理由",
-  "issues": ["问题1", "问题2", ...],
-  "suggestions": ["建议1", "建议2", ...]
-}}
-```
-"""
+        review_prompt = self._build_review_prompt(func_name, rust_signature, implementation, func_summary)
         
         # 记录对话
         ai_dialog_logger.info(f"=========== 审核函数 {func_name} 的实现 ===========")
@@ -804,6 +950,7 @@ class FunctionImplementationGenerator:
         
         return fixed_impl
     
+    @tracer.traced("cargo", "compile")
     def _check_compilation(self, implementation, dependencies, data):
         """检查函数实现是否能编译通过，包含完整的依赖环境"""
         main_logger.info("检查函数实现的编译状态")
@@ -1008,7 +1155,7 @@ class FunctionImplementationGenerator:
         main_logger.info(f"开始修复编译错误 (共 {len(compile_errors)} 个)")
         
         # 使用C2Rust转换器的错误修复功能
-        max_fix_rounds = 5
+        max_fix_rounds = run_budget.rounds(5)
         rounds = 0
         current_impl = implementation
         
@@ -1057,7 +1204,7 @@ class FunctionImplementationGenerator:
             
             try:
                 # 调用AI进行修复 - 使用消息数组格式
-                response = self.agent1.ask([
+                response = self.fixer.ask([
                     {"role": "system", "content": "你是一个专门修复Rust编译错误的专家。请直接返回修复后的代码，不要添加任何解释或导入语句。"},
                     {"role": "user", "content": fix_prompt}
                 ])
@@ -1123,18 +1270,10 @@ class FunctionImplementationGenerator:
         main_logger.info(f"开始修复编译错误 (共 {len(compile_errors)} 个)")
         
         # 使用C2Rust转换器的错误修复功能
-        max_fix_rounds = 5
+        max_fix_rounds = run_budget.rounds(5)
         rounds = 0
         current_impl = implementation
         
-        # 收集依赖项签名信息，用于提示
-        dependency_signatures = []
-        if dependencies:
-            for dep_id, dep_code in dependencies.items():
-                dependency_signatures.append(f"### {dep_id}\n```rust\n{dep_code}\n```\n")
-        
-        # 也可以从data中收集特定依赖的签名（如果需要）
-        
         for round_num in range(1, max_fix_rounds + 1):
             main_logger.info(f"修复轮次 {round_num}/{max_fix_rounds}")
             
@@ -1148,23 +1287,9 @@ class FunctionImplementationGenerator:
                         error_line = error_line[:150] + "..."
                     error_summaries.append(error_line)
             
-            # 构建错误修复的提示
-            fix_prompt = f"""修复这个Rust函数实现中的编译错误:
-
-    ## 当前实现:
-    ```rust
-    {current_impl}
-    ```
-
-    ## 编译错误:
-    {chr(10).join(error_summaries)}
-    """
-
-            # 添加依赖项签名信息
-            if dependency_signatures:
-                fix_prompt += "\n## 依赖项签名:\n" + "".join(dependency_signatures) + "\n"
+            # 构建错误修复的提示：修复要求在前，依赖项签名（按键排序）其次，当前实现和错误在最后
+            fix_prompt = """修复末尾给出的Rust函数实现中的编译错误。
 
-            fix_prompt += """
     ## 修复要求:
     1. 保持函数签名不变，只修改实现部分
     2. 修复所有编译错误
@@ -1176,6 +1301,24 @@ class FunctionImplementationGenerator:
     ```rust
     // 修复后的代码...
     ```
+    """
+
+            # 添加依赖项签名信息（按token预算裁剪，当前实现和错误中引用的依赖项优先）
+            if dependencies:
+                fitted, omitted = self.prompt_budget.fit_dependencies(
+                    dependencies, current_impl + "\n" + "\n".join(error_summaries)
+                )
+                fix_prompt += "\n## 依赖项签名:\n" + MicroBatcher.format_items(dict(sorted(fitted.items())), "rust")
+                fix_prompt += self.prompt_budget.omitted_note(sorted(omitted))
+
+            fix_prompt += f"""
+    ## 当前实现:
+    ```rust
+    {current_impl}
+    ```
+
+    ## 编译错误:
+    {chr(10).join(error_summaries)}
     """
             
             # 记录对话
@@ -1184,7 +1327,7 @@ class FunctionImplementationGenerator:
             
             try:
                 # 调用AI进行修复 - 使用消息数组格式
-                response = self.agent1.ask([
+                response = self.fixer.ask([
                     {"role": "system", "content": "你是一个专门修复Rust编译错误的专家。请直接返回修复后的代码，不要添加任何解释或导入语句。"},
                     {"role": "user", "content": fix_prompt}
                 ])
@@ -1259,6 +1402,21 @@ def main():
     parser.add_argument("--test", "-t", action="store_true", help="测试模式，只处理1个函数")
     parser.add_argument("--generate-validation", "-v", action="store_true", help="生成验证项目")
     parser.add_argument("--validation-dir", default="validation_project", help="验证项目输出目录")
+    parser.add_argument("--speculative", type=int, default=1, help="慢尾部函数（首轮审核未通过或签名与摘要较长）并行生成的候选实现数，第一个通过验证的胜出（默认1，即不启用）")
+    parser.add_argument("--deadline", type=float, help="每次大模型调用（含重试）的截止时间（秒），默认不限制")
+    parser.add_argument("--hedge", action="store_true", help="请求超过观测到的p95耗时仍未返回时发出对冲请求，使用先返回的结果")
+    parser.add_argument("--routes", help="模型路由配置JSON文件，为实现、审核、修复等角色分别指定模型、后端和回退顺序")
+    parser.add_argument("--base-url", help="覆盖所有路由的后端地址，例如本地OpenAI兼容服务 http://localhost:8000/v1")
+    parser.add_argument("--record", help="把每次大模型请求和响应录制到该JSONL文件")
+    parser.add_argument("--replay", help="从该JSONL文件回放录制的响应，不访问网络")
+    parser.add_argument("--replay-latency", action="store_true", help="回放时按录制的耗时等待")
+    parser.add_argument("--metrics", help="运行中定期把耗时分位数、token、吞吐量和预计剩余时间写入该Prometheus textfile文件")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"), help="运行结束时把本次运行的摘要追加到该历史文件（设为空字符串时不记录），用 run_report.py 对比")
+    parser.add_argument("--trace", help="记录各Agent请求、编译、检查点写入和逐项处理的耗时，导出为Chrome trace JSON到该路径")
+    parser.add_argument("--max-tokens", type=int, help="本次运行的token上限，用尽后不再实现新的函数（可参考 plan_run.py 的估算）")
+    parser.add_argument("--max-cost", type=float, help="本次运行的估算成本上限（美元），用尽后不再实现新的函数")
+    parser.add_argument("--time-limit", type=float, help="本次运行的时长上限（秒），与token/成本上限一起决定降级档位，到时不再派发新项目")
+    parser.add_argument("--roots", nargs="+", help="入口函数或类型名称（如 ZopfliDeflatePart ZopfliOptions，也可以写 文件::名称 或完整项目ID），只处理它们的传递依赖闭包，其余项目保持未处理")
     
     args = parser.parse_args()
     
@@ -1269,14 +1427,36 @@ def main():
     max_functions = 1 if args.test else args.max
     
     # 初始化生成器
-    generator = FunctionImplementationGenerator(api_key, model=args.model)
+    if args.trace:
+        tracer.enable()
+    run_metrics.start(args.metrics)
+    cassette = open_cassette(args.record, args.replay, args.replay_latency)
+    router = ModelRouter.from_file(args.routes, api_key, args.base_url,
+                                   request_options={"deadline": args.deadline, "hedge": args.hedge, "cassette": cassette},
+                                   default_model=args.model)
+    run_budget.configure(args.max_tokens, args.max_cost, router.prices, args.time_limit)
+    generator = FunctionImplementationGenerator(api_key, speculative_candidates=args.speculative, router=router)
     
     # 生成函数实现
-    result = generator.generate_implementation_from_json(
-        args.input, 
-        args.output, 
-        max_functions
-    )
+    try:
+        result = generator.generate_implementation_from_json(
+            args.input, 
+            args.output, 
+            max_functions,
+            roots=args.roots
+        )
+        if run_budget.limited:
+            main_logger.info(f"预算用量: {run_budget.describe()}")
+        record = record_run(args.history, "implement", vars(args), run_metrics.snapshot(), router.report())
+        if record:
+            main_logger.info(f"运行记录 {describe(record)}")
+    finally:
+        if args.trace:
+            tracer.export(args.trace, main_logger.info)
+        run_metrics.stop()
+        if args.metrics:
+            for line in run_metrics.summary_lines():
+                main_logger.info(f"运行指标 {line}")
     
     # 生成验证项目
     if args.generate_validation:
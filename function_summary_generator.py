@@ -11,10 +11,24 @@ from datetime import datetime
 logging.basicConfig(level=logging.WARNING)
 
 # 导入工具模块
+from sig_utils.async_logging import configure_logger
 from sig_utils.gpt_client import GPT
 from sig_utils.stats_collector import ConversionStats
 from sig_utils.text_extractor import TextExtractor
 from sig_utils.prompt_templates import PromptTemplates
+from sig_utils.dependency_graph import DependencyGraph, root_closure
+from sig_utils.fingerprint import carry_over_stage, stamp_fingerprint
+from sig_utils.micro_batcher import MicroBatcher
+from sig_utils.model_router import ModelRouter
+from sig_utils.llm_cassette import open_cassette
+from sig_utils.tracing import tracer
+from sig_utils.metrics import run_metrics
+from sig_utils.budget import run_budget
+from sig_utils.run_history import describe, record_run
+from sig_utils.prompt_budget import PromptBudget, collapse_to_signature
+from sig_utils.response_schemas import (
+    StructuredOutputError, SUMMARY_SCHEMA, SUMMARY_REVIEW_SCHEMA, BATCH_SUMMARY_SCHEMA, BATCH_SUMMARY_REVIEW_SCHEMA
+)
 
 # 配置目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -26,53 +40,23 @@ os.makedirs(DATA_DIR, exist_ok=True)
 # 配置日志
 class Logger:
     def __init__(self, name, log_dir=LOG_DIR, console_output=True):
-        self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.propagate = False
-        
-        if not self.logger.handlers:
-            file_handler = logging.FileHandler(
-                os.path.join(log_dir, f"{name}.log"), 
-                encoding="utf-8",
-                mode='w'
-            )
-            file_handler.setLevel(logging.DEBUG)
-            
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(formatter)
-            
-            self.logger.addHandler(file_handler)
-            
-            if console_output:
-                console_handler = logging.StreamHandler()
-                console_handler.setLevel(logging.INFO)
-                console_handler.setFormatter(formatter)
-                self.logger.addHandler(console_handler)
-                self.logger.addHandler(console_handler)
+        # 日志记录只放入队列，由后台线程写入按大小轮转并压缩的文件，较长的正文按内容哈希只保存一次
+        self.logger = configure_logger(logging.getLogger(name), os.path.join(log_dir, f"{name}.log"), console_output)
     
     def debug(self, msg): 
         self.logger.debug(msg)
-        self._flush_handlers()
         
     def info(self, msg): 
         self.logger.info(msg)
-        self._flush_handlers()
         
     def warning(self, msg): 
         self.logger.warning(msg)
-        self._flush_handlers()
         
     def error(self, msg): 
         self.logger.error(msg)
-        self._flush_handlers()
         
     def critical(self, msg): 
         self.logger.critical(msg)
-        self._flush_handlers()
-    
-    def _flush_handlers(self):
-        for handler in self.logger.handlers:
-            handler.flush()
 
 # 主日志
 main_logger = Logger("func_summary_main")
@@ -105,14 +89,19 @@ DEPENDENCY_EXAMPLE = """
 
 # 函数总结生成器
 class FunctionSummaryGenerator:
-    def __init__(self, api_key):
+    def __init__(self, api_key, batch_size=1, prompt_budget=None, request_options=None, router=None):
         main_logger.info("初始化函数总结生成器")
-        self.agent1 = GPT(api_key, model_name="gpt-4o")  # 总结生成专家
-        self.agent2 = GPT(api_key, model_name="gpt-4o")  # 总结审核专家
+        # 按角色选择模型和后端；未提供路由器时使用gpt-4o，request_options为请求保护选项（deadline、hedge）
+        self.router = router or ModelRouter(api_key, request_options=request_options)
+        self.agent1 = self.router.client("summariser", GPT)  # 总结生成专家
+        self.agent2 = self.router.client("reviewer", GPT)  # 总结审核专家
         self.stats = ConversionStats()
+        self.prompt_budget = prompt_budget or PromptBudget()  # 控制依赖项上下文和多轮对话的token数
+        self.batcher = MicroBatcher(batch_size, counter=self.prompt_budget.counter)  # 将多个小函数合并到一次请求中，batch_size为1时不合批
         # 用于跟踪总项目数
         self.total_functions = 0
     
+    @tracer.traced("summary", "summary", item_arg="item_id", stage="summary", kind="functions")
     def generate_summary(self, item_id, c_code, rust_signature, dependency_info=None, max_rounds=3):
         """为单个函数生成总结，包含多轮审核直到通过"""
         main_logger.info(f"开始生成函数总结: {item_id}")
@@ -126,37 +115,7 @@ class FunctionSummaryGenerator:
         ai_dialog_logger.info(f"输入Rust签名: {rust_signature}")
         
         # 准备依赖项信息
-        dependencies_text = ""
-        available_deps_list = []
-        
-        if dependency_info:
-            functions_deps = dependency_info.get("functions", {})
-            non_functions_deps = dependency_info.get("non_functions", {})
-            
-            # 构建依赖项信息
-            dependencies_text = "\n## 依赖项：\n"
-            
-            # 处理函数依赖
-            if functions_deps:
-                dependencies_text += "\n### 函数依赖：\n"
-                
-                for dep_id, dep_data in functions_deps.items():
-                    signature = dep_data.get("signature", "未知签名")
-                    purpose = dep_data.get("purpose", "未知目的")
-                    
-                    dependencies_text += f"#### {dep_id}\n```rust\n{signature}\n```\n"
-                    dependencies_text += f"目的: {purpose}\n\n"
-                    
-                    available_deps_list.append(dep_id)
-            
-            # 处理非函数依赖
-            if non_functions_deps:
-                dependencies_text += "\n### 非函数依赖：\n"
-                
-                for dep_id, signature in non_functions_deps.items():
-                    dependencies_text += f"#### {dep_id}\n```rust\n{signature}\n```\n\n"
-                    
-                    available_deps_list.append(dep_id)
+        dependencies_text, available_deps_list = self._format_dependency_info(dependency_info, c_code)
         
         # 构建提示
         summary_prompt = """请对以下C函数进行详细分析并生成总结，总结将用于后续转换为Rust实现：
@@ -234,11 +193,16 @@ class FunctionSummaryGenerator:
             
             try:
                 # 获取总结结果
-                summary_response_raw = self.agent1.ask(messages)
+                messages = self.prompt_budget.compact_messages(messages)
+                try:
+                    summary_json, summary_response_raw = self.agent1.ask_json(messages, SUMMARY_SCHEMA)
+                except StructuredOutputError as e:
+                    # 响应不符合Schema，回退到文本提取
+                    item_logger.warning(f"结构化总结校验失败，回退到文本提取: {e}")
+                    summary_response_raw = e.raw_text
+                    summary_json = TextExtractor.extract_json(summary_response_raw)
                 ai_dialog_logger.info(f"轮次 {round_num} - Agent1回复: {summary_response_raw}")
                 
-                # 解析JSON响应
-                summary_json = TextExtractor.extract_json(summary_response_raw)
                 if not summary_json:
                     # 如果JSON解析失败，尝试提取文本作为备选
                     item_logger.warning("JSON解析失败，尝试提取文本")
@@ -264,21 +228,7 @@ class FunctionSummaryGenerator:
                     summary_json["dependencies"] = {}
                 
                 # 验证dependencies只包含我们提供的依赖项
-                if dependency_info:
-                    valid_dependencies = set()
-                    if "functions" in dependency_info:
-                        valid_dependencies.update(dependency_info["functions"].keys())
-                    if "non_functions" in dependency_info:
-                        valid_dependencies.update(dependency_info["non_functions"].keys())
-                    
-                    current_dependencies = set(summary_json["dependencies"].keys())
-                    
-                    # 移除不在有效依赖项列表中的项
-                    invalid_deps = current_dependencies - valid_dependencies
-                    for dep in invalid_deps:
-                        if dep in summary_json["dependencies"]:
-                            del summary_json["dependencies"][dep]
-                            item_logger.warning(f"移除无效依赖项: {dep}")
+                self._filter_dependencies(summary_json, dependency_info)
                 
                 # 审核总结
                 review_prompt = """请审核以下函数总结的质量：
@@ -327,14 +277,18 @@ class FunctionSummaryGenerator:
                 ai_dialog_logger.info(f"轮次 {round_num} - 审核系统提示: {review_messages[0]['content']}")
                 ai_dialog_logger.info(f"轮次 {round_num} - 审核用户提示: {review_prompt}")
                 
-                review_response = self.agent2.ask(review_messages)
+                review_json = None
+                try:
+                    review_json, review_response = self.agent2.ask_json(review_messages, SUMMARY_REVIEW_SCHEMA)
+                except StructuredOutputError as e:
+                    item_logger.warning(f"总结审核结果校验失败，回退到文本提取: {e}")
+                    review_response = e.raw_text
                 ai_dialog_logger.info(f"轮次 {round_num} - Agent2回复: {review_response}")
                 
-                # 解析审核结果JSON
-                review_json = None
+                # 结构化解析失败时回退到文本提取
                 try:
-                    # 尝试直接解析
-                    review_json = TextExtractor.extract_json(review_response)
+                    if not review_json:
+                        review_json = TextExtractor.extract_json(review_response)
                     
                     # 如果提取失败，尝试从代码块中提取
                     if not review_json and "```json" in review_response:
@@ -494,8 +448,311 @@ class FunctionSummaryGenerator:
             "error": "未知错误，执行到了循环之外"
         }
     
-    def process_architecture_file(self, filepath, output_path=None, max_items=None):
-        """处理整个架构文件，为所有函数生成总结"""
+    @tracer.traced("summary_batch", "summary", stage="summary", kind="functions")
+    def generate_summaries_batch(self, entries):
+        """
+        在一次请求中为多个小函数生成总结，并在一次请求中审核
+        
+        只进行一轮生成和审核，响应中缺失、无法解析或未通过审核的函数不在此处重试，
+        由调用方使用generate_summary逐个重新生成。
+        
+        Args:
+            entries: 函数列表，每项包含id、c_code、rust_signature、dependency_info
+        
+        Returns:
+            Dict: 函数ID -> 总结结果（格式同generate_summary），只包含通过审核的函数
+        """
+        by_id = {entry["id"]: entry for entry in entries}
+        ids = list(by_id)
+        main_logger.info(f"📦 批量生成 {len(ids)} 个函数总结: {', '.join(ids)}")
+        ai_dialog_logger.info(f"==================== AI对话开始 [batch]: {', '.join(ids)} ====================")
+        
+        sections = ""
+        for entry in entries:
+            dependencies_text, available_deps_list = self._format_dependency_info(entry["dependency_info"], entry["c_code"])
+            sections += f"""## {entry['id']}
+### 原始C函数代码：
+```c
+{entry['c_code']}
+```
+
+### 对应的Rust函数签名：
+```rust
+{entry['rust_signature']}
+```
+{dependencies_text}
+可用依赖项：{', '.join(available_deps_list) if available_deps_list else '无'}
+
+"""
+        
+        items_example = ",\n    ".join(
+            f'"{func_id}": {{"function_name": "函数名称", "main_purpose": "...", "detailed_logic": "...", '
+            f'"error_handling": "...", "dependencies": {{}}}}'
+            for func_id in ids
+        )
+        summary_prompt = f"""请分别对以下 {len(ids)} 个C函数进行分析并生成总结，总结将用于后续转换为Rust实现，各函数互相独立：
+
+{sections}
+每个函数请提供：
+1. **函数的主要功能**：函数的整体目的和作用
+2. **函数的具体逻辑**：详细分析函数的执行流程和算法步骤
+3. **错误处理**：函数的错误检查和处理机制
+4. **依赖项**：函数如何使用其依赖项（仅包含该函数的可用依赖项，每项包含signature和usage）
+
+{DEPENDENCY_EXAMPLE}
+
+请以JSON格式返回所有函数的总结，items中必须包含上面列出的每一个函数：
+```json
+{{
+  "items": {{
+    {items_example}
+  }}
+}}
+```
+
+如果函数没有使用任何依赖项，请将其dependencies设为空对象{{}}。
+
+只返回JSON对象，不要添加其他文本。"""
+        messages = [
+            {"role": "system", "content": "你是一个精通C和Rust的编程专家，擅长分析C代码并为其生成详细的功能和逻辑总结。你的总结应该准确、全面、有条理，能够帮助其他开发者理解函数的工作原理并进行Rust实现。"},
+            {"role": "user", "content": summary_prompt}
+        ]
+        ai_dialog_logger.info(f"批量总结用户提示: {summary_prompt}")
+        
+        try:
+            try:
+                summary_response, summary_response_raw = self.agent1.ask_json(messages, BATCH_SUMMARY_SCHEMA)
+            except StructuredOutputError as e:
+                summary_response_raw = e.raw_text
+                summary_response = TextExtractor.extract_json(summary_response_raw)
+            ai_dialog_logger.info(f"批量总结 - Agent1回复: {summary_response_raw}")
+        except Exception as e:
+            main_logger.error(f"批量总结生成过程发生错误，回退为逐个生成: {str(e)}")
+            return {}
+        
+        summaries, missing = MicroBatcher.split_results(
+            summary_response, ids, lambda value: isinstance(value, dict) and value.get("main_purpose")
+        )
+        if missing:
+            main_logger.warning(f"批量总结缺少函数，将逐个重新生成: {', '.join(missing)}")
+        if not summaries:
+            return {}
+        for func_id, summary_json in summaries.items():
+            if not isinstance(summary_json.get("dependencies"), dict):
+                summary_json["dependencies"] = {}
+            self._filter_dependencies(summary_json, by_id[func_id]["dependency_info"])
+        
+        # 一次请求审核所有总结
+        review_sections = "".join(
+            f"""## {func_id}
+### 原始C函数代码：
+```c
+{by_id[func_id]['c_code']}
+```
+
+### 生成的函数总结：
+```json
+{json.dumps(summary_json, indent=2, ensure_ascii=False)}
+```
+
+"""
+            for func_id, summary_json in summaries.items()
+        )
+        review_example = ",\n    ".join(
+            f'"{func_id}": {{"review_result": "PASS/FAIL", "reason": "通过/失败的简要原因"}}' for func_id in summaries
+        )
+        review_prompt = f"""请分别审核以下 {len(summaries)} 个函数总结的质量：
+
+{review_sections}
+请评估每个总结是否基本准确地反映了函数的功能、逻辑和依赖项使用方式。不需要过于严格，只要能够帮助开发者理解函数功能即可。
+
+请以JSON格式返回审核结果，items中必须包含上面列出的每一个函数：
+```json
+{{
+  "items": {{
+    {review_example}
+  }}
+}}
+```
+
+只返回JSON对象，不要添加其他文本。"""
+        review_messages = [
+            {"role": "system", "content": "你是一个代码审核专家，负责评估函数总结的质量。审核应该务实而不是过于严格，只要总结能够帮助开发者理解函数的基本功能即可。"},
+            {"role": "user", "content": review_prompt}
+        ]
+        ai_dialog_logger.info(f"批量审核用户提示: {review_prompt}")
+        
+        try:
+            try:
+                review_response, review_response_raw = self.agent2.ask_json(review_messages, BATCH_SUMMARY_REVIEW_SCHEMA)
+            except StructuredOutputError as e:
+                review_response_raw = e.raw_text
+                review_response = TextExtractor.extract_json(review_response_raw)
+            ai_dialog_logger.info(f"批量审核 - Agent2回复: {review_response_raw}")
+        except Exception as e:
+            main_logger.error(f"批量总结审核过程发生错误，回退为逐个生成: {str(e)}")
+            return {}
+        
+        reviews, _ = MicroBatcher.split_results(
+            review_response, list(summaries), lambda value: isinstance(value, dict) and value.get("review_result") == "PASS"
+        )
+        results = {}
+        for func_id, review_json in reviews.items():
+            results[func_id] = {
+                "success": True,
+                "summary": summaries[func_id],
+                "review": review_json,
+                "rounds": 1,
+                "batched": True
+            }
+            item_logger.info(f"批量总结生成成功: {func_id}")
+        
+        main_logger.info(f"📦 批量总结完成: {len(results)}/{len(ids)} 个函数通过审核")
+        ai_dialog_logger.info(f"==================== AI对话结束 [batch]: {', '.join(ids)} ====================\n")
+        return results
+    
+    def _format_dependency_info(self, dependency_info, c_code=""):
+        """
+        将依赖项信息格式化为提示文本，返回 (提示文本, 可用依赖项列表)
+        
+        超出token预算时，C代码中直接引用的依赖项优先保留全文，其余只保留签名或省略
+        """
+        dependencies_text = ""
+        available_deps_list = []
+        
+        if dependency_info:
+            functions_deps = dependency_info.get("functions", {})
+            non_functions_deps = dependency_info.get("non_functions", {})
+            
+            snippets = {}
+            for dep_id, dep_data in functions_deps.items():
+                signature = dep_data.get("signature", "未知签名")
+                purpose = dep_data.get("purpose", "未知目的")
+                snippets[dep_id] = f"```rust\n{signature}\n```\n目的: {purpose}\n\n"
+            for dep_id, signature in non_functions_deps.items():
+                snippets[dep_id] = f"```rust\n{signature}\n```\n\n"
+            fitted, omitted = self.prompt_budget.fit_dependencies(snippets, c_code, self._collapse_dependency)
+            
+            # 构建依赖项信息
+            dependencies_text = "\n## 依赖项：\n"
+            
+            # 处理函数依赖
+            if any(dep_id in fitted for dep_id in functions_deps):
+                dependencies_text += "\n### 函数依赖：\n"
+                
+                for dep_id in functions_deps:
+                    if dep_id in fitted:
+                        dependencies_text += f"#### {dep_id}\n{fitted[dep_id]}"
+                        available_deps_list.append(dep_id)
+            
+            # 处理非函数依赖
+            if any(dep_id in fitted for dep_id in non_functions_deps):
+                dependencies_text += "\n### 非函数依赖：\n"
+                
+                for dep_id in non_functions_deps:
+                    if dep_id in fitted:
+                        dependencies_text += f"#### {dep_id}\n{fitted[dep_id]}"
+                        available_deps_list.append(dep_id)
+            
+            dependencies_text += self.prompt_budget.omitted_note(omitted)
+        
+        return dependencies_text, available_deps_list
+    
+    @staticmethod
+    def _collapse_dependency(text):
+        """依赖项片段只保留签名：去掉目的说明并折叠函数体"""
+        text = "\n".join(line for line in text.splitlines() if not line.startswith("目的:"))
+        return collapse_to_signature(text) + "\n\n"
+    
+    def _filter_dependencies(self, summary_json, dependency_info):
+        """移除总结中不在提供的依赖项列表中的依赖项"""
+        if not dependency_info:
+            return
+        valid_dependencies = set()
+        if "functions" in dependency_info:
+            valid_dependencies.update(dependency_info["functions"].keys())
+        if "non_functions" in dependency_info:
+            valid_dependencies.update(dependency_info["non_functions"].keys())
+        
+        current_dependencies = set(summary_json["dependencies"].keys())
+        
+        # 移除不在有效依赖项列表中的项
+        invalid_deps = current_dependencies - valid_dependencies
+        for dep in invalid_deps:
+            if dep in summary_json["dependencies"]:
+                del summary_json["dependencies"][dep]
+                item_logger.warning(f"移除无效依赖项: {dep}")
+    
+    def _collect_dependency_info(self, data, dependencies):
+        """收集依赖项的签名和目的，供生成总结时参考"""
+        dependency_info = {"functions": {}, "non_functions": {}}
+        
+        for dep_id, dep_info in dependencies.items():
+            dep_type = dep_info.get("type")
+            dep_qualified_name = dep_info.get("qualified_name", "")
+            
+            if not dep_qualified_name:
+                continue
+            
+            dep_parts = dep_qualified_name.split("::")
+            if len(dep_parts) < 2:
+                continue
+            
+            dep_file = dep_parts[0]
+            dep_name = "::".join(dep_parts[1:])
+            if dep_file not in data:
+                continue
+            
+            # 处理函数依赖
+            if dep_type == "functions":
+                if "functions" in data[dep_file] and dep_name in data[dep_file]["functions"]:
+                    dep_item = data[dep_file]["functions"][dep_name]
+                    
+                    # 获取签名和目的
+                    signature = dep_item.get("rust_signature", "未知签名")
+                    
+                    purpose = ""
+                    if "function_summary" in dep_item:
+                        summary_json = dep_item["function_summary"]
+                        purpose = summary_json.get("main_purpose", "未知目的")
+                    
+                    # 添加到依赖信息
+                    dependency_info["functions"][dep_id] = {
+                        "signature": signature,
+                        "purpose": purpose
+                    }
+            # 处理非函数依赖
+            else:
+                # 尝试从各种类型中找到依赖项
+                for item_type in ["typedefs", "structs", "defines", "fields"]:
+                    if item_type in data[dep_file] and dep_name in data[dep_file][item_type]:
+                        non_func_item = data[dep_file][item_type][dep_name]
+                        signature = non_func_item.get("rust_signature", "未知签名")
+                        dependency_info["non_functions"][dep_id] = signature
+                        break
+        
+        return dependency_info
+    
+    def _apply_summary_result(self, item, result):
+        """将总结结果写回函数项目"""
+        if result["success"]:
+            item["function_summary"] = result["summary"]
+            item["summary_status"] = "success"
+            item["summary_review"] = result["review"]
+            item["summary_rounds"] = result.get("rounds", 1)
+            if result.get("batched"):
+                item["summary_method"] = "batch"
+        else:
+            item["summary_status"] = "failed"
+            item["summary_error"] = result["error"]
+    
+    def process_architecture_file(self, filepath, output_path=None, max_items=None, roots=None):
+        """
+        处理整个架构文件，为所有函数生成总结
+
+        Args:
+            roots: 入口函数或类型名称列表，只为其依赖闭包中的函数生成总结；为空时处理全部函数
+        """
         main_logger.info("="*80)
         main_logger.info(f"开始处理架构文件: {filepath}")
         main_logger.info("="*80)
@@ -514,7 +771,7 @@ class FunctionSummaryGenerator:
                 output_basename = basename + '_with_summaries'
             output_path = os.path.join(os.path.dirname(filepath), output_basename)
         
-        # 检查输出文件是否已存在
+        # 检查输出文件是否已存在，沿用指纹未变化的函数总结
         data = copy.deepcopy(input_data)
         if os.path.exists(output_path):
             try:
@@ -522,25 +779,15 @@ class FunctionSummaryGenerator:
                 with open(output_path, "r", encoding="utf-8") as f:
                     output_data = json.load(f)
                 
-                # 合并数据，优先使用输出文件中的处理状态
-                for file_name, content in output_data.items():
-                    if file_name not in data:
-                        data[file_name] = content
-                        continue
-                        
-                    if "functions" in content:
-                        if "functions" not in data[file_name]:
-                            data[file_name]["functions"] = {}
-                            
-                        for item_name, item in content["functions"].items():
-                            # 如果函数已有总结，使用输出文件中的状态
-                            if "function_summary" in item:
-                                if item_name in data[file_name]["functions"]:
-                                    data[file_name]["functions"][item_name]["function_summary"] = item["function_summary"]
-                                    data[file_name]["functions"][item_name]["summary_status"] = item.get("summary_status", "unknown")
+                # 源码、签名或依赖项的签名/总结变化的函数及其反向依赖闭包重新生成总结
+                carried = carry_over_stage(data, output_data, "summary")
+                main_logger.info(f"沿用 {carried['carried']} 个函数总结，{carried['changed']} 个函数输入变化，共作废 {carried['invalidated']} 个函数（含反向依赖）")
             except Exception as e:
                 main_logger.error(f"读取输出文件时出错: {e}")
         
+        # 用于记录总结指纹的依赖图
+        fingerprint_graph = DependencyGraph(data)
+        
         # 收集所有函数信息
         all_functions = []
         function_dependencies = {}
@@ -573,6 +820,12 @@ class FunctionSummaryGenerator:
                         main_logger.warning(f"函数缺少必要信息: {file_name}::{item_name}")
                         continue
         
+        # 指定入口时只处理其依赖闭包中的函数
+        closure = root_closure(data, roots, fingerprint_graph)
+        if closure is not None:
+            all_functions = [func for func in all_functions if func["id"] in closure]
+            main_logger.info(f"入口 {', '.join(roots)} 的依赖闭包: {len(closure)} 个项目，闭包外的函数本次不生成总结")
+        
         # 设置总函数数量
         self.total_functions = len(all_functions)
         main_logger.info(f"找到 {self.total_functions} 个需要生成总结的函数")
@@ -596,10 +849,55 @@ class FunctionSummaryGenerator:
         processed_count = 0
         success_count = 0
         failed_count = 0
+        total_functions = self.total_functions
+        run_metrics.track_remaining("summary", lambda: max(0, total_functions - len(summarized_functions)))
+        
+        def finish(func, result):
+            """写回一个函数的总结结果并更新进度"""
+            nonlocal processed_count, success_count, failed_count
+            current_progress = processed_count + 1
+            
+            # 更新结果
+            self._apply_summary_result(data[func["file_name"]]["functions"][func["item_name"]], result)
+            if result["success"]:
+                stamp_fingerprint(fingerprint_graph, func["id"], "summary")
+            
+            # 添加到已总结集合（失败的函数也不需要再次处理）
+            summarized_functions.add(func["id"])
+            run_metrics.record_item("summary", "functions", "success" if result["success"] else "failed", result.get("rounds"))
+            
+            if result["success"]:
+                success_count += 1
+                main_logger.info(f"成功生成函数总结 [{current_progress}/{total_functions}]: {func['id']} (用了 {result.get('rounds', 1)} 轮)")
+            else:
+                failed_count += 1
+                main_logger.warning(f"生成函数总结失败 [{current_progress}/{total_functions}]: {func['id']}")
+            
+            processed_count += 1
+            
+            # 定期保存
+            if processed_count % 5 == 0:
+                with tracer.span("checkpoint", "io"), open(output_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=4, ensure_ascii=False)
+                main_logger.info(f"已处理 {processed_count}/{total_functions} 个函数，中间结果已保存")
+        
+        def flush_batch(batch):
+            """批量生成一组就绪小函数的总结，未成功的函数逐个重新生成"""
+            results = self.generate_summaries_batch(batch) if len(batch) > 1 else {}
+            for entry in batch:
+                result = results.get(entry["id"])
+                if result is None:
+                    result = self.generate_summary(
+                        entry["id"], entry["c_code"], entry["rust_signature"], entry["dependency_info"],
+                        max_rounds=run_budget.rounds(3)
+                    )
+                finish(entry, result)
         
         # 循环处理，直到所有函数都处理完或者无法继续处理
+        budget_stopped = False
         while len(summarized_functions) < len(all_functions) + len(summarized_functions):
             progress_made = False
+            pending_batch = []  # 本轮已就绪、等待合批的小函数
             
             for func in all_functions:
                 if func["id"] in summarized_functions:
@@ -630,109 +928,49 @@ class FunctionSummaryGenerator:
                     continue
                 
                 if all_deps_summarized:
+                    run_budget.adapt(self.router, log=main_logger.warning)
+                    if run_budget.exhausted():
+                        main_logger.warning(f"预算已用尽（{run_budget.describe()}），停止处理新的函数")
+                        budget_stopped = True
+                        break
+                    
                     # 所有依赖项都已总结，可以处理这个函数
-                    current_progress = processed_count + 1
-                    total_functions = self.total_functions
+                    current_progress = processed_count + len(pending_batch) + 1
                     main_logger.info(f"开始处理函数 [{current_progress}/{total_functions}] ({current_progress/total_functions*100:.1f}%): {func['id']}")
                     
                     # 收集依赖项信息
-                    dependency_info = {"functions": {}, "non_functions": {}}
-                    
-                    for dep_id, dep_info in func["dependencies"].items():
-                        dep_type = dep_info.get("type")
-                        dep_qualified_name = dep_info.get("qualified_name", "")
-                        
-                        if not dep_qualified_name:
-                            continue
-                        
-                        dep_parts = dep_qualified_name.split("::")
-                        if len(dep_parts) < 2:
-                            continue
-                        
-                        dep_file = dep_parts[0]
-                        dep_name = "::".join(dep_parts[1:])
-                        
-                        # 处理函数依赖
-                        if dep_type == "functions":
-                            if "functions" in data[dep_file] and dep_name in data[dep_file]["functions"]:
-                                dep_item = data[dep_file]["functions"][dep_name]
-                                
-                                # 获取签名和目的
-                                signature = dep_item.get("rust_signature", "未知签名")
-                                
-                                purpose = ""
-                                if "function_summary" in dep_item:
-                                    summary_json = dep_item["function_summary"]
-                                    purpose = summary_json.get("main_purpose", "未知目的")
-                                
-                                # 添加到依赖信息
-                                dependency_info["functions"][dep_id] = {
-                                    "signature": signature,
-                                    "purpose": purpose
-                                }
-                        # 处理非函数依赖
-                        else:
-                            # 尝试从各种类型中找到依赖项
-                            for item_type in ["typedefs", "structs", "defines", "fields"]:
-                                if item_type in data[dep_file] and dep_name in data[dep_file][item_type]:
-                                    non_func_item = data[dep_file][item_type][dep_name]
-                                    signature = non_func_item.get("rust_signature", "未知签名")
-                                    dependency_info["non_functions"][dep_id] = signature
-                                    break
-                    
-                    # 生成函数总结
-                    result = self.generate_summary(
-                        func["id"],
-                        func["c_code"],
-                        func["rust_signature"],
-                        dependency_info
-                    )
-                    
-                    # 更新结果
-                    if result["success"]:
-                        # 获取file_name和item_name
-                        file_name = func["file_name"]
-                        item_name = func["item_name"]
-                        
-                        # 更新数据
-                        data[file_name]["functions"][item_name]["function_summary"] = result["summary"]
-                        data[file_name]["functions"][item_name]["summary_status"] = "success"
-                        data[file_name]["functions"][item_name]["summary_review"] = result["review"]
-                        data[file_name]["functions"][item_name]["summary_rounds"] = result.get("rounds", 1)
-                        
-                        # 添加到已总结集合
-                        summarized_functions.add(func["id"])
-                        
-                        success_count += 1
-                        main_logger.info(f"成功生成函数总结 [{current_progress}/{total_functions}]: {func['id']} (用了 {result.get('rounds', 1)} 轮)")
-                    else:
-                        # 更新失败状态
-                        file_name = func["file_name"]
-                        item_name = func["item_name"]
-                        
-                        data[file_name]["functions"][item_name]["summary_status"] = "failed"
-                        data[file_name]["functions"][item_name]["summary_error"] = result["error"]
-                        
-                        # 添加到已总结集合（虽然失败了，但也不需要再次处理）
-                        summarized_functions.add(func["id"])
-                        
-                        failed_count += 1
-                        main_logger.warning(f"生成函数总结失败 [{current_progress}/{total_functions}]: {func['id']}")
-                    
-                    processed_count += 1
+                    dependency_info = self._collect_dependency_info(data, func["dependencies"])
                     progress_made = True
                     
-                    # 定期保存
-                    if processed_count % 5 == 0:
-                        with open(output_path, "w", encoding="utf-8") as f:
-                            json.dump(data, f, indent=4, ensure_ascii=False)
-                        main_logger.info(f"已处理 {processed_count}/{total_functions} 个函数，中间结果已保存")
+                    if self.batcher.fits(func["c_code"]):
+                        # 小函数先加入批次，凑满后一次请求生成
+                        pending_batch.append(dict(func, dependency_info=dependency_info))
+                        if len(pending_batch) >= self.batcher.max_batch_size:
+                            flush_batch(pending_batch)
+                            pending_batch = []
+                    else:
+                        # 生成函数总结
+                        result = self.generate_summary(
+                            func["id"],
+                            func["c_code"],
+                            func["rust_signature"],
+                            dependency_info,
+                            max_rounds=run_budget.rounds(3)
+                        )
+                        finish(func, result)
                     
                     # 检查是否达到最大处理数量
-                    if max_items and processed_count >= max_items:
+                    if max_items and processed_count + len(pending_batch) >= max_items:
                         main_logger.info(f"已达到最大处理数量 {max_items}，停止处理")
                         break
+            
+            # 本轮剩余不足一批的小函数
+            if pending_batch:
+                flush_batch(pending_batch)
                         
+            if budget_stopped:
+                break
+            
             # 如果这一轮没有处理任何函数，说明剩下的函数都有循环依赖，无法继续处理
             if not progress_made:
                 main_logger.warning("无法继续处理，可能存在循环依赖")
@@ -743,12 +981,14 @@ class FunctionSummaryGenerator:
                 break
         
         # 保存最终结果
-        with open(output_path, "w", encoding="utf-8") as f:
+        with tracer.span("checkpoint", "io"), open(output_path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4, ensure_ascii=False)
             
         # 输出结果统计
         main_logger.info("="*80)
         main_logger.info(f"处理完成: 成功={success_count}, 失败={failed_count}, 总计={processed_count}/{self.total_functions}")
+        for line in self.router.summary_lines():
+            main_logger.info(f"模型路由 {line}")
         main_logger.info(f"结果已保存到: {output_path}")
         main_logger.info("="*80)
         
@@ -833,6 +1073,22 @@ def main():
     parser.add_argument("--api-key", "-k", help="OpenAI API密钥")
     parser.add_argument("--debug", "-d", action="store_true", help="启用调试模式")
     parser.add_argument("--test", "-t", action="store_true", help="测试模式：只处理1个项目")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="每次请求最多合并的小函数数（默认1，即不合批）")
+    parser.add_argument("--deadline", type=float, help="每次大模型调用（含重试）的截止时间（秒），默认不限制")
+    parser.add_argument("--hedge", action="store_true", help="请求超过观测到的p95耗时仍未返回时发出对冲请求，使用先返回的结果")
+    parser.add_argument("--routes", help="模型路由配置JSON文件，为总结和审核角色分别指定模型、后端和回退顺序")
+    parser.add_argument("--base-url", help="覆盖所有路由的后端地址，例如本地OpenAI兼容服务 http://localhost:8000/v1")
+    parser.add_argument("--record", help="把每次大模型请求和响应录制到该JSONL文件")
+    parser.add_argument("--replay", help="从该JSONL文件回放录制的响应，不访问网络")
+    parser.add_argument("--replay-latency", action="store_true", help="回放时按录制的耗时等待")
+    parser.add_argument("--metrics", help="运行中定期把耗时分位数、token、吞吐量和预计剩余时间写入该Prometheus textfile文件")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"), help="运行结束时把本次运行的摘要追加到该历史文件（设为空字符串时不记录），用 run_report.py 对比")
+    parser.add_argument("--trace", help="记录各Agent请求、编译、检查点写入和逐项处理的耗时，导出为Chrome trace JSON到该路径")
+    parser.add_argument("--max-tokens", type=int, help="本次运行的token上限，用尽后不再处理新的函数（可参考 plan_run.py 的估算）")
+    parser.add_argument("--max-cost", type=float, help="本次运行的估算成本上限（美元），用尽后不再处理新的函数")
+    parser.add_argument("--time-limit", type=float, help="本次运行的时长上限（秒），与token/成本上限一起决定降级档位，到时不再派发新项目")
+    parser.add_argument("--roots", nargs="+", help="入口函数或类型名称（如 ZopfliDeflatePart ZopfliOptions，也可以写 文件::名称 或完整项目ID），只处理它们的传递依赖闭包，其余项目保持未处理")
     
     args = parser.parse_args()
     
@@ -859,7 +1115,14 @@ def main():
             
         # 初始化生成器
         main_logger.info("初始化函数总结生成器...")
-        generator = FunctionSummaryGenerator(api_key)
+        if args.trace:
+            tracer.enable()
+        run_metrics.start(args.metrics)
+        cassette = open_cassette(args.record, args.replay, args.replay_latency)
+        router = ModelRouter.from_file(args.routes, api_key, args.base_url,
+                                       request_options={"deadline": args.deadline, "hedge": args.hedge, "cassette": cassette})
+        run_budget.configure(args.max_tokens, args.max_cost, router.prices, args.time_limit)
+        generator = FunctionSummaryGenerator(api_key, args.batch_size, router=router)
         
         # 开始处理
         main_logger.info(f"使用输入文件: {input_path}")
@@ -870,15 +1133,28 @@ def main():
         result = generator.process_architecture_file(
             input_path,
             output_path,
-            max_items
+            max_items,
+            roots=args.roots
         )
         
         main_logger.info("函数总结生成完成!")
+        if run_budget.limited:
+            main_logger.info(f"预算用量: {run_budget.describe()}")
+        record = record_run(args.history, "summary", vars(args), run_metrics.snapshot(), router.report())
+        if record:
+            main_logger.info(f"运行记录 {describe(record)}")
         
     except Exception as e:
         main_logger.error(f"程序执行出错: {str(e)}")
         main_logger.error(traceback.format_exc())
         sys.exit(1)
+    finally:
+        if args.trace:
+            tracer.export(args.trace, main_logger.info)
+        run_metrics.stop()
+        if args.metrics:
+            for line in run_metrics.summary_lines():
+                main_logger.info(f"运行指标 {line}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+对话日志写入模块
+
+GPT客户端每轮对话追加一条JSONL记录，由后台线程写入文件：
+1. 调用方只把记录放入内存中的有界队列，不做磁盘I/O；队列满时丢弃最旧的记录并计数
+2. 后台线程把队列中的记录批量追加写入，文件超过大小上限时按 .1 .2 ... 轮转，只保留固定数量的旧文件
+3. 同一路径只有一个写入线程，多个GPT实例共用；进程退出时写完队列中剩余的记录
+"""
+
+import atexit
+import json
+import os
+import threading
+from collections import deque
+from typing import Dict
+
+
+class ConversationLog:
+    """后台追加写入的JSONL对话日志"""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5, max_pending: int = 10000):
+        """
+        Args:
+            path: JSONL文件路径
+            max_bytes: 单个文件的大小上限，超过后轮转
+            backup_count: 保留的轮转文件数
+            max_pending: 内存中等待写入的记录数上限
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self.written = 0
+        self._pending = deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._writing = False
+        self._thread = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def for_path(cls, path: str, **kwargs) -> "ConversationLog":
+        """获取路径对应的日志，同一路径只创建一个写入线程"""
+        with cls._instances_lock:
+            log = cls._instances.get(path)
+            if log is None or log._closed:
+                log = cls._instances[path] = cls(path, **kwargs)
+            return log
+
+    def append(self, record: Dict):
+        """追加一条记录（只入队，不等待写入）"""
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(record)
+            self._condition.notify()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待队列中的记录全部写入，返回是否在超时前完成"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def close(self):
+        """写完剩余记录后停止写入线程"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout=10)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                batch = list(self._pending)
+                self._pending.clear()
+                if not batch and self._closed:
+                    return
+                self._writing = True
+            self._write(batch)
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch)
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self.written += len(batch)
+        except OSError:
+            self.dropped += len(batch)
+
+    def _rotate(self):
+        """path -> path.1 -> path.2 ...，超出backup_count的最旧文件被删除"""
+        oldest = f"{self.path}.{self.backup_count}"
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
@@ -1,22 +1,39 @@
 import time
-import json
 import logging
 import requests
 import os
 import re
+from collections import deque
 from datetime import datetime
 from openai import OpenAI
 
+from impl_utils.conversation_log import ConversationLog
+from sig_utils.async_logging import configure_logger
+from sig_utils.llm_cassette import CassetteMissError
+from sig_utils.resilience import CircuitOpenError, DeadlineExceededError, RequestGuard
+from sig_utils.tracing import tracer
+
 class GPT:
-    def __init__(self, api_key, model_name="gpt-4o", base_url="https://api.zetatechs.com/v1"):
+    def __init__(self, api_key, model_name="gpt-4o", base_url="https://api.zetatechs.com/v1", deadline=None, hedge=False, cassette=None, guard=None,
+                 history_limit=200):
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        if cassette is not None:
+            self.client = cassette.wrap(self.client)  # 录制请求或回放已录制的响应（sig_utils.llm_cassette）
         self.model_name = model_name
+        self.trace_name = model_name  # 追踪span的名称，由路由器设置为角色名
+        # 熔断、按p95对冲和截止时间控制，并记录每次请求的耗时；路由器为同一后端的所有角色传入同一个guard
+        self.guard = guard or RequestGuard(deadline=deadline, hedge=hedge)
         self.total_tokens_in = 0
         self.total_tokens_out = 0
+        self.total_cached_tokens = 0  # 命中服务端提示缓存的输入token数
         self.call_count = 0
+        self.cached_calls = 0         # 命中提示缓存的请求数
+        self.latency_cached = 0.0     # 命中缓存的请求的总耗时（秒）
+        self.latency_uncached = 0.0   # 未命中缓存的请求的总耗时（秒）
         
-        # 用于记录对话历史
-        self.conversation_history = []
+        # 用于记录对话历史（只保留最近的消息，完整记录见对话日志文件）
+        self.conversation_history = deque(maxlen=history_limit)
+        self._last_messages = []  # 上一轮请求的消息及回复，用于只记录本轮新增的消息
         
         # 创建日志目录
         self.log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logs", "conversations")
@@ -32,37 +49,29 @@ class GPT:
         # 对话轮次计数
         self.turn_count = 0
         
+        # 每轮对话追加一条JSONL记录，由后台线程写入并按大小轮转
+        self.conversation_log = ConversationLog.for_path(
+            os.path.join(self.log_dir, f"conversation_{self.session_id}.jsonl"))
+        
         # 创建详细日志记录器
         self._setup_detailed_logger()
     
     def _setup_detailed_logger(self):
         """设置详细日志记录器"""
-        # 创建详细日志记录器
-        self.detailed_logger = logging.getLogger(f"detailed_{self.session_id}")
-        self.detailed_logger.setLevel(logging.DEBUG)
-        self.detailed_logger.propagate = False  # 避免向上传播到root logger
-        
-        # 创建详细日志文件处理器
-        log_filename = f"detailed_{self.session_id}.log"
-        log_path = os.path.join(self.detailed_log_dir, log_filename)
-        file_handler = logging.FileHandler(log_path, encoding="utf-8", mode='w')
-        file_handler.setLevel(logging.DEBUG)
-        
-        # 设置格式化器
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        
-        # 添加处理器
-        self.detailed_logger.addHandler(file_handler)
+        # 创建详细日志记录器，由后台线程写入，较长的消息正文按内容哈希只保存一次
+        log_path = os.path.join(self.detailed_log_dir, f"detailed_{self.session_id}.log")
+        self.detailed_logger = configure_logger(logging.getLogger(f"detailed_{self.session_id}"), log_path,
+                                                console_output=False)
         
         # 记录会话开始信息
         self.detailed_logger.info(f"================================")
         self.detailed_logger.info(f"会话 {self.session_id} 开始 (模型: {self.model_name})")
         self.detailed_logger.info(f"================================")
     
-    def ask(self, messages, temperature=0.2, max_retries=3, timeout=60):
-        """发送请求给API，支持重试机制"""
+    def ask(self, messages, temperature=0.2, max_retries=3, timeout=60, deadline=None):
+        """发送请求给API，支持重试机制；deadline为本次调用（含重试）的截止时间（秒），默认使用guard的设置"""
         retry_count = 0
+        deadline_at = self.guard.deadline_at(deadline)
         self.turn_count += 1
         
         # 记录详细日志 - 本轮对话的输入
@@ -70,49 +79,38 @@ class GPT:
         self.detailed_logger.info(f"轮次 {self.turn_count} - 输入消息")
         self.detailed_logger.info(f"{'='*50}")
         
-        # 记录每条消息
-        for i, msg in enumerate(messages):
+        # 只记录本轮新增的消息：本轮请求延续上一轮的对话时，跳过已记录的前缀
+        new_messages = messages
+        if self._last_messages and messages[:len(self._last_messages)] == self._last_messages:
+            new_messages = messages[len(self._last_messages):]
+        self.conversation_history.extend(new_messages)
+        
+        # 记录每条新消息
+        first_index = len(messages) - len(new_messages)
+        for i, msg in enumerate(new_messages, first_index):
             self.detailed_logger.info(f"消息 {i+1} (角色: {msg['role']}):")
             self.detailed_logger.info(f"{'-'*40}")
             self.detailed_logger.info(msg['content'])
             self.detailed_logger.info("")
         
-        # 记录会话历史
-        if len(self.conversation_history) == 0:
-            # 首次调用，记录所有消息
-            self.conversation_history.extend(messages)
-        else:
-            # 后续调用，只记录新消息（避免重复）
-            last_user_msg = next((i for i in reversed(range(len(self.conversation_history))) 
-                                if self.conversation_history[i]["role"] == "user"), None)
-            
-            if last_user_msg is not None and last_user_msg < len(self.conversation_history) - 1:
-                # 有新消息需要添加
-                self.conversation_history.extend(messages[-(len(messages) - last_user_msg - 1):])
-            else:
-                # 添加所有新消息
-                self.conversation_history.extend(messages)
-        
-        # 保存当前对话历史到日志文件
-        self._save_conversation()
-        
         while retry_count < max_retries:
             try:
                 logging.info(f"开始API调用 (尝试 {retry_count+1}/{max_retries})")
                 self.detailed_logger.info(f"开始API调用 (尝试 {retry_count+1}/{max_retries})")
                 
                 # 添加超时设置
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=temperature,
-                    timeout=timeout
-                )
+                request_start = time.time()
+                with tracer.span(f"llm:{self.trace_name}", "llm", model=self.model_name, attempt=retry_count + 1) as span:
+                    response = self.guard.call(lambda: self.client.chat.completions.create(
+                        model=self.model_name,
+                        messages=messages,
+                        temperature=temperature,
+                        timeout=timeout
+                    ), deadline_at)
+                    span.set(tokens_in=response.usage.prompt_tokens, tokens_out=response.usage.completion_tokens, outcome="ok")
                 
                 # 记录Token使用情况
-                self.total_tokens_in += response.usage.prompt_tokens
-                self.total_tokens_out += response.usage.completion_tokens
-                self.call_count += 1
+                self._record_usage(response.usage, time.time() - request_start)
                 
                 content = response.choices[0].message.content.strip()
                 logging.info(f"API调用成功，返回内容长度: {len(content)}")
@@ -141,23 +139,24 @@ class GPT:
                         tool_calls.append(f"GET_DEPENDENCY_C_CODE({call})")
                         self.detailed_logger.info(f"调用: GET_DEPENDENCY_C_CODE({call})")
                 
-                # 添加模型回复到对话历史
-                self.conversation_history.append({
-                    "role": "assistant", 
-                    "content": content,
-                    "metadata": {
-                        "tokens_in": response.usage.prompt_tokens,
-                        "tokens_out": response.usage.completion_tokens,
-                        "tool_calls": tool_calls,
-                        "timestamp": datetime.now().isoformat()
-                    }
+                # 添加模型回复到对话历史，并追加本轮的对话日志
+                self.conversation_history.append({"role": "assistant", "content": content})
+                self._last_messages = list(messages) + [{"role": "assistant", "content": content}]
+                self._log_turn(new_messages, content, {
+                    "tokens_in": response.usage.prompt_tokens,
+                    "tokens_out": response.usage.completion_tokens,
+                    "tool_calls": tool_calls,
+                    "latency": round(time.time() - request_start, 3)
                 })
                 
-                # 保存更新后的对话历史
-                self._save_conversation()
-                
                 return content
             
+            except (CircuitOpenError, DeadlineExceededError, CassetteMissError) as e:
+                # 熔断、超过截止时间或回放未命中，不再重试
+                logging.warning(f"API调用中止: {e}")
+                self.detailed_logger.warning(f"API调用中止: {e}")
+                raise
+            
             except (requests.exceptions.RequestException, requests.exceptions.Timeout) as e:
                 retry_count += 1
                 wait_time = 2 ** retry_count  # 指数退避
@@ -167,13 +166,18 @@ class GPT:
                 if retry_count < max_retries:
                     logging.info(f"等待 {wait_time} 秒后重试...")
                     self.detailed_logger.info(f"等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
+                    self.guard.backoff(wait_time, deadline_at)
                 else:
                     logging.error(f"网络请求失败，达到最大重试次数: {e}")
                     self.detailed_logger.error(f"网络请求失败，达到最大重试次数: {e}")
                     raise RuntimeError(f"API网络请求失败: {e}")
             
             except Exception as e:
+                # 模型或路径不存在（包括本地回放服务未命中）不是暂时性错误，不重试
+                if getattr(e, "status_code", None) == 404:
+                    self.detailed_logger.error(f"API调用失败: {type(e).__name__}: {e}")
+                    raise RuntimeError(f"API调用失败: {type(e).__name__}: {e}")
+                
                 retry_count += 1
                 wait_time = 2 ** retry_count  # 指数退避
                 logging.warning(f"API调用失败 (尝试 {retry_count}/{max_retries}): {type(e).__name__}: {e}")
@@ -182,7 +186,7 @@ class GPT:
                 if retry_count < max_retries:
                     logging.info(f"等待 {wait_time} 秒后重试...")
                     self.detailed_logger.info(f"等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
+                    self.guard.backoff(wait_time, deadline_at)
                 else:
                     logging.error(f"达到最大重试次数。错误类型: {type(e).__name__}, 错误信息: {e}")
                     self.detailed_logger.error(f"达到最大重试次数。错误类型: {type(e).__name__}, 错误信息: {e}")
@@ -194,28 +198,17 @@ class GPT:
                     else:
                         raise RuntimeError(f"API调用失败: {type(e).__name__}: {e}")
     
-    def _save_conversation(self):
-        """保存当前对话历史到日志文件"""
-        try:
-            # 创建对话记录文件
-            log_filename = f"conversation_{self.session_id}.json"
-            log_path = os.path.join(self.log_dir, log_filename)
-            
-            # 保存为JSON格式
-            with open(log_path, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "session_id": self.session_id,
-                    "model": self.model_name,
-                    "timestamp": datetime.now().isoformat(),
-                    "stats": self.get_stats(),
-                    "turn_count": self.turn_count,
-                    "conversation": self.conversation_history
-                }, f, ensure_ascii=False, indent=2)
-                
-            logging.debug(f"对话历史已保存到: {log_path}")
-        except Exception as e:
-            logging.error(f"保存对话历史失败: {e}")
-            self.detailed_logger.error(f"保存对话历史失败: {e}")
+    def _log_turn(self, messages, content, metadata):
+        """追加一条本轮对话记录（只入队，由后台线程写入）"""
+        self.conversation_log.append({
+            "session_id": self.session_id,
+            "model": self.model_name,
+            "turn": self.turn_count,
+            "timestamp": datetime.now().isoformat(),
+            "messages": messages,
+            "response": content,
+            **metadata
+        })
     
     def log_tool_response(self, tool_name, args, response):
         """记录工具调用的响应"""
@@ -226,11 +219,32 @@ class GPT:
         self.detailed_logger.info(f"{'='*30}")
         self.detailed_logger.info(f"响应:\n{response}")
     
+    def _record_usage(self, usage, elapsed):
+        """记录一次请求的token用量和耗时，缓存命中数来自 usage.prompt_tokens_details.cached_tokens"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        self.total_tokens_in += usage.prompt_tokens
+        self.total_tokens_out += usage.completion_tokens
+        self.total_cached_tokens += cached
+        self.call_count += 1
+        if cached:
+            self.cached_calls += 1
+            self.latency_cached += elapsed
+        else:
+            self.latency_uncached += elapsed
+    
     def get_stats(self):
         """返回API使用统计"""
+        uncached_calls = self.call_count - self.cached_calls
         return {
             "calls": self.call_count,
             "tokens_in": self.total_tokens_in,
             "tokens_out": self.total_tokens_out,
-            "total_tokens": self.total_tokens_in + self.total_tokens_out
+            "total_tokens": self.total_tokens_in + self.total_tokens_out,
+            "cached_tokens": self.total_cached_tokens,
+            "cache_hit_rate": f"{(self.total_cached_tokens / self.total_tokens_in * 100):.2f}%" if self.total_tokens_in else "0%",
+            "cached_calls": self.cached_calls,
+            "avg_latency_cached": round(self.latency_cached / self.cached_calls, 3) if self.cached_calls else None,
+            "avg_latency_uncached": round(self.latency_uncached / uncached_calls, 3) if uncached_calls else None,
+            **self.guard.get_stats()
         } 
\ No newline at end of file
@@ -2,6 +2,8 @@ import os
 import logging
 from datetime import datetime
 
+from sig_utils.async_logging import configure_logger
+
 # 配置日志
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -26,30 +28,9 @@ class Logger:
         Returns:
             配置好的日志器
         """
-        logger = logging.getLogger(name)
-        logger.setLevel(logging.DEBUG)
-        logger.propagate = False  # 禁止日志向上传播到root logger
-        
-        # 确保处理器不会重复添加
-        if not logger.handlers:
-            # 文件输出
-            if file_output:
-                file_handler = logging.FileHandler(
-                    os.path.join(LOG_DIR, f"{name}.log"),
-                    encoding="utf-8",
-                    mode='w'  # 使用'w'模式，每次运行覆盖之前的日志
-                )
-                file_handler.setLevel(logging.DEBUG)
-                formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-                file_handler.setFormatter(formatter)
-                logger.addHandler(file_handler)
-            
-            # 控制台输出
-            if console_output:
-                console_handler = logging.StreamHandler()
-                console_handler.setLevel(logging.INFO)
-                formatter = logging.Formatter('%(levelname)s: %(message)s')
-                console_handler.setFormatter(formatter)
-                logger.addHandler(console_handler)
+        # 日志记录只放入队列，由后台线程写入按大小轮转并压缩的文件
+        log_path = os.path.join(LOG_DIR, f"{name}.log") if file_output else None
+        logger = configure_logger(logging.getLogger(name), log_path, console_output,
+                                  console_format='%(levelname)s: %(message)s')
                 
         return logger 
\ No newline at end of file
@@ -3,6 +3,8 @@ import os
 import json
 import re
 
+from sig_utils.tracing import tracer
+
 # 配置Clang库路径
 clang.cindex.Config.set_library_path('/opt/homebrew/opt/llvm/lib')
 PROJECT_ROOT = '/Users/ormete/PycharmCode/gpt3.5_api/cParser/zopfli'
@@ -20,6 +22,7 @@ class CParser:
             '-std=c11',
         ]
 
+    @tracer.traced("parse_file", "parse", item_arg="filepath")
     def parse_file(self, filepath):
         """解析单个文件，返回其架构信息"""
         tu = self.index.parse(filepath, args=self.compile_args)
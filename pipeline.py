@@ -0,0 +1,442 @@
+import json
+import os
+import sys
+import copy
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 导入三个阶段的处理器
+from c2rust_converter_new import Logger, C2RustConverter
+from function_summary_generator import FunctionSummaryGenerator
+from function_implementation_generator import FunctionImplementationGenerator
+from sig_utils.dependency_graph import DependencyGraph, root_closure
+from sig_utils.ready_queue import ReadyQueue
+from sig_utils.fingerprint import carry_over_stage, stamp_fingerprint
+from sig_utils.model_router import ModelRouter
+from sig_utils.llm_cassette import open_cassette
+from sig_utils.tracing import tracer
+from sig_utils.metrics import run_metrics
+from sig_utils.budget import run_budget
+from sig_utils.run_history import describe, record_run
+from sig_utils.translation_memory import TranslationMemory
+
+# 配置目录
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# 配置日志
+main_logger = Logger("pipeline_main")
+
+# 阶段名称，顺序即派发优先级：优先推进下游阶段，尽早产出完整实现的函数
+STAGE_IMPLEMENT = "implement"
+STAGE_SUMMARY = "summary"
+STAGE_CONVERT = "convert"
+
+
+class StreamingPipeline:
+    """
+    流式跨阶段流水线：签名转换 → 函数总结 → 函数实现
+
+    三个阶段不再是先后执行的批处理程序：
+    1. 签名转换按依赖图的就绪队列调度
+    2. 函数签名转换完成且其依赖函数已完成总结后，立即进入总结阶段
+    3. 函数总结完成且其依赖函数已完成实现后，立即进入实现阶段
+    三个阶段共享同一组工作线程，结果统一在主线程写回同一份架构数据。
+    """
+
+    def __init__(self, api_key, max_workers=4, enable_compile_check=False, model="gpt-4o", speculative_candidates=1,
+                 request_options=None, router=None, translation_memory=None):
+        main_logger.info("初始化流式流水线")
+        self.max_workers = max(1, max_workers)
+        # 三个阶段共用一个模型路由器，同一角色（如审核）在各阶段使用同一组后端
+        self.router = router or ModelRouter(api_key, {"default": {"model": model}}, request_options=request_options)
+        self.converter = C2RustConverter(api_key, enable_compile_check, max_workers=self.max_workers,
+                                         speculative_candidates=speculative_candidates, router=self.router,
+                                         translation_memory=translation_memory)
+        self.summarizer = FunctionSummaryGenerator(api_key, router=self.router)
+        self.implementer = FunctionImplementationGenerator(api_key, speculative_candidates=speculative_candidates,
+                                                           router=self.router)
+
+    def run(self, input_path, output_path, max_items=None, roots=None):
+        """
+        运行流水线，返回包含签名、总结和实现的架构数据
+
+        Args:
+            roots: 入口函数或类型名称列表，三个阶段都只处理其依赖闭包，其余项目保持未处理；为空时处理全部项目
+        """
+        main_logger.info("="*80)
+        main_logger.info(f"开始流式处理架构文件: {input_path}")
+        main_logger.info("="*80)
+
+        with open(input_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.converter._reclassify_function_items(data)
+
+        # 输出文件已存在时从中断处继续：逐阶段沿用指纹未变化的结果，
+        # 变化项目及其反向依赖闭包在对应阶段及后续阶段重新处理
+        if os.path.exists(output_path):
+            main_logger.info(f"检测到现有输出文件: {output_path}，沿用未变化的结果")
+            with open(output_path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+            for stage in ("conversion", "summary", "implementation"):
+                carried = carry_over_stage(data, previous, stage)
+                main_logger.info(f"[{stage}] 沿用 {carried['carried']} 个, 输入变化 {carried['changed']} 个, 作废 {carried['invalidated']} 个")
+
+        # 签名转换：全部项目的依赖图
+        graph = DependencyGraph(data)
+        components = graph.strongly_connected_components()
+
+        # 总结与实现：函数调用关系图，两个阶段各自维护就绪队列
+        func_graph = DependencyGraph(data, kinds=["functions"])
+        func_components = func_graph.strongly_connected_components()
+
+        # 指定入口时各阶段只处理其依赖闭包（闭包对依赖封闭，分量整体在闭包内或闭包外）
+        closure = root_closure(data, roots, graph)
+        scope = set(graph.nodes) if closure is None else closure
+        if closure is not None:
+            components = [component for component in components if component[0] in closure]
+            func_components = [component for component in func_components if component[0] in closure]
+            main_logger.info(f"入口 {', '.join(roots)} 的依赖闭包: {len(closure)} 个项目（其中 {len(func_components)} 个函数分量），"
+                             f"其余 {len(graph.nodes) - len(closure)} 个项目本次不处理")
+
+        convert_queue = ReadyQueue(graph, components, graph.critical_path_priority(components))
+        func_priorities = func_graph.critical_path_priority(func_components)
+        queues = {
+            STAGE_CONVERT: convert_queue,
+            STAGE_SUMMARY: ReadyQueue(func_graph, func_components, func_priorities),
+            STAGE_IMPLEMENT: ReadyQueue(func_graph, func_components, func_priorities)
+        }
+        for stage, queue in queues.items():
+            run_metrics.track_remaining(stage, queue.remaining)
+
+        # 已转换成功的项目直接标记为已处理
+        processed_items = set()
+        for node_id in graph.nodes:
+            if graph.get_item(node_id).get("conversion_status") == "success":
+                processed_items.add(node_id)
+
+        self.state = {
+            "data": data,
+            "graph": graph,
+            "components": components,
+            "func_graph": func_graph,
+            "func_components": func_components,
+            "processed_items": processed_items,
+            "summarized": set(),    # 已完成总结阶段的函数（无论成功失败）
+            "implemented": set(),   # 已成功实现的函数
+            "parked": {STAGE_SUMMARY: [], STAGE_IMPLEMENT: []},  # 依赖已就绪但上一阶段尚未完成的分量
+            "progress": {
+                "item_count": 0,
+                "max_to_process": len(scope - processed_items),
+                "success": 0,
+                "skipped": 0,
+                "failed": 0
+            },
+            "counts": {STAGE_SUMMARY: 0, STAGE_IMPLEMENT: 0},
+            "output_path": output_path
+        }
+
+        running = {}  # future -> (阶段, 分量索引, 任务)
+        dispatched = 0
+        stop_converting = False
+        budget_stopped = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                while not budget_stopped and len(running) < self.max_workers:
+                    run_budget.adapt(self.router, queues.values(), main_logger.warning)
+                    if run_budget.exhausted():
+                        main_logger.warning(f"预算已用尽（{run_budget.describe()}），停止派发，等待进行中的任务完成")
+                        budget_stopped = True
+                        break
+                    picked = self._next_task(queues, stop_converting, dispatched)
+                    if picked is None:
+                        break
+                    stage, index, task = picked
+                    if stage == STAGE_CONVERT:
+                        dispatched += len(task["members"])
+                        if max_items and dispatched >= max_items:
+                            main_logger.info(f"已达到最大处理数量 {max_items}，停止派发新的转换任务")
+                            stop_converting = True
+
+                    # 多线程时工作线程只读取提交时的数据快照，避免与主线程写回结果冲突
+                    task_data = copy.deepcopy(data) if self.max_workers > 1 else data
+                    future = executor.submit(self._run_stage_task, stage, task, task_data)
+                    running[future] = (stage, index, task)
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, index, task = running.pop(future)
+                    self._apply_stage_result(stage, index, task, future.result())
+                    queues[stage].complete(index)
+
+        self.converter._save_checkpoint(data, output_path)
+
+        progress = self.state["progress"]
+        main_logger.info("="*80)
+        main_logger.info(f"签名转换: 成功={progress['success']}, 跳过={progress['skipped']}, 失败={progress['failed']}")
+        main_logger.info(f"函数总结: {self.state['counts'][STAGE_SUMMARY]} 个, 函数实现: {self.state['counts'][STAGE_IMPLEMENT]} 个, 其中成功实现 {len(self.state['implemented'])} 个")
+        if self.converter.translation_memory:
+            main_logger.info(f"翻译记忆: {self.converter.translation_memory.describe()}")
+        for line in self.router.summary_lines():
+            main_logger.info(f"模型路由 {line}")
+        main_logger.info(f"结果已保存到: {output_path}")
+        main_logger.info("="*80)
+        return data
+
+    def _next_task(self, queues, stop_converting, dispatched):
+        """按阶段优先级选出下一个可执行的任务，没有可执行任务时返回None"""
+        for stage in (STAGE_IMPLEMENT, STAGE_SUMMARY):
+            picked = self._next_function_task(stage, queues[stage])
+            if picked is not None:
+                return picked
+
+        if stop_converting:
+            return None
+        queue = queues[STAGE_CONVERT]
+        while len(queue):
+            index = queue.pop()
+            task = self.converter._build_task(
+                self.state["graph"], self.state["components"][index], self.state["data"],
+                self.state["processed_items"], self.state["progress"], dispatched
+            )
+            if task is not None:
+                return STAGE_CONVERT, index, task
+            queue.complete(index)
+        return None
+
+    def _next_function_task(self, stage, queue):
+        """从总结或实现阶段取出下一个任务，上一阶段尚未完成的分量暂存等待"""
+        parked = self.state["parked"][stage]
+        while True:
+            # 先检查之前暂存的分量
+            index = None
+            for i, candidate in enumerate(parked):
+                if self._stage_precondition_met(stage, candidate):
+                    index = parked.pop(i)
+                    break
+            if index is None:
+                if not len(queue):
+                    return None
+                index = queue.pop()
+                if not self._stage_precondition_met(stage, index):
+                    parked.append(index)
+                    continue
+
+            task = self._build_function_task(stage, index)
+            if task is not None:
+                return stage, index, task
+            queue.complete(index)
+
+    def _stage_precondition_met(self, stage, index):
+        """分量的所有成员是否已完成上一阶段"""
+        for func_id in self.state["func_components"][index]:
+            if stage == STAGE_SUMMARY:
+                # 签名转换对应的节点ID与函数图一致
+                if func_id not in self.state["processed_items"]:
+                    return False
+            elif func_id not in self.state["summarized"]:
+                return False
+        return True
+
+    def _build_function_task(self, stage, index):
+        """为总结或实现阶段准备任务，没有需要处理的成员时返回None"""
+        data = self.state["data"]
+        func_graph = self.state["func_graph"]
+        component = self.state["func_components"][index]
+        members = []
+
+        for func_id in component:
+            file_name, _, func_name = func_graph.nodes[func_id]
+            func_info = func_graph.get_item(func_id)
+
+            if stage == STAGE_SUMMARY:
+                if func_info.get("summary_status") == "success" and "function_summary" in func_info:
+                    self.state["summarized"].add(func_id)
+                    continue
+                if func_info.get("conversion_status") != "success" or not func_info.get("rust_signature") or not func_info.get("full_text"):
+                    main_logger.warning(f"函数缺少必要信息，跳过总结: {func_id}")
+                    self.state["summarized"].add(func_id)
+                    continue
+                members.append({
+                    "func_id": func_id,
+                    "func_name": func_name,
+                    "item": func_info,
+                    "dependency_info": self.summarizer._collect_dependency_info(data, func_info.get("dependencies", {}))
+                })
+            else:
+                if func_info.get("implementation_status") == "success":
+                    self.state["implemented"].add(func_id)
+                    continue
+                if not self.implementer._has_required_info(func_info):
+                    continue
+                # 依赖的函数必须已成功实现，互相递归的函数之间不做此要求
+                if not self.implementer._check_dependencies_implemented(
+                    func_info.get("dependencies", {}), self.state["implemented"] | set(component)
+                ):
+                    main_logger.info(f"函数 {func_name} 的依赖项未能全部实现，跳过")
+                    func_info["implementation_status"] = "skipped"
+                    func_info["reason"] = "依赖项未能全部实现"
+                    continue
+                members.append({
+                    "func_id": func_id,
+                    "func_name": func_name,
+                    "item": func_info
+                })
+
+        if not members:
+            return None
+        return {"members": members}
+
+    def _run_stage_task(self, stage, task, data):
+        """在工作线程中执行一个阶段任务，只返回结果，不修改架构数据"""
+        try:
+            if stage == STAGE_CONVERT:
+                return self.converter._run_task(task, data)
+
+            results = {}
+            for member in task["members"]:
+                if stage == STAGE_SUMMARY:
+                    results[member["func_id"]] = self.summarizer.generate_summary(
+                        member["func_id"],
+                        member["item"]["full_text"],
+                        member["item"]["rust_signature"],
+                        member["dependency_info"],
+                        max_rounds=run_budget.rounds(3)
+                    )
+                else:
+                    results[member["func_id"]] = self.implementer.implement_function(
+                        member["func_name"], member["item"], data, data
+                    )
+            return results
+        except Exception as e:
+            main_logger.error(f"{stage} 阶段任务执行出错: {str(e)}")
+            main_logger.error(traceback.format_exc())
+            return {"exception": str(e)}
+
+    def _apply_stage_result(self, stage, index, task, outcome):
+        """在主线程中写回阶段结果，并释放等待该结果的后续阶段任务"""
+        if stage == STAGE_CONVERT:
+            if "exception" in outcome:
+                outcome = {
+                    "results": {m["node_id"]: {"success": False, "exception": outcome["exception"]} for m in task["members"]},
+                    "joint": False,
+                    "elapsed": 0.0
+                }
+            self.converter._apply_task_results(
+                task, outcome, self.state["data"], self.state["processed_items"],
+                self.state["progress"], self.state["output_path"]
+            )
+
+        elif stage == STAGE_SUMMARY:
+            for member in task["members"]:
+                result = outcome.get(member["func_id"]) or {"success": False, "error": outcome.get("exception", "未知错误")}
+                self.summarizer._apply_summary_result(member["item"], result)
+                if result["success"]:
+                    stamp_fingerprint(self.state["graph"], member["func_id"], "summary")
+                self.state["summarized"].add(member["func_id"])
+                self.state["counts"][STAGE_SUMMARY] += 1
+                run_metrics.record_item(STAGE_SUMMARY, "functions", "success" if result["success"] else "failed", result.get("rounds"))
+                status = "成功" if result["success"] else "失败"
+                main_logger.info(f"📝 函数总结{status}: {member['func_id']}")
+
+        else:
+            for member in task["members"]:
+                updates = outcome.get(member["func_id"]) or {"implementation_status": "error", "reason": outcome.get("exception", "未知错误")}
+                member["item"].update(updates)
+                self.state["counts"][STAGE_IMPLEMENT] += 1
+                run_metrics.record_item(STAGE_IMPLEMENT, "functions", updates["implementation_status"],
+                                        updates.get("review_rounds", 0) + updates.get("fix_rounds", 0))
+                if updates["implementation_status"] == "success":
+                    self.state["implemented"].add(member["func_id"])
+                    stamp_fingerprint(self.state["graph"], member["func_id"], "implementation")
+
+            # 每完成一批实现保存一次，避免长时间运行中断丢失结果
+            if self.state["counts"][STAGE_IMPLEMENT] % 5 == 0:
+                self.converter._save_checkpoint(self.state["data"], self.state["output_path"])
+
+
+# 命令行接口
+def main():
+    """主程序入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="流式C到Rust转换流水线（签名 → 总结 → 实现）")
+    parser.add_argument("--input", "-i", default="merged_architecture.json", help="输入的架构JSON文件路径")
+    parser.add_argument("--output", "-o", default=os.path.join(DATA_DIR, "pipeline_architecture.json"), help="输出的结果JSON文件路径")
+    parser.add_argument("--max-items", "-m", type=int, help="最大签名转换项数，用于测试")
+    parser.add_argument("--max-workers", type=int, default=4, help="三个阶段共享的工作线程数（默认4）")
+    parser.add_argument("--api-key", "-k", help="OpenAI API密钥，如不提供则从环境变量OPENAI_API_KEY获取（--replay 时不需要）")
+    parser.add_argument("--model", default="gpt-4o", help="函数实现阶段使用的AI模型")
+    parser.add_argument("--enable-compile-check", action="store_true", help="签名转换阶段启用实时编译验证（需要安装Rust）")
+    parser.add_argument("--speculative", type=int, default=1,
+                        help="签名转换和函数实现阶段慢尾部项目（首轮未通过或规模较大）并行生成的候选数（默认1，即不启用）")
+    parser.add_argument("--deadline", type=float, help="每次大模型调用（含重试）的截止时间（秒），默认不限制")
+    parser.add_argument("--hedge", action="store_true", help="请求超过观测到的p95耗时仍未返回时发出对冲请求，使用先返回的结果")
+    parser.add_argument("--routes", help="模型路由配置JSON文件，为各角色分别指定模型、后端和回退顺序")
+    parser.add_argument("--base-url", help="覆盖所有路由的后端地址，例如本地OpenAI兼容服务 http://localhost:8000/v1")
+    parser.add_argument("--record", help="把每次大模型请求和响应录制到该JSONL文件")
+    parser.add_argument("--replay", help="从该JSONL文件回放录制的响应，不访问网络")
+    parser.add_argument("--replay-latency", action="store_true", help="回放时按录制的耗时等待")
+    parser.add_argument("--metrics", help="运行中定期把耗时分位数、token、吞吐量和预计剩余时间写入该Prometheus textfile文件")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"), help="运行结束时把本次运行的摘要追加到该历史文件（设为空字符串时不记录），用 run_report.py 对比")
+    parser.add_argument("--trace", help="记录各Agent请求、编译、检查点写入和逐项处理的耗时，导出为Chrome trace JSON到该路径")
+    parser.add_argument("--max-tokens", type=int, help="本次运行的token上限，用尽后不再派发新任务（可参考 plan_run.py 的估算）")
+    parser.add_argument("--max-cost", type=float, help="本次运行的估算成本上限（美元），用尽后不再派发新任务")
+    parser.add_argument("--time-limit", type=float, help="本次运行的时长上限（秒），与token/成本上限一起决定降级档位，到时不再派发新项目")
+    parser.add_argument("--roots", nargs="+", help="入口函数或类型名称（如 ZopfliDeflatePart ZopfliOptions，也可以写 文件::名称 或完整项目ID），只处理它们的传递依赖闭包，其余项目保持未处理")
+    parser.add_argument("--translation-memory",
+                        help="跨项目翻译记忆（SQLite）路径：签名转换阶段复用规范化C代码与依赖签名相同的项目此前通过验证的结果（如 data/translation_memory.db，默认不使用）")
+
+    args = parser.parse_args()
+
+    api_key = args.api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        if not args.replay:
+            main_logger.error("未提供API密钥，请通过--api-key参数或OPENAI_API_KEY环境变量提供")
+            sys.exit(1)
+        api_key = "replay"  # 回放不访问网络，客户端只需要一个占位密钥
+
+    memory = TranslationMemory(args.translation_memory) if args.translation_memory else None
+
+    try:
+        if args.trace:
+            tracer.enable()
+        run_metrics.start(args.metrics)
+        cassette = open_cassette(args.record, args.replay, args.replay_latency)
+        router = ModelRouter.from_file(args.routes, api_key, args.base_url,
+                                       request_options={"deadline": args.deadline, "hedge": args.hedge, "cassette": cassette},
+                                       default_model=args.model)
+        run_budget.configure(args.max_tokens, args.max_cost, router.prices, args.time_limit)
+        pipeline = StreamingPipeline(api_key, args.max_workers, args.enable_compile_check,
+                                     speculative_candidates=args.speculative, router=router,
+                                     translation_memory=memory)
+        pipeline.run(args.input, args.output, args.max_items, args.roots)
+        if run_budget.limited:
+            main_logger.info(f"预算用量: {run_budget.describe()}")
+        record = record_run(args.history, "pipeline", vars(args), run_metrics.snapshot(), router.report())
+        if record:
+            main_logger.info(f"运行记录 {describe(record)}")
+        if cassette is not None:
+            main_logger.info(f"cassette [{cassette.mode}] {cassette.path}: {cassette.get_stats()}")
+    except Exception as e:
+        main_logger.error(f"程序执行出错: {str(e)}")
+        main_logger.error(traceback.format_exc())
+        sys.exit(1)
+    finally:
+        if memory is not None:
+            memory.close()
+        if args.trace:
+            tracer.export(args.trace, main_logger.info)
+        run_metrics.stop()
+        if args.metrics:
+            for line in run_metrics.summary_lines():
+                main_logger.info(f"运行指标 {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+运行规划
+
+运行前估算一次转换的token、成本和耗时：
+1. 读取架构JSON，按项目的 full_text 加上依赖项上下文（按提示预算截取）估算每项的提示token，
+   已完成的项目跳过，规则转换可以处理的宏、类型定义和结构体不计大模型调用；指定入口时只估算其依赖闭包
+2. 每种项目的调用次数、输出token、单次调用耗时和轮数取自运行历史（data/run_history.jsonl），没有历史时使用默认值；
+   轮数用于估算多轮对话中每次调用额外携带的历史token
+3. 按模型路由中各阶段主角色的首选模型价格估算成本
+4. 按给定的工作线程数模拟就绪队列调度（关键路径优先）估算各阶段耗时，再与速率限制（每分钟请求数/token数）下的最短耗时取较大值
+
+估算结果可作为 --max-tokens / --max-cost 预算上限的参考，运行中由 sig_utils.budget 执行上限。
+
+示例：
+    python plan_run.py -i merged_architecture.json --max-workers 8 --rpm 60 --routes routes.json
+"""
+
+import heapq
+import json
+import os
+import sys
+from typing import Callable, Dict, List, Optional
+
+from sig_utils.dependency_graph import DependencyGraph, root_closure
+from sig_utils.local_converter import LocalConverter
+from sig_utils.model_router import ModelRouter
+from sig_utils.prompt_budget import PromptBudget, TokenCounter
+from sig_utils.ready_queue import ReadyQueue
+from sig_utils.run_history import RunHistory
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+STAGES = ("convert", "summary", "implement")
+
+# 各阶段的主要角色，成本按该角色首选模型的价格估算
+STAGE_ROLE = {"convert": "converter", "summary": "summariser", "implement": "implementer"}
+
+# 没有运行历史时的默认值：每项调用次数、每次调用的输出token、每次调用耗时（秒）、每项轮数
+DEFAULT_PROFILE = {
+    "convert": {"calls_per_item": 3.0, "tokens_out_per_call": 600, "seconds_per_call": 8.0, "rounds_per_item": 1.5},
+    "summary": {"calls_per_item": 2.0, "tokens_out_per_call": 400, "seconds_per_call": 6.0, "rounds_per_item": 1.2},
+    "implement": {"calls_per_item": 4.0, "tokens_out_per_call": 900, "seconds_per_call": 12.0, "rounds_per_item": 2.0}
+}
+
+# 提示模板、规则说明和输出格式的固定token开销（每次调用）
+PROMPT_OVERHEAD_TOKENS = {"convert": 1500, "summary": 800, "implement": 2000}
+
+
+def load_profiles(history_path: Optional[str], last_runs: int = 20) -> Dict[str, Dict]:
+    """
+    从运行历史汇总每种项目的画像
+
+    Returns:
+        Dict: "stage/kind" -> {"calls_per_item", "tokens_out_per_call", "seconds_per_call", "rounds_per_item", "items"}，
+              按项目数加权平均；回放的基准测试记录不含真实耗时，不参与汇总
+    """
+    if not history_path:
+        return {}
+    records = [record for record in RunHistory(history_path).load() if record.get("stage") != "benchmark"]
+    sums = {}
+    for record in records[-last_runs:]:
+        for key, row in (record.get("kinds") or {}).items():
+            items = row.get("items") or 0
+            if not items or not row.get("calls_per_item"):
+                continue
+            entry = sums.setdefault(key, {"items": 0, "calls": 0.0, "tokens_out": 0.0, "seconds": 0.0,
+                                          "timed_calls": 0.0, "rounds": 0.0, "rounded_items": 0})
+            calls = row["calls_per_item"] * items
+            entry["items"] += items
+            entry["calls"] += calls
+            entry["tokens_out"] += (row.get("tokens_out_per_item") or 0) * items
+            if row.get("seconds_per_call"):
+                entry["seconds"] += row["seconds_per_call"] * calls
+                entry["timed_calls"] += calls
+            if row.get("rounds_per_item"):
+                entry["rounds"] += row["rounds_per_item"] * items
+                entry["rounded_items"] += items
+
+    profiles = {}
+    for key, entry in sums.items():
+        default = DEFAULT_PROFILE.get(key.split("/")[0], DEFAULT_PROFILE["convert"])
+        profiles[key] = {
+            "items": entry["items"],
+            "calls_per_item": round(entry["calls"] / entry["items"], 3),
+            "tokens_out_per_call": round(entry["tokens_out"] / entry["calls"], 1),
+            "seconds_per_call": round(entry["seconds"] / entry["timed_calls"], 3) if entry["timed_calls"] else default["seconds_per_call"],
+            "rounds_per_item": round(entry["rounds"] / entry["rounded_items"], 3) if entry["rounded_items"] else default["rounds_per_item"]
+        }
+    return profiles
+
+
+def simulate_makespan(graph: DependencyGraph, durations: Dict[str, float], workers: int) -> float:
+    """
+    模拟就绪队列调度的总耗时
+
+    分量按关键路径优先级（以预计耗时加权）出队，最多workers个分量同时进行，
+    分量耗时为其中各项目耗时之和（循环依赖的项目作为一个整体转换）。
+    """
+    components = graph.strongly_connected_components()
+    priorities = graph.critical_path_priority(components, lambda node_id: durations.get(node_id, 0.0))
+    queue = ReadyQueue(graph, components, priorities)
+    running = []  # (完成时间, 分量索引)
+    now = 0.0
+    while True:
+        while len(running) < max(1, workers) and len(queue):
+            index = queue.pop()
+            finish = now + sum(durations.get(node_id, 0.0) for node_id in components[index])
+            heapq.heappush(running, (finish, index))
+        if not running:
+            return now
+        now, index = heapq.heappop(running)
+        queue.complete(index)
+
+
+def _pending(stage: str, kind: str, item: Dict) -> bool:
+    """项目在该阶段是否还需要处理"""
+    if stage == "convert":
+        return item.get("conversion_status") != "success"
+    if kind != "functions":
+        return False
+    if stage == "summary":
+        return "function_summary" not in item
+    return item.get("implementation_status") != "success"
+
+
+def plan_run(data: Dict, profiles: Dict[str, Dict], price_of: Callable[[str], Optional[Dict]], workers: int = 1,
+             rpm: Optional[float] = None, tpm: Optional[float] = None, stages=STAGES,
+             counter: Optional[TokenCounter] = None, top: int = 10, roots: Optional[List[str]] = None) -> Dict:
+    """
+    估算一次运行
+
+    Args:
+        data: 架构数据（file -> kind -> item），已完成的项目不计入
+        profiles: load_profiles() 的结果
+        price_of: 阶段 -> 模型价格 {"input", "output"}（每百万token），未知时返回None
+        workers: 工作线程数
+        rpm: 每分钟请求数限制
+        tpm: 每分钟token数限制
+        top: 报告中列出的提示最大的项目数
+        roots: 入口函数或类型名称，只估算其依赖闭包
+
+    Returns:
+        Dict: 各阶段和合计的项目数、调用次数、token、成本和耗时
+    """
+    counter = counter or TokenCounter()
+    budget = PromptBudget(counter=counter)
+    local_converter = LocalConverter()
+    graphs = {"convert": DependencyGraph(data)}
+    graphs["summary"] = graphs["implement"] = DependencyGraph(data, kinds=["functions"])
+    full_graph = graphs["convert"]
+    closure = root_closure(data, roots, full_graph)
+
+    report = {"workers": workers, "rpm": rpm, "tpm": tpm, "roots": roots, "stages": {}, "largest_prompts": []}
+    largest = []
+    for stage in stages:
+        graph = graphs[stage]
+        default = DEFAULT_PROFILE[stage]
+        price = price_of(stage)
+        totals = {"items": 0, "llm_items": 0, "calls": 0.0, "tokens_in": 0, "tokens_out": 0}
+        durations = {}
+        sources = set()
+        for node_id, (file_name, kind, item_name) in graph.nodes.items():
+            item = graph.get_item(node_id)
+            if closure is not None and node_id not in closure:
+                continue
+            if not _pending(stage, kind, item):
+                continue
+            totals["items"] += 1
+            c_code = item.get("full_text", "")
+            if stage == "convert" and local_converter.convert(kind, c_code):
+                continue
+
+            profile = profiles.get(f"{stage}/{kind}")
+            sources.add("history" if profile else "default")
+            profile = profile or default
+            snippets = {dep: full_graph.get_item(dep).get("full_text", "") for dep in full_graph.dependencies_of(node_id)}
+            fitted, _ = budget.fit_dependencies(snippets, c_code)
+            prompt_tokens = (PROMPT_OVERHEAD_TOKENS[stage] + counter.count(c_code)
+                             + sum(counter.count(text) for text in fitted.values()))
+
+            # 每次调用重发完整提示；第2轮起还带上之前各轮的回复作为对话历史，按轮数估算平均携带的历史，
+            # 不超过提示预算压缩后保留的历史token数
+            calls = profile["calls_per_item"]
+            rounds = max(1.0, profile["rounds_per_item"])
+            round_output = profile["tokens_out_per_call"] * calls / rounds
+            history_tokens = min(round_output * (rounds - 1) / 2, budget.history_tokens)
+            totals["llm_items"] += 1
+            totals["calls"] += calls
+            totals["tokens_in"] += int((prompt_tokens + history_tokens) * calls)
+            totals["tokens_out"] += int(profile["tokens_out_per_call"] * calls)
+            durations[node_id] = calls * profile["seconds_per_call"]
+            largest.append((prompt_tokens, stage, node_id))
+
+        critical_path = simulate_makespan(graph, durations, workers)
+        rate_bounds = [0.0]
+        if rpm:
+            rate_bounds.append(totals["calls"] / rpm * 60)
+        if tpm:
+            rate_bounds.append((totals["tokens_in"] + totals["tokens_out"]) / tpm * 60)
+        cost = None
+        if price is not None:
+            cost = round((totals["tokens_in"] * price["input"] + totals["tokens_out"] * price["output"]) / 1_000_000, 4)
+        report["stages"][stage] = dict(
+            totals,
+            calls=round(totals["calls"], 1),
+            cost=cost,
+            scheduled_seconds=round(critical_path, 1),
+            rate_limited_seconds=round(max(rate_bounds), 1),
+            makespan_seconds=round(max(critical_path, *rate_bounds), 1),
+            profile="+".join(sorted(sources)) or "-"
+        )
+
+    rows = report["stages"].values()
+    costs = [row["cost"] for row in rows]
+    report["total"] = {
+        "items": sum(row["items"] for row in rows),
+        "calls": round(sum(row["calls"] for row in rows), 1),
+        "tokens_in": sum(row["tokens_in"] for row in rows),
+        "tokens_out": sum(row["tokens_out"] for row in rows),
+        # 未知价格的阶段不计入，此时成本为下限
+        "cost": round(sum(cost for cost in costs if cost is not None), 4) if any(cost is not None for cost in costs) else None,
+        "cost_complete": all(cost is not None for cost in costs),
+        # 各阶段依次运行的耗时；流式流水线中各阶段重叠，实际更短
+        "makespan_seconds": round(sum(row["makespan_seconds"] for row in rows), 1)
+    }
+    largest.sort(reverse=True)
+    report["largest_prompts"] = [{"stage": stage, "item": node_id, "prompt_tokens": tokens}
+                                 for tokens, stage, node_id in largest[:top]]
+    return report
+
+
+def main():
+    """主程序入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="运行前估算token、成本和耗时")
+    parser.add_argument("--input", "-i", default="merged_architecture.json", help="架构JSON文件路径（可以是断点续跑的输出文件）")
+    parser.add_argument("--stages", default=",".join(STAGES), help="估算的阶段，逗号分隔（默认 convert,summary,implement）")
+    parser.add_argument("--max-workers", type=int, default=1, help="工作线程数（默认1）")
+    parser.add_argument("--rpm", type=float, help="每分钟请求数限制")
+    parser.add_argument("--tpm", type=float, help="每分钟token数限制")
+    parser.add_argument("--routes", help="模型路由配置JSON文件，用于确定各阶段的模型和价格")
+    parser.add_argument("--model", default="gpt-4o", help="未配置路由时使用的模型")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"), help="运行历史文件，用于取每种项目的调用次数和轮数")
+    parser.add_argument("--roots", nargs="+", help="入口函数或类型名称，只估算它们的传递依赖闭包（与转换脚本的 --roots 相同）")
+    parser.add_argument("--margin", type=float, default=0.2, help="建议预算上限在估算值上留出的余量比例（默认0.2）")
+    parser.add_argument("--output", "-o", default=os.path.join(DATA_DIR, "run_plan.json"), help="估算报告输出路径")
+
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        print(f"未知的阶段: {', '.join(unknown)}（可选: {', '.join(STAGES)}）")
+        sys.exit(2)
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    router = ModelRouter.from_file(args.routes, api_key="", default_model=args.model)
+
+    def price_of(stage):
+        return router.prices.get(router.route(STAGE_ROLE[stage])[0]["model"])
+
+    profiles = load_profiles(args.history)
+    try:
+        report = plan_run(data, profiles, price_of, args.max_workers, args.rpm, args.tpm, stages, TokenCounter(args.model),
+                          roots=args.roots)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    total = report["total"]
+    report["suggested_budget"] = {
+        "max_tokens": int((total["tokens_in"] + total["tokens_out"]) * (1 + args.margin)),
+        "max_cost": round(total["cost"] * (1 + args.margin), 2) if total["cost"] is not None else None
+    }
+    report["profiles"] = profiles
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+
+    print(f"{'阶段':<10}{'项目':>8}{'调用':>10}{'输入token':>14}{'输出token':>12}{'成本($)':>10}{'耗时(s)':>10}  画像")
+    for stage, row in report["stages"].items():
+        cost = "-" if row["cost"] is None else row["cost"]
+        print(f"{stage:<12}{row['items']:>8}{row['calls']:>10}{row['tokens_in']:>14}{row['tokens_out']:>12}"
+              f"{cost:>10}{row['makespan_seconds']:>10}  {row['profile']}")
+    cost = "未知" if total["cost"] is None else f"${total['cost']}" + ("" if total["cost_complete"] else "（部分模型价格未知）")
+    print(f"合计: {total['items']} 项, {total['calls']} 次调用, token {total['tokens_in']}/{total['tokens_out']}, "
+          f"成本 {cost}, 耗时约 {total['makespan_seconds']}s（{args.max_workers} 个工作线程）")
+    suggested = report["suggested_budget"]
+    flags = f"--max-tokens {suggested['max_tokens']}"
+    if suggested["max_cost"] is not None:
+        flags += f" --max-cost {suggested['max_cost']}"
+    print(f"建议预算上限: {flags}")
+    print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+运行历史报告
+
+列出各阶段的历史运行，或将一次运行与基线对比，标记吞吐量、成本、token、调用次数和轮数的性能回退。
+运行记录由转换、总结、实现、流水线和基准测试脚本在运行结束时追加（默认 data/run_history.jsonl）。
+
+示例：
+    python run_report.py --list                      # 最近的运行
+    python run_report.py --stage pipeline            # 最近一次流水线运行与上一次对比
+    python run_report.py --stage benchmark --baseline a1b2c3d --threshold 0.05
+"""
+
+import json
+import os
+import sys
+
+from sig_utils.run_history import RunHistory, compare, describe
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+
+def format_value(value):
+    return "-" if value is None else str(value)
+
+
+def main():
+    """主程序入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="运行历史报告与性能回退检查")
+    parser.add_argument("--history", default=os.path.join(DATA_DIR, "run_history.jsonl"), help="运行历史文件路径")
+    parser.add_argument("--stage", default="pipeline",
+                        help="对比的命令：convert、summary、implement、pipeline、benchmark（默认pipeline）")
+    parser.add_argument("--run", default="-1", help="要检查的运行：序号（-1为最近一次）、run_id前缀或git版本（默认-1）")
+    parser.add_argument("--baseline", default="-2", help="基线运行，格式同--run（默认-2，即上一次运行）")
+    parser.add_argument("--threshold", type=float, default=0.1, help="相对变化超过该比例且变差时视为回退（默认0.1）")
+    parser.add_argument("--list", type=int, nargs="?", const=20, help="列出所有命令最近N次运行（默认20），不做对比")
+    parser.add_argument("--json", action="store_true", help="以JSON输出对比结果")
+
+    args = parser.parse_args()
+    history = RunHistory(args.history)
+
+    if args.list:
+        records = history.load()
+        for record in records[-args.list:]:
+            print(describe(record))
+        if not records:
+            print(f"没有运行记录: {args.history}")
+        return
+
+    run = history.find(args.run, args.stage)
+    baseline = history.find(args.baseline, args.stage)
+    if run is None or baseline is None:
+        print(f"找不到 [{args.stage}] 的运行或基线记录（运行: {args.run}, 基线: {args.baseline}）")
+        sys.exit(2)
+
+    result = compare(run, baseline, args.threshold)
+    if args.json:
+        print(json.dumps({"run": run["run_id"], "baseline": baseline["run_id"], **result}, indent=4, ensure_ascii=False))
+    else:
+        print(f"运行: {describe(run)}")
+        print(f"基线: {describe(baseline)}")
+        if run.get("config") != baseline.get("config"):
+            changed = sorted(key for key in set(run.get("config", {})) | set(baseline.get("config", {}))
+                             if run.get("config", {}).get(key) != baseline.get("config", {}).get(key))
+            print(f"配置差异: {', '.join(changed)}")
+        print(f"{'指标':<16}{'基线':>14}{'本次':>14}{'变化':>10}")
+        for row in result["rows"]:
+            change = f"{row['change'] * 100:+.1f}%" if row["change"] is not None else "-"
+            flag = "  ⚠️ 回退" if row["regression"] else ""
+            print(f"{row['name']:<16}{format_value(row['baseline']):>14}{format_value(row['run']):>14}{change:>10}{flag}")
+        if result["regressions"]:
+            print(f"⚠️ 性能回退（阈值 {args.threshold * 100:.0f}%）: {', '.join(result['regressions'])}")
+        else:
+            print("✅ 未发现性能回退")
+
+    # 有回退时返回非零退出码，便于在脚本中检查
+    if result["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,32 +12,71 @@ import logging
 import re  # 添加re模块导入
 from typing import Dict, List, Optional
 from .gpt_client import GPT
+from .micro_batcher import MicroBatcher
+from .prompt_budget import dependency_name
+from .response_schemas import BATCH_DETECTION_SCHEMA, DETECTION_SCHEMA, StructuredOutputError
+from .text_extractor import TextExtractor
 
 logger = logging.getLogger(__name__)
 
+# 单项目检测与批量检测共用的检测标准
+DETECTION_CRITERIA = """## 检测标准（仅适用于函数）
+
+### 1. 函数实现检测
+- ✅ 允许：`unimplemented!()`, `todo!()`, `panic!()`, 简单返回值 (如 `0`, `false`, `None`)
+- ❌ 禁止：具体的业务逻辑、算法实现、复杂运算、函数调用、变量定义
+
+### 2. 重定义检测  
+- ❌ 禁止：重新定义已知的依赖项
+- ✅ 允许：定义新的函数
+
+### 3. 复杂度检测
+- ❌ 禁止：复杂的控制流 (if/for/while)、多行实现、算术运算、局部变量
+- ✅ 允许：简单的函数签名和占位符
+
+**重要说明：这个检测只针对函数类型。函数应该只包含签名和简单占位符，不应该有具体的业务逻辑实现。**"""
+
 class AIImplementationDetector:
-    """AI实现检测器 - 用AI检测AI的额外实现"""
+    """AI实现检测器 - 先做本地结构分析，只有无法确定时才用AI检测AI的额外实现"""
+    
+    def __init__(self, api_key: str, local_confidence_threshold: float = 0.9, client=None):
+        """
+        初始化检测器
+        
+        Args:
+            api_key: OpenAI API密钥
+            local_confidence_threshold: 本地结构分析的置信度达到该值时直接采用，不再调用AI
+            client: 检测使用的GPT客户端（如模型路由器中detector角色的客户端），默认使用gpt-4o
+        """
+        self.detector_ai = client or GPT(api_key, model_name="gpt-4o")
+        self.local_confidence_threshold = local_confidence_threshold
+        self.stats = self._empty_stats()
+        logger.info("AI实现检测器初始化完成")
     
-    def __init__(self, api_key: str):
-        """初始化检测器"""
-        self.detector_ai = GPT(api_key, model_name="gpt-4o")
-        self.stats = {
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
             "total_checks": 0,
             "implementations_detected": 0,
             "redefinitions_detected": 0,
-            "clean_code_count": 0
+            "clean_code_count": 0,
+            "local_decisions": 0,  # 由本地结构分析直接判定的次数
+            "llm_decisions": 0     # 交给AI判定的次数
         }
-        logger.info("AI实现检测器初始化完成")
     
     def detect_extra_implementation(self, rust_code: str, code_type: str, 
-                                  dependencies: List[str] = None) -> Dict:
+                                  dependencies: List[str] = None, item_name: str = None) -> Dict:
         """
         检测Rust代码中是否有额外的实现
         
+        先由StructuralAnalyzer做本地结构分析，置信度足够（或非函数类型）时直接返回，
+        否则再调用AI检测。
+        
         Args:
             rust_code: 要检测的Rust代码
             code_type: 代码类型 (functions, structs, defines等)
             dependencies: 已知的依赖项列表
+            item_name: 当前项目名称，定义自身不算重定义
             
         Returns:
             Dict: {
@@ -46,80 +85,129 @@ class AIImplementationDetector:
                 "is_clean": bool,                # 代码是否干净
                 "violations": List[str],         # 违规列表
                 "severity": str,                 # 严重程度: "none", "minor", "major"
-                "recommendation": str            # 修复建议
+                "recommendation": str,           # 修复建议
+                "tier": str,                     # 判定层级: "local", "llm", "local_fallback"
+                "confidence": float              # 判定置信度（0-1）
             }
         """
         self.stats["total_checks"] += 1
         
-        # 只对函数类型进行实现检测，其他类型应该有完整实现
-        if code_type != "functions":
-            # 对于非函数类型，只检查重定义问题，不检查实现
-            logger.info(f"跳过非函数类型的实现检测: {code_type}")
-            
-            # 检查重定义
-            has_redefinition = False
-            violations = []
-            
-            if dependencies:
-                # 简单检查是否重定义了依赖项
-                for dep in dependencies:
-                    if dep in rust_code:
-                        has_redefinition = True
-                        violations.append(f"可能重定义了依赖项: {dep}")
-            
-            result = {
-                "has_implementation": False,  # 非函数类型允许有实现
-                "has_redefinition": has_redefinition,
-                "is_clean": not has_redefinition,
-                "violations": violations,
-                "severity": "major" if has_redefinition else "none",
-                "recommendation": "代码符合要求" if not has_redefinition else "请检查重定义问题"
-            }
-            
-            if result["is_clean"]:
-                self.stats["clean_code_count"] += 1
-            if result["has_redefinition"]:
-                self.stats["redefinitions_detected"] += 1
-            
-            return result
+        local_result = StructuralAnalyzer.analyze(rust_code, code_type, dependencies, item_name)
         
-        # 只对函数类型进行完整的AI检测
+        # 非函数类型允许有完整实现，只检查重定义，本地分析即可判定
+        if code_type != "functions" or local_result["confidence"] >= self.local_confidence_threshold:
+            local_result["tier"] = "local"
+            self.stats["local_decisions"] += 1
+            self._update_stats(local_result)
+            logger.info(f"本地结构分析判定: 干净={local_result['is_clean']}, 置信度={local_result['confidence']:.2f}")
+            return local_result
+        
+        # 本地分析无法确定，交给AI检测
         detection_prompt = self._build_detection_prompt(rust_code, code_type, dependencies)
         
         try:
             # 让AI检测实现
-            response = self.detector_ai.ask([
-                {"role": "system", "content": self._get_detector_system_prompt()},
-                {"role": "user", "content": detection_prompt}
-            ])
-            
-            # 解析检测结果
-            result = self._parse_detection_result(response)
+            try:
+                result, _ = self.detector_ai.ask_json([
+                    {"role": "system", "content": self._get_detector_system_prompt()},
+                    {"role": "user", "content": detection_prompt}
+                ], DETECTION_SCHEMA)
+            except StructuredOutputError as e:
+                # 响应不符合Schema，回退到文本解析
+                result = self._parse_detection_result(e.raw_text)
+            return self._accept_llm_result(result, local_result)
             
-            # 更新统计
-            if result["has_implementation"]:
-                self.stats["implementations_detected"] += 1
-            if result["has_redefinition"]:
-                self.stats["redefinitions_detected"] += 1
-            if result["is_clean"]:
-                self.stats["clean_code_count"] += 1
-            
-            logger.info(f"AI检测完成: 实现={result['has_implementation']}, "
-                       f"重定义={result['has_redefinition']}, "
-                       f"干净={result['is_clean']}")
-            
-            return result
+        except Exception as e:
+            logger.error(f"AI检测过程出错，采用本地结构分析结果: {e}")
+            return self._accept_local_fallback(local_result, f"AI检测过程出错: {str(e)}")
+    
+    def detect_batch(self, entries: Dict[str, tuple], dependencies: List[str] = None) -> Dict[str, Dict]:
+        """
+        批量检测多个项目
+        
+        每个项目先做本地结构分析，无法确定的项目合并到一次AI请求中检测，
+        AI响应中缺失的项目采用本地结构分析结果（tier为local_fallback）。
+        
+        Args:
+            entries: 项目键 -> (rust_code, code_type)
+            dependencies: 已知的依赖项列表（本批项目共用）
             
+        Returns:
+            Dict[str, Dict]: 项目键 -> 检测结果（格式同detect_extra_implementation）
+        """
+        results = {}
+        uncertain = {}
+        for key, (rust_code, code_type) in entries.items():
+            self.stats["total_checks"] += 1
+            local_result = StructuralAnalyzer.analyze(rust_code, code_type, dependencies, key)
+            if code_type != "functions" or local_result["confidence"] >= self.local_confidence_threshold:
+                local_result["tier"] = "local"
+                self.stats["local_decisions"] += 1
+                self._update_stats(local_result)
+                results[key] = local_result
+            else:
+                uncertain[key] = local_result
+        
+        if not uncertain:
+            return results
+        
+        try:
+            prompt = self._build_batch_detection_prompt(
+                {key: entries[key][0] for key in uncertain}, dependencies
+            )
+            try:
+                response, _ = self.detector_ai.ask_json([
+                    {"role": "system", "content": self._get_detector_system_prompt()},
+                    {"role": "user", "content": prompt}
+                ], BATCH_DETECTION_SCHEMA)
+            except StructuredOutputError as e:
+                response = TextExtractor.extract_json(e.raw_text)
+            found, missing = MicroBatcher.split_results(
+                response, list(uncertain), lambda value: isinstance(value, dict) and "is_clean" in value
+            )
         except Exception as e:
-            logger.error(f"AI检测过程出错: {e}")
-            return {
-                "has_implementation": False,
-                "has_redefinition": False,
-                "is_clean": True,
-                "violations": [f"检测过程出错: {str(e)}"],
-                "severity": "none",
-                "recommendation": "无法检测，建议手动检查"
-            }
+            logger.error(f"AI批量检测过程出错，采用本地结构分析结果: {e}")
+            found, missing = {}, list(uncertain)
+        
+        for key, result in found.items():
+            results[key] = self._accept_llm_result(self._normalize_result(result), uncertain[key])
+        for key in missing:
+            results[key] = self._accept_local_fallback(uncertain[key], "AI批量检测未返回该项目的结果")
+        logger.info(f"AI批量检测完成: {len(found)}/{len(uncertain)} 个项目由AI判定")
+        return results
+    
+    def _accept_llm_result(self, result: Dict, local_result: Dict) -> Dict:
+        """采用AI检测结果并更新统计"""
+        result["tier"] = "llm"
+        result["local_confidence"] = local_result["confidence"]
+        try:
+            result["confidence"] = float(result.get("confidence"))
+        except (TypeError, ValueError):
+            result["confidence"] = None
+        self.stats["llm_decisions"] += 1
+        self._update_stats(result)
+        
+        logger.info(f"AI检测完成: 实现={result['has_implementation']}, "
+                   f"重定义={result['has_redefinition']}, "
+                   f"干净={result['is_clean']}")
+        return result
+    
+    def _accept_local_fallback(self, local_result: Dict, reason: str) -> Dict:
+        """AI检测不可用时采用本地结构分析结果"""
+        local_result["tier"] = "local_fallback"
+        local_result["violations"] = local_result["violations"] + [reason]
+        self.stats["local_decisions"] += 1
+        self._update_stats(local_result)
+        return local_result
+    
+    def _update_stats(self, result: Dict):
+        """根据检测结果更新统计"""
+        if result["has_implementation"]:
+            self.stats["implementations_detected"] += 1
+        if result["has_redefinition"]:
+            self.stats["redefinitions_detected"] += 1
+        if result["is_clean"]:
+            self.stats["clean_code_count"] += 1
     
     def _build_detection_prompt(self, rust_code: str, code_type: str, 
                               dependencies: List[str] = None) -> str:
@@ -144,21 +232,7 @@ class AIImplementationDetector:
 
 {dependencies_text}
 
-## 检测标准（仅适用于函数）
-
-### 1. 函数实现检测
-- ✅ 允许：`unimplemented!()`, `todo!()`, `panic!()`, 简单返回值 (如 `0`, `false`, `None`)
-- ❌ 禁止：具体的业务逻辑、算法实现、复杂运算、函数调用、变量定义
-
-### 2. 重定义检测  
-- ❌ 禁止：重新定义已知的依赖项
-- ✅ 允许：定义新的函数
-
-### 3. 复杂度检测
-- ❌ 禁止：复杂的控制流 (if/for/while)、多行实现、算术运算、局部变量
-- ✅ 允许：简单的函数签名和占位符
-
-**重要说明：这个检测只针对函数类型。函数应该只包含签名和简单占位符，不应该有具体的业务逻辑实现。**
+{DETECTION_CRITERIA}
 
 请以JSON格式返回检测结果：
 
@@ -169,10 +243,49 @@ class AIImplementationDetector:
   "is_clean": true,
   "violations": [],
   "severity": "none",
-  "recommendation": "代码符合要求"
+  "recommendation": "代码符合要求",
+  "confidence": 0.9
 }}
 ```
 
+其中confidence为你对判定结果的置信度（0到1之间的小数）。
+
+只返回JSON，不要其他文本。"""
+    
+    def _build_batch_detection_prompt(self, codes: Dict[str, str], dependencies: List[str] = None) -> str:
+        """构建批量检测提示，每个项目按键分别给出检测结果"""
+        dependencies_text = ""
+        if dependencies:
+            dependencies_text = f"""
+## 已知依赖项
+以下是已存在的依赖项，不应该重新定义：
+{chr(10).join(f"- {dep}" for dep in dependencies)}
+"""
+        items_example = ",\n    ".join(
+            f'"{key}": {{"has_implementation": false, "has_redefinition": false, "is_clean": true, '
+            f'"violations": [], "severity": "none", "recommendation": "代码符合要求", "confidence": 0.9}}'
+            for key in codes
+        )
+        return f"""请分别检测以下 {len(codes)} 段Rust函数代码是否包含额外的实现，各项目互相独立判定。
+
+## 待检测的Rust代码
+{MicroBatcher.format_items(codes, "rust")}
+{dependencies_text}
+
+{DETECTION_CRITERIA}
+
+请以JSON格式返回检测结果，items中必须包含上面列出的每一个项目：
+
+```json
+{{
+  "items": {{
+    {items_example}
+  }}
+}}
+```
+
+其中confidence为你对判定结果的置信度（0到1之间的小数）。
+
 只返回JSON，不要其他文本。"""
     
     def _get_detector_system_prompt(self) -> str:
@@ -199,37 +312,7 @@ class AIImplementationDetector:
             json_match = re.search(r'\{.*\}', response, re.DOTALL)
             if json_match:
                 result_json = json.loads(json_match.group())
-                
-                # 验证必需字段
-                required_fields = ["has_implementation", "has_redefinition", "is_clean", 
-                                 "violations", "severity", "recommendation"]
-                
-                for field in required_fields:
-                    if field not in result_json:
-                        result_json[field] = False if field.startswith("has_") or field == "is_clean" else []
-                
-                # 统一处理violations格式：确保始终是字符串列表
-                violations = result_json.get("violations", [])
-                if violations:
-                    normalized_violations = []
-                    for violation in violations:
-                        if isinstance(violation, dict):
-                            # 如果是字典，提取有用的信息转换为字符串
-                            if "details" in violation:
-                                normalized_violations.append(violation["details"])
-                            elif "description" in violation:
-                                normalized_violations.append(violation["description"])
-                            else:
-                                # 其他字典格式，转换为描述性字符串
-                                violation_type = violation.get("type", "未知违规")
-                                violation_msg = violation.get("message", str(violation))
-                                normalized_violations.append(f"{violation_type}: {violation_msg}")
-                        else:
-                            # 如果已经是字符串，直接使用
-                            normalized_violations.append(str(violation))
-                    result_json["violations"] = normalized_violations
-                
-                return result_json
+                return self._normalize_result(result_json)
             else:
                 # JSON解析失败，尝试简单解析
                 return self._fallback_parse(response)
@@ -237,6 +320,39 @@ class AIImplementationDetector:
         except json.JSONDecodeError:
             return self._fallback_parse(response)
     
+    def _normalize_result(self, result_json: Dict) -> Dict:
+        """补全必需字段，并统一violations格式"""
+        # 验证必需字段
+        required_fields = ["has_implementation", "has_redefinition", "is_clean", 
+                         "violations", "severity", "recommendation"]
+        
+        for field in required_fields:
+            if field not in result_json:
+                result_json[field] = False if field.startswith("has_") or field == "is_clean" else []
+        
+        # 统一处理violations格式：确保始终是字符串列表
+        violations = result_json.get("violations", [])
+        if violations:
+            normalized_violations = []
+            for violation in violations:
+                if isinstance(violation, dict):
+                    # 如果是字典，提取有用的信息转换为字符串
+                    if "details" in violation:
+                        normalized_violations.append(violation["details"])
+                    elif "description" in violation:
+                        normalized_violations.append(violation["description"])
+                    else:
+                        # 其他字典格式，转换为描述性字符串
+                        violation_type = violation.get("type", "未知违规")
+                        violation_msg = violation.get("message", str(violation))
+                        normalized_violations.append(f"{violation_type}: {violation_msg}")
+                else:
+                    # 如果已经是字符串，直接使用
+                    normalized_violations.append(str(violation))
+            result_json["violations"] = normalized_violations
+        
+        return result_json
+    
     def _fallback_parse(self, response: str) -> Dict:
         """备用解析方法"""
         # 简单的关键词检测
@@ -265,12 +381,7 @@ class AIImplementationDetector:
     
     def reset_stats(self):
         """重置统计"""
-        self.stats = {
-            "total_checks": 0,
-            "implementations_detected": 0,
-            "redefinitions_detected": 0,
-            "clean_code_count": 0
-        }
+        self.stats = self._empty_stats()
 
 
 class SimpleImplementationChecker:
@@ -325,14 +436,160 @@ class SimpleImplementationChecker:
         }
 
 
+class StructuralAnalyzer:
+    """本地结构分析器 - 根据顶层项目、函数体形状和已知依赖名称判定明确的情况"""
+    
+    # 顶层定义：fn/struct/enum/union/type/const/static/trait 及其名称
+    DEFINITION_PATTERN = re.compile(
+        r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:(?:const|unsafe|async|extern\s+"[^"]*")\s+)*'
+        r'(fn|struct|enum|union|type|const|static|trait)\s+(?:mut\s+)?([A-Za-z_]\w*)',
+        re.MULTILINE
+    )
+    IMPL_PATTERN = re.compile(r'^\s*(?:unsafe\s+)?impl\b', re.MULTILINE)
+    # 允许的占位函数体
+    PLACEHOLDER_PATTERN = re.compile(
+        r'^(?:return\s+)?(?:'
+        r'(?:unimplemented|todo|panic|unreachable)!\(.*\)'
+        r'|-?\d+(?:\.\d+)?(?:_?[iuf](?:8|16|32|64|128|size))?'
+        r'|true|false|None|\(\)'
+        r'|(?:(?:std|core)::)?(?:ptr::)?null(?:_mut)?\(\)'
+        r'|(?:Default::default|Vec::new|String::new)\(\)'
+        r')?;?$',
+        re.DOTALL
+    )
+    # 明确的业务逻辑特征
+    LOGIC_PATTERNS = [
+        (re.compile(r'\blet\b'), "变量定义"),
+        (re.compile(r'\bfor\b[^{]*\bin\b'), "循环"),
+        (re.compile(r'\bwhile\b'), "while循环"),
+        (re.compile(r'\bloop\b'), "loop循环"),
+        (re.compile(r'\bmatch\b'), "模式匹配"),
+        (re.compile(r'\bif\b'), "条件判断"),
+    ]
+    
+    @staticmethod
+    def dependency_names(dependencies: Optional[List[str]]) -> set:
+        """依赖键中的名称集合，名称提取见 prompt_budget.dependency_name"""
+        return {name for name in map(dependency_name, dependencies or []) if name}
+    
+    @staticmethod
+    def _strip_comments_and_strings(code: str) -> str:
+        code = re.sub(r'"(?:[^"\\]|\\.)*"', '""', code)
+        code = re.sub(r'/\*[\s\S]*?\*/', '', code)
+        return re.sub(r'//[^\n]*', '', code)
+    
+    @staticmethod
+    def _function_bodies(code: str) -> List[Optional[str]]:
+        """提取每个fn的函数体，只有声明（以分号结束）时为None"""
+        bodies = []
+        for match in re.finditer(r'\bfn\s+[A-Za-z_]\w*', code):
+            index = match.end()
+            depth = 0
+            # 跳过参数列表和返回类型，找到函数体起始的{或声明结尾的;
+            while index < len(code):
+                char = code[index]
+                if char in "(<[":
+                    depth += 1
+                elif char in ")>]" and depth > 0:
+                    depth -= 1
+                elif depth == 0 and char in "{;":
+                    break
+                index += 1
+            if index >= len(code) or code[index] == ";":
+                bodies.append(None)
+                continue
+            start = index
+            depth = 0
+            while index < len(code):
+                if code[index] == "{":
+                    depth += 1
+                elif code[index] == "}":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                index += 1
+            bodies.append(code[start + 1:index])
+        return bodies
+    
+    @staticmethod
+    def _result(has_implementation: bool, has_redefinition: bool, violations: List[str],
+                confidence: float, recommendation: str) -> Dict:
+        is_clean = not (has_implementation or has_redefinition)
+        return {
+            "has_implementation": has_implementation,
+            "has_redefinition": has_redefinition,
+            "is_clean": is_clean,
+            "violations": violations,
+            "severity": "none" if is_clean else "major",
+            "recommendation": recommendation,
+            "confidence": confidence
+        }
+    
+    @classmethod
+    def analyze(cls, rust_code: str, code_type: str, dependencies: List[str] = None,
+                item_name: str = None) -> Dict:
+        """
+        分析Rust代码结构
+        
+        Returns:
+            Dict: 与detect_extra_implementation相同的字段，confidence表示本地判定的置信度
+        """
+        code = cls._strip_comments_and_strings(rust_code)
+        definitions = cls.DEFINITION_PATTERN.findall(code)
+        
+        # 重定义：代码中定义了已知依赖项的名称（项目自身除外）
+        own_names = cls.dependency_names([item_name]) if item_name else set()
+        redefined = sorted({name for _, name in definitions} & (cls.dependency_names(dependencies) - own_names))
+        violations = [f"重定义了依赖项: {name}" for name in redefined]
+        
+        if code_type != "functions":
+            return cls._result(False, bool(redefined), violations, 0.95,
+                               "请检查重定义问题" if redefined else "代码符合要求")
+        if redefined:
+            return cls._result(False, True, violations, 0.95, "删除已有依赖项的定义，直接使用")
+        
+        bodies = cls._function_bodies(code)
+        if not bodies:
+            return cls._result(False, False, ["未找到函数定义"], 0.3, "无法确定，需要AI检测")
+        
+        logic = []
+        placeholders = 0
+        for body in bodies:
+            if body is None:
+                placeholders += 1
+                continue
+            stripped = body.strip()
+            unsafe_block = re.fullmatch(r'unsafe\s*\{(.*)\}', stripped, re.DOTALL)
+            if unsafe_block:
+                stripped = unsafe_block.group(1).strip()
+            if cls.PLACEHOLDER_PATTERN.match(stripped):
+                placeholders += 1
+                continue
+            found = [description for pattern, description in cls.LOGIC_PATTERNS if pattern.search(stripped)]
+            if found or stripped.count(";") > 1:
+                logic.extend(found or ["函数体包含多条语句"])
+        
+        has_impl_block = bool(cls.IMPL_PATTERN.search(code))
+        other_items = [name for kind, name in definitions if kind != "fn"]
+        
+        if logic:
+            return cls._result(True, False, sorted(set(logic)), 0.9, "函数体只保留占位符，删除具体实现")
+        if placeholders == len(bodies) and not has_impl_block and not other_items:
+            return cls._result(False, False, [], 0.95, "代码符合要求")
+        
+        # 单个表达式的函数体、impl块或额外的类型定义：本地无法确定
+        hints = SimpleImplementationChecker.quick_check(rust_code, code_type)["violations"]
+        return cls._result(bool(hints), False, hints, 0.5, "无法确定，需要AI检测")
+
+
 # 全局检测器实例
 _global_detector = None
 
-def get_detector(api_key: str) -> AIImplementationDetector:
-    """获取全局检测器实例"""
+def get_detector(api_key: str, client=None) -> AIImplementationDetector:
+    """获取全局检测器实例，client只在首次创建时使用"""
     global _global_detector
     if _global_detector is None:
-        _global_detector = AIImplementationDetector(api_key)
+        _global_detector = AIImplementationDetector(api_key, client=client)
     return _global_detector
 
 def detect_implementation(rust_code: str, code_type: str, api_key: str,
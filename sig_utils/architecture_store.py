@@ -0,0 +1,311 @@
+"""
+架构存储模块
+
+基于SQLite（标准库sqlite3）的可选架构存储：
+1. items表保存每个项目的完整JSON及各阶段状态，按状态、类型和限定名建立索引
+2. dependencies表保存依赖关系，支持"哪些项目依赖X"的反向查询
+3. attempts表记录每次处理尝试，便于追踪失败原因
+4. 支持与现有架构JSON格式（file -> kind -> item）互相导入导出
+
+目前只有签名转换（c2rust_converter_new.py --store）逐项写入存储，检查点仍完整重写JSON输出文件；
+函数总结、函数实现和流式流水线仍只读写JSON文件，可用 import_json / export_file 与存储互相转换。
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sig_utils.dependency_graph import ITEM_KINDS, make_node_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    meta TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    qualified_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    conversion_status TEXT,
+    summary_status TEXT,
+    implementation_status TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_items_kind_conversion ON items(kind, conversion_status);
+CREATE INDEX IF NOT EXISTS idx_items_summary ON items(summary_status);
+CREATE INDEX IF NOT EXISTS idx_items_implementation ON items(implementation_status);
+CREATE INDEX IF NOT EXISTS idx_items_qualified_name ON items(qualified_name);
+
+CREATE TABLE IF NOT EXISTS dependencies (
+    item_id TEXT NOT NULL,
+    dep_key TEXT NOT NULL,
+    dep_qualified_name TEXT,
+    dep_type TEXT,
+    PRIMARY KEY (item_id, dep_key)
+);
+CREATE INDEX IF NOT EXISTS idx_dependencies_qualified_name ON dependencies(dep_qualified_name);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT,
+    rounds INTEGER,
+    detail TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_item ON attempts(item_id, stage);
+"""
+
+
+class ArchitectureStore:
+    """SQLite架构存储 - 以行为单位查询和更新项目，避免每次重写整个JSON文件"""
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: 数据库文件路径，":memory:" 表示内存数据库
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()  # 同一连接可能被多个工作线程使用
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 导入导出
+    # ------------------------------------------------------------------
+
+    def import_json(self, data: Dict, replace: bool = True) -> int:
+        """
+        导入架构JSON数据
+
+        Args:
+            data: 架构数据（file -> kind -> item）
+            replace: 是否先清空已有数据
+
+        Returns:
+            int: 导入的项目数
+        """
+        count = 0
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("DELETE FROM files")
+                self._conn.execute("DELETE FROM items")
+                self._conn.execute("DELETE FROM dependencies")
+            for file_name, content in data.items():
+                if not isinstance(content, dict):
+                    continue
+                # 文件级的非项目字段（如description）和键顺序单独保存，保证导出后与原JSON一致
+                meta = {
+                    "keys": list(content.keys()),
+                    "extra": {key: value for key, value in content.items() if key not in ITEM_KINDS}
+                }
+                row = self._conn.execute("SELECT position FROM files WHERE file = ?", (file_name,)).fetchone()
+                position = row["position"] if row else self._conn.execute(
+                    "SELECT COALESCE(MAX(position), -1) + 1 FROM files").fetchone()[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (file, position, meta) VALUES (?, ?, ?)",
+                    (file_name, position, json.dumps(meta, ensure_ascii=False))
+                )
+                for kind in ITEM_KINDS:
+                    for item_name, item in content.get(kind, {}).items():
+                        self._upsert(file_name, kind, item_name, item)
+                        count += 1
+        return count
+
+    def export_json(self) -> Dict:
+        """按导入时的顺序导出为架构JSON格式"""
+        with self._lock:
+            file_rows = self._conn.execute("SELECT file, meta FROM files ORDER BY position").fetchall()
+            rows = self._conn.execute("SELECT file, kind, name, data FROM items ORDER BY position").fetchall()
+        
+        items = {}
+        for row in rows:
+            items.setdefault(row["file"], {}).setdefault(row["kind"], {})[row["name"]] = json.loads(row["data"])
+        
+        data = {}
+        for file_row in file_rows:
+            meta = json.loads(file_row["meta"])
+            file_items = items.pop(file_row["file"], {})
+            content = {}
+            for key in meta["keys"]:
+                content[key] = file_items.pop(key, {}) if key in ITEM_KINDS else meta["extra"].get(key)
+            content.update(file_items)  # 导入后新增的项目类型
+            data[file_row["file"]] = content
+        # 只通过upsert_item写入、没有文件记录的项目
+        for file_name, file_items in items.items():
+            data[file_name] = file_items
+        return data
+
+    def import_file(self, json_path: str, replace: bool = True) -> int:
+        """从架构JSON文件导入"""
+        with open(json_path, "r", encoding="utf-8") as f:
+            return self.import_json(json.load(f), replace)
+
+    def export_file(self, json_path: str):
+        """导出到架构JSON文件"""
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.export_json(), f, indent=4, ensure_ascii=False)
+
+    # ------------------------------------------------------------------
+    # 单项读写
+    # ------------------------------------------------------------------
+
+    def _upsert(self, file_name: str, kind: str, item_name: str, item: Dict):
+        """写入一个项目及其依赖（调用方负责加锁和事务）"""
+        item_id = make_node_id(file_name, kind, item_name)
+        row = self._conn.execute("SELECT position FROM items WHERE id = ?", (item_id,)).fetchone()
+        if row:
+            position = row["position"]
+        else:
+            position = self._conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM items").fetchone()[0]
+
+        self._conn.execute(
+            """INSERT OR REPLACE INTO items
+               (id, file, kind, name, qualified_name, position, conversion_status, summary_status,
+                implementation_status, data, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                item_id, file_name, kind, item_name,
+                f"{file_name}::{item_name}",
+                position,
+                item.get("conversion_status"),
+                item.get("summary_status"),
+                item.get("implementation_status"),
+                json.dumps(item, ensure_ascii=False),
+                time.time()
+            )
+        )
+
+        self._conn.execute("DELETE FROM dependencies WHERE item_id = ?", (item_id,))
+        for dep_key, dep_info in item.get("dependencies", {}).items():
+            dep_info = dep_info or {}
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dependencies (item_id, dep_key, dep_qualified_name, dep_type) VALUES (?, ?, ?, ?)",
+                (item_id, dep_key, dep_info.get("qualified_name"), dep_info.get("type"))
+            )
+
+    def upsert_item(self, file_name: str, kind: str, item_name: str, item: Dict):
+        """在单个事务中写入或更新一个项目"""
+        with self._lock, self._conn:
+            self._upsert(file_name, kind, item_name, item)
+
+    def get_item(self, file_name: str, kind: str, item_name: str) -> Optional[Dict]:
+        """读取一个项目，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM items WHERE id = ?", (make_node_id(file_name, kind, item_name),)
+            ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def record_attempt(self, item_id: str, stage: str, status: str, rounds: Optional[int] = None,
+                       detail: Optional[Dict] = None):
+        """记录一次处理尝试"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO attempts (item_id, stage, status, rounds, detail, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (item_id, stage, status, rounds, json.dumps(detail, ensure_ascii=False) if detail else None, time.time())
+            )
+
+    def attempts_for(self, item_id: str, stage: Optional[str] = None) -> List[Dict]:
+        """查询项目的处理尝试记录（按时间顺序）"""
+        sql = "SELECT stage, status, rounds, detail, created_at FROM attempts WHERE item_id = ?"
+        params = [item_id]
+        if stage:
+            sql += " AND stage = ?"
+            params.append(stage)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY id", params).fetchall()
+        return [
+            {
+                "stage": row["stage"],
+                "status": row["status"],
+                "rounds": row["rounds"],
+                "detail": json.loads(row["detail"]) if row["detail"] else None,
+                "created_at": row["created_at"]
+            }
+            for row in rows
+        ]
+
+    # ------------------------------------------------------------------
+    # 索引查询
+    # ------------------------------------------------------------------
+
+    def query_items(self, kind: Optional[str] = None, conversion_status: Optional[str] = None,
+                    summary_status: Optional[str] = None, implementation_status: Optional[str] = None,
+                    has_summary: Optional[bool] = None,
+                    has_implementation: Optional[bool] = None) -> Iterator[Tuple[str, str, str, Dict]]:
+        """
+        按类型和各阶段状态查询项目
+
+        例如 query_items(kind="defines", conversion_status="success") 返回所有转换成功的宏定义，
+        query_items(kind="functions", summary_status="success", has_implementation=False)
+        返回已有总结但尚未成功实现的函数。
+
+        Returns:
+            Iterator[Tuple[str, str, str, Dict]]: (file, kind, name, item)
+        """
+        conditions = []
+        params = []
+        for column, value in (("kind", kind), ("conversion_status", conversion_status),
+                              ("summary_status", summary_status),
+                              ("implementation_status", implementation_status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if has_summary is not None:
+            conditions.append("summary_status = 'success'" if has_summary else
+                              "(summary_status IS NULL OR summary_status != 'success')")
+        if has_implementation is not None:
+            conditions.append("implementation_status = 'success'" if has_implementation else
+                              "(implementation_status IS NULL OR implementation_status != 'success')")
+
+        sql = "SELECT file, kind, name, data FROM items"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY position", params).fetchall()
+        for row in rows:
+            yield row["file"], row["kind"], row["name"], json.loads(row["data"])
+
+    def dependents_of(self, qualified_name: str) -> List[str]:
+        """查询直接依赖某个限定名（如 zopfli::ZopfliOptions）的项目ID"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT item_id FROM dependencies WHERE dep_qualified_name = ? ORDER BY item_id",
+                (qualified_name,)
+            ).fetchall()
+        return [row["item_id"] for row in rows]
+
+    def status_counts(self, stage_column: str = "conversion_status") -> Dict[str, Dict[str, int]]:
+        """按类型统计某阶段各状态的项目数"""
+        if stage_column not in ("conversion_status", "summary_status", "implementation_status"):
+            raise ValueError(f"未知的状态列: {stage_column}")
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT kind, COALESCE({stage_column}, 'pending') AS status, COUNT(*) AS n "
+                f"FROM items GROUP BY kind, status"
+            ).fetchall()
+        counts = {}
+        for row in rows:
+            counts.setdefault(row["kind"], {})[row["status"]] = row["n"]
+        return counts
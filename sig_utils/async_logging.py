@@ -0,0 +1,269 @@
+"""
+异步日志模块
+
+把日志的磁盘I/O移出调用线程：
+1. 各日志器只挂一个QueueHandler，调用方只把日志记录放入队列；进程内共用一个QueueListener线程，
+   按日志器名称把记录分发给对应的文件和控制台处理器
+2. 文件处理器按大小轮转，轮转出的旧文件用gzip压缩；每次运行第一次写入时把上一次运行的日志轮转保存，
+   不再在导入时以 'w' 模式清空
+3. 多行日志中较长的正文（提示、依赖代码、模型响应等）按Markdown标题（## / ### / ####）切分为片段，
+   较长的片段按内容哈希只保存一次到 logs/blobs/，日志行中只保留首行、较短的片段和引用；
+   不同项目的提示中相同的依赖项片段（"### 依赖项ID + 代码块"）只保存一次
+4. blobs目录按总大小和文件年龄清理：启动时删除过期文件，超过大小上限时按最近使用时间删除最旧的文件；
+   被清理的片段在旧日志中的引用随之失效
+"""
+
+import atexit
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import re
+import shutil
+import time
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 正文按Markdown标题切分为片段，标题行可能带缩进（函数实现提示）
+_SECTION_PATTERN = re.compile(r'(?m)^(?=[ \t]*#{2,4} )')
+
+
+class BlobStore:
+    """按内容哈希保存日志正文，相同内容只写一次"""
+
+    def __init__(self, directory: str, min_size: int = 512, section_min_size: int = 256,
+                 max_bytes: int = 200 * 1024 * 1024, max_age_days: float = 14):
+        """
+        Args:
+            directory: 正文文件目录
+            min_size: 达到该字符数的正文才按片段处理
+            section_min_size: 达到该字符数的片段才单独保存
+            max_bytes: 目录总大小上限，超过后按最近使用时间删除最旧的文件，直到降到上限的80%
+            max_age_days: 超过该天数未使用的文件在启动时删除
+        """
+        self.directory = directory
+        self.min_size = min_size
+        self.section_min_size = section_min_size
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._known = set()
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "reused": 0, "pruned": 0}
+        self._size = self.prune(expire=True)
+
+    def prune(self, expire: bool = False) -> int:
+        """
+        清理blobs目录，返回清理后的总大小
+
+        Args:
+            expire: 是否删除超过 max_age_days 未使用的文件（启动时）
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.max_age_days * 86400
+        target = self.max_bytes * 0.8 if total > self.max_bytes else total
+        for mtime, size, path in entries:
+            if not (expire and mtime < cutoff) and total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.stats["pruned"] += 1
+        with self._lock:
+            self._known.clear()  # 已删除的文件需要重新写入
+        return total
+
+    def reference(self, text: str) -> str:
+        """保存正文（已保存过则跳过），返回引用文本"""
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            known = digest in self._known
+            self._known.add(digest)
+        path = os.path.join(self.directory, f"{digest}.txt")
+        if known:
+            self.stats["reused"] += 1
+        elif os.path.exists(path):
+            os.utime(path)  # 更新最近使用时间，清理时保留常用的片段
+            self.stats["reused"] += 1
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            self.stats["stored"] += 1
+            self._size += len(text.encode("utf-8"))
+            if self._size > self.max_bytes:
+                self._size = self.prune()
+        return f"<blob:{digest}, {len(text)} 字符>"
+
+    def replace_sections(self, body: str) -> str:
+        """把正文中较长的片段替换为引用，较短的片段保留原文"""
+        parts = []
+        for section in _SECTION_PATTERN.split(body):
+            if len(section) >= self.section_min_size:
+                parts.append(self.reference(section) + ("\n" if section.endswith("\n") else ""))
+            else:
+                parts.append(section)
+        return "".join(parts)
+
+
+class BlobFormatter(logging.Formatter):
+    """多行日志中较长的正文按片段替换为BlobStore引用，保留首行和较短的片段"""
+
+    def __init__(self, blobs: Optional[BlobStore], fmt: str = LOG_FORMAT):
+        super().__init__(fmt)
+        self.blobs = blobs
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if self.blobs is not None and len(message) >= self.blobs.min_size:
+            head, sep, body = message.partition("\n")
+            if sep and len(body) >= self.blobs.min_size:
+                message = f"{head}\n{self.blobs.replace_sections(body)}"
+        record = logging.makeLogRecord(dict(record.__dict__, msg=message, args=None))
+        return super().format(record)
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """按大小轮转并gzip压缩旧文件；第一次写入时先轮转上一次运行留下的日志"""
+
+    def __init__(self, filename: str, max_bytes: int = 20 * 1024 * 1024, backup_count: int = 5):
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+        self._started = False
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def emit(self, record: logging.LogRecord):
+        if not self._started:
+            self._started = True
+            if self.backupCount > 0 and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                self.doRollover()
+        super().emit(record)
+
+
+class _Router(logging.Handler):
+    """监听线程中按日志器名称把记录分发给对应的处理器"""
+
+    def __init__(self):
+        super().__init__()
+        self.routes: Dict[str, List[logging.Handler]] = {}
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def emit(self, record):
+        self.handle(record)
+
+
+class _AsyncLogging:
+    """进程内共用的日志队列和监听线程"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.router = _Router()
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def attach(self, logger: logging.Logger, handlers: List[logging.Handler]):
+        with self._lock:
+            self.router.routes.setdefault(logger.name, []).extend(handlers)
+            logger.addHandler(QueueHandler(self.queue))
+            if self.listener is None:
+                self.listener = QueueListener(self.queue, self.router)
+                self.listener.start()
+                atexit.register(self.stop)
+
+    def flush(self):
+        """等待队列中的日志全部写出"""
+        if self.listener is not None:
+            self.queue.join()
+        for handlers in list(self.router.routes.values()):
+            for handler in handlers:
+                handler.flush()
+
+    def stop(self):
+        with self._lock:
+            if self.listener is None:
+                return
+            self.listener.stop()
+            self.listener = None
+        for handlers in self.router.routes.values():
+            for handler in handlers:
+                handler.close()
+
+
+_async_logging = _AsyncLogging()
+_blob_stores: Dict[str, BlobStore] = {}
+_blob_stores_lock = threading.Lock()
+
+
+def configure_logger(logger: logging.Logger, log_path: Optional[str], console_output: bool = True,
+                     console_format: str = LOG_FORMAT, dedup_payloads: bool = True,
+                     max_bytes: int = 20 * 1024 * 1024, backup_count: int = 5) -> logging.Logger:
+    """
+    为日志器配置异步的文件和控制台输出，重复调用时不会重复添加处理器
+
+    Args:
+        logger: 日志器
+        log_path: 日志文件路径，为None时只输出到控制台
+        console_output: 是否输出到控制台（INFO及以上）
+        dedup_payloads: 是否把较长的多行正文按内容哈希保存到日志目录下的blobs目录
+        max_bytes: 单个日志文件的大小上限，超过后轮转并压缩
+        backup_count: 保留的压缩旧文件数
+    """
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False  # 禁止日志向上传播到root logger
+
+    handlers = []
+    if log_path:
+        blobs = None
+        if dedup_payloads:
+            blob_dir = os.path.join(os.path.dirname(log_path), "blobs")
+            # 同一目录只创建一个BlobStore：构造时会清理过期文件，重复创建会删掉已缓存实例仍在引用的正文
+            with _blob_stores_lock:
+                if blob_dir not in _blob_stores:
+                    _blob_stores[blob_dir] = BlobStore(blob_dir)
+                blobs = _blob_stores[blob_dir]
+        file_handler = CompressingRotatingFileHandler(log_path, max_bytes, backup_count)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(BlobFormatter(blobs))
+        handlers.append(file_handler)
+    if console_output:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(logging.Formatter(console_format))
+        handlers.append(console_handler)
+    _async_logging.attach(logger, handlers)
+    return logger
+
+
+def flush_logs():
+    """等待所有异步日志写出（例如在读取日志文件之前）"""
+    _async_logging.flush()
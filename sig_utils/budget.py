@@ -0,0 +1,172 @@
+"""
+运行预算模块
+
+在运行中按实际用量执行token、成本和运行时长上限：
+1. 从 sig_utils.tracing 的大模型请求span累计输入/输出token，按模型价格估算成本
+2. 预算使用比例（token、成本、时长中最高的一项）超过阈值后逐级降级：减少转换/审核/修复轮数、
+   不再仲裁、按价格优先使用路由中较便宜的后端、就绪队列改为优先处理下游依赖项目最多的分量
+3. 各阶段在派发新项目之前检查 exhausted()，预算用尽后不再派发，等待进行中的项目完成后保存结果
+4. 进行中的项目仍会完成，实际用量可能略超上限
+
+上限通常取 plan_run.py 的估算结果再留出余量。
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from sig_utils.tracing import tracer
+
+# 降级档位，按预算使用比例从低到高排列
+DEGRADATION_LEVELS = [
+    {"level": 0, "name": "正常", "from": 0.0, "round_scale": 1.0, "arbitration": True,
+     "cheap_routes": False, "prefer_fan_out": False},
+    {"level": 1, "name": "节约", "from": 0.6, "round_scale": 0.6, "arbitration": False,
+     "cheap_routes": False, "prefer_fan_out": True},
+    {"level": 2, "name": "最低", "from": 0.85, "round_scale": 0.4, "arbitration": False,
+     "cheap_routes": True, "prefer_fan_out": True},
+]
+
+
+class RunBudget:
+    """一次运行的token、成本与时长预算"""
+
+    def __init__(self):
+        self.max_tokens = None
+        self.max_cost = None
+        self.prices = {}
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self.unpriced_tokens = 0  # 没有价格的模型的token数，不计入成本
+        self.time_limit = None
+        self.started_at = time.time()
+        self._level = 0  # 最近一次 adapt() 应用的档位
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self) -> bool:
+        return self.max_tokens is not None or self.max_cost is not None or self.time_limit is not None
+
+    def configure(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None, prices: Optional[Dict] = None,
+                  time_limit: Optional[float] = None):
+        """
+        设置预算并清零用量，运行时长从此刻开始计算
+
+        Args:
+            max_tokens: 输入与输出token总数上限
+            max_cost: 估算成本上限（美元）
+            prices: 模型 -> {"input", "output"} 每百万token价格，通常为 ModelRouter.prices
+            time_limit: 运行时长上限（秒）
+        """
+        tracer.remove_sink(self._on_span)
+        with self._lock:
+            self.max_tokens = max_tokens
+            self.max_cost = max_cost
+            self.time_limit = time_limit
+            self.prices = prices or {}
+            self.tokens_in = self.tokens_out = self.unpriced_tokens = 0
+            self.cost = 0.0
+            self.started_at = time.time()
+            self._level = 0
+        if self.max_tokens is not None or self.max_cost is not None:
+            tracer.add_sink(self._on_span)
+
+    def _on_span(self, name: str, category: str, seconds: float, args: Dict):
+        """tracing的sink：累计大模型请求的token和成本"""
+        if category != "llm":
+            return
+        tokens_in = args.get("tokens_in", 0)
+        tokens_out = args.get("tokens_out", 0)
+        price = self.prices.get(args.get("model"))
+        with self._lock:
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            if price:
+                self.cost += (tokens_in * price["input"] + tokens_out * price["output"]) / 1_000_000
+            else:
+                self.unpriced_tokens += tokens_in + tokens_out
+
+    def used_fraction(self) -> float:
+        """已用预算比例，取token、成本和运行时长中最高的一项；未设置上限时为0"""
+        fractions = [0.0]
+        if self.max_tokens:
+            fractions.append((self.tokens_in + self.tokens_out) / self.max_tokens)
+        if self.max_cost:
+            fractions.append(self.cost / self.max_cost)
+        if self.time_limit:
+            fractions.append((time.time() - self.started_at) / self.time_limit)
+        return max(fractions)
+
+    def exhausted(self) -> bool:
+        return self.limited and self.used_fraction() >= 1.0
+
+    def policy(self) -> Dict:
+        """当前预算使用比例对应的降级档位"""
+        used = self.used_fraction()
+        current = DEGRADATION_LEVELS[0]
+        for level in DEGRADATION_LEVELS:
+            if used >= level["from"]:
+                current = level
+        return current
+
+    def rounds(self, default: int) -> int:
+        """按当前档位缩减的最大轮数，至少1轮"""
+        return max(1, round(default * self.policy()["round_scale"]))
+
+    def max_arbitration(self, default: int = 1) -> int:
+        """当前档位允许的仲裁次数"""
+        return default if self.policy()["arbitration"] else 0
+
+    def adapt(self, router=None, queues: Iterable = (), log: Optional[Callable[[str], None]] = None) -> Optional[Dict]:
+        """
+        档位升高时切换调度策略（在调度循环中派发前调用）
+
+        Args:
+            router: ModelRouter，最低档时按价格优先使用较便宜的后端
+            queues: ReadyQueue，节约档起优先处理下游依赖项目最多的分量
+            log: 日志函数
+
+        Returns:
+            Optional[Dict]: 档位发生变化时返回新档位，否则为None
+        """
+        policy = self.policy()
+        with self._lock:
+            if policy["level"] <= self._level:
+                return None
+            self._level = policy["level"]
+        if router is not None:
+            router.set_economy(policy["cheap_routes"])
+        for queue in queues:
+            queue.prefer_fan_out(policy["prefer_fan_out"])
+        if log:
+            log(f"预算已用 {self.used_fraction():.0%}（{self.describe()}），切换到「{policy['name']}」档: "
+                f"轮数 x{policy['round_scale']}, 仲裁{'保留' if policy['arbitration'] else '关闭'}, "
+                f"{'低价路由优先, ' if policy['cheap_routes'] else ''}"
+                f"{'优先处理下游依赖最多的项目' if policy['prefer_fan_out'] else '关键路径优先'}")
+        return policy
+
+    def spent(self) -> Dict:
+        return {
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "cost": round(self.cost, 4),
+            "unpriced_tokens": self.unpriced_tokens,
+            "elapsed_seconds": round(time.time() - self.started_at, 1),
+            "used_fraction": round(self.used_fraction(), 4),
+            "level": self.policy()["name"]
+        }
+
+    def describe(self) -> str:
+        """用量与上限的单行描述，用于日志"""
+        parts = [f"token {self.tokens_in + self.tokens_out}" + (f"/{self.max_tokens}" if self.max_tokens else "")]
+        parts.append(f"成本 ${self.cost:.4f}" + (f"/${self.max_cost}" if self.max_cost else ""))
+        if self.time_limit:
+            parts.append(f"时长 {time.time() - self.started_at:.0f}s/{self.time_limit:.0f}s")
+        if self.unpriced_tokens:
+            parts.append(f"未知价格的token {self.unpriced_tokens}")
+        return ", ".join(parts)
+
+
+# 进程内共用的运行预算
+run_budget = RunBudget()
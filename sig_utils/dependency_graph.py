@@ -0,0 +1,327 @@
+"""
+依赖图模块
+
+基于架构JSON构建项目级依赖图：
+1. 将依赖信息统一解析为节点ID（file::kind::name），支持跨类型和name字段匹配
+2. 使用Tarjan算法识别强连通分量（互相递归的结构体、函数等）
+3. 按依赖优先的顺序产出强连通分量，循环依赖的项目作为一个整体转换
+4. 计算关键路径优先级（下游深度与扇出），用于就绪队列调度
+5. 计算入口项目（函数或类型）的传递依赖闭包，只处理入口实际用到的项目
+"""
+
+import logging
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 架构文件中的项目类型，顺序即默认处理顺序
+ITEM_KINDS = ["fields", "defines", "typedefs", "structs", "functions"]
+
+
+def make_node_id(file_name: str, kind: str, item_name: str) -> str:
+    """生成与转换器一致的完整项目ID"""
+    return f"{file_name}::{kind}::{item_name}"
+
+
+class DependencyGraph:
+    """项目依赖图 - 节点为架构文件中的每个项目，边从项目指向其依赖项"""
+
+    def __init__(self, data: Dict, kinds: List[str] = None):
+        """
+        根据架构数据构建依赖图
+
+        Args:
+            data: 架构数据（file -> kind -> item）
+            kinds: 参与建图的项目类型，默认为全部类型
+        """
+        self.data = data
+        self.kinds = kinds or ITEM_KINDS
+        self.nodes = {}  # node_id -> (file_name, kind, item_name)
+        self.edges = {}  # node_id -> 依赖的node_id集合
+        self.reverse_edges = {}  # node_id -> 依赖它的node_id集合
+        self.unresolved = {}  # node_id -> 无法解析的依赖ID列表
+        self._name_index = {}  # (file_name, name字段) -> [node_id]
+
+        self._build()
+
+    def _build(self):
+        """收集节点并解析依赖边"""
+        for file_name, content in self.data.items():
+            if not isinstance(content, dict):
+                continue
+            for kind in self.kinds:
+                for item_name, item in content.get(kind, {}).items():
+                    node_id = make_node_id(file_name, kind, item_name)
+                    self.nodes[node_id] = (file_name, kind, item_name)
+                    self.edges[node_id] = set()
+                    self.reverse_edges[node_id] = set()
+
+                    name = item.get("name") if isinstance(item, dict) else None
+                    if name and name != item_name:
+                        self._name_index.setdefault((file_name, name), []).append(node_id)
+
+        for node_id, (file_name, kind, item_name) in self.nodes.items():
+            item = self.data[file_name][kind][item_name]
+            for dep_id, dep_info in item.get("dependencies", {}).items():
+                target = self.resolve_dependency(dep_id, dep_info)
+                if target is None:
+                    self.unresolved.setdefault(node_id, []).append(dep_id)
+                    continue
+                if target == node_id:
+                    continue  # 自引用（如链表节点）不构成需要调度的依赖
+                self.edges[node_id].add(target)
+                self.reverse_edges[target].add(node_id)
+
+    def resolve_dependency(self, dep_id: str, dep_info: Dict) -> Optional[str]:
+        """
+        将依赖项解析为图中的节点ID
+
+        解析顺序与转换器的依赖检查保持一致：先按声明的类型精确匹配，
+        再搜索其他类型，最后通过name字段匹配。
+        """
+        if dep_id in self.nodes:
+            return dep_id
+        if not dep_info:
+            return None
+
+        dep_type = dep_info.get("type")
+        dep_qualified_name = dep_info.get("qualified_name")
+        if not dep_qualified_name:
+            return None
+
+        dep_parts = dep_qualified_name.split("::")
+        if len(dep_parts) < 2:
+            return None
+        dep_file = dep_parts[0]
+        dep_name = "::".join(dep_parts[1:])
+
+        search_kinds = [dep_type] if dep_type in self.kinds else []
+        search_kinds += [kind for kind in self.kinds if kind != dep_type]
+        for kind in search_kinds:
+            node_id = make_node_id(dep_file, kind, dep_name)
+            if node_id in self.nodes:
+                return node_id
+
+        candidates = self._name_index.get((dep_file, dep_name), [])
+        if candidates:
+            for node_id in candidates:
+                if self.nodes[node_id][1] == dep_type:
+                    return node_id
+            return candidates[0]
+
+        return None
+
+    def get_item(self, node_id: str) -> Dict:
+        """返回节点对应的架构项目"""
+        file_name, kind, item_name = self.nodes[node_id]
+        return self.data[file_name][kind][item_name]
+
+    def dependencies_of(self, node_id: str) -> Set[str]:
+        """节点的直接依赖"""
+        return self.edges.get(node_id, set())
+
+    def dependents_of(self, node_id: str) -> Set[str]:
+        """直接依赖该节点的项目"""
+        return self.reverse_edges.get(node_id, set())
+
+    def names_of(self, node_id: str) -> Set[str]:
+        """项目可被引用的名称：项目键、签名中括号前的部分、其中最后一个标识符（函数名、类型名）和name字段"""
+        _, _, item_name = self.nodes[node_id]
+        base = item_name.split("(")[0].strip()
+        names = {item_name, base}
+        identifiers = re.findall(r'[A-Za-z_]\w*', base)
+        if identifiers:
+            names.add(identifiers[-1])
+        item = self.get_item(node_id)
+        if isinstance(item, dict) and item.get("name"):
+            names.add(item["name"])
+        return names
+
+    def resolve_roots(self, roots: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """
+        将入口名称解析为节点ID
+
+        入口可以是完整的节点ID（file::kind::item）、file::名称 或 名称，名称按 names_of() 匹配；
+        同名的多个项目（如结构体和同名typedef）都作为入口
+
+        Returns:
+            Tuple[List[str], List[str]]: (入口节点ID, 无法解析的入口)
+        """
+        resolved = []
+        unresolved = []
+        for root in roots:
+            if root in self.nodes:
+                matches = [root]
+            else:
+                file_name, name = root.split("::", 1) if "::" in root else (None, root)
+                matches = [node_id for node_id, (node_file, _, _) in self.nodes.items()
+                           if (file_name is None or node_file == file_name) and name in self.names_of(node_id)]
+            if not matches:
+                unresolved.append(root)
+            resolved.extend(node_id for node_id in matches if node_id not in resolved)
+        return resolved, unresolved
+
+    def closure(self, node_ids: Iterable[str]) -> Set[str]:
+        """节点及其直接和间接依赖"""
+        seen = set()
+        stack = list(node_ids)
+        while stack:
+            node_id = stack.pop()
+            if node_id in seen:
+                continue
+            seen.add(node_id)
+            stack.extend(self.edges.get(node_id, ()))
+        return seen
+
+    def strongly_connected_components(self) -> List[List[str]]:
+        """
+        使用Tarjan算法（迭代实现）计算强连通分量
+
+        Returns:
+            List[List[str]]: 强连通分量列表，依赖项所在分量总是排在依赖它的分量之前
+        """
+        index_counter = 0
+        indices = {}
+        lowlinks = {}
+        on_stack = set()
+        stack = []
+        components = []
+        # 分量内部保持原始的类型/文件顺序，便于日志阅读
+        order = {node_id: i for i, node_id in enumerate(self.nodes)}
+
+        for root in self.nodes:
+            if root in indices:
+                continue
+
+            # 迭代DFS，避免长依赖链导致递归过深
+            work = [(root, iter(sorted(self.edges[root])))]
+            indices[root] = lowlinks[root] = index_counter
+            index_counter += 1
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                node, successors = work[-1]
+                advanced = False
+                for succ in successors:
+                    if succ not in indices:
+                        indices[succ] = lowlinks[succ] = index_counter
+                        index_counter += 1
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, iter(sorted(self.edges[succ]))))
+                        advanced = True
+                        break
+                    elif succ in on_stack:
+                        lowlinks[node] = min(lowlinks[node], indices[succ])
+                if advanced:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+                if lowlinks[node] == indices[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    component.sort(key=order.get)
+                    components.append(component)
+
+        return components
+
+    def cyclic_components(self) -> List[List[str]]:
+        """返回包含循环依赖（多于一个项目）的强连通分量"""
+        return [component for component in self.strongly_connected_components() if len(component) > 1]
+
+    def external_dependencies(self, component: List[str]) -> List[Tuple[str, str]]:
+        """
+        收集分量中所有项目在分量外部的依赖
+
+        Returns:
+            List[Tuple[str, str]]: (成员node_id, 依赖ID) 列表，依赖ID为架构文件中的原始键
+        """
+        members = set(component)
+        external = []
+        for node_id in component:
+            item = self.get_item(node_id)
+            for dep_id, dep_info in item.get("dependencies", {}).items():
+                target = self.resolve_dependency(dep_id, dep_info)
+                if target in members:
+                    continue
+                external.append((node_id, dep_id))
+        return external
+
+    def critical_path_priority(self, components: List[List[str]],
+                               weight: Optional[Callable[[str], float]] = None) -> List[Tuple[float, int]]:
+        """
+        计算每个强连通分量的关键路径优先级
+
+        阻塞下游长依赖链的分量应优先处理，使并行工作线程不会因等待依赖而空闲。
+
+        Args:
+            components: strongly_connected_components() 的结果（依赖优先顺序）
+            weight: 可选的 node_id -> 预计耗时 函数，默认每个项目耗时相同
+
+        Returns:
+            List[Tuple[float, int]]: 与components一一对应的 (下游深度, 扇出)
+                下游深度：从该分量出发、沿依赖它的项目走到底的最长加权路径（含自身）
+                扇出：直接或间接依赖该分量的项目总数
+        """
+        weight = weight or (lambda node_id: 1.0)
+        component_of = {node_id: i for i, component in enumerate(components) for node_id in component}
+        depth = [0.0] * len(components)
+        downstream = [0] * len(components)  # 位掩码：所有下游分量
+
+        # 依赖它的分量总是排在后面，因此逆序遍历即可一次算出
+        for i in range(len(components) - 1, -1, -1):
+            longest = 0.0
+            mask = 0
+            for node_id in components[i]:
+                for dependent in self.reverse_edges.get(node_id, ()):
+                    j = component_of.get(dependent)
+                    if j is None or j == i:
+                        continue
+                    longest = max(longest, depth[j])
+                    mask |= downstream[j] | (1 << j)
+            depth[i] = sum(weight(node_id) for node_id in components[i]) + longest
+            downstream[i] = mask
+
+        sizes = [len(component) for component in components]
+        priorities = []
+        for i in range(len(components)):
+            mask = downstream[i]
+            fan_out = 0
+            while mask:
+                low = mask & -mask
+                fan_out += sizes[low.bit_length() - 1]
+                mask ^= low
+            priorities.append((depth[i], fan_out))
+        return priorities
+
+
+def root_closure(data: Dict, roots: Optional[Iterable[str]], graph: Optional[DependencyGraph] = None) -> Optional[Set[str]]:
+    """
+    入口项目在架构数据中的传递依赖闭包
+
+    Args:
+        data: 架构数据（file -> kind -> item）
+        roots: 入口名称，格式见 DependencyGraph.resolve_roots；为空时返回None，表示处理全部项目
+        graph: 已构建的全类型依赖图，默认按data构建
+
+    Raises:
+        ValueError: 有入口无法解析
+    """
+    if not roots:
+        return None
+    graph = graph or DependencyGraph(data)
+    resolved, unresolved = graph.resolve_roots(roots)
+    if unresolved:
+        raise ValueError(f"找不到入口项目: {', '.join(unresolved)}")
+    return graph.closure(resolved)
@@ -0,0 +1,158 @@
+"""
+指纹模块
+
+为每个项目记录各阶段的输入指纹，支持增量重新转换：
+1. 源指纹：项目自身输入字段（如full_text、rust_signature）的哈希
+2. 依赖指纹：依赖项输出字段（如依赖的rust_signature、function_summary）的哈希
+3. 重新运行时，只有指纹变化的项目及其反向依赖闭包被作废重做，其余项目原样沿用
+"""
+
+import hashlib
+import json
+import logging
+from typing import Dict, Set, Tuple
+
+from sig_utils.dependency_graph import DependencyGraph
+
+logger = logging.getLogger(__name__)
+
+# 各阶段的状态字段、输出字段，以及参与指纹计算的自身字段和依赖项字段
+STAGES = {
+    "conversion": {
+        "status": "conversion_status",
+        "outputs": ["rust_signature", "conversion_status", "conversion_rounds", "failure_reason",
+                    "is_header_guard", "conversion_component", "conversion_seconds",
+                    "conversion_method"],
+        "source": ["full_text"],
+        "dependencies": ["rust_signature"]
+    },
+    "summary": {
+        "status": "summary_status",
+        "outputs": ["function_summary", "summary_status", "summary_review", "summary_rounds", "summary_error"],
+        "source": ["full_text", "rust_signature"],
+        "dependencies": ["rust_signature", "function_summary"]
+    },
+    "implementation": {
+        "status": "implementation_status",
+        "outputs": ["rust_implementation", "implementation_status", "review_rounds", "required_fix",
+                    "fix_rounds", "reason", "compile_errors", "last_attempt"],
+        "source": ["rust_signature", "function_summary"],
+        "dependencies": ["rust_signature", "function_summary"]
+    }
+}
+
+
+def _hash(value) -> str:
+    """对任意JSON可序列化的值计算稳定的短哈希"""
+    text = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def compute_fingerprint(graph: DependencyGraph, node_id: str, stage: str) -> Dict[str, str]:
+    """
+    计算项目在某阶段的当前指纹
+
+    Returns:
+        Dict[str, str]: {"source": 自身输入哈希, "dependencies": 依赖项输出哈希}
+    """
+    fields = STAGES[stage]
+    item = graph.get_item(node_id)
+    dependency_values = []
+    for dep in sorted(graph.dependencies_of(node_id)):
+        dep_item = graph.get_item(dep)
+        dependency_values.append([dep, [dep_item.get(field) for field in fields["dependencies"]]])
+    return {
+        "source": _hash([item.get(field) for field in fields["source"]]),
+        "dependencies": _hash(dependency_values)
+    }
+
+
+def stamp_fingerprint(graph: DependencyGraph, node_id: str, stage: str):
+    """在项目上记录该阶段的当前指纹（阶段成功完成后调用）"""
+    item = graph.get_item(node_id)
+    item.setdefault("fingerprints", {})[stage] = compute_fingerprint(graph, node_id, stage)
+
+
+def invalidate(item: Dict, stage: str):
+    """清除项目在某阶段的输出和指纹，使其重新处理"""
+    for field in STAGES[stage]["outputs"]:
+        item.pop(field, None)
+    fingerprints = item.get("fingerprints")
+    if fingerprints:
+        fingerprints.pop(stage, None)
+
+
+def find_stale_items(graph: DependencyGraph, stage: str, recorded: Dict[str, Dict[str, str]]) -> Tuple[Set[str], Set[str]]:
+    """
+    找出需要作废的项目
+
+    Args:
+        graph: 当前数据上的依赖图
+        stage: 阶段名称
+        recorded: node_id -> 上次成功时记录的指纹，没有记录指纹的旧结果视为未变化
+
+    Returns:
+        Tuple[Set[str], Set[str]]: (指纹变化的项目, 需要作废的项目即变化项目及其反向依赖闭包)
+    """
+    changed = set()
+    for node_id, fingerprint in recorded.items():
+        if fingerprint and compute_fingerprint(graph, node_id, stage) != fingerprint:
+            changed.add(node_id)
+
+    # 沿反向依赖扩散：依赖变化项目的项目都需要重做
+    stale = set()
+    stack = list(changed)
+    while stack:
+        node_id = stack.pop()
+        if node_id in stale:
+            continue
+        stale.add(node_id)
+        stack.extend(graph.dependents_of(node_id))
+
+    return changed, stale & set(recorded)
+
+
+def carry_over_stage(data: Dict, previous: Dict, stage: str) -> Dict[str, int]:
+    """
+    将上次输出中某阶段的成功结果沿用到当前数据中
+
+    只复制该阶段的输出字段和指纹，当前数据中的输入字段保持最新；
+    指纹变化的项目及其反向依赖闭包不沿用，留待重新处理。
+
+    Args:
+        data: 当前阶段的输入数据（会被原地修改）
+        previous: 上次运行的输出数据
+        stage: 阶段名称
+
+    Returns:
+        Dict[str, int]: carried（沿用数）、changed（指纹变化数）、invalidated（作废数）
+    """
+    fields = STAGES[stage]
+    graph = DependencyGraph(data)
+    recorded = {}
+
+    for node_id, (file_name, kind, item_name) in graph.nodes.items():
+        previous_item = previous.get(file_name, {}).get(kind, {}).get(item_name)
+        if not previous_item or previous_item.get(fields["status"]) != "success":
+            continue
+
+        item = graph.get_item(node_id)
+        for field in fields["outputs"]:
+            if field in previous_item:
+                item[field] = previous_item[field]
+        fingerprint = previous_item.get("fingerprints", {}).get(stage)
+        if fingerprint:
+            item.setdefault("fingerprints", {})[stage] = fingerprint
+        recorded[node_id] = fingerprint
+
+    changed, stale = find_stale_items(graph, stage, recorded)
+    for node_id in stale:
+        invalidate(graph.get_item(node_id), stage)
+        logger.info(f"[{stage}] 输入已变化，重新处理: {node_id}")
+
+    return {
+        "carried": len(recorded) - len(stale),
+        "changed": len(changed),
+        "invalidated": len(stale)
+    }
+
@@ -3,37 +3,73 @@ import logging
 import requests
 from openai import OpenAI
 
+from sig_utils.llm_cassette import CassetteMissError
+from sig_utils.resilience import CircuitOpenError, DeadlineExceededError, RequestGuard
+from sig_utils.tracing import tracer
+from sig_utils.response_schemas import StructuredOutputError, parse_response, response_format as build_response_format
+
+
+class UnsupportedResponseFormatError(RuntimeError):
+    """服务端拒绝了response_format参数"""
+
+
+def _mentions_response_format(error) -> bool:
+    """400错误的信息是否指向response_format/json_schema参数"""
+    text = f"{error} {getattr(error, 'body', '') or ''}".lower()
+    return "response_format" in text or "json_schema" in text
+
+
 class GPT:
-    def __init__(self, api_key, model_name="gpt-4o", base_url="https://api.zetatechs.com/v1"):
+    def __init__(self, api_key, model_name="gpt-4o", base_url="https://api.zetatechs.com/v1", deadline=None, hedge=False, cassette=None, guard=None):
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        if cassette is not None:
+            self.client = cassette.wrap(self.client)  # 录制请求或回放已录制的响应（sig_utils.llm_cassette）
         self.model_name = model_name
+        self.trace_name = model_name  # 追踪span的名称，由路由器设置为角色名
+        # 熔断、按p95对冲和截止时间控制，并记录每次请求的耗时；路由器为同一后端的所有角色传入同一个guard
+        self.guard = guard or RequestGuard(deadline=deadline, hedge=hedge)
         self.total_tokens_in = 0
         self.total_tokens_out = 0
+        self.total_cached_tokens = 0  # 命中服务端提示缓存的输入token数
         self.call_count = 0
+        self.cached_calls = 0         # 命中提示缓存的请求数
+        self.latency_cached = 0.0     # 命中缓存的请求的总耗时（秒）
+        self.latency_uncached = 0.0   # 未命中缓存的请求的总耗时（秒）
+        self.structured_output = True  # 服务端不支持response_format时自动关闭
+        self.structured_failures = 0   # 结构化响应不符合Schema、需要调用方回退的次数
     
-    def ask(self, messages, temperature=0.2, max_retries=3, timeout=60):
-        """发送请求给API，支持重试机制"""
+    def ask(self, messages, temperature=0.2, max_retries=3, timeout=60, response_format=None, deadline=None):
+        """发送请求给API，支持重试机制；deadline为本次调用（含重试）的截止时间（秒），默认使用guard的设置"""
         retry_count = 0
+        deadline_at = self.guard.deadline_at(deadline)
+        extra_args = {"response_format": response_format} if response_format else {}
         while retry_count < max_retries:
             try:
                 logging.info(f"开始API调用 (尝试 {retry_count+1}/{max_retries})")
                 # 添加超时设置
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=temperature,
-                    timeout=timeout
-                )
+                request_start = time.time()
+                with tracer.span(f"llm:{self.trace_name}", "llm", model=self.model_name, attempt=retry_count + 1) as span:
+                    response = self.guard.call(lambda: self.client.chat.completions.create(
+                        model=self.model_name,
+                        messages=messages,
+                        temperature=temperature,
+                        timeout=timeout,
+                        **extra_args
+                    ), deadline_at)
+                    span.set(tokens_in=response.usage.prompt_tokens, tokens_out=response.usage.completion_tokens, outcome="ok")
                 
                 # 记录Token使用情况
-                self.total_tokens_in += response.usage.prompt_tokens
-                self.total_tokens_out += response.usage.completion_tokens
-                self.call_count += 1
+                self._record_usage(response.usage, time.time() - request_start)
                 
                 content = response.choices[0].message.content.strip()
                 logging.info(f"API调用成功，返回内容长度: {len(content)}")
                 return content
             
+            except (CircuitOpenError, DeadlineExceededError, CassetteMissError) as e:
+                # 熔断、超过截止时间或回放未命中，不再重试
+                logging.warning(f"API调用中止: {e}")
+                raise
+            
             except (requests.exceptions.RequestException, requests.exceptions.Timeout) as e:
                 retry_count += 1
                 wait_time = 2 ** retry_count  # 指数退避
@@ -41,19 +77,29 @@ class GPT:
                 
                 if retry_count < max_retries:
                     logging.info(f"等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
+                    self.guard.backoff(wait_time, deadline_at)
                 else:
                     logging.error(f"网络请求失败，达到最大重试次数: {e}")
                     raise RuntimeError(f"API网络请求失败: {e}")
             
             except Exception as e:
+                # 带response_format的请求被拒绝（400）不是暂时性错误，不重试：错误信息涉及response_format时交给ask_json回退，
+                # 其他400（如上下文超长）原样抛出，不影响后续请求的结构化输出
+                if response_format and getattr(e, "status_code", None) == 400:
+                    if _mentions_response_format(e):
+                        raise UnsupportedResponseFormatError(f"服务端不支持response_format: {e}")
+                    raise
+                # 模型或路径不存在（包括本地回放服务未命中）同样不是暂时性错误
+                if getattr(e, "status_code", None) == 404:
+                    raise RuntimeError(f"API调用失败: {type(e).__name__}: {e}")
+                
                 retry_count += 1
                 wait_time = 2 ** retry_count  # 指数退避
                 logging.warning(f"API调用失败 (尝试 {retry_count}/{max_retries}): {type(e).__name__}: {e}")
                 
                 if retry_count < max_retries:
                     logging.info(f"等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
+                    self.guard.backoff(wait_time, deadline_at)
                 else:
                     logging.error(f"达到最大重试次数。错误类型: {type(e).__name__}, 错误信息: {e}")
                     # 处理常见的API错误
@@ -64,11 +110,64 @@ class GPT:
                     else:
                         raise RuntimeError(f"API调用失败: {type(e).__name__}: {e}")
     
+    def ask_json(self, messages, schema, temperature=0.2, max_retries=3, timeout=60, deadline=None):
+        """
+        请求符合JSON Schema的结构化响应
+        
+        Args:
+            messages: 对话消息
+            schema: sig_utils.response_schemas 中定义的Schema
+        
+        Returns:
+            tuple: (解析并校验后的dict, 原始响应文本)
+        
+        Raises:
+            StructuredOutputError: 响应不符合Schema，异常的raw_text为原始响应，调用方可回退到旧的文本提取
+        """
+        content = None
+        if self.structured_output:
+            try:
+                content = self.ask(messages, temperature, max_retries, timeout,
+                                   response_format=build_response_format(schema), deadline=deadline)
+            except UnsupportedResponseFormatError as e:
+                logging.warning(f"{e}，改用普通请求")
+                self.structured_output = False
+        if content is None:
+            content = self.ask(messages, temperature, max_retries, timeout, deadline=deadline)
+        
+        try:
+            return parse_response(content, schema), content
+        except StructuredOutputError:
+            self.structured_failures += 1
+            raise
+    
+    def _record_usage(self, usage, elapsed):
+        """记录一次请求的token用量和耗时，缓存命中数来自 usage.prompt_tokens_details.cached_tokens"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        self.total_tokens_in += usage.prompt_tokens
+        self.total_tokens_out += usage.completion_tokens
+        self.total_cached_tokens += cached
+        self.call_count += 1
+        if cached:
+            self.cached_calls += 1
+            self.latency_cached += elapsed
+        else:
+            self.latency_uncached += elapsed
+    
     def get_stats(self):
         """返回API使用统计"""
+        uncached_calls = self.call_count - self.cached_calls
         return {
             "calls": self.call_count,
             "tokens_in": self.total_tokens_in,
             "tokens_out": self.total_tokens_out,
-            "total_tokens": self.total_tokens_in + self.total_tokens_out
+            "total_tokens": self.total_tokens_in + self.total_tokens_out,
+            "cached_tokens": self.total_cached_tokens,
+            "cache_hit_rate": f"{(self.total_cached_tokens / self.total_tokens_in * 100):.2f}%" if self.total_tokens_in else "0%",
+            "cached_calls": self.cached_calls,
+            "avg_latency_cached": round(self.latency_cached / self.cached_calls, 3) if self.cached_calls else None,
+            "avg_latency_uncached": round(self.latency_uncached / uncached_calls, 3) if uncached_calls else None,
+            "structured_failures": self.structured_failures,
+            **self.guard.get_stats()
         } 
\ No newline at end of file
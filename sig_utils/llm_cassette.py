@@ -0,0 +1,262 @@
+"""
+大模型请求录制与回放模块
+
+不消耗token地重现一次完整运行，用于离线测试和基准测试：
+1. 录制模式：GPT客户端照常请求后端，每次请求的模型、消息、温度、响应格式和响应内容、token用量、耗时
+   按行追加到JSONL文件（cassette）
+2. 回放模式：按请求内容的哈希查找录制的响应直接返回，不访问网络；同一请求录制了多次时按录制顺序依次返回，
+   可选按录制的耗时等待，以重现真实的时延
+3. CassetteServer 以本地OpenAI兼容HTTP服务的形式提供回放，配合 --base-url 使用时经过完整的HTTP客户端路径
+
+回放未命中时抛出 CassetteMissError（不重试，不计入熔断）。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+
+class CassetteMissError(RuntimeError):
+    """回放模式下没有找到录制的响应"""
+
+    status_code = 404
+
+
+class Cassette:
+    """请求录制与回放"""
+
+    def __init__(self, path: str, mode: str = MODE_REPLAY, replay_latency: bool = False):
+        """
+        Args:
+            path: JSONL文件路径
+            mode: record（录制）或 replay（回放）
+            replay_latency: 回放时是否按录制的耗时等待
+        """
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"未知的cassette模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._entries = {}   # 请求键 -> 按录制顺序排列的响应
+        self._cursor = {}    # 请求键 -> 下一次回放的位置
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "hits": 0, "misses": 0, "replayed_latency": 0.0}
+        if mode == MODE_REPLAY:
+            self._load()
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"cassette文件不存在: {self.path}，请先使用录制模式运行一次")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    @staticmethod
+    def request_key(request: Dict) -> str:
+        """请求的哈希键：模型、消息、温度和响应格式，不含timeout等传输参数"""
+        canonical = json.dumps({
+            "model": request.get("model"),
+            "messages": request.get("messages"),
+            "temperature": request.get("temperature"),
+            "response_format": request.get("response_format")
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def record(self, request: Dict, content: str, usage: Dict, latency: float):
+        """追加一条录制记录"""
+        messages = request.get("messages") or []
+        entry = {
+            "key": self.request_key(request),
+            "model": request.get("model"),
+            "temperature": request.get("temperature"),
+            "prompt_preview": (messages[-1].get("content") or "")[:200] if messages else "",
+            "content": content,
+            "usage": usage,
+            "latency": round(latency, 3)
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._entries.setdefault(entry["key"], []).append(entry)
+            self.stats["recorded"] += 1
+
+    def lookup(self, request: Dict) -> Dict:
+        """
+        回放一次请求
+
+        Raises:
+            CassetteMissError: 没有录制该请求
+        """
+        key = self.request_key(request)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                raise CassetteMissError(f"cassette中没有该请求的录制（模型 {request.get('model')}，键 {key[:12]}）")
+            position = self._cursor.get(key, 0)
+            # 录制次数用完后重复最后一次响应
+            entry = entries[min(position, len(entries) - 1)]
+            self._cursor[key] = position + 1
+            self.stats["hits"] += 1
+            self.stats["replayed_latency"] += entry.get("latency", 0.0)
+        if self.replay_latency and entry.get("latency"):
+            time.sleep(entry["latency"])
+        return entry
+
+    def wrap(self, client) -> "CassetteClient":
+        """包装OpenAI客户端，录制模式下转发请求并录制，回放模式下不使用原客户端"""
+        return CassetteClient(self, client)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["replayed_latency"] = round(stats["replayed_latency"], 3)
+        return stats
+
+
+def _usage_dict(usage) -> Dict:
+    """OpenAI响应的usage对象 -> dict"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0
+    }
+
+
+def _response_object(entry: Dict):
+    """录制记录 -> 与OpenAI响应结构相同的对象（GPT客户端只读取choices和usage）"""
+    usage = entry.get("usage") or {}
+    return SimpleNamespace(
+        model=entry.get("model"),
+        choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=entry["content"]))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            prompt_tokens_details=SimpleNamespace(cached_tokens=usage.get("cached_tokens", 0))
+        )
+    )
+
+
+class _Completions:
+    def __init__(self, cassette: Cassette, client):
+        self._cassette = cassette
+        self._client = client
+
+    def create(self, **request):
+        if self._cassette.mode == MODE_REPLAY:
+            return _response_object(self._cassette.lookup(request))
+        start = time.time()
+        response = self._client.chat.completions.create(**request)
+        self._cassette.record(request, response.choices[0].message.content, _usage_dict(response.usage),
+                              time.time() - start)
+        return response
+
+
+class CassetteClient:
+    """替代OpenAI客户端，只实现GPT客户端用到的 chat.completions.create"""
+
+    def __init__(self, cassette: Cassette, client=None):
+        self.chat = SimpleNamespace(completions=_Completions(cassette, client))
+
+
+class CassetteServer:
+    """本地OpenAI兼容HTTP服务，回放cassette中的响应（POST /v1/chat/completions）"""
+
+    def __init__(self, cassette: Cassette, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            cassette: 回放模式的cassette
+            port: 监听端口，0表示自动选择
+        """
+        self.cassette = cassette
+        handler = self._make_handler(cassette)
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @staticmethod
+    def _make_handler(cassette: Cassette):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._reply(404, {"error": {"message": f"不支持的路径: {self.path}"}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                try:
+                    entry = cassette.lookup(request)
+                except CassetteMissError as e:
+                    self._reply(404, {"error": {"message": str(e), "type": "cassette_miss"}})
+                    return
+                usage = entry.get("usage") or {}
+                self._reply(200, {
+                    "id": f"cassette-{entry['key'][:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": entry.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": entry["content"]}}],
+                    "usage": {
+                        "prompt_tokens": usage.get("prompt_tokens", 0),
+                        "completion_tokens": usage.get("completion_tokens", 0),
+                        "total_tokens": usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0),
+                        "prompt_tokens_details": {"cached_tokens": usage.get("cached_tokens", 0)}
+                    }
+                })
+
+            def _reply(self, status, body):
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "CassetteServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="cassette-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def open_cassette(record_path: Optional[str] = None, replay_path: Optional[str] = None,
+                  replay_latency: bool = False) -> Optional[Cassette]:
+    """按命令行参数创建cassette，两者都未指定时返回None"""
+    if record_path and replay_path:
+        raise ValueError("--record 和 --replay 不能同时使用")
+    if record_path:
+        return Cassette(record_path, MODE_RECORD)
+    if replay_path:
+        return Cassette(replay_path, MODE_REPLAY, replay_latency)
+    return None
@@ -0,0 +1,374 @@
+"""
+本地转换模块
+
+基于规则的C到Rust快速转换，无需调用大模型：
+1. 宏定义：头文件保护宏直接忽略，数值/字符串常量转换为 const
+2. 类型定义：标量类型别名转换为 type 别名
+3. 结构体：仅包含标量、指针和定长数组字段的普通结构体转换为 #[repr(C)] 结构体
+4. 转换结果在本地做结构校验，无法确定的情况返回None，由调用方回退到大模型转换
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional
+
+from sig_utils.c_preprocessor import CPreprocessor
+
+logger = logging.getLogger(__name__)
+
+# C标量类型到Rust类型的映射（键为规范化后的类型名，多个单词用单个空格分隔）
+TYPE_MAP = {
+    "char": "i8",
+    "signed char": "i8",
+    "unsigned char": "u8",
+    "short": "i16",
+    "short int": "i16",
+    "signed short": "i16",
+    "unsigned short": "u16",
+    "unsigned short int": "u16",
+    "int": "i32",
+    "signed": "i32",
+    "signed int": "i32",
+    "unsigned": "u32",
+    "unsigned int": "u32",
+    "long": "i64",
+    "long int": "i64",
+    "signed long": "i64",
+    "unsigned long": "u64",
+    "unsigned long int": "u64",
+    "long long": "i64",
+    "long long int": "i64",
+    "unsigned long long": "u64",
+    "unsigned long long int": "u64",
+    "float": "f32",
+    "double": "f64",
+    "_Bool": "bool",
+    "bool": "bool",
+    "size_t": "usize",
+    "ssize_t": "isize",
+    "ptrdiff_t": "isize",
+    "intptr_t": "isize",
+    "uintptr_t": "usize",
+    "int8_t": "i8",
+    "int16_t": "i16",
+    "int32_t": "i32",
+    "int64_t": "i64",
+    "uint8_t": "u8",
+    "uint16_t": "u16",
+    "uint32_t": "u32",
+    "uint64_t": "u64",
+}
+
+# 仅能出现在指针后面的类型
+POINTER_ONLY_TYPES = {"void": "core::ffi::c_void"}
+
+RUST_KEYWORDS = {
+    "as", "break", "const", "continue", "crate", "else", "enum", "extern", "false", "fn", "for",
+    "if", "impl", "in", "let", "loop", "match", "mod", "move", "mut", "pub", "ref", "return",
+    "self", "Self", "static", "struct", "super", "trait", "true", "type", "unsafe", "use", "where",
+    "while", "async", "await", "dyn", "abstract", "become", "box", "do", "final", "macro",
+    "override", "priv", "typeof", "unsized", "virtual", "yield", "try",
+}
+
+# 不能写成 r#name 的关键字
+RAW_IDENTIFIER_EXCLUDED = {"self", "Self", "super", "crate"}
+
+IDENTIFIER = r"[A-Za-z_][A-Za-z0-9_]*"
+# 带可选后缀的整数字面量（十进制、十六进制、八进制）
+INTEGER_LITERAL = re.compile(r"^(-?)(0[xX][0-9A-Fa-f]+|0[0-7]*|[1-9][0-9]*)([uU]?[lL]{0,2}|[lL]{1,2}[uU])$")
+FLOAT_LITERAL = re.compile(r"^-?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?([fFlL]?)$")
+STRING_LITERAL = re.compile(r'^"([^"\\]|\\.)*"$')
+CHAR_LITERAL = re.compile(r"^'([^'\\]|\\.)'$")
+# C与Rust含义相同的转义序列；八进制（\0后跟数字）、变长十六进制和\a、\v等Rust不支持的转义交给大模型
+SHARED_ESCAPE = re.compile(r"\\(?:[nrt\\'\"]|0(?![0-7])|x[0-7][0-9A-Fa-f](?![0-9A-Fa-f]))")
+# Rust整数类型的取值范围（usize按64位目标）
+INTEGER_RANGES = {
+    "i32": (-2 ** 31, 2 ** 31 - 1),
+    "u32": (0, 2 ** 32 - 1),
+    "i64": (-2 ** 63, 2 ** 63 - 1),
+    "u64": (0, 2 ** 64 - 1),
+    "usize": (0, 2 ** 64 - 1),
+}
+FLOAT_MAX = {"f32": 3.4028234663852886e38, "f64": 1.7976931348623157e308}
+
+
+class LocalConverter:
+    """基于规则的本地转换器 - 只处理能够确定性转换的简单项目"""
+
+    def convert(self, kind: str, c_code: str) -> Optional[Dict]:
+        """
+        尝试在本地转换一个C代码项
+
+        Args:
+            kind: 项目类型（defines、typedefs、structs）
+            c_code: 原始C代码
+
+        Returns:
+            Optional[Dict]: 成功时返回 {"rust_code", "rule", "is_header_guard"}，无法处理时返回None
+        """
+        handlers = {
+            "defines": self._convert_define,
+            "typedefs": self._convert_typedef,
+            "structs": self._convert_struct,
+        }
+        handler = handlers.get(kind)
+        if not handler:
+            return None
+
+        try:
+            result = handler(c_code)
+        except Exception as e:
+            logger.debug(f"本地转换异常，交由大模型处理: {e}")
+            return None
+        if not result:
+            return None
+
+        if not result.get("is_header_guard") and not self.validate(kind, result["rust_code"]):
+            logger.debug(f"本地转换结果未通过校验，交由大模型处理: {result['rust_code']}")
+            return None
+        result.setdefault("is_header_guard", False)
+        return result
+
+    # ------------------------------------------------------------------
+    # 宏定义
+    # ------------------------------------------------------------------
+
+    def _convert_define(self, c_code: str) -> Optional[Dict]:
+        text = CPreprocessor.clean_comments(c_code).strip()
+        if "\\\n" in text:
+            return None  # 多行宏
+        macro_type = CPreprocessor.classify_macro(text)
+
+        # 除CPreprocessor识别的形式外，无值且以 _H/_H_ 结尾的宏（如 ZOPFLI_SLICE_H_）也是头文件保护宏
+        if macro_type == "header_guard" or re.match(rf"^\s*#\s*define\s+{IDENTIFIER}_H_*\s*$", text):
+            return {
+                "rust_code": "// 头文件保护宏在Rust中不需要，已忽略",
+                "rule": "header_guard",
+                "is_header_guard": True
+            }
+        if macro_type == "conditional":
+            return None
+
+        # classify_macro会把值以括号开头的宏（如 #define EOF (-1)）归为函数宏，
+        # 这里要求宏名与值之间有空白，真正的函数宏 NAME(args) 不会匹配
+        match = re.match(rf"^\s*#\s*define\s+({IDENTIFIER})\s+(.+)$", text)
+        if not match:
+            return None
+        name, value = match.group(1), match.group(2).strip()
+        # 去掉包裹整个值的一层括号，如 (-1)
+        if value.startswith("(") and value.endswith(")") and value.count("(") == 1:
+            value = value[1:-1].strip()
+
+        constant = self._convert_literal(value)
+        if not constant:
+            return None
+        rust_type, rust_value = constant
+        return {"rust_code": f"pub const {name}: {rust_type} = {rust_value};", "rule": "constant"}
+
+    def _convert_literal(self, value: str) -> Optional[tuple]:
+        """将C字面量转换为 (Rust类型, Rust值)，无法确定时返回None"""
+        match = INTEGER_LITERAL.match(value)
+        if match:
+            sign, digits, suffix = match.groups()
+            suffix = suffix.lower()
+            if len(digits) > 1 and digits.startswith("0") and not digits.lower().startswith("0x"):
+                digits = "0o" + digits[1:]  # C八进制字面量
+            unsigned = "u" in suffix
+            long_suffix = "l" in suffix
+            if sign:
+                rust_type = "i64" if long_suffix else "i32"
+            elif unsigned:
+                rust_type = "u64" if long_suffix else "u32"
+            elif long_suffix:
+                rust_type = "i64"
+            else:
+                # 无后缀的非负整数常量多用作长度、下标和数组大小，与已有转换结果保持一致使用usize
+                rust_type = "usize"
+            minimum, maximum = INTEGER_RANGES[rust_type]
+            if not minimum <= int(f"{sign}{digits}", 0) <= maximum:
+                return None  # 超出目标类型范围
+            return rust_type, f"{sign}{digits}"
+
+        match = FLOAT_LITERAL.match(value)
+        if match and any(ch in value for ch in ".eE"):
+            suffix = match.group(3)
+            number = value[:-1] if suffix else value
+            if number.endswith("."):
+                number += "0"
+            if number.startswith(".") or number.startswith("-."):
+                number = number.replace(".", "0.", 1)
+            rust_type = "f32" if suffix in ("f", "F") else "f64"
+            if abs(float(number)) > FLOAT_MAX[rust_type]:
+                return None  # 超出目标类型范围
+            return rust_type, number
+
+        if STRING_LITERAL.match(value) or CHAR_LITERAL.match(value):
+            if not self._has_shared_escapes(value[1:-1]):
+                return None
+            if value.startswith('"'):
+                return "&str", value
+            return "u8", f"b{value}"
+        return None
+
+    @staticmethod
+    def _has_shared_escapes(body: str) -> bool:
+        """字面量中的转义序列是否都能原样用于Rust"""
+        return "\\" not in SHARED_ESCAPE.sub("", body)
+
+    # ------------------------------------------------------------------
+    # 类型定义
+    # ------------------------------------------------------------------
+
+    def _convert_typedef(self, c_code: str) -> Optional[Dict]:
+        text = CPreprocessor.clean_comments(c_code)
+        text = re.sub(r"\s+", " ", text).strip().rstrip(";").strip()
+        if "(" in text or "{" in text or "[" in text:
+            return None  # 函数指针、匿名结构体、数组类型交给大模型
+
+        match = re.match(rf"^typedef (.+?)\s*({IDENTIFIER})$", text)
+        if not match:
+            return None
+        c_type, alias = match.group(1).strip(), match.group(2)
+
+        # typedef struct X Y：结构体本身由结构体项转换，这里只生成别名
+        struct_match = re.match(rf"^(struct|union|enum) ({IDENTIFIER})$", c_type)
+        if struct_match:
+            target = struct_match.group(2)
+            if target == alias:
+                return None  # 同名别名在Rust中没有对应写法，保留原有处理
+            return {"rust_code": f"pub type {alias} = {target};", "rule": "struct_alias"}
+
+        rust_type = self._map_type(c_type)
+        if not rust_type:
+            return None
+        return {"rust_code": f"pub type {alias} = {rust_type};", "rule": "scalar_typedef"}
+
+    # ------------------------------------------------------------------
+    # 结构体
+    # ------------------------------------------------------------------
+
+    def _convert_struct(self, c_code: str) -> Optional[Dict]:
+        text = CPreprocessor.clean_comments(c_code)
+        text = re.sub(r"\s+", " ", text).strip().rstrip(";").strip()
+
+        match = re.match(rf"^(?:typedef )?struct ({IDENTIFIER}) ?\{{(.*)\}}\s*({IDENTIFIER})?$", text)
+        if not match:
+            return None
+        name, body, typedef_name = match.group(1), match.group(2), match.group(3)
+        if typedef_name and typedef_name != name:
+            return None
+        # 嵌套结构体、联合体、位域、函数指针交给大模型
+        if re.search(r"[{}():]|\bunion\b|\benum\b", body):
+            return None
+
+        fields = []
+        for declaration in body.split(";"):
+            declaration = declaration.strip()
+            if not declaration:
+                continue
+            converted = self._convert_field_declaration(declaration)
+            if converted is None:
+                return None
+            fields.extend(converted)
+        if not fields:
+            return None
+
+        names = [field_name for field_name, _ in fields]
+        if len(set(names)) != len(names):
+            return None
+
+        lines = ["#[repr(C)]", "#[derive(Debug, Clone, Copy)]", f"pub struct {name} {{"]
+        for field_name, rust_type in fields:
+            lines.append(f"    pub {self._field_name(field_name)}: {rust_type},")
+        lines.append("}")
+        return {"rust_code": "\n".join(lines), "rule": "plain_struct"}
+
+    def _convert_field_declaration(self, declaration: str) -> Optional[List[tuple]]:
+        """转换一条字段声明（可能包含多个逗号分隔的声明符），返回 [(字段名, Rust类型)]"""
+        declarators = [part.strip() for part in declaration.split(",")]
+        first = re.match(rf"^(.*?)\s*(\**)\s*({IDENTIFIER})\s*(\[[^\]]*\])?$", declarators[0])
+        if not first:
+            return None
+        base_type = first.group(1).strip()
+        if not base_type:
+            return None
+
+        fields = []
+        for index, declarator in enumerate(declarators):
+            if index == 0:
+                stars, field_name, array = first.group(2), first.group(3), first.group(4)
+            else:
+                match = re.match(rf"^(\**)\s*({IDENTIFIER})\s*(\[[^\]]*\])?$", declarator)
+                if not match:
+                    return None
+                stars, field_name, array = match.groups()
+
+            rust_type = self._map_type(base_type + " " + stars if stars else base_type)
+            if not rust_type:
+                return None
+            if array:
+                size = array[1:-1].strip()
+                if re.fullmatch(r"\d+", size) or re.fullmatch(IDENTIFIER, size):
+                    rust_type = f"[{rust_type}; {size}]"
+                else:
+                    return None  # 表达式数组长度交给大模型
+            fields.append((field_name, rust_type))
+        return fields
+
+    # ------------------------------------------------------------------
+    # 类型映射与校验
+    # ------------------------------------------------------------------
+
+    def _map_type(self, c_type: str) -> Optional[str]:
+        """将C类型（可带const和指针）映射为Rust类型，无法映射时返回None"""
+        c_type = re.sub(r"\s*\*", " *", c_type).strip()
+        tokens = c_type.split()
+        pointer_depth = 0
+        # 指针本身的const（如 int *const p）不影响Rust类型
+        while tokens and tokens[-1] in ("*", "const"):
+            if tokens.pop() == "*":
+                pointer_depth += 1
+
+        pointee_const = "const" in tokens
+        tokens = [token for token in tokens if token not in ("const", "volatile", "struct")]
+        if not tokens:
+            return None
+        base = " ".join(tokens)
+
+        if base in TYPE_MAP:
+            rust_type = TYPE_MAP[base]
+        elif pointer_depth and base in POINTER_ONLY_TYPES:
+            rust_type = POINTER_ONLY_TYPES[base]
+        elif pointer_depth and re.fullmatch(IDENTIFIER, base) and not base.endswith("_t"):
+            # 项目内定义的类型只允许出现在指针后面：按依赖顺序已先行转换，
+            # 但不一定实现Copy，按值嵌入会使生成的derive无法编译
+            rust_type = base
+        else:
+            return None
+
+        for level in range(pointer_depth):
+            qualifier = "const" if pointee_const and level == 0 else "mut"
+            rust_type = f"*{qualifier} {rust_type}"
+        return rust_type
+
+    @staticmethod
+    def _field_name(name: str) -> str:
+        # self、Self、super、crate不能作为原始标识符，改名加下划线后缀
+        if name in RAW_IDENTIFIER_EXCLUDED:
+            return f"{name}_"
+        return f"r#{name}" if name in RUST_KEYWORDS else name
+
+    @staticmethod
+    def validate(kind: str, rust_code: str) -> bool:
+        """对本地转换结果做结构校验：只包含一个声明、括号配对、没有函数实现"""
+        if rust_code.count("{") != rust_code.count("}") or rust_code.count("[") != rust_code.count("]"):
+            return False
+        if re.search(r"\bfn\b|\bimpl\b", rust_code):
+            return False
+        if kind == "defines":
+            return re.fullmatch(rf"pub const {IDENTIFIER}: [^=]+ = [^;]+;", rust_code) is not None
+        if kind == "typedefs":
+            return re.fullmatch(rf"pub type {IDENTIFIER} = [^;]+;", rust_code) is not None
+        if kind == "structs":
+            return re.search(rf"^pub struct {IDENTIFIER} \{{$", rust_code, re.MULTILINE) is not None
+        return False
@@ -0,0 +1,285 @@
+"""
+运行指标模块
+
+三个阶段共用的运行指标，可定期写入Prometheus textfile格式的文件供看板采集，运行结束时也用于生成运行历史记录：
+1. 每个Agent角色的大模型请求耗时p50/p95/p99和失败次数、各阶段编译耗时分位数
+   （来自 sig_utils.tracing 的span，无需开启追踪导出）
+2. 按阶段和项目类型统计输入/输出token总数及每个项目的平均token数
+3. 按阶段统计完成的项目数和结果、平均轮数、每分钟完成项目数，以及按依赖图剩余项目数估计的剩余时间
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from sig_utils.resilience import LatencyTracker
+from sig_utils.tracing import tracer
+
+PREFIX = "c2rust"
+
+
+class _Timing:
+    """一组耗时样本：分位数按最近的样本计算，总和与次数覆盖整次运行"""
+
+    def __init__(self, window: int = 5000):
+        self.latency = LatencyTracker(window)
+        self.total = 0.0
+        self.failures = 0
+
+
+class RunMetrics:
+    """一次运行的指标"""
+
+    def __init__(self):
+        self.active = False
+        self.path = None
+        self.interval = 15.0
+        self.started_at = None
+        self.stopped_at = None
+        self._llm = {}        # 角色 -> _Timing
+        self._compile = {}    # 阶段 -> _Timing
+        self._tokens = {}     # (阶段, 类型) -> [输入token, 输出token, 请求次数, 请求耗时]
+        self._items = {}      # (阶段, 类型, 结果) -> 项目数
+        self._rounds = {}     # (阶段, 类型) -> [总轮数, 有轮数记录的项目数]
+        self._remaining = {}  # 阶段 -> 返回剩余项目数的函数
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, path: Optional[str] = None, interval: float = 15.0):
+        """
+        开始收集指标，指定路径时每interval秒刷新一次指标文件
+
+        Args:
+            path: 指标文件路径（如 node_exporter textfile 目录下的 c2rust.prom），为None时只在内存中收集
+        """
+        with self._lock:
+            self._llm, self._compile, self._tokens, self._items, self._rounds, self._remaining = {}, {}, {}, {}, {}, {}
+        self.active = True
+        self.path = path
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped_at = None
+        tracer.add_sink(self._on_span)
+        self._stop.clear()
+        if path:
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止收集并写出最终的指标文件"""
+        if not self.active:
+            return
+        self.active = False
+        self.stopped_at = time.time()
+        tracer.remove_sink(self._on_span)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.write()
+
+    def track_remaining(self, stage: str, remaining: Callable[[], int]):
+        """登记阶段的剩余工作量，通常为就绪队列的 remaining"""
+        if self.active:
+            with self._lock:
+                self._remaining[stage] = remaining
+
+    def record_item(self, stage: str, kind: str, outcome: str, rounds: Optional[int] = None):
+        """记录阶段完成一个项目，outcome为写回的状态（success、failed、error等），rounds为生成/审核/修复轮数"""
+        if not self.active:
+            return
+        key = (stage, kind, outcome or "unknown")
+        with self._lock:
+            self._items[key] = self._items.get(key, 0) + 1
+            if rounds:
+                totals = self._rounds.setdefault((stage, kind), [0, 0])
+                totals[0] += rounds
+                totals[1] += 1
+
+    def _on_span(self, name: str, category: str, seconds: float, args: Dict):
+        """tracing的sink：收集大模型请求和编译的耗时与token"""
+        if category == "llm":
+            failed = str(args.get("outcome", "")).startswith("error")
+            with self._lock:
+                timing = self._llm.setdefault(name.split(":", 1)[-1], _Timing())
+                if failed:
+                    timing.failures += 1
+                else:
+                    timing.total += seconds
+                key = (args.get("stage", "unknown"), args.get("kind", "unknown"))
+                tokens = self._tokens.setdefault(key, [0, 0, 0, 0.0])
+                tokens[0] += args.get("tokens_in", 0)
+                tokens[1] += args.get("tokens_out", 0)
+                tokens[2] += 1
+                tokens[3] += seconds
+            if not failed:
+                timing.latency.record(seconds)
+        elif category == "compile":
+            with self._lock:
+                timing = self._compile.setdefault(args.get("stage", "unknown"), _Timing())
+                timing.total += seconds
+            timing.latency.record(seconds)
+
+    def snapshot(self) -> Dict:
+        """当前指标的字典形式"""
+        elapsed = (self.stopped_at or time.time()) - self.started_at if self.started_at else 0.0
+        with self._lock:
+            llm = dict(self._llm)
+            compile_timings = dict(self._compile)
+            tokens = {key: list(value) for key, value in self._tokens.items()}
+            items = dict(self._items)
+            rounds = {key: list(value) for key, value in self._rounds.items()}
+            remaining = dict(self._remaining)
+
+        done = {}  # (阶段, 类型) -> 项目数
+        for (stage, kind, _), count in items.items():
+            done[(stage, kind)] = done.get((stage, kind), 0) + count
+
+        stages = {}
+        for stage in sorted({stage for stage, _ in done} | set(remaining)):
+            completed = sum(count for (s, _), count in done.items() if s == stage)
+            rate = completed / (elapsed / 60) if elapsed > 0 else 0.0
+            left = remaining[stage]() if stage in remaining else None
+            eta = None
+            if left is not None and rate > 0:
+                eta = round(left / rate * 60, 1)
+            stage_rounds = [sum(value[i] for (s, _), value in rounds.items() if s == stage) for i in (0, 1)]
+            stages[stage] = {
+                "items": completed,
+                "items_per_minute": round(rate, 2),
+                "rounds_per_item": round(stage_rounds[0] / stage_rounds[1], 2) if stage_rounds[1] else None,
+                "remaining": left,
+                "eta_seconds": eta
+            }
+
+        # 按阶段和类型的用量，没有大模型请求的类型（如规则转换）也列出，用于运行历史和运行前估算
+        token_rows = []
+        for key in sorted(set(tokens) | set(done)):
+            tokens_in, tokens_out, calls, seconds = tokens.get(key, (0, 0, 0, 0.0))
+            count = done.get(key, 0)
+            kind_rounds = rounds.get(key)
+            token_rows.append({
+                "stage": key[0],
+                "kind": key[1],
+                "items": count,
+                "calls": calls,
+                "llm_time": round(seconds, 3),
+                "tokens_in": tokens_in,
+                "tokens_out": tokens_out,
+                "per_item_in": round(tokens_in / count, 1) if count else None,
+                "per_item_out": round(tokens_out / count, 1) if count else None,
+                "calls_per_item": round(calls / count, 3) if count else None,
+                "rounds_per_item": round(kind_rounds[0] / kind_rounds[1], 2) if kind_rounds and kind_rounds[1] else None
+            })
+
+        # 各阶段并发推进且后一阶段依赖前一阶段，整体剩余时间取各阶段的最大值
+        etas = [stage["eta_seconds"] for stage in stages.values() if stage["eta_seconds"] is not None]
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "eta_seconds": max(etas) if etas else None,
+            "stages": stages,
+            "items": [{"stage": s, "kind": k, "outcome": o, "count": c} for (s, k, o), c in sorted(items.items())],
+            "tokens": token_rows,
+            "llm": {role: dict(timing.latency.snapshot(), total=round(timing.total, 3), failures=timing.failures)
+                    for role, timing in sorted(llm.items())},
+            "compile": {stage: dict(timing.latency.snapshot(), total=round(timing.total, 3))
+                        for stage, timing in sorted(compile_timings.items())}
+        }
+
+    def render(self) -> str:
+        """Prometheus textfile格式的指标文本"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for suffix, labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{PREFIX}_{name}{suffix}{{{label_text}}} {value}" if label_text else f"{PREFIX}_{name}{suffix} {value}")
+
+        def summary_samples(timings: Dict, label: str) -> List:
+            samples = []
+            for key, timing in timings.items():
+                for quantile in ("p50", "p95", "p99"):
+                    if quantile in timing:
+                        samples.append(("", {label: key, "quantile": f"0.{quantile[1:]}"}, timing[quantile]))
+                samples.append(("_sum", {label: key}, timing["total"]))
+                samples.append(("_count", {label: key}, timing["count"]))
+            return samples
+
+        metric("llm_request_seconds", "summary", "各Agent角色成功的大模型请求耗时（秒）",
+               summary_samples(snapshot["llm"], "agent"))
+        metric("llm_request_failures_total", "counter", "各Agent角色失败的大模型请求次数",
+               [("", {"agent": role}, timing["failures"]) for role, timing in snapshot["llm"].items()])
+        metric("compile_seconds", "summary", "各阶段的编译验证耗时（秒）",
+               summary_samples(snapshot["compile"], "stage"))
+        token_samples, per_item_samples = [], []
+        for row in snapshot["tokens"]:
+            for direction in ("in", "out"):
+                labels = {"stage": row["stage"], "kind": row["kind"], "direction": direction}
+                token_samples.append(("", labels, row[f"tokens_{direction}"]))
+                per_item_samples.append(("", labels, row[f"per_item_{direction}"]))
+        metric("tokens_total", "counter", "按阶段和项目类型统计的token数", token_samples)
+        metric("tokens_per_item", "gauge", "按阶段和项目类型统计的每个项目平均token数", per_item_samples)
+        metric("items_total", "counter", "按阶段、项目类型和结果统计的完成项目数",
+               [("", {"stage": row["stage"], "kind": row["kind"], "outcome": row["outcome"]}, row["count"])
+                for row in snapshot["items"]])
+        metric("items_per_minute", "gauge", "各阶段每分钟完成的项目数",
+               [("", {"stage": stage}, row["items_per_minute"]) for stage, row in snapshot["stages"].items()])
+        metric("rounds_per_item", "gauge", "各阶段每个项目的平均生成/审核/修复轮数",
+               [("", {"stage": stage}, row["rounds_per_item"]) for stage, row in snapshot["stages"].items()])
+        metric("remaining_items", "gauge", "各阶段依赖图中尚未完成的项目数",
+               [("", {"stage": stage}, row["remaining"]) for stage, row in snapshot["stages"].items()])
+        metric("eta_seconds", "gauge", "按当前吞吐量估计的剩余时间（秒），stage=\"all\"为整次运行",
+               [("", {"stage": stage}, row["eta_seconds"]) for stage, row in snapshot["stages"].items()]
+               + [("", {"stage": "all"}, snapshot["eta_seconds"])])
+        metric("run_elapsed_seconds", "gauge", "本次运行已用时间（秒）", [("", {}, snapshot["elapsed_seconds"])])
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """写出指标文件（先写临时文件再替换，采集方不会读到写了一半的文件）"""
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_path, self.path)
+
+    def summary_lines(self) -> List[str]:
+        """吞吐量、剩余时间、token和耗时分位数的摘要，用于日志"""
+        snapshot = self.snapshot()
+        lines = []
+        for stage, row in snapshot["stages"].items():
+            eta = f"{row['eta_seconds']}s" if row["eta_seconds"] is not None else "未知"
+            lines.append(f"[{stage}] 完成 {row['items']} 项, {row['items_per_minute']} 项/分钟, 剩余 {row['remaining']} 项, 预计剩余 {eta}")
+        for row in snapshot["tokens"]:
+            lines.append(f"[{row['stage']}/{row['kind']}] token {row['tokens_in']}/{row['tokens_out']}, "
+                         f"每项 {row['per_item_in']}/{row['per_item_out']}")
+        for label, timings in (("Agent", snapshot["llm"]), ("编译", snapshot["compile"])):
+            for key, timing in timings.items():
+                if "p50" in timing:
+                    lines.append(f"{label} {key}: {timing['count']} 次, p50={timing['p50']}s, p95={timing['p95']}s, p99={timing['p99']}s")
+        return lines
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# 进程内共用的运行指标
+run_metrics = RunMetrics()
@@ -0,0 +1,101 @@
+"""
+微批处理模块
+
+将多个兼容的小项目合并到一次大模型请求中：
+1. 从就绪队列中取出与当前项目兼容（类型相同、体积较小）的其他就绪项目，最多K个，不兼容的放回队列
+2. 多个项目使用与联合转换相同的 "### key + 代码块" 格式拼接到一个提示中
+3. 响应按 items 中的键拆分回各项目，缺失或无效的项目由调用方逐个重新处理
+"""
+
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from sig_utils.prompt_budget import TokenCounter
+from sig_utils.ready_queue import ReadyQueue
+
+
+class MicroBatcher:
+    """微批处理器"""
+
+    def __init__(self, max_batch_size: int = 8, max_item_tokens: int = 300, max_scan: Optional[int] = None,
+                 counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            max_batch_size: 每批最多项目数
+            max_item_tokens: 可参与批处理的单个项目最大token数
+            max_scan: 组批时最多从队列中查看的项目数，默认为max_batch_size的4倍
+            counter: token计数器
+        """
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_item_tokens = max_item_tokens
+        self.max_scan = max_scan or self.max_batch_size * 4
+        self.counter = counter or TokenCounter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    def fits(self, text: str) -> bool:
+        """项目是否足够小，可以参与批处理"""
+        return self.enabled and self.counter.count(text) <= self.max_item_tokens
+
+    def take(self, queue: ReadyQueue, first: int, key: Callable[[int], Optional[Hashable]]) -> List[int]:
+        """
+        以first为首组成一批就绪分量
+
+        Args:
+            queue: 就绪队列（first已出队）
+            first: 本批第一个分量索引
+            key: 分量 -> 批处理键，键相同的分量可以合批，返回None表示不参与批处理
+
+        Returns:
+            List[int]: 本批分量索引（第一个为first）
+        """
+        batch = [first]
+        batch_key = key(first) if self.enabled else None
+        if batch_key is None:
+            return batch
+
+        skipped = []
+        scanned = 0
+        while len(batch) < self.max_batch_size and len(queue) and scanned < self.max_scan:
+            index = queue.pop()
+            scanned += 1
+            if key(index) == batch_key:
+                batch.append(index)
+            else:
+                skipped.append(index)
+        for index in skipped:
+            queue.requeue(index)
+        return batch
+
+    @staticmethod
+    def format_items(entries: Dict[str, str], language: str = "c") -> str:
+        """将多个项目拼接为 "### key + 代码块" 格式"""
+        return "".join(f"### {key}\n```{language}\n{text}\n```\n\n" for key, text in entries.items())
+
+    @staticmethod
+    def split_results(response: Optional[Dict], keys: List[str],
+                      is_valid: Callable[[object], bool] = bool) -> Tuple[Dict[str, object], List[str]]:
+        """
+        按键拆分批处理响应
+
+        Args:
+            response: 响应JSON，结果位于 items 字段
+            keys: 本批项目的键
+            is_valid: 判断单个结果是否可用
+
+        Returns:
+            Tuple[Dict[str, object], List[str]]: (可用结果, 缺失或无效需要重新处理的键)
+        """
+        items = response.get("items") if isinstance(response, dict) else None
+        if not isinstance(items, dict):
+            items = {}
+        results = {}
+        missing = []
+        for key in keys:
+            value = items.get(key)
+            if value is not None and is_valid(value):
+                results[key] = value
+            else:
+                missing.append(key)
+        return results, missing
@@ -0,0 +1,285 @@
+"""
+模型路由模块
+
+按Agent角色选择模型和后端：
+1. 每个角色（转换、审核、仲裁、检测、总结、实现、修复）对应一条路由，路由是按顺序尝试的后端列表，
+   第一个后端失败（重试耗尽、熔断、超过截止时间）时依次回退到后面的后端；
+   同一后端（base_url, model）的所有角色共享一个请求保护（RequestGuard），后端故障时所有角色一起熔断
+2. 路由配置为JSON文件，未配置的角色使用default；后端可以指向本地的OpenAI兼容服务，便于离线测试
+3. 按路由统计调用次数、失败与回退次数、耗时分位数、token数和估算成本，用于调整路由
+4. 预算紧张时可切换为低价优先，按价格从低到高尝试路由中的后端（未知价格的后端排在最后）
+
+配置示例：
+{
+    "default": {"model": "gpt-4o", "base_url": "https://api.zetatechs.com/v1"},
+    "routes": {
+        "detector": ["gpt-4o-mini", "gpt-4o"],
+        "reviewer": [{"model": "gpt-4o-mini"}, {"model": "gpt-4o"}],
+        "fixer": [{"model": "qwen2.5-coder", "base_url": "http://localhost:8000/v1", "api_key_env": "LOCAL_API_KEY"}]
+    },
+    "prices": {"qwen2.5-coder": {"input": 0, "output": 0}}
+}
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from sig_utils.resilience import LatencyTracker, RequestGuard
+from sig_utils.response_schemas import StructuredOutputError
+
+# Agent角色
+ROLES = ("converter", "reviewer", "arbiter", "detector", "summariser", "implementer", "fixer")
+
+DEFAULT_BACKEND = {"model": "gpt-4o", "base_url": "https://api.zetatechs.com/v1"}
+
+# 每百万token的价格（美元），用于估算成本；未列出的模型不计成本
+DEFAULT_PRICES = {
+    "gpt-4o": {"input": 2.5, "output": 10.0},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.6},
+    "gpt-4.1": {"input": 2.0, "output": 8.0},
+    "gpt-4.1-mini": {"input": 0.4, "output": 1.6}
+}
+
+
+class RoutedClient:
+    """一个角色的客户端：接口与GPT相同，按路由顺序调用后端，失败时回退"""
+
+    def __init__(self, role: str, backends: List[Dict], prices: Dict):
+        """
+        Args:
+            role: 角色名
+            backends: [{"model", "base_url", "client"}]，按尝试顺序排列
+            prices: 模型 -> {"input", "output"} 每百万token价格
+        """
+        self.role = role
+        self.prices = prices
+        self.backends = []
+        for backend in backends:
+            self.backends.append(dict(backend, latency=LatencyTracker(), calls=0, failures=0, fallbacks=0, total_time=0.0))
+        self.economy = False
+        self._lock = threading.Lock()
+
+    def _ordered_backends(self) -> List[Dict]:
+        """尝试顺序：默认按配置顺序，低价优先时按每百万token输入+输出价格升序（排序稳定）"""
+        if not self.economy:
+            return self.backends
+
+        def price(backend):
+            model_price = self.prices.get(backend["model"])
+            return model_price["input"] + model_price["output"] if model_price else float("inf")
+        return sorted(self.backends, key=price)
+
+    @property
+    def model_name(self) -> str:
+        return self.backends[0]["model"]
+
+    @property
+    def guard(self):
+        """第一个后端的请求保护（兼容直接使用GPT客户端的代码）"""
+        return getattr(self.backends[0]["client"], "guard", None)
+
+    def ask(self, messages, *args, **kwargs):
+        return self._route("ask", messages, *args, **kwargs)
+
+    def ask_json(self, messages, schema, *args, **kwargs):
+        return self._route("ask_json", messages, schema, *args, **kwargs)
+
+    def _route(self, method: str, *args, **kwargs):
+        """按顺序调用后端；结构化响应不符合Schema不是后端故障，直接交给调用方处理"""
+        last_error = None
+        backends = self._ordered_backends()
+        for position, backend in enumerate(backends):
+            is_last = position == len(backends) - 1
+            guard = getattr(backend["client"], "guard", None)
+            if not is_last and guard is not None and guard.breaker.retry_after() > 0:
+                # 熔断中的后端直接跳过
+                self._count(backend, "fallbacks")
+                continue
+            start = time.time()
+            try:
+                result = getattr(backend["client"], method)(*args, **kwargs)
+            except StructuredOutputError:
+                # 后端已正常返回，同样计入调用次数和耗时
+                self._record_call(backend, time.time() - start)
+                raise
+            except Exception as e:
+                last_error = e
+                self._count(backend, "failures")
+                if not is_last:
+                    self._count(backend, "fallbacks")
+                continue
+            self._record_call(backend, time.time() - start)
+            return result
+        raise last_error
+
+    def _record_call(self, backend: Dict, elapsed: float):
+        backend["latency"].record(elapsed)
+        with self._lock:
+            backend["calls"] += 1
+            backend["total_time"] += elapsed
+
+    def _count(self, backend: Dict, field: str):
+        with self._lock:
+            backend[field] += 1
+
+    def get_stats(self) -> Dict:
+        """返回第一个后端的统计（兼容GPT.get_stats），各后端的统计见 route_stats"""
+        return self.backends[0]["client"].get_stats()
+
+    def route_stats(self) -> List[Dict]:
+        """返回每个后端的调用、回退、耗时、token和估算成本；对冲次数来自共享的guard，为使用该后端的所有角色合计"""
+        stats = []
+        for backend in self.backends:
+            client_stats = backend["client"].get_stats()
+            tokens_in = client_stats.get("tokens_in", 0)
+            tokens_out = client_stats.get("tokens_out", 0)
+            price = self.prices.get(backend["model"])
+            cost = None
+            if price:
+                cost = round((tokens_in * price["input"] + tokens_out * price["output"]) / 1_000_000, 4)
+            stats.append({
+                "model": backend["model"],
+                "base_url": backend["base_url"],
+                "calls": backend["calls"],
+                "failures": backend["failures"],
+                "fallbacks": backend["fallbacks"],
+                "latency": backend["latency"].snapshot(),
+                "total_time": round(backend["total_time"], 3),
+                "tokens_in": tokens_in,
+                "tokens_out": tokens_out,
+                "cost": cost,
+                "hedged_calls": client_stats.get("hedged_calls", 0)
+            })
+        return stats
+
+
+class ModelRouter:
+    """按角色创建路由客户端"""
+
+    def __init__(self, api_key: str, config: Optional[Dict] = None, base_url: Optional[str] = None,
+                 request_options: Optional[Dict] = None):
+        """
+        Args:
+            api_key: 默认API密钥，后端配置了api_key_env且该环境变量存在时使用环境变量
+            config: 路由配置，格式见模块说明；为None时所有角色使用gpt-4o
+            base_url: 覆盖所有后端的地址，例如指向本地的OpenAI兼容服务
+            request_options: 传给GPT客户端的选项（deadline、hedge、cassette）
+        """
+        config = config or {}
+        self.api_key = api_key
+        self.base_url = base_url
+        self.request_options = request_options or {}
+        self.default = self._normalize(config.get("default"), DEFAULT_BACKEND)
+        self.routes = {}
+        for role, entries in (config.get("routes") or {}).items():
+            if role not in ROLES:
+                raise ValueError(f"未知的路由角色: {role}（可选: {', '.join(ROLES)}）")
+            if not isinstance(entries, list):
+                entries = [entries]
+            self.routes[role] = [self._normalize(entry, self.default) for entry in entries]
+        self.prices = dict(DEFAULT_PRICES, **(config.get("prices") or {}))
+        self.economy = False
+        self._clients = {}
+        self._guards = {}  # (base_url, model) -> RequestGuard，同一后端的所有角色共享熔断器
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: Optional[str], api_key: str, base_url: Optional[str] = None,
+                  request_options: Optional[Dict] = None, default_model: Optional[str] = None) -> "ModelRouter":
+        """
+        从JSON配置文件创建路由器
+
+        Args:
+            path: 配置文件路径，为None时使用默认路由
+            default_model: 配置中没有default时使用的模型
+        """
+        config = {}
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        if default_model and "default" not in config:
+            config["default"] = {"model": default_model}
+        return cls(api_key, config, base_url, request_options)
+
+    @staticmethod
+    def _normalize(entry, defaults: Dict) -> Dict:
+        """后端配置可以只写模型名，缺少的字段从defaults继承"""
+        if entry is None:
+            return dict(defaults)
+        if isinstance(entry, str):
+            entry = {"model": entry}
+        return dict(defaults, **entry)
+
+    def route(self, role: str) -> List[Dict]:
+        """角色对应的后端列表"""
+        return self.routes.get(role) or [self.default]
+
+    def client(self, role: str, client_class) -> RoutedClient:
+        """
+        获取角色的路由客户端，同一角色和客户端类型只创建一次
+
+        Args:
+            role: 角色名
+            client_class: GPT客户端类（sig_utils或impl_utils中的GPT）
+        """
+        if role not in ROLES:
+            raise ValueError(f"未知的路由角色: {role}")
+        key = (role, client_class)
+        with self._lock:
+            if key not in self._clients:
+                backends = []
+                for entry in self.route(role):
+                    base_url = self.base_url or entry["base_url"]
+                    api_key = os.environ.get(entry["api_key_env"]) if entry.get("api_key_env") else None
+                    guard = self._guard(base_url, entry["model"])
+                    client = client_class(api_key or self.api_key, model_name=entry["model"], base_url=base_url,
+                                          guard=guard, **self.request_options)
+                    client.trace_name = role  # 追踪中按角色区分请求
+                    backends.append({"model": entry["model"], "base_url": base_url, "client": client})
+                self._clients[key] = RoutedClient(role, backends, self.prices)
+                self._clients[key].economy = self.economy
+            return self._clients[key]
+
+    def _guard(self, base_url: str, model: str) -> RequestGuard:
+        """后端的请求保护，每个（base_url, model）只创建一个，调用方持有self._lock"""
+        key = (base_url, model)
+        if key not in self._guards:
+            self._guards[key] = RequestGuard(deadline=self.request_options.get("deadline"),
+                                             hedge=self.request_options.get("hedge", False))
+        return self._guards[key]
+
+    def set_economy(self, enabled: bool = True):
+        """所有角色切换为低价优先（或恢复配置顺序），之后创建的客户端同样生效"""
+        with self._lock:
+            self.economy = enabled
+            for client in self._clients.values():
+                client.economy = enabled
+
+    def report(self) -> Dict[str, List[Dict]]:
+        """按角色返回已使用路由的统计，同一角色的多种客户端合并列出"""
+        report = {}
+        with self._lock:
+            clients = list(self._clients.items())
+        for (role, _), client in clients:
+            report.setdefault(role, []).extend(client.route_stats())
+        return report
+
+    def summary_lines(self) -> List[str]:
+        """每个已调用过的后端一行耗时与成本统计，用于日志"""
+        lines = []
+        for role, backends in self.report().items():
+            for backend in backends:
+                if not (backend["calls"] or backend["failures"] or backend["fallbacks"]):
+                    continue
+                latency = backend["latency"]
+                host = urlparse(backend["base_url"]).netloc or backend["base_url"]
+                timing = f"p50={latency['p50']}s, p95={latency['p95']}s" if latency["count"] else "无成功请求"
+                cost = f"${backend['cost']}" if backend["cost"] is not None else "未知"
+                lines.append(f"{role} → {backend['model']}@{host}: {backend['calls']} 次, 失败 {backend['failures']} 次, "
+                             f"回退 {backend['fallbacks']} 次, {timing}, 对冲 {backend['hedged_calls']} 次, "
+                             f"token {backend['tokens_in']}/{backend['tokens_out']}, 成本 {cost}")
+        return lines
@@ -0,0 +1,201 @@
+"""
+提示预算模块
+
+控制每次请求的提示规模：
+1. TokenCounter 统计token数，安装了tiktoken时精确计数，否则按字符估计
+2. PromptBudget.fit_dependencies 按相关性（被直接引用、体积小）排序依赖项片段，
+   预算内保留全文，超出预算的折叠为签名，仍然放不下的只列出名称
+3. PromptBudget.compact_messages 在多轮对话超出预算时将较早的轮次压缩为一条摘要
+4. PromptBudget.fit_sections 对转换历史等按时间排列的段落只保留最近的完整内容
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class TokenCounter:
+    """token计数器"""
+
+    def __init__(self, model: str = "gpt-4o"):
+        self.model = model
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("o200k_base")
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        """统计文本的token数；无tiktoken时ASCII约4个字符一个token，其他字符（如中文）按每个字符一个token估计"""
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        non_ascii = sum(1 for ch in text if ord(ch) > 127)
+        return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        """统计消息列表的token数（每条消息另加约4个token的格式开销）"""
+        return sum(self.count(message.get("content") or "") + 4 for message in messages)
+
+
+def collapse_to_signature(rust_code: str) -> str:
+    """将Rust代码折叠为签名：函数体替换为 { ... }，其余定义保持不变"""
+    result = []
+    index = 0
+    for match in re.finditer(r'\bfn\s+\w+', rust_code):
+        if match.start() < index:
+            continue
+        body_start = rust_code.find("{", match.end())
+        if body_start == -1:
+            break
+        # 跳过签名中的泛型约束和where子句，到函数体的左花括号为止；遇到分号说明是无函数体的声明
+        semicolon = rust_code.find(";", match.end())
+        if semicolon != -1 and semicolon < body_start:
+            continue
+        depth = 0
+        end = body_start
+        while end < len(rust_code):
+            if rust_code[end] == "{":
+                depth += 1
+            elif rust_code[end] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        result.append(rust_code[index:body_start])
+        result.append("{ ... }")
+        index = end + 1
+    result.append(rust_code[index:])
+    return "".join(result).strip()
+
+
+def strip_code_blocks(text: str) -> str:
+    """将文本中的代码块替换为省略说明，保留其他说明文字"""
+    return re.sub(r"```\w*\n[\s\S]*?```\n?", "（代码已省略）\n", text)
+
+
+def dependency_name(dep_id: str) -> str:
+    """从依赖键（如 zopfli::Foo(int)、structs::Bar、typedef struct Node Node）中提取名称"""
+    name = dep_id.split("::")[-1].split("(")[0].strip()
+    identifiers = re.findall(r'[A-Za-z_]\w*', name)
+    return identifiers[-1] if identifiers else name
+
+
+class PromptBudget:
+    """提示预算"""
+
+    SUMMARY_HEADER = "## 之前轮次摘要（为控制篇幅，较早的对话已压缩）"
+
+    def __init__(self, dependency_tokens: int = 3000, history_tokens: int = 6000, keep_last: int = 2,
+                 counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            dependency_tokens: 依赖项上下文的token预算
+            history_tokens: 多轮对话消息的token预算
+            keep_last: 压缩对话时保留的最近消息数
+            counter: token计数器
+        """
+        self.dependency_tokens = dependency_tokens
+        self.history_tokens = history_tokens
+        self.keep_last = keep_last
+        self.counter = counter or TokenCounter()
+
+    def fit_dependencies(self, snippets: Dict[str, str], source_text: str,
+                         collapse: Callable[[str], str] = collapse_to_signature,
+                         budget: Optional[int] = None) -> Tuple[Dict[str, str], List[str]]:
+        """
+        在预算内选择依赖项片段
+
+        Args:
+            snippets: 依赖键 -> 片段文本
+            source_text: 当前项目的源码（或摘要），用于判断依赖项是否被直接引用
+            collapse: 将片段折叠为签名的函数
+            budget: token预算，默认使用dependency_tokens
+
+        Returns:
+            Tuple[Dict[str, str], List[str]]: (依赖键 -> 保留的全文或签名，按原顺序；因预算省略的依赖键)
+        """
+        budget = self.dependency_tokens if budget is None else budget
+        sizes = {key: self.counter.count(text) for key, text in snippets.items()}
+        if sum(sizes.values()) <= budget:
+            return dict(snippets), []
+
+        source_identifiers = set(re.findall(r'[A-Za-z_]\w*', source_text or ""))
+        ranked = sorted(snippets, key=lambda key: (dependency_name(key) not in source_identifiers, sizes[key]))
+
+        selected = {}
+        omitted = []
+        used = 0
+        for key in ranked:
+            if used + sizes[key] <= budget:
+                selected[key] = snippets[key]
+                used += sizes[key]
+                continue
+            collapsed = collapse(snippets[key])
+            collapsed_size = self.counter.count(collapsed)
+            if used + collapsed_size <= budget:
+                selected[key] = collapsed
+                used += collapsed_size
+            else:
+                omitted.append(key)
+        return {key: selected[key] for key in snippets if key in selected}, omitted
+
+    def fit_sections(self, sections: List[str], budget: Optional[int] = None,
+                     collapse: Callable[[str], str] = strip_code_blocks) -> List[str]:
+        """按时间排列的段落：从最新的开始保留全文，超出预算后较早的段落折叠（默认去掉代码块）"""
+        budget = self.history_tokens if budget is None else budget
+        fitted = []
+        used = 0
+        for section in reversed(sections):
+            size = self.counter.count(section)
+            if used + size <= budget or not fitted:
+                fitted.append(section)
+                used += size
+            else:
+                fitted.append(collapse(section))
+        return list(reversed(fitted))
+
+    def compact_messages(self, messages: List[Dict], budget: Optional[int] = None) -> List[Dict]:
+        """
+        多轮对话超出预算时压缩较早的轮次
+
+        保留系统提示、首条用户提示和最近keep_last条消息，中间的消息压缩为一条摘要，
+        每条只保留开头部分。未超出预算时原样返回。
+        """
+        budget = self.history_tokens if budget is None else budget
+        head = 2 if len(messages) > 1 and messages[0].get("role") == "system" else 1
+        if len(messages) <= head + self.keep_last or self.counter.count_messages(messages) <= budget:
+            return messages
+
+        middle = messages[head:len(messages) - self.keep_last]
+        lines = [self.SUMMARY_HEADER]
+        for message in middle:
+            content = (message.get("content") or "").strip()
+            if content.startswith(self.SUMMARY_HEADER):
+                # 之前压缩过的摘要原样保留
+                lines.extend(content.splitlines()[1:])
+                continue
+            excerpt = content[:200].replace("\n", " ")
+            if len(content) > 200:
+                excerpt += "..."
+            speaker = "你的回复" if message.get("role") == "assistant" else "反馈"
+            lines.append(f"- {speaker}: {excerpt}")
+        summary = {"role": "user", "content": "\n".join(lines)}
+        return messages[:head] + [summary] + messages[len(messages) - self.keep_last:]
+
+    @staticmethod
+    def omitted_note(omitted: List[str]) -> str:
+        """因预算省略的依赖项说明"""
+        if not omitted:
+            return ""
+        return f"（另有 {len(omitted)} 个依赖项因篇幅省略：{', '.join(dependency_name(key) for key in omitted)}）\n"
@@ -69,35 +69,33 @@ class PromptTemplates:
 """
 
     AGENT1_PROMPTS = {
-        "struct": """请将以下C语言结构体定义转换为Rust结构体：
-
-```c
-{input}
-```
+        "struct": """请将末尾给出的C语言结构体定义转换为Rust结构体。
 
 请按照Rust的惯用法进行转换，注意处理指针、特殊类型和命名规范。
 只在绝对必要时使用unsafe，并解释为什么。
 对于复杂的内存布局，考虑使用#[repr(C)]。
 返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
-""",
-
-        "typedef": """请将以下C语言类型定义（typedef）转换为Rust类型定义：
 
+## 原始C代码：
 ```c
 {input}
 ```
+""",
+
+        "typedef": """请将末尾给出的C语言类型定义（typedef）转换为Rust类型定义。
 
 请按照Rust的惯用法进行转换，注意处理指针、特殊类型和命名规范。
 只在绝对必要时使用unsafe，并解释为什么。
 如果涉及函数指针，考虑使用Rust的函数类型或trait。
 返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
-""",
-
-        "define": """请将以下C语言宏定义转换为Rust等价物（常量、函数或其他适当的形式）：
 
+## 原始C代码：
 ```c
 {input}
 ```
+""",
+
+        "define": """请将末尾给出的C语言宏定义转换为Rust等价物（常量、函数或其他适当的形式）。
 
 请按照以下规则处理：
 1. 如果是简单常量定义，转换为Rust常量
@@ -107,24 +105,26 @@ class PromptTemplates:
 
 只在绝对必要时使用unsafe，并解释为什么。
 返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
-""",
-
-        "field": """请将以下C语言变量/字段定义转换为Rust字段定义：
 
+## 原始C代码：
 ```c
 {input}
 ```
+""",
+
+        "field": """请将末尾给出的C语言变量/字段定义转换为Rust字段定义。
 
 请按照Rust的惯用法进行转换，注意处理指针、特殊类型和命名规范。
 只在绝对必要时使用unsafe，并解释为什么。
 返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
-""",
-
-        "function": """请将以下C语言函数签名转换为Rust函数签名：
 
+## 原始C代码：
 ```c
 {input}
 ```
+""",
+
+        "function": """请将末尾给出的C语言函数签名转换为Rust函数签名。
 
 ⚠️ **严格要求**：
 1. **只转换函数签名** - 绝对不要实现函数体逻辑
@@ -155,26 +155,129 @@ pub fn example_function(param: i32) -> i32 {
 请按照Rust的惯用法进行转换，注意处理指针类型、命名规范和返回值。
 只在绝对必要时使用unsafe，并解释为什么。
 返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
+
+## 原始C代码：
+```c
+{input}
+```
 """
     }
 
     # 带有预处理信息的Agent1提示
-    AGENT1_WITH_ANALYSIS = """请将以下C语言定义转换为Rust：
+    AGENT1_WITH_ANALYSIS = """请将末尾给出的C语言定义转换为Rust。
 
-```c
-{input}
-```
+请按照Rust的惯用法进行转换，尽量使用安全Rust特性，只在必要时使用unsafe。
+如果是函数，只转换签名部分，函数体使用 `{ unimplemented!() }` 或 `{ todo!() }` 占位。
+注意处理指针、特殊类型和命名规范。如果使用unsafe，请添加注释解释原因。
+返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
 
 ## 代码分析
 我已检测到代码中包含以下特殊结构，请在转换时特别注意：
 {special_structures}
 
+## 原始C代码：
+```c
+{input}
+```
+"""
+
+    # Agent1 JSON转换提示：按 静态说明 -> 依赖项（按键排序）-> 当前项目 的顺序拼接，
+    # 同一类提示的前缀在项目之间逐字节相同，可以命中服务端的提示缓存
+    AGENT1_JSON_INSTRUCTIONS = """请将末尾"当前项目"中的C语言定义转换为Rust代码，并以JSON格式返回结果。
+
+## 转换要求
 请按照Rust的惯用法进行转换，尽量使用安全Rust特性，只在必要时使用unsafe。
-如果是函数，只转换签名部分，函数体使用 `{ unimplemented!() }` 或 `{ todo!() }` 占位。
 注意处理指针、特殊类型和命名规范。如果使用unsafe，请添加注释解释原因。
-返回Rust代码时，请使用```rust 代码块，仅包含代码，不要添加解释。
+如果给出了依赖项的Rust代码，请在转换时参考，保持一致的风格和命名。
+
+**重要：不要生成任何导入语句（use、mod等），只生成核心的类型定义、结构体或函数签名。**
+
+## 输出格式
+请以JSON格式返回转换结果，包含以下字段：
+```json
+{
+  "rust_code": "转换后的Rust代码",
+  "confidence": "HIGH/MEDIUM/LOW",
+  "warnings": ["警告信息列表"],
+  "unsafe_used": true/false,
+  "unsafe_reason": "如果使用了unsafe，请说明原因"
+}
+```
+
+只返回JSON对象，不要添加其他文本。
+"""
+
+    AGENT1_COMPONENT_INSTRUCTIONS = """末尾"当前项目"中的C语言定义之间存在循环依赖，请将它们作为一个整体转换为Rust代码，并以JSON格式返回结果。
+
+## 转换要求
+这些定义互相引用，请确保转换后的类型名和函数名在各项目之间保持一致，彼此可以直接引用。
+请按照Rust的惯用法进行转换，尽量使用安全Rust特性，只在必要时使用unsafe。
+如果给出了依赖项的Rust代码，请在转换时参考，保持一致的风格和命名。
+
+**重要：不要生成任何导入语句（use、mod等），只生成核心的类型定义、结构体或函数签名。**
+
+## 输出格式
+请以JSON格式返回转换结果，items的键为"当前项目"中每个项目 ### 标题后的项目键，必须包含每一个项目：
+```json
+{
+  "rust_code": "所有项目合并后的Rust代码",
+  "items": {
+    "项目键": "该项目的Rust代码"
+  },
+  "confidence": "HIGH/MEDIUM/LOW",
+  "warnings": ["警告信息列表"]
+}
+```
+
+只返回JSON对象，不要添加其他文本。
+"""
+
+    AGENT1_BATCH_INSTRUCTIONS = """请将末尾"当前项目"中互相独立的多个C语言定义分别转换为Rust代码，并以JSON格式返回结果。
+
+## 转换要求
+每个项目单独转换，项目之间不要互相引用或重复定义。
+请按照Rust的惯用法进行转换，尽量使用安全Rust特性，只在必要时使用unsafe。
+如果给出了依赖项的Rust代码，请在转换时参考，保持一致的风格和命名。
+
+**重要：不要生成任何导入语句（use、mod等），只生成核心的类型定义、结构体或函数签名。**
+
+## 输出格式
+请以JSON格式返回转换结果，items的键为"当前项目"中每个项目 ### 标题后的项目键，必须包含每一个项目：
+```json
+{
+  "items": {
+    "项目键": "该项目的Rust代码"
+  },
+  "confidence": "HIGH/MEDIUM/LOW"
+}
+```
+
+只返回JSON对象，不要添加其他文本。
 """
 
+    FUNCTION_NOTE = """## 特别注意
+只转换函数签名，不实现函数体。函数体使用 { unimplemented!() } 或 { todo!() } 占位。
+"""
+
+    FUNCTION_POINTER_NOTE = """## 特别注意：函数指针类型转换
+这是一个函数指针类型定义。请转换为Rust的函数类型：
+- C格式：`typedef return_type FuncName(param_types)`
+- Rust格式：`type FuncName = fn(param_types) -> return_type;`
+- 如果涉及C ABI，使用：`type FuncName = unsafe extern "C" fn(param_types) -> return_type;`
+- 只输出一行类型定义，不要添加其他代码
+"""
+
+    DEPENDENCY_HEADER = "## 依赖项的Rust代码：\n"
+    ITEM_HEADER = "## 当前项目\n"
+
+    @staticmethod
+    def stable_prompt(instructions, dependency_text="", item_text=""):
+        """按 静态说明 -> 依赖项 -> 当前项目 的顺序拼接提示，前两部分不含任何逐项目变化的内容"""
+        prompt = instructions
+        if dependency_text:
+            prompt += "\n" + PromptTemplates.DEPENDENCY_HEADER + dependency_text
+        return prompt + "\n" + PromptTemplates.ITEM_HEADER + item_text
+
     # Agent2: Rust代码审核专家
     AGENT2_SYSTEM = """你是一位严格但务实的Rust语言专家和代码审核员，专注于检查C到Rust的转换质量。你需要仔细评估提供的Rust代码是否正确实现了C代码的签名定义，同时保持适当的安全性和惯用性。
     
@@ -213,19 +316,7 @@ pub fn example_function(param: i32) -> i32 {
 确保你的评价严格但务实 - 对于必要的unsafe不要过分苛责，重点在于签名等价和安全增强。
 """
 
-    AGENT2_PROMPT = """请审核以下C代码到Rust的转换是否正确、安全且符合Rust惯用法：
-
-## 原始C代码：
-```c
-{c_code}
-```
-
-## 生成的Rust代码：
-```rust
-{rust_code}
-```
-
-{conversion_history}
+    AGENT2_PROMPT = """请审核末尾给出的C代码到Rust的转换是否正确、安全且符合Rust惯用法。
 
 请只评估签名转换是否正确，不需关注函数实现细节。评估应考虑以下方面：
 1. 签名是否功能等价
@@ -240,10 +331,6 @@ pub fn example_function(param: i32) -> i32 {
 }
 
 确保JSON格式正确，且只返回JSON对象，不要有其他文本。
-"""
-
-    # 包含转换历史的Agent2提示
-    AGENT2_WITH_HISTORY = """请审核以下C代码到Rust的转换是否正确、安全且符合Rust惯用法：
 
 ## 原始C代码：
 ```c
@@ -255,8 +342,11 @@ pub fn example_function(param: i32) -> i32 {
 {rust_code}
 ```
 
-## 转换历史：
 {conversion_history}
+"""
+
+    # 包含转换历史的Agent2提示
+    AGENT2_WITH_HISTORY = """请审核末尾给出的C代码到Rust的转换是否正确、安全且符合Rust惯用法。
 
 请特别注意之前已经确定的问题是否已解决。评估时要务实，对于某些C结构（如复杂宏、void*指针、特殊内存布局），可能确实需要unsafe代码。
 
@@ -264,7 +354,6 @@ pub fn example_function(param: i32) -> i32 {
 
 如果代码使用了unsafe但确实必要，而且整体实现了签名等价性，应该考虑通过。
 
-
 以JSON格式返回你的审核结果：
 {
   "result": "PASS" 或 "FAIL",
@@ -272,6 +361,19 @@ pub fn example_function(param: i32) -> i32 {
 }
 
 确保JSON格式正确，且只返回JSON对象，不要有其他文本。
+
+## 原始C代码：
+```c
+{c_code}
+```
+
+## 生成的Rust代码：
+```rust
+{rust_code}
+```
+
+## 转换历史：
+{conversion_history}
 """
 
     # Agent3: 仲裁专家提示
@@ -292,7 +394,14 @@ pub fn example_function(param: i32) -> i32 {
 
 请提供最终的解决方案，优先考虑签名的正确性和可用性。"""
 
-    AGENT3_PROMPT = """请分析以下C到Rust转换的争议情况：
+    AGENT3_PROMPT = """请作为专家仲裁末尾给出的C到Rust转换的争议情况，考虑：
+1. 这是否属于必须使用unsafe的情况
+2. 签名等价性是否比完美的Rust惯用性更重要
+3. 如何在保持签名功能的同时尽可能提高安全性
+
+记住：我们只需要转换签名部分，函数体可使用 `{ unimplemented!() }` 或空实现。
+
+请使用```rust 代码块返回最终Rust代码。如使用unsafe，请添加注释解释原因。
 
 ## 原始C代码：
 ```c
@@ -310,13 +419,4 @@ pub fn example_function(param: i32) -> i32 {
 ## 争议说明：
 我们尝试了{attempts}次转换，但仍未通过审核。审核者提出的最新问题是：
 "{latest_feedback}"
-
-请作为专家仲裁此争议，考虑：
-1. 这是否属于必须使用unsafe的情况
-2. 签名等价性是否比完美的Rust惯用性更重要
-3. 如何在保持签名功能的同时尽可能提高安全性
-
-记住：我们只需要转换签名部分，函数体可使用 `{ unimplemented!() }` 或空实现。
-
-请使用```rust 代码块返回最终Rust代码。如使用unsafe，请添加注释解释原因。
-""" 
\ No newline at end of file
+"""
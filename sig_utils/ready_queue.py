@@ -0,0 +1,104 @@
+"""
+就绪队列模块
+
+基于依赖图的强连通分量调度：
+1. 分量的所有依赖分量完成后才进入就绪队列
+2. 就绪分量按关键路径优先级出队（下游深度优先，其次扇出）
+3. 同等优先级保持依赖图原有顺序，保证调度结果稳定可复现
+4. 预算紧张时可切换为扇出优先，先完成下游依赖项目最多的分量
+"""
+
+import heapq
+from typing import List, Optional, Tuple
+
+from sig_utils.dependency_graph import DependencyGraph
+
+
+class ReadyQueue:
+    """强连通分量就绪队列"""
+
+    def __init__(self, graph: DependencyGraph, components: List[List[str]],
+                 priorities: Optional[List[Tuple[float, int]]] = None):
+        """
+        Args:
+            graph: 依赖图
+            components: 依赖优先顺序的强连通分量列表
+            priorities: 与components对应的 (下游深度, 扇出)，默认按原有顺序出队
+        """
+        self.components = components
+        self.priorities = priorities or [(0.0, 0)] * len(components)
+        self._heap = []
+        self._fan_out_first = False
+        self._completed = set()
+        self._remaining = sum(len(component) for component in components)
+
+        component_of = {node_id: i for i, component in enumerate(components) for node_id in component}
+        self.dependents = [set() for _ in components]  # 分量 -> 依赖它的分量
+        self.waiting = [0] * len(components)  # 分量 -> 尚未完成的依赖分量数
+
+        for i, component in enumerate(components):
+            upstream = set()
+            for node_id in component:
+                for dep in graph.dependencies_of(node_id):
+                    j = component_of.get(dep)
+                    if j is not None and j != i:
+                        upstream.add(j)
+            self.waiting[i] = len(upstream)
+            for j in upstream:
+                self.dependents[j].add(i)
+
+        for i in range(len(components)):
+            if self.waiting[i] == 0:
+                self._push(i)
+
+    def _push(self, index: int):
+        depth, fan_out = self.priorities[index]
+        key = (-fan_out, -depth) if self._fan_out_first else (-depth, -fan_out)
+        heapq.heappush(self._heap, (*key, index))
+
+    def prefer_fan_out(self, enabled: bool = True):
+        """切换出队顺序：扇出优先（下游依赖项目最多的先出队）或默认的下游深度优先"""
+        if enabled == self._fan_out_first:
+            return
+        self._fan_out_first = enabled
+        indices = [entry[2] for entry in self._heap]
+        self._heap = []
+        for index in indices:
+            self._push(index)
+
+    def pop(self) -> Optional[int]:
+        """取出优先级最高的就绪分量索引，队列为空时返回None"""
+        if not self._heap:
+            return None
+        return heapq.heappop(self._heap)[2]
+
+    def requeue(self, index: int):
+        """将已出队但暂不处理的就绪分量放回队列"""
+        self._push(index)
+
+    def complete(self, index: int) -> List[int]:
+        """
+        标记分量已完成，释放依赖它的分量
+
+        Returns:
+            List[int]: 因此变为就绪的分量索引
+        """
+        if index in self._completed:
+            return []
+        self._completed.add(index)
+        self._remaining -= len(self.components[index])
+
+        released = []
+        for dependent in sorted(self.dependents[index]):
+            self.waiting[dependent] -= 1
+            if self.waiting[dependent] == 0:
+                self._push(dependent)
+                released.append(dependent)
+        return released
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def remaining(self) -> int:
+        """尚未完成的分量中的项目数（含未就绪的分量），用于估计剩余工作量"""
+        return self._remaining
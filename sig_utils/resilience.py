@@ -0,0 +1,296 @@
+"""
+请求韧性模块
+
+GPT客户端的单次请求保护：
+1. LatencyTracker 记录最近的请求耗时，提供p50/p95/p99等分位数，用于设置对冲阈值
+2. hedged_call 在超过对冲阈值（默认取观测到的p95）仍未返回时再发出一个相同的请求，
+   使用先返回的结果；整体超过截止时间时抛出 DeadlineExceededError
+3. CircuitBreaker 在后端连续失败达到阈值后熔断，冷却期内直接拒绝请求，
+   冷却结束后放行一个探测请求，成功则恢复
+4. RequestGuard 把以上三者组合起来，供 sig_utils 和 impl_utils 的GPT客户端共用；
+   ModelRouter 为每个后端（base_url, model）只创建一个，使用该后端的所有角色共享熔断状态、耗时统计和线程池
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from sig_utils.tracing import tracer
+
+
+class DeadlineExceededError(RuntimeError):
+    """请求超过截止时间仍未返回"""
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，请求被拒绝"""
+
+
+def _nearest_rank(samples, p: float) -> float:
+    """已排序样本的第p百分位数（最近秩法）"""
+    rank = math.ceil(p / 100 * len(samples))
+    return samples[min(len(samples), max(1, rank)) - 1]
+
+
+class LatencyTracker:
+    """滑动窗口内的请求耗时统计"""
+
+    def __init__(self, window: int = 200):
+        """
+        Args:
+            window: 参与分位数计算的最近请求数
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """最近请求耗时的第p百分位数，没有样本时返回None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        return _nearest_rank(samples, p) if samples else None
+
+    def snapshot(self) -> Dict:
+        """返回耗时分位数（秒）"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {"count": count}
+        return {
+            "count": count,
+            "p50": round(_nearest_rank(samples, 50), 3),
+            "p95": round(_nearest_rank(samples, 95), 3),
+            "p99": round(_nearest_rank(samples, 99), 3),
+            "max": round(samples[-1], 3)
+        }
+
+
+class CircuitBreaker:
+    """熔断器：closed（正常）→ open（拒绝）→ half_open（放行一个探测请求）"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后熔断
+            reset_timeout: 熔断后等待多少秒再放行探测请求
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """距离放行探测请求还需等待的秒数"""
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.time() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """探测请求没有得到后端是否正常的结论（未发出或请求本身有误），释放探测名额，不改变失败计数"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened_count += 1
+                self.state = "open"
+                self._opened_at = time.time()
+                self._probe_in_flight = False
+
+
+def hedged_call(func: Callable[[], object], executor: ThreadPoolExecutor, hedge_after: Optional[float] = None,
+                timeout: Optional[float] = None) -> Dict:
+    """
+    执行一次可对冲的调用
+
+    Args:
+        func: 无参调用，可能被执行两次，必须是幂等的
+        executor: 执行调用的线程池
+        hedge_after: 超过该秒数仍未返回时发出对冲请求，None表示不对冲
+        timeout: 截止时间（秒），None表示不限制
+
+    Returns:
+        Dict: {"result": 调用结果, "hedged": 是否发出了对冲请求, "hedge_won": 结果是否来自对冲请求}
+
+    Raises:
+        DeadlineExceededError: 超过截止时间仍没有调用返回
+        Exception: 所有已发出的调用都失败时，抛出最先失败的异常
+    """
+    start = time.time()
+    func = tracer.bind(func)  # 请求线程中的span计入发起请求的项目
+    primary = executor.submit(func)
+    pending = {primary}
+    hedged = False
+    first_error = None
+
+    while pending:
+        elapsed = time.time() - start
+        wait_for = None if timeout is None else timeout - elapsed
+        if not hedged and hedge_after is not None:
+            wait_for = hedge_after - elapsed if wait_for is None else min(wait_for, hedge_after - elapsed)
+        if wait_for is not None and wait_for <= 0:
+            done = set()
+        else:
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            try:
+                return {"result": future.result(), "hedged": hedged, "hedge_won": future is not primary}
+            except Exception as e:
+                first_error = first_error or e
+
+        elapsed = time.time() - start
+        if not pending:
+            break
+        if timeout is not None and elapsed >= timeout:
+            raise DeadlineExceededError(f"请求超过截止时间 {timeout:.1f} 秒仍未返回")
+        if not hedged and hedge_after is not None and elapsed >= hedge_after:
+            hedged = True
+            pending.add(executor.submit(func))
+
+    raise first_error
+
+
+class RequestGuard:
+    """GPT客户端的请求保护：熔断检查、按p95对冲、截止时间，并记录每次请求的耗时"""
+
+    def __init__(self, deadline: Optional[float] = None, hedge: bool = False, hedge_percentile: float = 95,
+                 hedge_min_samples: int = 20, breaker: Optional[CircuitBreaker] = None, max_workers: int = 16):
+        """
+        Args:
+            deadline: 一次ask调用（含重试）的截止时间（秒），None表示只依赖请求本身的timeout
+            hedge: 是否启用对冲请求
+            hedge_percentile: 对冲阈值取观测耗时的哪个分位数
+            hedge_min_samples: 样本数不足时不对冲，避免阈值不稳定
+            breaker: 熔断器，默认连续失败5次熔断30秒
+            max_workers: 执行请求的线程数上限（对冲或设置了截止时间时使用）
+        """
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.hedged_calls = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gpt-request")
+        self._lock = threading.Lock()
+
+    def deadline_at(self, deadline: Optional[float] = None) -> Optional[float]:
+        """本次调用的截止时刻，deadline为None时使用默认值"""
+        deadline = self.deadline if deadline is None else deadline
+        return time.time() + deadline if deadline else None
+
+    def call(self, func: Callable[[], object], deadline_at: Optional[float] = None):
+        """
+        发出一次请求
+
+        Raises:
+            CircuitOpenError: 熔断中
+            DeadlineExceededError: 超过截止时间
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"后端连续失败已熔断，{self.breaker.retry_after():.0f} 秒后重试")
+        timeout = None
+        if deadline_at is not None:
+            timeout = deadline_at - time.time()
+            if timeout <= 0:
+                self.breaker.release_probe()  # 未发出请求，释放可能占用的探测名额
+                raise DeadlineExceededError("已超过截止时间")
+        hedge_after = None
+        if self.hedge and self.latency.count >= self.hedge_min_samples:
+            hedge_after = self.latency.percentile(self.hedge_percentile)
+
+        start = time.time()
+        try:
+            if hedge_after is None and timeout is None:
+                result = func()
+            else:
+                outcome = hedged_call(func, self._executor, hedge_after, timeout)
+                result = outcome["result"]
+                if outcome["hedged"]:
+                    with self._lock:
+                        self.hedged_calls += 1
+                        self.hedge_wins += outcome["hedge_won"]
+        except Exception as e:
+            if isinstance(e, DeadlineExceededError):
+                with self._lock:
+                    self.deadline_exceeded += 1
+            if self._is_backend_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        self.latency.record(time.time() - start)
+        return result
+
+    def backoff(self, wait_time: float, deadline_at: Optional[float] = None):
+        """重试前等待；等待后将超过截止时间时直接抛出 DeadlineExceededError"""
+        if deadline_at is not None and time.time() + wait_time >= deadline_at:
+            raise DeadlineExceededError("重试等待将超过截止时间")
+        time.sleep(wait_time)
+
+    @staticmethod
+    def _is_backend_failure(error: Exception) -> bool:
+        """后端故障（超时、连接错误、5xx、429）计入熔断，请求本身的错误（其他4xx）不计入"""
+        status = getattr(error, "status_code", None)
+        return status is None or status >= 500 or status == 429
+
+    def summary(self) -> str:
+        """一行耗时与对冲统计，用于日志"""
+        latency = self.latency.snapshot()
+        if not latency["count"]:
+            return "无请求"
+        return (f"{latency['count']} 次请求, p50={latency['p50']}s, p95={latency['p95']}s, p99={latency['p99']}s, "
+                f"对冲 {self.hedged_calls} 次（对冲先返回 {self.hedge_wins} 次）, 超过截止时间 {self.deadline_exceeded} 次, "
+                f"熔断 {self.breaker.opened_count} 次")
+
+    def get_stats(self) -> Dict:
+        """返回耗时分位数、对冲和熔断统计"""
+        return {
+            "latency": self.latency.snapshot(),
+            "hedged_calls": self.hedged_calls,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.opened_count
+        }
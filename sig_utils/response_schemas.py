@@ -0,0 +1,254 @@
+"""
+结构化输出模块
+
+定义各代理返回结果的JSON Schema，并提供唯一的解析校验入口：
+1. 转换（Agent1）、审核（Agent2）、实现检测、函数总结及其审核各有一个Schema
+2. GPT.ask_json 使用Schema请求受约束的响应（response_format=json_schema）
+3. parse_response 对响应做一次解析和校验，不符合Schema时抛出 StructuredOutputError，
+   调用方可以用异常中的原始文本回退到 TextExtractor 的旧解析流程
+"""
+
+import json
+import re
+from typing import Dict, List
+
+
+class StructuredOutputError(ValueError):
+    """响应不是符合Schema的JSON"""
+
+    def __init__(self, message: str, raw_text: str = ""):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+# 每个Schema说明：name为response_format中的名称；strict为True时服务端严格按Schema生成，
+# 严格模式要求列出所有属性且不允许额外属性，因此键名不固定的对象（如items、dependencies）使用非严格模式
+
+CONVERSION_SCHEMA = {
+    "name": "conversion_result",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "rust_code": {"type": "string"},
+            "confidence": {"type": "string", "enum": ["HIGH", "MEDIUM", "LOW"]},
+            "warnings": {"type": "array", "items": {"type": "string"}},
+            "unsafe_used": {"type": "boolean"},
+            "unsafe_reason": {"type": ["string", "null"]}
+        },
+        "required": ["rust_code", "confidence", "warnings", "unsafe_used", "unsafe_reason"],
+        "additionalProperties": False
+    }
+}
+
+FIX_SCHEMA = {
+    "name": "fix_result",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "rust_code": {"type": "string"},
+            "confidence": {"type": "string", "enum": ["HIGH", "MEDIUM", "LOW"]},
+            "changes_made": {"type": "array", "items": {"type": "string"}},
+            "unsafe_used": {"type": "boolean"},
+            "unsafe_reason": {"type": ["string", "null"]}
+        },
+        "required": ["rust_code", "confidence", "changes_made", "unsafe_used", "unsafe_reason"],
+        "additionalProperties": False
+    }
+}
+
+COMPONENT_CONVERSION_SCHEMA = {
+    "name": "component_conversion_result",
+    "strict": False,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "rust_code": {"type": "string"},
+            "items": {"type": "object", "additionalProperties": {"type": "string"}},
+            "confidence": {"type": "string", "enum": ["HIGH", "MEDIUM", "LOW"]}
+        },
+        "required": ["items"]
+    }
+}
+
+REVIEW_SCHEMA = {
+    "name": "review_result",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "result": {"type": "string", "enum": ["PASS", "FAIL"]},
+            "reason": {"type": "string"}
+        },
+        "required": ["result", "reason"],
+        "additionalProperties": False
+    }
+}
+
+DETECTION_SCHEMA = {
+    "name": "implementation_detection",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "has_implementation": {"type": "boolean"},
+            "has_redefinition": {"type": "boolean"},
+            "is_clean": {"type": "boolean"},
+            "violations": {"type": "array", "items": {"type": "string"}},
+            "severity": {"type": "string", "enum": ["none", "minor", "major"]},
+            "recommendation": {"type": "string"},
+            "confidence": {"type": "number"}
+        },
+        "required": ["has_implementation", "has_redefinition", "is_clean", "violations",
+                     "severity", "recommendation", "confidence"],
+        "additionalProperties": False
+    }
+}
+
+SUMMARY_SCHEMA = {
+    "name": "function_summary",
+    "strict": False,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "function_name": {"type": "string"},
+            "main_purpose": {"type": "string"},
+            "detailed_logic": {"type": "string"},
+            "error_handling": {"type": "string"},
+            "dependencies": {
+                "type": "object",
+                "additionalProperties": {
+                    "type": "object",
+                    "properties": {
+                        "signature": {"type": "string"},
+                        "usage": {"type": "string"}
+                    }
+                }
+            }
+        },
+        "required": ["function_name", "main_purpose", "detailed_logic", "error_handling", "dependencies"]
+    }
+}
+
+SUMMARY_REVIEW_SCHEMA = {
+    "name": "summary_review",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "review_result": {"type": "string", "enum": ["PASS", "FAIL"]},
+            "reason": {"type": "string"}
+        },
+        "required": ["review_result", "reason"],
+        "additionalProperties": False
+    }
+}
+
+
+def batch_schema(spec: Dict) -> Dict:
+    """由单项目Schema构造批处理Schema：items为 项目键 -> 单项目结果"""
+    return {
+        "name": f"{spec['name']}_batch",
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "items": {"type": "object", "additionalProperties": spec["schema"]}
+            },
+            "required": ["items"]
+        }
+    }
+
+
+BATCH_CONVERSION_SCHEMA = COMPONENT_CONVERSION_SCHEMA
+BATCH_REVIEW_SCHEMA = batch_schema(REVIEW_SCHEMA)
+BATCH_DETECTION_SCHEMA = batch_schema(DETECTION_SCHEMA)
+BATCH_SUMMARY_SCHEMA = batch_schema(SUMMARY_SCHEMA)
+BATCH_SUMMARY_REVIEW_SCHEMA = batch_schema(SUMMARY_REVIEW_SCHEMA)
+
+
+def response_format(spec: Dict) -> Dict:
+    """构造OpenAI接口的response_format参数"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": spec["name"], "schema": spec["schema"], "strict": spec["strict"]}
+    }
+
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "boolean": lambda value: isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "null": lambda value: value is None,
+}
+
+
+def validate(value, schema: Dict, path: str = "$") -> List[str]:
+    """按JSON Schema子集（type、enum、properties、required、additionalProperties、items）校验，返回错误列表"""
+    errors = []
+    types = schema.get("type")
+    if types:
+        types = types if isinstance(types, list) else [types]
+        if not any(_TYPE_CHECKS[t](value) for t in types):
+            return [f"{path}: 类型应为 {'/'.join(types)}"]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: 取值应为 {schema['enum']} 之一")
+
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: 缺少字段 {key}")
+        additional = schema.get("additionalProperties", True)
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate(item, properties[key], f"{path}.{key}"))
+            elif additional is False:
+                errors.append(f"{path}: 不允许的字段 {key}")
+            elif isinstance(additional, dict):
+                errors.extend(validate(item, additional, f"{path}.{key}"))
+    elif isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def parse_response(text: str, spec: Dict) -> Dict:
+    """
+    解析并校验结构化响应
+
+    受约束的响应本身就是JSON；服务端不支持response_format时，允许响应被```json代码块包裹
+    或前后带有说明文字，取第一个完整的JSON对象。
+
+    Raises:
+        StructuredOutputError: 无法解析或不符合Schema
+    """
+    text = (text or "").strip()
+    fenced = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+    candidates = [text] + ([fenced.group(1)] if fenced else [])
+
+    parsed = None
+    for candidate in candidates:
+        try:
+            parsed = json.loads(candidate)
+            break
+        except json.JSONDecodeError:
+            start = candidate.find("{")
+            if start == -1:
+                continue
+            try:
+                parsed, _ = json.JSONDecoder().raw_decode(candidate[start:])
+                break
+            except json.JSONDecodeError:
+                continue
+
+    if parsed is None:
+        raise StructuredOutputError(f"{spec['name']}: 响应不是有效的JSON", text)
+    errors = validate(parsed, spec["schema"])
+    if errors:
+        raise StructuredOutputError(f"{spec['name']}: {'; '.join(errors[:5])}", text)
+    return parsed
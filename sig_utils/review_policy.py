@@ -0,0 +1,93 @@
+"""
+审核策略模块
+
+决定每轮转换是否需要Agent2审核：
+1. 低风险项目（类型、代码规模、Agent1置信度为HIGH、本地实现检测通过）可以跳过审核，
+   后续的实现检测和编译验证仍然照常进行
+2. 跳过的前提是该类型已有足够的审核样本，且ConversionStats中统计的审核通过率达到阈值
+3. 即使满足跳过条件，仍按配置的比例抽样完整审核，使通过率持续可测
+"""
+
+import random
+import threading
+from typing import Dict, Optional
+
+# 各类型允许跳过审核的最大代码行数，未列出的类型始终审核
+DEFAULT_MAX_LINES = {
+    "defines": 5,
+    "typedefs": 10,
+    "structs": 60,
+    "functions": 15,
+}
+
+
+class ReviewPolicy:
+    """自适应审核策略"""
+
+    def __init__(self, sample_rate: float = 0.1, min_pass_rate: float = 0.95, min_reviews: int = 20,
+                 max_lines: Optional[Dict[str, int]] = None, seed: Optional[int] = None):
+        """
+        Args:
+            sample_rate: 满足跳过条件时仍进行完整审核的比例，1.0表示始终审核
+            min_pass_rate: 该类型审核通过率达到此值才允许跳过
+            min_reviews: 该类型至少完成多少次审核后才允许跳过
+            max_lines: 各类型允许跳过审核的最大代码行数
+            seed: 抽样随机数种子
+        """
+        self.sample_rate = sample_rate
+        self.min_pass_rate = min_pass_rate
+        self.min_reviews = min_reviews
+        self.max_lines = dict(DEFAULT_MAX_LINES if max_lines is None else max_lines)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def decide(self, kind: str, rust_code: str, agent1_confidence: Optional[str], round_num: int,
+               stats, local_check: Optional[Dict] = None) -> Dict:
+        """
+        判断本轮转换结果是否需要Agent2审核
+
+        Args:
+            kind: 项目类型
+            rust_code: Agent1生成的Rust代码
+            agent1_confidence: Agent1返回的置信度（HIGH/MEDIUM/LOW）
+            round_num: 当前轮次，之前轮次未通过的项目不再视为低风险
+            stats: ConversionStats，提供各类型的审核通过率
+            local_check: 本地结构分析结果（StructuralAnalyzer.analyze的返回值）
+
+        Returns:
+            Dict: {"review": 是否审核, "reason": 原因, "sampled": 是否为抽样审核}
+        """
+        if self.sample_rate >= 1.0:
+            return self._review("审核策略要求始终审核")
+        if round_num > 1:
+            return self._review("之前轮次未通过")
+        if kind not in self.max_lines:
+            return self._review(f"{kind} 类型始终审核")
+
+        lines = len([line for line in rust_code.splitlines() if line.strip()])
+        if lines > self.max_lines[kind]:
+            return self._review(f"代码行数 {lines} 超过 {self.max_lines[kind]}")
+        if str(agent1_confidence).upper() != "HIGH":
+            return self._review(f"Agent1置信度为 {agent1_confidence}")
+        if local_check is not None and not (local_check["is_clean"] and local_check["confidence"] >= 0.9):
+            return self._review("本地实现检测未能确认代码干净")
+
+        pass_rate, reviews = stats.review_pass_rate(kind)
+        if reviews < self.min_reviews:
+            return self._review(f"{kind} 审核样本不足 ({reviews}/{self.min_reviews})")
+        if pass_rate < self.min_pass_rate:
+            return self._review(f"{kind} 审核通过率 {pass_rate:.2%} 低于 {self.min_pass_rate:.2%}")
+
+        with self._lock:
+            sampled = self._random.random() < self.sample_rate
+        if sampled:
+            return {"review": True, "reason": "低风险项目抽样审核", "sampled": True}
+        return {
+            "review": False,
+            "reason": f"低风险项目，{kind} 审核通过率 {pass_rate:.2%}，跳过Agent2审核",
+            "sampled": False
+        }
+
+    @staticmethod
+    def _review(reason: str) -> Dict:
+        return {"review": True, "reason": reason, "sampled": False}
@@ -0,0 +1,212 @@
+"""
+运行历史模块
+
+每次运行结束时向本地JSONL文件追加一条摘要记录，不随日志轮转丢失：
+1. 记录运行的阶段、配置、git版本、项目数、总耗时、大模型调用次数、token、估算成本、编译耗时、成功率和平均轮数，
+   以及按阶段和项目类型的每项调用次数、token和轮数（供 plan_run.py 估算）
+2. 按记录序号、run_id前缀或git版本查找运行
+3. 与基线运行对比吞吐量、每项成本/token/调用次数/轮数和成功率，超过阈值的变化标记为性能回退
+
+数据来自 sig_utils.metrics 的运行指标和模型路由的统计。
+"""
+
+import json
+import os
+import subprocess
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# 对比的指标：(字段, 名称, 越大越好)
+COMPARED_FIELDS = [
+    ("items_per_minute", "吞吐量(项/分钟)", True),
+    ("success_rate", "成功率", True),
+    ("cost_per_item", "每项成本($)", False),
+    ("tokens_per_item", "每项token", False),
+    ("calls_per_item", "每项调用次数", False),
+    ("rounds_per_item", "每项轮数", False),
+    ("compile_time_per_item", "每项编译耗时(s)", False)
+]
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 不写入历史记录的配置项（密钥等）
+_SECRET_KEYS = ("api_key",)
+
+
+def git_revision(cwd: str = BASE_DIR) -> Dict:
+    """当前git版本和工作区是否有未提交的改动，不在git仓库中时返回空值"""
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True, text=True, timeout=10)
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return {"rev": None, "dirty": None}
+    if rev.returncode != 0:
+        return {"rev": None, "dirty": None}
+    return {"rev": rev.stdout.strip(), "dirty": bool(status.stdout.strip())}
+
+
+def build_record(stage: str, config: Dict, snapshot: Dict, routes: Optional[Dict] = None) -> Dict:
+    """
+    由运行指标生成一条运行记录
+
+    Args:
+        stage: 运行的命令（convert、summary、implement、pipeline、benchmark）
+        config: 命令行参数
+        snapshot: RunMetrics.snapshot()
+        routes: ModelRouter.report()，用于估算成本
+    """
+    items = {}
+    for row in snapshot["items"]:
+        items[row["outcome"]] = items.get(row["outcome"], 0) + row["count"]
+    total_items = sum(items.values())
+
+    llm_calls = sum(timing["count"] + timing["failures"] for timing in snapshot["llm"].values())
+    tokens_in = sum(row["tokens_in"] for row in snapshot["tokens"])
+    tokens_out = sum(row["tokens_out"] for row in snapshot["tokens"])
+    compile_count = sum(timing["count"] for timing in snapshot["compile"].values())
+    compile_time = sum(timing["total"] for timing in snapshot["compile"].values())
+
+    cost = None
+    for backends in (routes or {}).values():
+        for backend in backends:
+            if backend.get("cost") is not None:
+                cost = (cost or 0.0) + backend["cost"]
+
+    rounds = [(row["rounds_per_item"], row["items"]) for row in snapshot["stages"].values() if row["rounds_per_item"]]
+    rounded_items = sum(count for _, count in rounds)
+    wall_time = snapshot["elapsed_seconds"]
+
+    def per_item(value):
+        return round(value / total_items, 4) if value is not None and total_items else None
+
+    return {
+        "run_id": f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}",
+        "stage": stage,
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "config": {key: value for key, value in config.items() if key not in _SECRET_KEYS},
+        "items": dict(items, total=total_items),
+        "stages": {name: row["items"] for name, row in snapshot["stages"].items()},
+        "wall_time": wall_time,
+        "items_per_minute": round(total_items / (wall_time / 60), 2) if wall_time else None,
+        "success_rate": round(items.get("success", 0) / total_items, 4) if total_items else None,
+        "llm": {
+            "calls": llm_calls,
+            "time": round(sum(timing["total"] for timing in snapshot["llm"].values()), 3),
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "cost": round(cost, 4) if cost is not None else None
+        },
+        "compile": {
+            "count": compile_count,
+            "time": round(compile_time, 3),
+            "by_stage": {stage: {"count": timing["count"], "time": timing["total"]} for stage, timing in snapshot["compile"].items()}
+        },
+        "kinds": {f"{row['stage']}/{row['kind']}": {
+            "items": row["items"],
+            "calls_per_item": row["calls_per_item"],
+            "tokens_in_per_item": row["per_item_in"],
+            "tokens_out_per_item": row["per_item_out"],
+            "seconds_per_call": round(row["llm_time"] / row["calls"], 3) if row["calls"] else None,
+            "rounds_per_item": row["rounds_per_item"]
+        } for row in snapshot["tokens"]},
+        "calls_per_item": per_item(llm_calls),
+        "tokens_per_item": per_item(tokens_in + tokens_out),
+        "cost_per_item": per_item(cost),
+        "rounds_per_item": round(sum(r * count for r, count in rounds) / rounded_items, 2) if rounded_items else None,
+        "compile_time_per_item": per_item(compile_time)
+    }
+
+
+class RunHistory:
+    """JSONL格式的运行历史"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, record: Dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def load(self, stage: Optional[str] = None) -> List[Dict]:
+        """按时间顺序返回记录，可只返回某个命令的记录；无法解析的行被跳过"""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if stage is None or record.get("stage") == stage:
+                    records.append(record)
+        return records
+
+    def find(self, ref: str, stage: Optional[str] = None) -> Optional[Dict]:
+        """
+        查找运行记录
+
+        Args:
+            ref: 序号（-1为最近一次，-2为上一次）、run_id前缀或git版本前缀（取该版本最近一次运行）
+        """
+        records = self.load(stage)
+        try:
+            index = int(ref)
+        except ValueError:
+            index = None
+        if index is not None and -len(records) <= index < len(records):
+            return records[index]
+        for record in reversed(records):
+            if str(record.get("run_id", "")).startswith(ref) or str((record.get("git") or {}).get("rev") or "").startswith(ref):
+                return record
+        return None
+
+
+def compare(run: Dict, baseline: Dict, threshold: float = 0.1) -> Dict:
+    """
+    对比运行与基线
+
+    Args:
+        threshold: 相对变化超过该比例且方向变差时视为回退
+
+    Returns:
+        Dict: {"rows": [{"field", "name", "run", "baseline", "change", "regression"}], "regressions": [名称]}
+    """
+    rows = []
+    for field, name, higher_is_better in COMPARED_FIELDS:
+        current, previous = run.get(field), baseline.get(field)
+        change = None
+        regression = False
+        if current is not None and previous:
+            change = (current - previous) / previous
+            worse = -change if higher_is_better else change
+            regression = worse > threshold
+        rows.append({"field": field, "name": name, "run": current, "baseline": previous,
+                     "change": round(change, 4) if change is not None else None, "regression": regression})
+    return {"rows": rows, "regressions": [row["name"] for row in rows if row["regression"]]}
+
+
+def record_run(path: Optional[str], stage: str, config: Dict, snapshot: Dict, routes: Optional[Dict] = None) -> Optional[Dict]:
+    """生成并追加一条运行记录，path为空时不记录"""
+    if not path:
+        return None
+    record = build_record(stage, config, snapshot, routes)
+    RunHistory(path).append(record)
+    return record
+
+
+def describe(record: Dict) -> str:
+    """一条记录的单行摘要，用于日志和列表"""
+    cost = f"${record['llm']['cost']}" if record["llm"]["cost"] is not None else "未知"
+    rev = (record.get("git") or {}).get("rev") or "-"
+    if (record.get("git") or {}).get("dirty"):
+        rev += "+"
+    return (f"{record['run_id']} [{record['stage']}] {rev} 项目 {record['items']['total']}, 耗时 {record['wall_time']}s, "
+            f"{record['items_per_minute']} 项/分钟, 成功率 {record['success_rate']}, 调用 {record['llm']['calls']} 次, "
+            f"token {record['llm']['tokens_in']}/{record['llm']['tokens_out']}, 成本 {cost}, 编译 {record['compile']['time']}s")
@@ -0,0 +1,138 @@
+"""
+推测式多候选生成模块
+
+对慢尾部的项目（首轮生成未通过、或规模较大的项目），同时发出多个不同温度的Agent1请求：
+1. 每个候选生成后立即在各自的线程中验证（本地检查、编译、审核等，由调用方提供）
+2. 第一个通过验证的候选胜出，尚未开始的候选直接取消，正在验证的候选在下一个检查点退出
+3. 所有候选都未通过时返回None，由调用方回退到原来的逐轮流程
+4. 一次推测消耗约N倍的生成token，大多数项目首轮即可通过，因此只对慢尾部启用（见 should_speculate）
+
+Python线程无法强制中断，已经发出的请求会正常返回但结果被丢弃；
+验证函数应在每个耗时步骤之前检查cancelled，避免在已有胜出者后继续发出审核等请求。
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from sig_utils.tracing import tracer
+
+# 候选的采样温度，第一个与逐轮流程的默认温度相同
+DEFAULT_TEMPERATURES = [0.2, 0.5, 0.8, 1.0]
+
+# 首轮即推测的项目规模下限（token数），更小的项目先按逐轮流程执行一轮，未通过后再推测
+DEFAULT_MIN_TOKENS = 400
+
+
+class SpeculativeRunner:
+    """推测式多候选生成器"""
+
+    def __init__(self, candidates: int = 1, temperatures: Optional[List[float]] = None, min_tokens: int = DEFAULT_MIN_TOKENS):
+        """
+        Args:
+            candidates: 每个项目同时生成的候选数，1表示不启用
+            temperatures: 各候选的采样温度，候选数多于温度数时循环使用
+            min_tokens: 首轮即推测的项目规模下限（token数）
+        """
+        self.candidates = max(1, candidates)
+        self.temperatures = list(temperatures or DEFAULT_TEMPERATURES)
+        self.min_tokens = min_tokens
+        self._lock = threading.Lock()
+        self.stats = {"runs": 0, "won": 0, "no_winner": 0, "candidates": 0, "cancelled": 0,
+                      "first_round": 0, "after_failure": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.candidates > 1
+
+    def should_speculate(self, tokens: int = 0, failed_rounds: int = 0, high_risk: bool = False) -> bool:
+        """
+        项目是否属于慢尾部
+
+        Args:
+            tokens: 项目规模（C代码或函数签名与摘要的token数）
+            failed_rounds: 已未通过的轮数，首轮未通过的项目通常还需要多轮
+            high_risk: 调用方判定的高风险项目（如包含函数指针、联合体等特殊结构）
+        """
+        if not self.enabled:
+            return False
+        if failed_rounds > 0:
+            reason = "after_failure"
+        elif tokens >= self.min_tokens or high_risk:
+            reason = "first_round"
+        else:
+            return False
+        with self._lock:
+            self.stats[reason] += 1
+        return True
+
+    def temperature(self, index: int) -> float:
+        return self.temperatures[index % len(self.temperatures)]
+
+    def run(self, generate: Callable[[float], object],
+            validate: Callable[[object, threading.Event], Dict]) -> Optional[Dict]:
+        """
+        并行生成并验证候选，返回第一个通过验证的候选
+
+        Args:
+            generate: 温度 -> 候选，生成失败时返回None或抛出异常
+            validate: (候选, 取消事件) -> 验证结果，必须包含passed字段；
+                      取消事件被设置后应尽快返回
+
+        Returns:
+            Optional[Dict]: {"index": 候选序号, "temperature": 温度, "candidate": 候选, "validation": 验证结果,
+                             "attempts": 已完成验证的候选结果列表}；没有候选通过时返回None
+        """
+        cancelled = threading.Event()
+
+        def attempt(index):
+            if cancelled.is_set():
+                return index, None, {"passed": False, "reason": "已取消"}
+            candidate = generate(self.temperature(index))
+            if candidate is None:
+                return index, None, {"passed": False, "reason": "生成失败"}
+            if cancelled.is_set():
+                return index, candidate, {"passed": False, "reason": "已取消"}
+            return index, candidate, validate(candidate, cancelled)
+
+        executor = ThreadPoolExecutor(max_workers=self.candidates, thread_name_prefix="speculative")
+        attempt = tracer.bind(attempt)  # 候选线程中的请求span计入当前项目
+        pending = {executor.submit(attempt, index) for index in range(self.candidates)}
+        attempts = []
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        index, candidate, validation = future.result()
+                    except Exception as e:
+                        attempts.append({"passed": False, "reason": f"候选出错: {e}"})
+                        continue
+                    attempts.append(dict(validation, index=index))
+                    if validation.get("passed") and winner is None:
+                        winner = {
+                            "index": index,
+                            "temperature": self.temperature(index),
+                            "candidate": candidate,
+                            "validation": validation,
+                            "attempts": attempts
+                        }
+        finally:
+            # 有胜出者时通知其余候选退出，未开始的直接取消，不等待正在进行的请求
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["candidates"] += self.candidates
+            self.stats["cancelled"] += len(pending)
+            self.stats["won" if winner else "no_winner"] += 1
+        return winner
+
+    def get_stats(self) -> Dict:
+        """返回推测生成统计"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["win_rate"] = f"{(stats['won'] / stats['runs'] * 100):.2f}%" if stats["runs"] else "0%"
+        return stats
@@ -1,3 +1,5 @@
+import threading
+import time
 from datetime import datetime
 
 class ConversionStats:
@@ -15,55 +17,111 @@ class ConversionStats:
             "failure": [],  # 失败样本
             "skipped": []   # 跳过样本
         }
+        self.detections = {}  # 按类型统计实现检测的判定层级、结果和置信度
+        self.reviews = {}  # 按类型统计Agent2审核的通过、未通过和按策略跳过次数
+        self.durations = {}  # 按类型记录每个项目的处理耗时（秒）
+        self._start_times = {}
+        self._lock = threading.Lock()  # 支持多个工作线程同时记录
     
-    def record_start(self, item_id, kind):
-        """记录开始处理一个项目"""
-        self.total_items += 1
-        if kind not in self.by_type:
-            self.by_type[kind] = {"total": 0, "success": 0, "fail": 0, "skipped": 0}
-        self.by_type[kind]["total"] += 1
+    def record_start(self, item_id, kind, started=None):
+        """记录开始处理一个项目，started为实际开始时间（默认当前时间）"""
+        with self._lock:
+            self.total_items += 1
+            if kind not in self.by_type:
+                self.by_type[kind] = {"total": 0, "success": 0, "fail": 0, "skipped": 0}
+            self.by_type[kind]["total"] += 1
+            self._start_times[(item_id, kind)] = started or time.time()
+    
+    def _record_duration(self, item_id, kind):
+        """记录项目从开始到结束的耗时"""
+        started = self._start_times.pop((item_id, kind), None)
+        if started is not None:
+            self.durations.setdefault(kind, []).append(time.time() - started)
+    
+    def average_duration(self, kind):
+        """返回某类型项目的平均处理耗时（秒），没有记录时返回None"""
+        with self._lock:
+            durations = self.durations.get(kind)
+            return sum(durations) / len(durations) if durations else None
     
     def record_success(self, item_id, kind, rounds, example=None, is_skipped=False):
         """记录一次成功转换"""
-        self.success_count += 1
-        self.by_type[kind]["success"] += 1
+        with self._lock:
+            self.success_count += 1
+            self.by_type[kind]["success"] += 1
+            self._record_duration(item_id, kind)
         
-        if is_skipped:
-            self.skipped_count += 1
-            self.by_type[kind]["skipped"] += 1
-            if example and len(self.samples["skipped"]) < 5:
-                self.samples["skipped"].append({
-                    "id": item_id,
-                    "kind": kind,
-                    "reason": "头文件保护宏",
-                    "example": example
-                })
-        else:
-            self.rounds_data.append(rounds)
-            if example and len(self.samples["success"]) < 5:
-                self.samples["success"].append({
-                    "id": item_id,
-                    "kind": kind,
-                    "rounds": rounds,
-                    "example": example
-                })
+            if is_skipped:
+                self.skipped_count += 1
+                self.by_type[kind]["skipped"] += 1
+                if example and len(self.samples["skipped"]) < 5:
+                    self.samples["skipped"].append({
+                        "id": item_id,
+                        "kind": kind,
+                        "reason": "头文件保护宏",
+                        "example": example
+                    })
+            else:
+                self.rounds_data.append(rounds)
+                if example and len(self.samples["success"]) < 5:
+                    self.samples["success"].append({
+                        "id": item_id,
+                        "kind": kind,
+                        "rounds": rounds,
+                        "example": example
+                    })
     
     def record_failure(self, item_id, kind, error_type, example=None):
         """记录一次失败转换"""
-        self.fail_count += 1
-        self.by_type[kind]["fail"] += 1
+        with self._lock:
+            self.fail_count += 1
+            self.by_type[kind]["fail"] += 1
+            self._record_duration(item_id, kind)
         
-        if error_type not in self.error_types:
-            self.error_types[error_type] = 0
-        self.error_types[error_type] += 1
+            if error_type not in self.error_types:
+                self.error_types[error_type] = 0
+            self.error_types[error_type] += 1
         
-        if example and len(self.samples["failure"]) < 5:
-            self.samples["failure"].append({
-                "id": item_id,
-                "kind": kind,
-                "error_type": error_type,
-                "example": example
+            if example and len(self.samples["failure"]) < 5:
+                self.samples["failure"].append({
+                    "id": item_id,
+                    "kind": kind,
+                    "error_type": error_type,
+                    "example": example
+                })
+    
+    def record_detection(self, kind, tier, is_clean, confidence=None):
+        """记录一次实现检测的判定（tier: local/llm/local_fallback）"""
+        with self._lock:
+            stats = self.detections.setdefault(kind, {
+                "local": 0, "llm": 0, "local_fallback": 0, "clean": 0, "flagged": 0,
+                "confidence_sum": 0.0, "confidence_count": 0
             })
+            stats[tier] = stats.get(tier, 0) + 1
+            stats["clean" if is_clean else "flagged"] += 1
+            if confidence is not None:
+                stats["confidence_sum"] += confidence
+                stats["confidence_count"] += 1
+    
+    def record_review(self, kind, passed, skipped=False, sampled=False):
+        """记录一次Agent2审核结果，skipped表示按审核策略跳过"""
+        with self._lock:
+            stats = self.reviews.setdefault(kind, {"passed": 0, "failed": 0, "skipped": 0, "sampled": 0})
+            if skipped:
+                stats["skipped"] += 1
+                return
+            stats["passed" if passed else "failed"] += 1
+            if sampled:
+                stats["sampled"] += 1
+    
+    def review_pass_rate(self, kind):
+        """返回某类型实际审核的通过率和审核次数 (rate, count)，没有记录时通过率为0"""
+        with self._lock:
+            stats = self.reviews.get(kind)
+            if not stats:
+                return 0.0, 0
+            count = stats["passed"] + stats["failed"]
+            return (stats["passed"] / count if count else 0.0), count
     
     def generate_report(self, gpt_stats=None):
         """生成统计报告"""
@@ -101,6 +159,36 @@ class ConversionStats:
                 "成功率": f"{success_rate:.2f}%"
             }
         
+        # 添加实现检测的分层判定统计
+        if self.detections:
+            report["实现检测"] = {}
+            for kind, stats in self.detections.items():
+                total = stats["local"] + stats["llm"] + stats["local_fallback"]
+                report["实现检测"][kind] = {
+                    "总数": total,
+                    "本地判定": stats["local"],
+                    "AI判定": stats["llm"],
+                    "AI失败回退本地": stats["local_fallback"],
+                    "AI判定占比": f"{(stats['llm'] / total * 100):.2f}%" if total else "0%",
+                    "通过": stats["clean"],
+                    "未通过": stats["flagged"],
+                    "平均置信度": f"{stats['confidence_sum'] / stats['confidence_count']:.2f}" if stats["confidence_count"] else "N/A"
+                }
+        
+        # 添加审核策略统计
+        if self.reviews:
+            report["审核统计"] = {}
+            for kind, stats in self.reviews.items():
+                reviewed = stats["passed"] + stats["failed"]
+                report["审核统计"][kind] = {
+                    "审核": reviewed,
+                    "通过": stats["passed"],
+                    "未通过": stats["failed"],
+                    "抽样审核": stats["sampled"],
+                    "跳过": stats["skipped"],
+                    "通过率": f"{(stats['passed'] / reviewed * 100):.2f}%" if reviewed else "0%"
+                }
+        
         # 添加API使用信息
         if gpt_stats:
             report["API使用"] = gpt_stats
@@ -0,0 +1,283 @@
+"""
+追踪模块
+
+轻量的span记录，用于分析一次运行的时间花在哪里（各Agent请求、cargo编译、检查点写入、libclang解析、逐项转换）：
+1. tracer.span(name, category, **args) 记录一段耗时及其参数（项目ID、token数、结果等），
+   span内开启的子span自动继承项目ID
+2. tracer.traced(...) 装饰器，把整个函数调用记录为一个span，可从参数中取项目ID
+   交给其他线程执行的函数用 tracer.bind(func) 包装，线程内的span同样继承提交时外层span的项目ID、类型和阶段
+3. 导出为Chrome trace-event JSON（chrome://tracing 或 https://ui.perfetto.dev 打开），
+   并按类别和名称汇总次数、总耗时和分位数
+4. 注册的sink在每个span结束时收到 (名称, 类别, 耗时, 参数)，不记录事件也可以使用（如运行指标）
+
+默认关闭，没有开启记录也没有sink时span只做一次判断，几乎没有开销。
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class _Span:
+    """正在进行的span，可在结束前补充参数"""
+
+    __slots__ = ("args",)
+
+    def __init__(self, args: Dict):
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class _NullSpan:
+    """追踪关闭时使用的空span"""
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+# 子span从外层span继承的参数：项目ID、项目类型和所属阶段
+_INHERITED = ("item", "kind", "stage")
+
+
+class Tracer:
+    """span记录器"""
+
+    def __init__(self, max_events: int = 500000):
+        """
+        Args:
+            max_events: 最多保留的事件数，超出后不再记录
+        """
+        self.enabled = False
+        self.sinks = []
+        self.max_events = max_events
+        self.dropped = 0
+        self._events = []
+        self._threads = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        """开始记录，清空之前的事件"""
+        with self._lock:
+            self._events = []
+            self._threads = {}
+            self.dropped = 0
+            self._origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_sink(self, sink: Callable[[str, str, float, Dict], None]):
+        """注册span结束时的回调 sink(名称, 类别, 耗时秒数, 参数)"""
+        self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        self.sinks = [s for s in self.sinks if s != sink]  # 绑定方法每次取值都是新对象，按相等比较
+
+    @property
+    def active(self) -> bool:
+        return self.enabled or bool(self.sinks)
+
+    def _stack(self) -> List[Dict]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def bind(self, func: Callable) -> Callable:
+        """
+        包装提交到其他线程执行的函数（推测候选、对冲请求等），
+        使函数内开启的span继承当前线程外层span的项目ID、类型和阶段
+        """
+        if not (self.enabled or self.sinks):
+            return func
+        stack = self._stack()
+        if not stack:
+            return func
+        inherited = {key: stack[-1][key] for key in _INHERITED if key in stack[-1]}
+
+        @functools.wraps(func)
+        def wrapper(*call_args, **call_kwargs):
+            # 只压入继承的参数作为外层，不记录为span
+            worker_stack = self._stack()
+            worker_stack.append(inherited)
+            try:
+                return func(*call_args, **call_kwargs)
+            finally:
+                worker_stack.pop()
+        return wrapper
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """
+        记录一个span
+
+        Args:
+            name: 名称，如 llm:reviewer、cargo、checkpoint
+            category: 类别，汇总时按类别分组，如 llm、compile、io、parse、convert
+            args: 附加参数；未提供的item、kind、stage继承外层span的值
+        """
+        if not (self.enabled or self.sinks):
+            yield _NULL_SPAN
+            return
+        stack = self._stack()
+        if stack:
+            for key in _INHERITED:
+                if key not in args and key in stack[-1]:
+                    args[key] = stack[-1][key]
+        stack.append(args)
+        span = _Span(args)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            args.setdefault("outcome", f"error: {type(e).__name__}")
+            raise
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            self._record(name, category, start, end, args)
+
+    def traced(self, name: str, category: str, arg_names: Sequence[str] = (), item_arg: Optional[str] = None, **fixed_args):
+        """
+        装饰器：把函数调用记录为span
+
+        Args:
+            arg_names: 记录到span参数中的函数参数名
+            item_arg: 作为项目ID的函数参数名
+            fixed_args: 固定的span参数，如 stage="summary"
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*call_args, **call_kwargs):
+                if not (self.enabled or self.sinks):
+                    return func(*call_args, **call_kwargs)
+                bound = signature.bind_partial(*call_args, **call_kwargs).arguments
+                args = dict(fixed_args)
+                args.update((arg, _short(bound.get(arg))) for arg in arg_names if arg in bound)
+                if item_arg and item_arg in bound:
+                    args["item"] = _short(bound[item_arg])
+                with self.span(name, category, **args) as span:
+                    result = func(*call_args, **call_kwargs)
+                    if isinstance(result, dict) and "success" in result:
+                        span.set(outcome="success" if result["success"] else "failed")
+                    return result
+            return wrapper
+        return decorator
+
+    def _record(self, name: str, category: str, start: float, end: float, args: Dict):
+        for sink in self.sinks:
+            sink(name, category, end - start, args)
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args
+        }
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def events(self) -> List[Dict]:
+        with self._lock:
+            return list(self._events)
+
+    def export_chrome(self, path: str):
+        """导出为Chrome trace-event JSON"""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+    def summary(self) -> List[Dict]:
+        """按类别和名称汇总：次数、总耗时、p50、p95、最大耗时（秒），按总耗时降序"""
+        groups = {}
+        for event in self.events():
+            groups.setdefault((event["cat"], event["name"]), []).append(event["dur"] / 1e6)
+        rows = []
+        for (category, name), durations in groups.items():
+            durations.sort()
+            rows.append({
+                "category": category,
+                "name": name,
+                "count": len(durations),
+                "total": round(sum(durations), 3),
+                "p50": round(durations[(len(durations) - 1) // 2], 3),
+                "p95": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 3),
+                "max": round(durations[-1], 3)
+            })
+        rows.sort(key=lambda row: row["total"], reverse=True)
+        return rows
+
+    def summary_table(self) -> str:
+        """汇总表格文本，用于日志"""
+        rows = self.summary()
+        if not rows:
+            return "（没有追踪记录）"
+        # (列名, 字段, 宽度, 是否右对齐)
+        columns = [("类别", "category", 12, False), ("名称", "name", 30, False), ("次数", "count", 8, True),
+                   ("总耗时(s)", "total", 12, True), ("p50(s)", "p50", 10, True), ("p95(s)", "p95", 10, True),
+                   ("最大(s)", "max", 10, True)]
+        lines = ["".join(_pad(title, width, right) for title, _, width, right in columns)]
+        for row in rows:
+            lines.append("".join(_pad(row[field], width, right) for _, field, width, right in columns))
+        return "\n".join(lines)
+
+    def export(self, path: str, log: Callable[[str], None]):
+        """导出Chrome trace并逐行输出汇总表格（运行结束时调用）"""
+        self.export_chrome(path)
+        log(f"追踪已导出到 {path}（{len(self._events)} 个span，可在 chrome://tracing 或 ui.perfetto.dev 打开）")
+        if self.dropped:
+            log(f"追踪事件超过上限 {self.max_events}，丢弃 {self.dropped} 个")
+        for line in self.summary_table().splitlines():
+            log(line)
+
+
+def _pad(value, width: int, right: bool = False) -> str:
+    """按显示宽度补齐（中文等全角字符占两列）"""
+    text = str(value)
+    display = sum(2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1 for ch in text)
+    padding = " " * max(0, width - display)
+    return padding + text if right else text + padding
+
+
+def _short(value, limit: int = 120):
+    """span参数只保留简短的字符串形式"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+# 进程内共用的追踪器
+tracer = Tracer()
@@ -0,0 +1,194 @@
+"""
+翻译记忆模块
+
+跨项目复用已通过验证的转换结果（SQLite，标准库sqlite3）：
+1. 键为规范化的C代码（CPreprocessor.clean_comments + normalize_whitespace，* 单独成词）加上被引用依赖项的规范化Rust签名，
+   注释、空白和指针写法不同的同一段代码得到相同的键；依赖项的转换结果变化时不会命中
+2. 精确命中直接返回此前通过审核（及编译验证）的Rust代码，不调用大模型
+3. 未命中时按规范化代码的token二元组相似度（Jaccard）查找同类型的近似条目，作为少样本示例加入提示
+4. 只记录经Agent2实际审核通过或编译通过的大模型转换结果，审核被抽样跳过且未编译验证的结果、规则转换和头文件保护宏不写入
+5. 默认不启用，由命令行 --translation-memory 指定数据库路径
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sig_utils.c_preprocessor import CPreprocessor
+from sig_utils.prompt_budget import collapse_to_signature, dependency_name
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    dependencies TEXT NOT NULL,
+    c_code TEXT NOT NULL,
+    rust_code TEXT NOT NULL,
+    source TEXT,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_translations_kind ON translations(kind);
+"""
+
+
+def normalize_code(c_code: str) -> str:
+    """去掉注释并规范化空白，作为键和相似度比较的基础；* 单独成词，int* p 与 int *p 相同"""
+    normalized = CPreprocessor.normalize_whitespace(CPreprocessor.clean_comments(c_code or ""))
+    return re.sub(r' +', ' ', normalized.replace('*', ' * ')).strip()
+
+
+def dependency_signatures(c_code: str, dependency_code: Optional[Dict[str, str]]) -> List[str]:
+    """
+    C代码中被引用的依赖项的规范化Rust签名，按字典序排列
+
+    只取名称出现在代码中的依赖项，批量或联合转换时任务级依赖的并集不影响单个项目的键
+    """
+    identifiers = set(re.findall(r'[A-Za-z_]\w*', c_code or ""))
+    signatures = set()
+    for dep_id, rust_code in (dependency_code or {}).items():
+        if dependency_name(dep_id) in identifiers:
+            signatures.add(re.sub(r'\s+', ' ', collapse_to_signature(rust_code)).strip())
+    return sorted(signatures)
+
+
+def _shingles(normalized: str) -> set:
+    tokens = re.findall(r'\w+|[^\w\s]', normalized)
+    return set(zip(tokens, tokens[1:])) or set(tokens)
+
+
+class TranslationMemory:
+    """持久化的翻译记忆"""
+
+    def __init__(self, db_path: str, threshold: float = 0.5, max_example_chars: int = 3000):
+        """
+        Args:
+            db_path: 数据库文件路径，":memory:" 表示内存数据库
+            threshold: 近似条目的最低相似度
+            max_example_chars: 超过该长度（C与Rust代码合计）的条目不作为示例，避免提示过长
+        """
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_example_chars = max_example_chars
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()  # 同一连接可能被多个工作线程使用
+        self._candidates = {}  # kind -> [(key, shingles, c_code, rust_code)]，首次查找近似条目时加载
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "examples": 0}
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def make_key(kind: str, c_code: str, dependency_code: Optional[Dict[str, str]] = None) -> str:
+        text = "\n".join([kind, normalize_code(c_code)] + dependency_signatures(c_code, dependency_code))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, kind: str, c_code: str, dependency_code: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+        """
+        精确查找
+
+        Returns:
+            Optional[Dict]: {"rust_code", "source", "hits"}，未命中时返回None
+        """
+        key = self.make_key(kind, c_code, dependency_code)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT rust_code, source, hits FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE translations SET hits = hits + 1 WHERE key = ?", (key,))
+            self.stats["hits"] += 1
+        return {"rust_code": row["rust_code"], "source": row["source"], "hits": row["hits"] + 1}
+
+    def store(self, kind: str, c_code: str, dependency_code: Optional[Dict[str, str]], rust_code: str,
+              source: Optional[str] = None):
+        """
+        记录一条通过验证的转换结果，相同的键覆盖旧结果
+
+        Args:
+            source: 来源项目ID，便于追溯
+        """
+        key = self.make_key(kind, c_code, dependency_code)
+        normalized = normalize_code(c_code)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO translations (key, kind, normalized, dependencies, c_code, rust_code, source, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET rust_code = excluded.rust_code, source = excluded.source, "
+                "c_code = excluded.c_code, updated_at = excluded.updated_at",
+                (key, kind, normalized, json.dumps(dependency_signatures(c_code, dependency_code), ensure_ascii=False),
+                 c_code, rust_code, source, now, now)
+            )
+            self.stats["stored"] += 1
+            candidates = self._candidates.get(kind)
+            if candidates is not None:
+                candidates[:] = [entry for entry in candidates if entry[0] != key]
+                candidates.append((key, _shingles(normalized), c_code, rust_code))
+
+    def similar(self, kind: str, c_code: str, limit: int = 2) -> List[Dict]:
+        """
+        查找同类型的近似条目（不含规范化代码完全相同的条目），按相似度降序
+
+        Returns:
+            List[Dict]: [{"c_code", "rust_code", "similarity"}]
+        """
+        normalized = normalize_code(c_code)
+        target = _shingles(normalized)
+        if not target:
+            return []
+        with self._lock:
+            if kind not in self._candidates:
+                rows = self._conn.execute("SELECT key, normalized, c_code, rust_code FROM translations WHERE kind = ?",
+                                          (kind,)).fetchall()
+                self._candidates[kind] = [(row["key"], _shingles(row["normalized"]), row["c_code"], row["rust_code"])
+                                          for row in rows]
+            candidates = list(self._candidates[kind])
+
+        scored = []
+        for _, shingles, example_c, example_rust in candidates:
+            if len(example_c) + len(example_rust) > self.max_example_chars:
+                continue
+            similarity = len(target & shingles) / len(target | shingles)
+            if self.threshold <= similarity < 1.0:
+                scored.append({"c_code": example_c, "rust_code": example_rust, "similarity": round(similarity, 3)})
+        scored.sort(key=lambda entry: entry["similarity"], reverse=True)
+        with self._lock:
+            self.stats["examples"] += min(limit, len(scored))
+        return scored[:limit]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            return dict(self.stats, entries=entries)
+
+    def describe(self) -> str:
+        """本次运行用量的单行描述，用于日志"""
+        stats = self.get_stats()
+        return (f"命中 {stats['hits']} 个, 未命中 {stats['misses']} 个, 新增 {stats['stored']} 条, "
+                f"提供近似译例 {stats['examples']} 个, 共 {stats['entries']} 条")
+
+    @staticmethod
+    def format_examples(examples: List[Dict]) -> str:
+        """把近似条目格式化为提示中的参考示例"""
+        if not examples:
+            return ""
+        text = "## 参考示例（相似代码此前通过审核的转换结果，仅供参考，请按当前代码转换）\n"
+        for i, example in enumerate(examples, 1):
+            text += f"\n### 示例{i}（相似度 {example['similarity']:.0%}）\n```c\n{example['c_code']}\n```\n```rust\n{example['rust_code']}\n```\n"
+        return text